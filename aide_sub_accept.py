@@ -16,10 +16,15 @@
 # 2. CANVAS_API_KEY: Your Canvas API access token.
 # 3. CANVAS_SUBACCOUNT_ID: The account ID where the users are located.
 # 4. DRY_RUN (optional): Set to "true" to list invitations without accepting them. Defaults to true for safety.
+# 5. RUNNER (optional): "async" (default) accepts invitations concurrently through canvas_async.py;
+#    "sequential" uses the original one-request-at-a-time loop.
+# 6. CONCURRENCY (optional): Maximum concurrent Canvas requests for the async runner. Defaults to 10.
 
 import os
 import requests
 import sys
+import asyncio
+from canvas_async import AsyncCanvasClient
 
 # --- Configuration ---
 CANVAS_DOMAIN = os.getenv("CANVAS_API_URL")
@@ -27,6 +32,8 @@ API_TOKEN = os.getenv("CANVAS_API_KEY")
 ACCOUNT_ID = os.getenv("CANVAS_SUBACCOUNT_ID")
 # Safety first: Default to dry run unless explicitly set to "false".
 DRY_RUN = os.getenv("DRY_RUN", "true").lower() != "false"
+RUNNER = os.getenv("RUNNER", "async").lower()
+CONCURRENCY = int(os.getenv("CONCURRENCY", "10"))
 
 # --- Users to process ---
 USERS_TO_PROCESS = [
@@ -154,5 +161,79 @@ def main():
     print(f"  - Failed to accept: {fail_count}")
     print("--------------------------")
 
+# --- Async Runner ---
+
+async def get_user_id_async(client, email):
+    """Async version of get_user_id."""
+    url = f"{CANVAS_DOMAIN}/api/v1/accounts/{ACCOUNT_ID}/users"
+    users = await client.get_paginated(url, {"search_term": email})
+    for user in users or []:
+        if user.get('login_id') == email:
+            print(f"Found user '{user.get('name')}' with ID: {user['id']}")
+            return user['id']
+    print(f"Could not find any user matching '{email}'.")
+    return None
+
+async def get_pending_invitations_async(client, user_id):
+    """Async version of get_pending_invitations."""
+    url = f"{CANVAS_DOMAIN}/api/v1/users/{user_id}/enrollments"
+    invitations = await client.get_paginated(url, [("state[]", "invited"), ("per_page", 100)])
+    if invitations is not None:
+        print(f"Found {len(invitations)} pending invitations for user ID {user_id}.")
+    return invitations
+
+async def accept_invitation_async(client, course_id, enrollment_id):
+    """Async version of accept_invitation."""
+    url = f"{CANVAS_DOMAIN}/api/v1/courses/{course_id}/enrollments/{enrollment_id}/accept"
+    status, body, _ = await client.request("POST", url)
+    if status is None or status >= 400:
+        print(f"  - ❌ Failed to accept invitation in course {course_id}. Status: {status}. Response: {body}")
+        return False
+    print(f"  - ✅ Successfully accepted invitation in course {course_id}.")
+    return True
+
+async def async_main():
+    """Concurrent version of main(). Same dry-run behavior and summary."""
+    print("--- Starting Script to Accept Course Invitations (async runner) ---")
+    if DRY_RUN:
+        print("⚠️  Running in DRY RUN mode. No invitations will be accepted.")
+    validate_config()
+
+    async with AsyncCanvasClient(CANVAS_DOMAIN, API_TOKEN, max_concurrency=CONCURRENCY) as client:
+        user_ids = await asyncio.gather(*(get_user_id_async(client, email) for email in USERS_TO_PROCESS))
+        for email, user_id in zip(USERS_TO_PROCESS, user_ids):
+            if not user_id:
+                print(f"Cannot proceed without finding user '{email}'.")
+                sys.exit(1)
+
+        invitation_lists = await asyncio.gather(*(get_pending_invitations_async(client, user_id) for user_id in user_ids))
+        all_invitations = [inv for invites in invitation_lists if invites for inv in invites]
+
+        if not all_invitations:
+            print("\nNo pending invitations found for any of the specified users. Exiting.")
+            sys.exit(0)
+
+        if DRY_RUN:
+            print("\n--- Invitations Found (Dry Run) ---")
+            for inv in all_invitations:
+                print(f"  - User: {inv['user']['name']}, Course ID: {inv['course_id']}, Role: {inv['role']}")
+            print("\n--- Dry Run Complete ---")
+            print(f"Found a total of {len(all_invitations)} invitations to be accepted.")
+            print("To accept them, set the DRY_RUN environment variable to 'false'.")
+            sys.exit(0)
+
+        print(f"\n--- Accepting {len(all_invitations)} Invitations (up to {CONCURRENCY} at a time) ---")
+        results = await asyncio.gather(*(accept_invitation_async(client, inv['course_id'], inv['id']) for inv in all_invitations))
+
+        print("\n--- Script Finished ---")
+        print("Summary:")
+        print(f"  - Successfully accepted invitations: {results.count(True)}")
+        print(f"  - Failed to accept: {results.count(False)}")
+        print(f"  - Canvas requests: {client.request_count}, throttled responses: {client.throttle_count}")
+        print("--------------------------")
+
 if __name__ == "__main__":
-    main()
+    if RUNNER == "sequential":
+        main()
+    else:
+        asyncio.run(async_main())
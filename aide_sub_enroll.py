@@ -20,10 +20,15 @@
 # 4. CANVAS_SUBACCOUNT_ID: The account ID to search for users within.
 # 5. SEARCH_ROOT_ACCOUNT (optional): Set to "true" to search for courses across the entire institution.
 # 6. DRY_RUN (optional): Set to "true" to list courses without enrolling. Defaults to true for safety.
+# 7. RUNNER (optional): "async" (default) runs enrollments concurrently through canvas_async.py;
+#    "sequential" uses the original one-request-at-a-time loop.
+# 8. CONCURRENCY (optional): Maximum concurrent Canvas requests for the async runner. Defaults to 10.
 
 import os
 import requests
 import sys
+import asyncio
+from canvas_async import AsyncCanvasClient
 
 # --- Configuration ---
 # Load configuration from environment variables for security.
@@ -34,6 +39,8 @@ ACCOUNT_ID = os.getenv("CANVAS_SUBACCOUNT_ID")
 SEARCH_ROOT = os.getenv("SEARCH_ROOT_ACCOUNT", "false").lower() == "true"
 # Safety first: Default to dry run unless explicitly set to "false".
 DRY_RUN = os.getenv("DRY_RUN", "false").lower() != "false"
+RUNNER = os.getenv("RUNNER", "async").lower()
+CONCURRENCY = int(os.getenv("CONCURRENCY", "10"))
 
 
 # --- Users to Enroll ---
@@ -215,5 +222,106 @@ def main():
     print(f"  - Failed or pre-existing enrollments: {failed_enrollments}")
     print("------------------------")
 
+# --- Async Runner ---
+
+async def get_user_id_async(client, email):
+    """Async version of get_user_id."""
+    url = f"{CANVAS_DOMAIN}/api/v1/accounts/{ACCOUNT_ID}/users"
+    users = await client.get_paginated(url, {"search_term": email})
+    for user in users or []:
+        if user.get('login_id') == email:
+            print(f"Found user '{user.get('name')}' with ID: {user['id']}")
+            return user['id']
+    print(f"Could not find an exact match for '{email}'.")
+    return None
+
+async def get_existing_ta_course_ids(client, user_id, role_type):
+    """
+    Returns the course IDs where the user already holds an active or invited enrollment
+    of the given role. One paginated listing per user replaces a 409 per existing course.
+    """
+    url = f"{CANVAS_DOMAIN}/api/v1/users/{user_id}/enrollments"
+    params = [("type[]", role_type), ("state[]", "active"), ("state[]", "invited"), ("per_page", 100)]
+    enrollments = await client.get_paginated(url, params)
+    if enrollments is None:
+        return None
+    return {enrollment['course_id'] for enrollment in enrollments}
+
+async def enroll_user_in_course_async(client, course_id, user_id, role_type):
+    """Async version of enroll_user_in_course. Returns "Success", "Already Enrolled" or "Failed"."""
+    url = f"{CANVAS_DOMAIN}/api/v1/courses/{course_id}/enrollments"
+    payload = {"enrollment": {"user_id": user_id, "type": role_type, "enrollment_state": "active"}}
+    status, body, _ = await client.request("POST", url, json_body=payload)
+    if status == 409:
+        print(f"  - User {user_id} is already enrolled in course {course_id}.")
+        return "Already Enrolled"
+    if status is None or status >= 400:
+        print(f"  - Failed to enroll user {user_id} in course {course_id}. Status: {status}. Response body: {body}")
+        return "Failed"
+    print(f"  - Successfully enrolled user {user_id} in course {course_id} as a {role_type}.")
+    return "Success"
+
+async def async_main():
+    """Concurrent version of main(). Same dry-run behavior and summary."""
+    print("--- Starting Canvas TA Enrollment Script (async runner) ---")
+    if DRY_RUN:
+        print("⚠️  Running in DRY RUN mode. No enrollments will be made.")
+    validate_config()
+
+    async with AsyncCanvasClient(CANVAS_DOMAIN, API_TOKEN, max_concurrency=CONCURRENCY) as client:
+        course_search_account_id = "1" if SEARCH_ROOT else ACCOUNT_ID
+        print(f"\nFetching all courses for Term ID: {TERM_ID} within Account ID: {course_search_account_id}...")
+        url = f"{CANVAS_DOMAIN}/api/v1/accounts/{course_search_account_id}/courses"
+        courses = await client.get_paginated(url, [("enrollment_term_id", TERM_ID), ("per_page", 100), ("include[]", "term")])
+        if not courses:
+            print("No courses found for the specified term. Exiting.")
+            sys.exit(1)
+        print(f"Found {len(courses)} courses.")
+
+        if DRY_RUN:
+            print("\n--- Courses Found (Dry Run) ---")
+            for course in courses:
+                term_name = course.get('term', {}).get('name', 'N/A')
+                print(f"  - ID: {course['id']}, Name: \"{course.get('name', 'Unnamed Course')}\", Term: \"{term_name}\"")
+            print("\n--- Dry Run Complete ---")
+            print("Review the list above. If these are the correct courses, set the DRY_RUN environment variable to 'false' to perform enrollments.")
+            sys.exit(0)
+
+        print("\n--- Step 1: Resolving User IDs ---")
+        user_ids_to_enroll = await asyncio.gather(*(get_user_id_async(client, email) for email in USERS_TO_ENROLL))
+        for email, user_id in zip(USERS_TO_ENROLL, user_ids_to_enroll):
+            if not user_id:
+                print(f"Halting script because user '{email}' could not be found.")
+                sys.exit(1)
+
+        print("\n--- Step 2: Checking Existing TA Enrollments ---")
+        existing = await asyncio.gather(*(get_existing_ta_course_ids(client, user_id, ENROLLMENT_ROLE) for user_id in user_ids_to_enroll))
+        pending = []
+        already_enrolled = 0
+        for user_id, enrolled_course_ids in zip(user_ids_to_enroll, existing):
+            if enrolled_course_ids is None:
+                print(f"  - Could not list enrollments for user {user_id}. Every course will be attempted.")
+                enrolled_course_ids = set()
+            for course in courses:
+                if course['id'] in enrolled_course_ids:
+                    already_enrolled += 1
+                else:
+                    pending.append((course['id'], user_id))
+        print(f"  - {already_enrolled} enrollments already exist. {len(pending)} to create.")
+
+        print(f"\n--- Step 3: Creating {len(pending)} Enrollments (up to {CONCURRENCY} at a time) ---")
+        results = await asyncio.gather(*(enroll_user_in_course_async(client, course_id, user_id, ENROLLMENT_ROLE) for course_id, user_id in pending))
+
+        print("\n--- Script Finished ---")
+        print("Summary:")
+        print(f"  - Successful new enrollments: {results.count('Success')}")
+        print(f"  - Pre-existing enrollments (skipped): {already_enrolled + results.count('Already Enrolled')}")
+        print(f"  - Failed enrollments: {results.count('Failed')}")
+        print(f"  - Canvas requests: {client.request_count}, throttled responses: {client.throttle_count}")
+        print("------------------------")
+
 if __name__ == "__main__":
-    main()
+    if RUNNER == "sequential":
+        main()
+    else:
+        asyncio.run(async_main())
@@ -3,16 +3,28 @@
 # ==============================================================================
 import os
 import json
+import logging
+from logging.handlers import RotatingFileHandler
 import requests
 import time
-from datetime import datetime
-from flask import Flask, request, jsonify
+from datetime import datetime, timezone
+from flask import Flask, request, jsonify, g, Response
 from celery import Celery
+from celery.signals import task_prerun, task_postrun
 from canvasapi import Canvas
 from canvasapi.exceptions import CanvasException, Conflict, ResourceDoesNotExist
-from collections import defaultdict
+from collections import defaultdict, Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, ExitStack
+from urllib.parse import urlparse
+import contextvars
 import unicodedata
 import re
+import redis
+from task_profiler import ProfileSchedule, profiled
+from canvas_throttle import CanvasThrottle, CanvasThrottleAdapter
+import json_codec
+from staff_directory import StaffDirectory
 
 # ==============================================================================
 # CENTRALIZED CONFIGURATION
@@ -20,9 +32,30 @@ import re
 MONDAY_API_KEY = os.environ.get("MONDAY_API_KEY")
 CANVAS_API_KEY = os.environ.get("CANVAS_API_KEY")
 CANVAS_API_URL = os.environ.get("CANVAS_API_URL")
-MONDAY_API_URL = "https://api.monday.com/v2"
+MONDAY_API_URL = os.environ.get("MONDAY_API_URL", "https://api.monday.com/v2")
 CELERY_BROKER_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
 CELERY_RESULT_BACKEND = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+VALKEY_URL = os.environ.get('DATABASE_URL', CELERY_BROKER_URL)
+USER_DIRECTORY_REFRESH_SECONDS = int(os.environ.get("USER_DIRECTORY_REFRESH_SECONDS", 3600))
+USER_DIRECTORY_LOCAL_SECONDS = int(os.environ.get("USER_DIRECTORY_LOCAL_SECONDS", 300))
+STAFF_DIRECTORY_REFRESH_SECONDS = int(os.environ.get("STAFF_DIRECTORY_REFRESH_SECONDS", 3600))  # Full All Staff rescan, in case a webhook was missed
+API_CALL_WARN_THRESHOLD = int(os.environ.get("API_CALL_WARN_THRESHOLD", 0))  # 0 disables the warning
+MONDAY_TRACK_COMPLEXITY = os.environ.get("MONDAY_TRACK_COMPLEXITY", "true").lower() == "true"
+METRICS_FLUSH_SECONDS = float(os.environ.get("METRICS_FLUSH_SECONDS", 2))
+WEBHOOK_RECORD_PATH = os.environ.get("WEBHOOK_RECORD_PATH")  # Opt-in: capture webhook payloads for replay_webhooks.py
+WEBHOOK_RECORD_MAX_BYTES = int(os.environ.get("WEBHOOK_RECORD_MAX_BYTES", 50 * 1024 * 1024))
+WEBHOOK_RECORD_BACKUPS = int(os.environ.get("WEBHOOK_RECORD_BACKUPS", 5))
+PROFILE_TASKS = os.environ.get("PROFILE_TASKS", "")  # e.g. "app.process_canvas_full_sync_from_status:10,*:500" profiles 1 in N per process
+PROFILE_ALLOW_HEADER = os.environ.get("PROFILE_ALLOW_HEADER", "false").lower() == "true"  # Honor "X-Profile-Task: 1" on webhooks
+PROFILE_MODE = os.environ.get("PROFILE_MODE", "sample")  # "sample" (gevent-safe) or "cprofile"
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", 5))
+COLUMN_STATE_MAX_AGE_SECONDS = int(os.environ.get("COLUMN_STATE_MAX_AGE_SECONDS", 900))  # 0 disables the column state cache
+MONDAY_MUTATION_BATCH_SIZE = int(os.environ.get("MONDAY_MUTATION_BATCH_SIZE", 25))  # Mutations per aliased request
+MONDAY_READ_CONCURRENCY = int(os.environ.get("MONDAY_READ_CONCURRENCY", 4))  # Parallel items(ids:) chunks per bulk read
+CANVAS_MAX_CONCURRENCY = int(os.environ.get("CANVAS_MAX_CONCURRENCY", 10))  # Upper bound on Canvas calls in flight per process
+CANVAS_RATE_LIMIT_REFILL_PER_SECOND = float(os.environ.get("CANVAS_RATE_LIMIT_REFILL_PER_SECOND", 10))
+PEOPLE_SYNC_CONCURRENCY = int(os.environ.get("PEOPLE_SYNC_CONCURRENCY", 8))  # Parallel board updates per people-sync task
 PLP_BOARD_ID = os.environ.get("PLP_BOARD_ID")
 PLP_CANVAS_SYNC_COLUMN_ID = os.environ.get("PLP_CANVAS_SYNC_COLUMN_ID")
 PLP_CANVAS_SYNC_STATUS_VALUE = os.environ.get("PLP_CANVAS_SYNC_STATUS_VALUE", "Done")
@@ -88,9 +121,228 @@ ROSTER_AND_CREDIT_COURSES = {10097, 10002, 10092, 10164, 10198}
 ALL_SPECIAL_COURSES = ROSTER_ONLY_COURSES.union(ROSTER_AND_CREDIT_COURSES)
 
 
+# ==============================================================================
+# API CALL ACCOUNTING
+# ==============================================================================
+# Every Monday and Canvas call is charged to the task (or phase) that made it. The
+# active ApiUsage lives in a ContextVar, so each gevent greenlet has its own. When
+# a task ends, one "API_USAGE {json}" line is printed with its totals.
+_current_api_usage = contextvars.ContextVar('api_usage', default=None)
+GRAPHQL_SHAPE_RE = re.compile(r'^\s*(query|mutation)?[^{]*\{\s*(?:\w+\s*:\s*)?(\w+)')
+CANVAS_PATH_ID_RE = re.compile(r'/(?:\d+|[a-z_]+:[^/]+)(?=/|$)')
+
+class ApiUsage:
+    """Call counts, latency, complexity, retries and 429s for one task or phase."""
+    def __init__(self, label, parent=None):
+        self.label = label
+        self.parent = parent
+        self.started = time.monotonic()
+        self.duration = 0.0
+        self.invocations = 1
+        self.services = defaultdict(lambda: {'calls': 0, 'total_latency_s': 0.0, 'max_latency_s': 0.0, 'retries': 0, 'rate_limited': 0, 'failed': 0})
+        self.shapes = Counter()
+
+    def record(self, service, shape, latency, retry=False, rate_limited=False, failed=False, complexity=0):
+        stats = self.services[service]
+        stats['calls'] += 1
+        stats['total_latency_s'] += latency
+        stats['max_latency_s'] = max(stats['max_latency_s'], latency)
+        stats['retries'] += int(retry)
+        stats['rate_limited'] += int(rate_limited)
+        stats['failed'] += int(failed)
+        if complexity: stats['complexity'] = stats.get('complexity', 0) + complexity
+        self.shapes[f"{service} {shape}"] += 1
+
+    def merge(self, other):
+        self.invocations += other.invocations
+        self.duration += other.duration
+        for service, other_stats in other.services.items():
+            stats = self.services[service]
+            for key, value in other_stats.items():
+                stats[key] = max(stats.get(key, 0), value) if key == 'max_latency_s' else stats.get(key, 0) + value
+        self.shapes.update(other.shapes)
+
+    @property
+    def total_calls(self):
+        return sum(stats['calls'] for stats in self.services.values())
+
+    def summary(self, top=5):
+        return {
+            'label': self.label, 'invocations': self.invocations, 'duration_s': round(self.duration, 3), 'calls': self.total_calls,
+            **{service: {k: round(v, 3) if isinstance(v, float) else v for k, v in stats.items()} for service, stats in self.services.items()},
+            'top_calls': self.shapes.most_common(top),
+        }
+
+def start_api_usage(label):
+    """Begins charging API calls to a new ApiUsage. Returns the token for finish_api_usage."""
+    return _current_api_usage.set(ApiUsage(label, parent=_current_api_usage.get()))
+
+def finish_api_usage(token, emit=True):
+    """Ends the current ApiUsage, folds it into any enclosing one, and returns it."""
+    usage = _current_api_usage.get()
+    _current_api_usage.reset(token)
+    if usage is None: return None
+    usage.duration = time.monotonic() - usage.started
+    if usage.parent: usage.parent.merge(usage)
+    if emit: print(f"API_USAGE {json.dumps(usage.summary())}")
+    if API_CALL_WARN_THRESHOLD and usage.total_calls > API_CALL_WARN_THRESHOLD:
+        print(f"WARNING: '{usage.label}' made {usage.total_calls} API calls (threshold {API_CALL_WARN_THRESHOLD}). Top calls: {usage.shapes.most_common(3)}")
+    return usage
+
+@contextmanager
+def api_usage(label, emit=True):
+    """Charges the API calls made inside the block to `label`."""
+    token = start_api_usage(label)
+    try: yield _current_api_usage.get()
+    finally: finish_api_usage(token, emit=emit)
+
+def record_api_call(service, shape, latency, **kwargs):
+    usage = _current_api_usage.get()
+    if usage is not None: usage.record(service, shape, latency, **kwargs)
+
+def graphql_shape(query):
+    """'mutation change_multiple_column_values' for a query string; aliases are ignored."""
+    match = GRAPHQL_SHAPE_RE.match(query)
+    return f"{match.group(1) or 'query'} {match.group(2)}" if match else "unknown"
+
+def with_complexity_field(query):
+    """Asks Monday to report the query's complexity cost and the budget left after it."""
+    return query.replace("{", "{ complexity { query after } ", 1)
+
+def record_canvas_response(response, *args, **kwargs):
+    """requests response hook for the canvasapi session."""
+    path = CANVAS_PATH_ID_RE.sub('/:id', urlparse(response.request.url).path.replace('/api/v1', '', 1))
+    rate_limited = response.status_code == 429 or (response.status_code == 403 and 'rate limit' in response.text.lower())
+    record_api_call('canvas', f"{response.request.method} {path}", response.elapsed.total_seconds(),
+                    rate_limited=rate_limited, failed=response.status_code >= 500)
+    try: set_metric('canvas_rate_limit_remaining', float(response.headers['X-Rate-Limit-Remaining']))
+    except (KeyError, ValueError): pass
+
+# ==============================================================================
+# METRICS
+# ==============================================================================
+# The gunicorn workers and the Celery worker are separate processes. Metrics are
+# therefore kept in two Valkey hashes, and /metrics renders them in the Prometheus
+# text format. Each process buffers its own updates and flushes them at most every
+# METRICS_FLUSH_SECONDS, so the webhook path rarely waits on Valkey. Gauges are
+# last-write-wins across processes.
+METRICS_COUNTERS_KEY = "metrics:counters"
+METRICS_GAUGES_KEY = "metrics:gauges"
+INGEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+TASK_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+PROPAGATION_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+METRICS = {
+    'webhook_request_duration_seconds': ('histogram', 'Time to accept a webhook, by the route it was dispatched to.'),
+    'webhook_requests_total': ('counter', 'Webhook requests, by route and HTTP status.'),
+    'webhook_enqueued_total': ('counter', 'Tasks queued from webhooks, by task.'),
+    'webhook_enqueue_failures_total': ('counter', 'Webhooks whose task could not be queued, by task.'),
+    'celery_task_duration_seconds': ('histogram', 'Task run time, by task.'),
+    'celery_tasks_total': ('counter', 'Finished tasks, by task and state.'),
+    'webhook_propagation_seconds': ('histogram', 'Monday event trigger time to successful task completion, by task.'),
+    'celery_queue_depth': ('gauge', 'Messages waiting in the broker queue.'),
+    'celery_unacked_tasks': ('gauge', 'Messages reserved by workers but not yet acknowledged.'),
+    'monday_complexity_remaining': ('gauge', 'Monday complexity budget left after the most recent call.'),
+    'canvas_rate_limit_remaining': ('gauge', 'X-Rate-Limit-Remaining from the most recent Canvas response.'),
+    'canvas_throttled_total': ('counter', 'Canvas requests rejected by the rate limit and retried.'),
+}
+LE_LABEL_RE = re.compile(r',?le="([^"]+)"')
+
+_pending_counters = Counter()
+_pending_gauges = {}
+_metrics_flushed_at = time.monotonic()
+_broker_client = None
+
+def _series(name, labels=None):
+    if not labels: return name
+    return name + "{" + ",".join(f"{k}={json.dumps(str(v), ensure_ascii=False)}" for k, v in labels.items()) + "}"
+
+def inc_metric(name, labels=None, amount=1):
+    _pending_counters[_series(name, labels)] += amount
+    flush_metrics()
+
+def set_metric(name, value, labels=None):
+    _pending_gauges[_series(name, labels)] = value
+    flush_metrics()
+
+def observe_metric(name, value, buckets, labels=None):
+    labels = labels or {}
+    for bound in buckets:
+        if value <= bound: _pending_counters[_series(f"{name}_bucket", {**labels, 'le': bound})] += 1
+    _pending_counters[_series(f"{name}_bucket", {**labels, 'le': '+Inf'})] += 1
+    _pending_counters[_series(f"{name}_sum", labels)] += value
+    _pending_counters[_series(f"{name}_count", labels)] += 1
+    flush_metrics()
+
+def flush_metrics(force=False):
+    """Writes buffered metrics to Valkey. If Valkey is down they are dropped and flushing pauses for a minute."""
+    global _pending_counters, _pending_gauges, _metrics_flushed_at
+    if not force and time.monotonic() - _metrics_flushed_at < METRICS_FLUSH_SECONDS: return
+    _metrics_flushed_at = time.monotonic()
+    counters, gauges = _pending_counters, _pending_gauges
+    _pending_counters, _pending_gauges = Counter(), {}
+    client = get_valkey_client()
+    if client is None or not (counters or gauges): return
+    try:
+        pipe = client.pipeline(transaction=False)
+        for series, amount in counters.items(): pipe.hincrbyfloat(METRICS_COUNTERS_KEY, series, amount)
+        if gauges: pipe.hset(METRICS_GAUGES_KEY, mapping=gauges)
+        pipe.execute()
+    except redis.RedisError as e:
+        print(f"WARNING: Could not flush metrics to Valkey: {e}")
+        _metrics_flushed_at = time.monotonic() + 60
+
+def get_broker_client():
+    global _broker_client
+    if _broker_client is None:
+        try:
+            ssl_kwargs = {'ssl_cert_reqs': 'required'} if CELERY_BROKER_URL.startswith('rediss://') else {}
+            _broker_client = redis.Redis.from_url(CELERY_BROKER_URL, socket_timeout=5, socket_connect_timeout=5, **ssl_kwargs)
+        except (redis.RedisError, ValueError) as e:
+            print(f"WARNING: Could not create broker client: {e}")
+    return _broker_client
+
+def parse_trigger_time(value):
+    """Monday's event triggerTime ('2024-08-19T17:04:05.123Z') as an aware datetime, or None."""
+    try: parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError: return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+def _metric_sort_key(item):
+    series = item[0]
+    match = LE_LABEL_RE.search(series)
+    le = float(match.group(1)) if match else 0.0
+    return (LE_LABEL_RE.sub('', series).replace('{}', ''), le)
+
+def render_metrics():
+    """All stored metrics plus the live broker gauges, in the Prometheus text format."""
+    flush_metrics(force=True)
+    values = {}
+    client = get_valkey_client()
+    if client is not None:
+        for key in (METRICS_COUNTERS_KEY, METRICS_GAUGES_KEY):
+            values.update({k.decode(): float(v) for k, v in client.hgetall(key).items()})
+    broker = get_broker_client()
+    if broker is not None:
+        try:
+            values[_series('celery_queue_depth', {'queue': celery_app.conf.task_default_queue})] = broker.llen(celery_app.conf.task_default_queue)
+            values['celery_unacked_tasks'] = broker.hlen('unacked')
+        except redis.RedisError as e:
+            print(f"WARNING: Could not read Celery queue depth: {e}")
+    families = defaultdict(list)
+    for series, value in sorted(values.items(), key=_metric_sort_key):
+        base = series.split('{', 1)[0]
+        family = base if base in METRICS else base.rsplit('_', 1)[0]
+        families[family].append(f"{series} {int(value) if float(value).is_integer() else value}")
+    lines = []
+    for family, samples in families.items():
+        metric_type, help_text = METRICS.get(family, ('untyped', ''))
+        lines += [f"# HELP {family} {help_text}", f"# TYPE {family} {metric_type}", *samples]
+    return "\n".join(lines) + "\n"
+
 # ==============================================================================
 # MONDAY.COM UTILITIES
 # ==============================================================================
+MONDAY_ITEMS_PER_READ = 100  # The most items(ids:) returns in one request
 MONDAY_HEADERS = { "Authorization": MONDAY_API_KEY, "Content-Type": "application/json", "API-Version": "2023-10" }
 
 def get_logged_items_from_updates(subitem_id):
@@ -149,20 +401,30 @@ def find_or_create_subitem(parent_item_id, subitem_name, column_values=None):
     print(f"  INFO: No existing subitem named '{subitem_name}'. Creating it.")
     return create_subitem(parent_item_id, subitem_name, column_values=column_values)
     
-def execute_monday_graphql(query):
+def execute_monday_graphql(query, partial=False):
+    """Returns the response, or None on failure. With partial, a response with errors is still returned for whatever data it has."""
     max_retries = 4; delay = 2
+    shape = graphql_shape(query)
+    if MONDAY_TRACK_COMPLEXITY: query = with_complexity_field(query)
     for attempt in range(max_retries):
+        started = time.monotonic()
         try:
-            response = requests.post(MONDAY_API_URL, json={"query": query}, headers=MONDAY_HEADERS, timeout=30)
+            response = requests.post(MONDAY_API_URL, data=json_codec.dumps_bytes({"query": query}), headers=MONDAY_HEADERS, timeout=30)
             if response.status_code == 429:
+                record_api_call('monday', shape, time.monotonic() - started, retry=attempt > 0, rate_limited=True)
                 print(f"WARNING: Rate limit hit. Waiting {delay} seconds..."); time.sleep(delay); delay *= 2; continue
             response.raise_for_status()
-            json_response = response.json()
+            json_response = json_codec.loads(response.content)
+            data = json_response.get('data')
+            complexity = data.pop('complexity', None) if isinstance(data, dict) else None
+            if complexity and complexity.get('after') is not None: set_metric('monday_complexity_remaining', complexity['after'])
+            record_api_call('monday', shape, time.monotonic() - started, retry=attempt > 0, complexity=(complexity or {}).get('query', 0))
             if "errors" in json_response:
                 print(f"ERROR: Monday GraphQL Error: {json_response['errors']}")
-                return None
+                return json_response if partial else None
             return json_response
-        except requests.exceptions.RequestException as e:
+        except (requests.exceptions.RequestException, json_codec.JSONDecodeError) as e:
+            record_api_call('monday', shape, time.monotonic() - started, retry=attempt > 0, failed=True)
             print(f"WARNING: Monday HTTP Request Error: {e}. Retrying...")
             if attempt < max_retries - 1: time.sleep(delay); delay *= 2
             else: print("ERROR: Final retry failed."); return None
@@ -170,11 +432,8 @@ def execute_monday_graphql(query):
 
 def get_user_email(user_id):
     if user_id is None: return None
-    query = f"query {{ users(ids: [{user_id}]) {{ email }} }}"
-    result = execute_monday_graphql(query)
-    if result and 'data' in result and result['data'].get('users'):
-        return result['data']['users'][0].get('email')
-    return None
+    user = resolve_users([user_id]).get(_as_user_id(user_id))
+    return user.get('email') if user else None
 
 def get_item_name(item_id, board_id):
     query = f"query {{ boards(ids: {board_id}) {{ items_page(query_params: {{ids: [{item_id}]}}) {{ items {{ name }} }} }} }}"
@@ -185,26 +444,39 @@ def get_item_name(item_id, board_id):
             return board['items_page']['items'][0].get('name')
     return None
 
+def fetch_items_by_ids(item_ids, column_ids=None):
+    """
+    Reads many items with items(ids:) in chunks of MONDAY_ITEMS_PER_READ, up to MONDAY_READ_CONCURRENCY
+    chunks at a time, fetching only the given columns. Returns {item_id: {'name', 'columns': {column_id:
+    {'id', 'text', 'value'}}}}. A chunk that fails is logged and left out.
+    """
+    item_ids = sorted({int(i) for i in item_ids})
+    if not item_ids: return {}
+    columns = f" column_values(ids: {json.dumps(sorted(column_ids))}) {{ id text value }}" if column_ids else ""
+    chunks = [item_ids[i:i + MONDAY_ITEMS_PER_READ] for i in range(0, len(item_ids), MONDAY_ITEMS_PER_READ)]
+    merged = {}
+    for found in run_concurrently(_fetch_item_chunk, [(chunk, columns) for chunk in chunks], limit=MONDAY_READ_CONCURRENCY):
+        merged.update(found or {})
+    return merged
+
+def _fetch_item_chunk(chunk, columns):
+    result = execute_monday_graphql(f"query {{ items(ids: {chunk}, limit: {len(chunk)}) {{ id name{columns} }} }}")
+    try: found = result['data']['items'] or []
+    except (TypeError, KeyError):
+        print(f"WARNING: Could not read {len(chunk)} items ({chunk[0]}..{chunk[-1]}).")
+        return {}
+    return {int(item['id']): {'name': item.get('name'), 'columns': {cv['id']: cv for cv in item.get('column_values') or []}} for item in found}
+
 def get_item_names(item_ids):
     """Efficiently gets names for a list of item IDs."""
-    if not item_ids:
-        return {}
-    query = f"query {{ items(ids: {list(item_ids)}) {{ id name }} }}"
-    result = execute_monday_graphql(query)
-    try:
-        return {int(item['id']): item['name'] for item in result['data']['items']}
-    except (TypeError, KeyError, IndexError):
-        return {}
+    return {item_id: item['name'] for item_id, item in fetch_items_by_ids(item_ids).items()}
 
 
         
 def get_user_name(user_id):
     if user_id is None or user_id == -4: return "automation"
-    query = f"query {{ users(ids: [{user_id}]) {{ name }} }}"
-    result = execute_monday_graphql(query)
-    if result and 'data' in result and result['data'].get('users'):
-        return result['data']['users'][0].get('name')
-    return "automation"
+    user = resolve_users([user_id]).get(_as_user_id(user_id))
+    return user.get('name') if user and user.get('name') else "automation"
 
 def get_roster_teacher_name(master_student_id):
     tor_val = get_column_value(master_student_id, int(MASTER_STUDENT_BOARD_ID), MASTER_STUDENT_TOR_COLUMN_ID)
@@ -226,8 +498,8 @@ def get_column_value(item_id, board_id, column_id):
             col_val = column_list[0]
             parsed_value = col_val.get('value')
             if isinstance(parsed_value, str):
-                try: parsed_value = json.loads(parsed_value)
-                except json.JSONDecodeError: pass
+                try: parsed_value = json_codec.loads(parsed_value)
+                except json_codec.JSONDecodeError: pass
             return {'value': parsed_value, 'text': col_val.get('text')}
         except (IndexError, KeyError): return None
     return None
@@ -242,7 +514,7 @@ def find_item_by_person(board_id, person_column_id, person_id):
 
 def update_item_name(item_id, board_id, new_name):
     column_values_obj = {"name": new_name}
-    graphql_value = json.dumps(json.dumps(column_values_obj))
+    graphql_value = json_codec.graphql_string(column_values_obj)
     mutation = f"mutation {{ change_multiple_column_values(board_id: {board_id}, item_id: {item_id}, column_values: {graphql_value}) {{ id }} }}"
     return execute_monday_graphql(mutation) is not None
     
@@ -253,45 +525,71 @@ def change_column_value_generic(board_id, item_id, column_id, value):
     return execute_monday_graphql(mutation) is not None
 
 def get_people_ids_from_value(value_data):
-    if not value_data: return set()
-    if isinstance(value_data, str):
-        try: value_data = json.loads(value_data)
-        except json.JSONDecodeError: return set()
-    persons_and_teams = value_data.get('personsAndTeams', [])
-    return {person['id'] for person in persons_and_teams if 'id' in person}
+    return {person_id for person_id, _ in json_codec.people_entries(value_data)}
 
 def get_linked_ids_from_connect_column_value(value_data):
-    if not value_data: return set()
-    parsed_value = value_data if isinstance(value_data, dict) else json.loads(value_data) if isinstance(value_data, str) else {}
-    if "linkedPulseIds" in parsed_value:
-        return {int(item["linkedPulseId"]) for item in parsed_value["linkedPulseIds"] if "linkedPulseId" in item}
-    return set()
+    return set(json_codec.linked_item_ids(value_data))
 
 def get_linked_items_from_board_relation(item_id, board_id, connect_column_id):
     column_data = get_column_value(item_id, board_id, connect_column_id)
     return get_linked_ids_from_connect_column_value(column_data.get('value')) if column_data else set()
 
+def get_linked_items_by_column(item_id, connect_column_ids):
+    """One read of several connect columns on an item: {column_id: linked ids}, or None if the read failed."""
+    values = read_column_values(item_id, connect_column_ids)
+    if values is None: return None
+    return {col_id: get_linked_ids_from_connect_column_value(value) for col_id, value in values.items()}
+
 def update_connect_board_column(item_id, board_id, connect_column_id, item_to_link_id, action="add"):
-    current_linked_items = get_linked_items_from_board_relation(item_id, board_id, connect_column_id)
+    current_linked_items = (get_linked_items_by_column(item_id, [connect_column_id]) or {}).get(connect_column_id, set())
     target_item_id_int = int(item_to_link_id)
     if action == "add": updated_linked_items = current_linked_items | {target_item_id_int}
     elif action == "remove": updated_linked_items = current_linked_items - {target_item_id_int}
     else: return False
+    if updated_linked_items == current_linked_items: return True
     connect_value = {"linkedPulseIds": [{"linkedPulseId": lid} for lid in sorted(list(updated_linked_items))]}
-    graphql_value = json.dumps(json.dumps(connect_value))
+    graphql_value = json_codec.graphql_string(connect_value)
     mutation = f"mutation {{ change_column_value (board_id: {board_id}, item_id: {item_id}, column_id: \"{connect_column_id}\", value: {graphql_value}) {{ id }} }}"
-    return execute_monday_graphql(mutation) is not None
+    if execute_monday_graphql(mutation) is None:
+        forget_column_values(item_id, [connect_column_id])
+        return False
+    remember_column_values(item_id, {connect_column_id: connect_value})
+    return True
+
+def apply_connect_column_changes(item_id, board_id, changes):
+    """
+    Applies every add/remove for one item's connect columns with one read and at most one
+    change_multiple_column_values. `changes` is {column_id: {'add': ids, 'remove': ids}};
+    removals win over adds. Returns False only if the read or write failed.
+    """
+    changes = {col_id: change for col_id, change in changes.items() if col_id and (change.get('add') or change.get('remove'))}
+    if not changes: return True
+    current = get_linked_items_by_column(item_id, changes)
+    if current is None:
+        print(f"ERROR: Could not read connect columns on item {item_id}.")
+        return False
+    column_values = {}
+    for col_id, change in changes.items():
+        before = current.get(col_id, set())
+        after = (before | {int(i) for i in change.get('add', ())}) - {int(i) for i in change.get('remove', ())}
+        if after != before:
+            column_values[col_id] = {"linkedPulseIds": [{"linkedPulseId": lid} for lid in sorted(after)]}
+    if not column_values: return True
+    print(f"INFO: Updating connect column(s) {sorted(column_values)} on item {item_id} in one write.")
+    mutation = f"mutation {{ change_multiple_column_values (board_id: {board_id}, item_id: {item_id}, column_values: {json_codec.graphql_string(column_values)}) {{ id }} }}"
+    if execute_monday_graphql(mutation) is None:
+        forget_column_values(item_id, list(column_values))
+        return False
+    remember_column_values(item_id, column_values)
+    return True
 
 def create_subitem(parent_item_id, subitem_name, column_values=None):
-    values_for_api = {col_id: val for col_id, val in (column_values or {}).items()}
-    column_values_json = json.dumps(values_for_api)
-    mutation = f"mutation {{ create_subitem (parent_item_id: {parent_item_id}, item_name: {json.dumps(subitem_name)}, column_values: {json.dumps(column_values_json)}) {{ id }} }}"
+    mutation = f"mutation {{ create_subitem (parent_item_id: {parent_item_id}, item_name: {json.dumps(subitem_name)}, column_values: {json_codec.graphql_string(column_values or {})}) {{ id }} }}"
     result = execute_monday_graphql(mutation)
     return result['data']['create_subitem'].get('id') if result and 'data' in result and result['data'].get('create_subitem') else None
 
 def create_item(board_id, item_name, column_values=None):
-    column_values_str = json.dumps(column_values or {})
-    mutation = f"mutation {{ create_item (board_id: {board_id}, item_name: {json.dumps(item_name)}, column_values: {json.dumps(column_values_str)}) {{ id }} }}"
+    mutation = f"mutation {{ create_item (board_id: {board_id}, item_name: {json.dumps(item_name)}, column_values: {json_codec.graphql_string(column_values or {})}) {{ id }} }}"
     result = execute_monday_graphql(mutation)
     return result['data']['create_item'].get('id') if result and 'data' in result and result['data'].get('create_item') else None
 
@@ -303,11 +601,8 @@ def update_people_column(item_id, board_id, people_column_id, new_people_value,
     if new_persons_and_teams:
         new_person_id = new_persons_and_teams[0].get('id')
 
-    # Get the IDs of the people currently in the column on Monday.com
-    current_col_val = get_column_value(item_id, board_id, people_column_id)
-    current_people_ids = set()
-    if current_col_val and current_col_val.get('value'):
-        current_people_ids = get_people_ids_from_value(current_col_val['value'])
+    # Get the IDs of the people currently in the column (from the column state cache when it's fresh)
+    current_people_ids = get_people_ids_from_value((read_column_values(item_id, [people_column_id]) or {}).get(people_column_id))
 
     # --- NEW: Check if an update is needed before proceeding ---
     if target_column_type == "person":
@@ -338,15 +633,107 @@ def update_people_column(item_id, board_id, people_column_id, new_people_value,
         else:
             return False
 
-    graphql_value = json.dumps(json.dumps(final_value))
+    graphql_value = json_codec.graphql_string(final_value)
     mutation = f"mutation {{ change_column_value(board_id: {board_id}, item_id: {item_id}, column_id: \"{people_column_id}\", value: {graphql_value}) {{ id }} }}"
-    return execute_monday_graphql(mutation) is not None
+    if execute_monday_graphql(mutation) is None:
+        forget_column_values(item_id, [people_column_id])
+        return False
+    # Cached in the shape Monday reads back, whichever shape we wrote
+    written_ids = final_value.get('persons') or [p['id'] for p in final_value.get('personsAndTeams', [])]
+    remember_column_values(item_id, {people_column_id: {"personsAndTeams": [{"id": int(pid), "kind": "person"} for pid in written_ids]} if written_ids else None})
+    return True
+
+def run_concurrently(func, jobs, limit=PEOPLE_SYNC_CONCURRENCY, raise_errors=False):
+    """
+    Calls func(*job) for every job with at most `limit` in flight and returns the results in order.
+    The gevent worker monkey-patches threading, so these are greenlets there. Each job runs in a copy
+    of the caller's context so its API calls are charged to the calling task. A job that raises is
+    logged and returns None instead of failing the others; with raise_errors, a RuntimeError naming
+    the failures is raised once every job has finished.
+    """
+    jobs = list(jobs)
+    errors = []
+    if len(jobs) <= 1 or limit <= 1: results = [_run_job(func, job, errors) for job in jobs]
+    else:
+        with ThreadPoolExecutor(max_workers=min(limit, len(jobs))) as pool:
+            contexts = [contextvars.copy_context() for _ in jobs]
+            results = list(pool.map(lambda context, job: context.run(_run_job, func, job, errors), contexts, jobs))
+    if errors and raise_errors:
+        raise RuntimeError(f"{len(errors)} of {len(jobs)} {func.__name__} calls failed") from errors[0]
+    return results
+
+def _run_job(func, job, errors):
+    try: return func(*job)
+    except Exception as e:
+        print(f"ERROR: {func.__name__}{tuple(job)} failed: {e}")
+        errors.append(e)
+        return None
 
 def create_monday_update(item_id, update_text):
     formatted_text = json.dumps(update_text)
     mutation = f"mutation {{ create_update (item_id: {item_id}, body: {formatted_text}) {{ id }} }}"
     return execute_monday_graphql(mutation)
 
+class MondayMutationBuffer:
+    """
+    Collects create_update, create_subitem and change_column_value mutations and sends them as
+    aliased multi-mutation documents of up to MONDAY_MUTATION_BATCH_SIZE operations. Each mutation
+    is charged its own complexity, so documents this size stay far inside the per-query budget.
+    Use it as a context manager to flush on exit; flush() returns {key: new or changed ID, or None}.
+    """
+    def __init__(self, batch_size=MONDAY_MUTATION_BATCH_SIZE):
+        self.batch_size = max(1, batch_size)
+        self.pending = []
+        self.results = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+    def _add(self, key, mutation, idempotent=False):
+        key = len(self.results) + len(self.pending) if key is None else key
+        self.pending.append((key, mutation, idempotent))
+        return key
+
+    def create_update(self, item_id, update_text, key=None):
+        return self._add(key, f"create_update (item_id: {item_id}, body: {json.dumps(update_text)}) {{ id }}")
+
+    def create_subitem(self, parent_item_id, subitem_name, column_values=None, key=None):
+        return self._add(key, f"create_subitem (parent_item_id: {parent_item_id}, item_name: {json.dumps(subitem_name)}, column_values: {json_codec.graphql_string(column_values or {})}) {{ id }}")
+
+    def change_column_value(self, board_id, item_id, column_id, value, key=None):
+        return self._add(key, f"change_column_value (board_id: {board_id}, item_id: {item_id}, column_id: \"{column_id}\", value: {json_codec.graphql_string(value)}) {{ id }}", idempotent=True)
+
+    def flush(self):
+        pending, self.pending = self.pending, []
+        for start in range(0, len(pending), self.batch_size):
+            batch = pending[start:start + self.batch_size]
+            if len(batch) == 1:
+                self.results[batch[0][0]] = self._send_one(batch[0][1])
+                continue
+            document = "mutation { " + " ".join(f"op{i}: {mutation}" for i, (_, mutation, _) in enumerate(batch)) + " }"
+            # An error in one operation leaves the others' results in the data, so only the failed ones are handled below
+            data = (execute_monday_graphql(document, partial=True) or {}).get('data') or {}
+            failed = []
+            for i, (key, mutation, idempotent) in enumerate(batch):
+                written = data.get(f"op{i}")
+                if isinstance(written, dict) and written.get('id'): self.results[key] = written['id']
+                else: failed.append((key, mutation, idempotent))
+            if not failed: continue
+            # A failed create may still have gone through (when the whole request failed), so only idempotent writes are retried one by one
+            print(f"ERROR: {len(failed)} of {len(batch)} batched mutations failed. Retrying the column writes individually.")
+            for key, mutation, idempotent in failed:
+                self.results[key] = self._send_one(mutation) if idempotent else None
+        return self.results
+
+    @staticmethod
+    def _send_one(mutation):
+        result = execute_monday_graphql(f"mutation {{ {mutation} }}")
+        try: return next(iter(result['data'].values()))['id']
+        except (TypeError, KeyError, AttributeError, StopIteration): return None
+
 def check_if_subitem_exists_by_name(parent_item_id, subitem_name_to_check):
     """
     Checks if a subitem for a specific course already exists,
@@ -368,11 +755,274 @@ def check_if_subitem_exists_by_name(parent_item_id, subitem_name_to_check):
         pass
     return False
 
+# ==============================================================================
+# CACHED MONDAY USER DIRECTORY
+# ==============================================================================
+# The directory lives in Valkey as a hash of user ID -> {"name", "email"} so every
+# gunicorn and Celery process shares one copy. Each process also keeps a short-lived
+# local copy so hot paths (changer names, people-sync logs) make no network calls.
+USER_DIRECTORY_KEY = "monday:user_directory"
+USER_DIRECTORY_LOADED_AT_KEY = "monday:user_directory:loaded_at"
+USER_DIRECTORY_LOCK_KEY = "monday:user_directory:lock"
+
+_valkey_client = None
+_user_directory = {'by_id': {}, 'by_name': {}, 'checked_at': 0}
+
+def get_valkey_client():
+    """Returns a shared Valkey client, or None if no URL is configured."""
+    global _valkey_client
+    if _valkey_client is None and VALKEY_URL:
+        try:
+            ssl_kwargs = {'ssl_cert_reqs': 'required'} if VALKEY_URL.startswith('rediss://') else {}
+            _valkey_client = redis.Redis.from_url(VALKEY_URL, socket_timeout=5, socket_connect_timeout=5, **ssl_kwargs)
+        except (redis.RedisError, ValueError) as e:
+            print(f"WARNING: Could not create Valkey client: {e}")
+    return _valkey_client
+
+def _as_user_id(user_id):
+    try: return int(user_id)
+    except (TypeError, ValueError): return None
+
+def fetch_all_monday_users(page_size=200):
+    """Fetches every Monday.com user in one paginated sweep."""
+    all_users = []
+    page = 1
+    while True:
+        query = f"query {{ users(kind: all, limit: {page_size}, page: {page}) {{ id name email }} }}"
+        result = execute_monday_graphql(query)
+        try:
+            page_users = result['data']['users'] or []
+        except (TypeError, KeyError):
+            print(f"WARNING: Could not read users page {page}. Directory may be incomplete.")
+            break
+        all_users.extend(page_users)
+        if len(page_users) < page_size: break
+        page += 1
+    return all_users
+
+def fetch_monday_users_by_ids(user_ids, chunk_size=100):
+    """Fetches specific users with batched users(ids: [...]) queries."""
+    found = []
+    user_ids = sorted(user_ids)
+    for i in range(0, len(user_ids), chunk_size):
+        chunk = user_ids[i:i + chunk_size]
+        query = f"query {{ users(ids: {chunk}, limit: {len(chunk)}) {{ id name email }} }}"
+        result = execute_monday_graphql(query)
+        try: found.extend(result['data']['users'] or [])
+        except (TypeError, KeyError): pass
+    return found
+
+def _set_local_user_directory(by_id):
+    _user_directory['by_id'] = by_id
+    _user_directory['by_name'] = {entry['name'].lower(): uid for uid, entry in by_id.items() if entry.get('name')}
+    _user_directory['checked_at'] = time.time()
+
+def _store_users_in_valkey(users_by_id, mark_loaded=False):
+    client = get_valkey_client()
+    if not client or not users_by_id: return
+    try:
+        pipe = client.pipeline()
+        pipe.hset(USER_DIRECTORY_KEY, mapping={str(uid): json.dumps(entry) for uid, entry in users_by_id.items()})
+        if mark_loaded:
+            pipe.set(USER_DIRECTORY_LOADED_AT_KEY, int(time.time()))
+        pipe.execute()
+    except redis.RedisError as e:
+        print(f"WARNING: Could not store user directory in Valkey: {e}")
+
+def refresh_user_directory():
+    """Rebuilds the directory from a full user sweep and publishes it to Valkey."""
+    users = fetch_all_monday_users()
+    if not users:
+        return _user_directory['by_id']
+    by_id = {int(u['id']): {'name': u.get('name'), 'email': u.get('email')} for u in users}
+    client = get_valkey_client()
+    if client:
+        try:
+            client.delete(USER_DIRECTORY_KEY)
+        except redis.RedisError as e:
+            print(f"WARNING: Could not clear user directory in Valkey: {e}")
+    _store_users_in_valkey(by_id, mark_loaded=True)
+    _set_local_user_directory(by_id)
+    print(f"INFO: Loaded {len(by_id)} Monday.com users into the user directory.")
+    return by_id
+
+def get_user_directory():
+    """
+    Returns the user directory as {'by_id': {...}, 'by_name': {...}}.
+    Uses the local copy if it is recent, otherwise Valkey, otherwise a fresh sweep.
+    A stale Valkey copy is refreshed by whichever process wins the refresh lock.
+    """
+    if _user_directory['by_id'] and time.time() - _user_directory['checked_at'] < USER_DIRECTORY_LOCAL_SECONDS:
+        return _user_directory
+    client = get_valkey_client()
+    if not client:
+        refresh_user_directory()
+        return _user_directory
+    try:
+        loaded_at = int(client.get(USER_DIRECTORY_LOADED_AT_KEY) or 0)
+        if time.time() - loaded_at >= USER_DIRECTORY_REFRESH_SECONDS:
+            if client.set(USER_DIRECTORY_LOCK_KEY, 1, nx=True, ex=120):
+                try: refresh_user_directory()
+                finally: client.delete(USER_DIRECTORY_LOCK_KEY)
+                return _user_directory
+        raw_entries = client.hgetall(USER_DIRECTORY_KEY)
+    except redis.RedisError as e:
+        print(f"WARNING: Could not read user directory from Valkey: {e}")
+        if not _user_directory['by_id']: refresh_user_directory()
+        return _user_directory
+    if raw_entries:
+        _set_local_user_directory({int(uid): json.loads(entry) for uid, entry in raw_entries.items()})
+    elif not _user_directory['by_id']:
+        refresh_user_directory()
+    return _user_directory
+
+def resolve_users(user_ids):
+    """
+    Returns {user_id: {'name', 'email'}} for the given IDs from the directory.
+    IDs the directory does not know are fetched in one batched query and cached.
+    """
+    wanted = {uid for uid in (_as_user_id(u) for u in user_ids) if uid is not None and uid != -4}
+    if not wanted: return {}
+    by_id = get_user_directory()['by_id']
+    missing = wanted - by_id.keys()
+    if missing:
+        fetched = {int(u['id']): {'name': u.get('name'), 'email': u.get('email')} for u in fetch_monday_users_by_ids(missing)}
+        if fetched:
+            _store_users_in_valkey(fetched)
+            _set_local_user_directory({**by_id, **fetched})
+            by_id = _user_directory['by_id']
+    return {uid: by_id[uid] for uid in wanted if uid in by_id}
+
+# All Staff items (name, email, SIS/Canvas/internal IDs, person), shared with the nightly teacher sync through Valkey
+# and invalidated by webhooks on the board (see staff_directory.py)
+staff_directory = StaffDirectory(ALL_STAFF_BOARD_ID, {'email': ALL_STAFF_EMAIL_COLUMN_ID, 'sis_id': ALL_STAFF_SIS_ID_COLUMN_ID, 'canvas_id': ALL_STAFF_CANVAS_ID_COLUMN,
+                                                      'internal_id': ALL_STAFF_INTERNAL_ID_COLUMN, 'person': ALL_STAFF_PERSON_COLUMN_ID},
+                                 execute_monday_graphql, fetch_items_by_ids, get_valkey_client,
+                                 refresh_seconds=STAFF_DIRECTORY_REFRESH_SECONDS, local_seconds=USER_DIRECTORY_LOCAL_SECONDS)
+
+# ==============================================================================
+# COLUMN STATE CACHE
+# ==============================================================================
+# Webhooks carry the new value of the column that changed, and our own writes know
+# what they wrote. Both are kept in Valkey as one hash per item (column ID ->
+# {"value", "at"}), so the people and connect-column write helpers can skip their
+# pre-read. An entry is only replaced by one with a later "at" (the event's change
+# time or our write time). Entries older than COLUMN_STATE_MAX_AGE_SECONDS are
+# ignored, so a change we got no webhook for is picked up by a live read at the latest
+# then. Only values whose webhook and API shapes match (people, connect) are cached.
+COLUMN_STATE_KEY = "monday:column_state:{}"
+CACHEABLE_VALUE_KEYS = ('linkedPulseIds', 'personsAndTeams')
+STORE_IF_NEWER_SCRIPT = """
+for i = 1, #ARGV - 1, 3 do
+  local current = redis.call('HGET', KEYS[1], ARGV[i])
+  if not current or cjson.decode(current)['at'] <= tonumber(ARGV[i + 1]) then
+    redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 2])
+  end
+end
+redis.call('EXPIRE', KEYS[1], ARGV[#ARGV])
+"""
+
+_column_state_paused_until = 0
+
+def _column_state_client():
+    if not COLUMN_STATE_MAX_AGE_SECONDS or time.monotonic() < _column_state_paused_until: return None
+    return get_valkey_client()
+
+def _column_state_unavailable(e):
+    global _column_state_paused_until
+    print(f"WARNING: Column state cache unavailable, pausing it for a minute: {e}")
+    _column_state_paused_until = time.monotonic() + 60
+
+def _parse_column_value(value):
+    if isinstance(value, str):
+        try: return json_codec.loads(value)
+        except json_codec.JSONDecodeError: return value
+    return value
+
+def remember_column_values(item_id, values, at=None):
+    """Records {column_id: value} as the item's known state as of `at` (epoch seconds, default now)."""
+    client = _column_state_client()
+    if client is None or not item_id or not values: return
+    at = time.time() if at is None else float(at)
+    args = []
+    for col_id, value in values.items():
+        args += [col_id, at, json_codec.dumps({'value': value, 'at': at})]
+    try: client.eval(STORE_IF_NEWER_SCRIPT, 1, COLUMN_STATE_KEY.format(item_id), *args, COLUMN_STATE_MAX_AGE_SECONDS)
+    except redis.RedisError as e: _column_state_unavailable(e)
+
+def forget_column_values(item_id, column_ids):
+    """Drops cached state after a failed write, so the next write does a live read."""
+    client = _column_state_client()
+    if client is None or not column_ids: return
+    try: client.hdel(COLUMN_STATE_KEY.format(item_id), *column_ids)
+    except redis.RedisError as e: _column_state_unavailable(e)
+
+def get_known_column_values(item_id, column_ids):
+    """{column_id: value} for the columns with a fresh cache entry; the others are left out."""
+    client = _column_state_client()
+    if client is None or not column_ids: return {}
+    try: entries = client.hmget(COLUMN_STATE_KEY.format(item_id), list(column_ids))
+    except redis.RedisError as e:
+        _column_state_unavailable(e)
+        return {}
+    cutoff = time.time() - COLUMN_STATE_MAX_AGE_SECONDS
+    known = {}
+    for col_id, raw in zip(column_ids, entries):
+        if raw is None: continue
+        entry = json_codec.loads(raw)
+        if entry['at'] >= cutoff: known[col_id] = entry['value']
+    return known
+
+def read_column_values(item_id, column_ids):
+    """
+    Current values of several columns on one item as {column_id: parsed value}: fresh cache
+    entries first, then one live read for the rest. Returns None if the live read failed.
+    """
+    column_ids = sorted({col_id for col_id in column_ids if col_id})
+    if not item_id or not column_ids: return {}
+    values = get_known_column_values(item_id, column_ids)
+    missing = [col_id for col_id in column_ids if col_id not in values]
+    if not missing: return values
+    query = f"query {{ items (ids: [{item_id}]) {{ column_values (ids: {json.dumps(missing)}) {{ id value }} }} }}"
+    result = execute_monday_graphql(query)
+    try: found = {cv['id']: _parse_column_value(cv.get('value')) for cv in result['data']['items'][0]['column_values']}
+    except (TypeError, KeyError, IndexError): return None
+    live = {col_id: found.get(col_id) for col_id in missing}
+    remember_column_values(item_id, {col_id: value for col_id, value in live.items() if _is_cacheable(value)})
+    values.update(live)
+    return values
+
+def _is_cacheable(value):
+    return value is None or (isinstance(value, dict) and any(key in value for key in CACHEABLE_VALUE_KEYS))
+
+def remember_webhook_event(event):
+    """Caches the new value from an update_column_value event, timed by when Monday says it changed."""
+    if event.get('type') != 'update_column_value' or not event.get('pulseId') or not event.get('columnId'): return
+    value = _parse_column_value(event.get('value'))
+    if not _is_cacheable(value): return
+    at = event.get('changedAt')
+    if at is None:
+        triggered = parse_trigger_time(event.get('triggerTime'))
+        at = triggered.timestamp() if triggered else None
+    remember_column_values(event['pulseId'], {event['columnId']: value}, at=at)
+
 # ==============================================================================
 # CANVAS UTILITIES
 # ==============================================================================
+# One throttle per process, shared by every Canvas client the tasks create
+canvas_throttle = CanvasThrottle(max_concurrency=CANVAS_MAX_CONCURRENCY, refill_per_second=CANVAS_RATE_LIMIT_REFILL_PER_SECOND, get_client=get_valkey_client)
+
+def record_canvas_throttled(response):
+    record_canvas_response(response)
+    inc_metric('canvas_throttled_total')
+
 def initialize_canvas_api():
-    return Canvas(CANVAS_API_URL, CANVAS_API_KEY) if CANVAS_API_URL and CANVAS_API_KEY else None
+    if not (CANVAS_API_URL and CANVAS_API_KEY): return None
+    canvas = Canvas(CANVAS_API_URL, CANVAS_API_KEY)
+    session = canvas._Canvas__requester._session
+    session.mount(CANVAS_API_URL, CanvasThrottleAdapter(canvas_throttle, on_throttled=record_canvas_throttled))
+    session.hooks['response'].append(record_canvas_response)
+    return canvas
 
 def is_middle_or_high_school(grade_text):
     """Checks if a student is in middle or high school (grades 6-12)."""
@@ -622,8 +1272,8 @@ def get_teacher_person_value_from_canvas_board(canvas_item_id):
     linked_staff_ids = get_linked_items_from_board_relation(canvas_item_id, int(CANVAS_BOARD_ID), CANVAS_TO_STAFF_CONNECT_COLUMN_ID)
     if not linked_staff_ids: return None
     staff_item_id = list(linked_staff_ids)[0]
-    person_col_val = get_column_value(staff_item_id, int(ALL_STAFF_BOARD_ID), ALL_STAFF_PERSON_COLUMN_ID)
-    return person_col_val.get('value') if person_col_val else None
+    staff = staff_directory.details([staff_item_id]).get(int(staff_item_id))
+    return staff.get('person_value') if staff else None
 
 # ==============================================================================
 # CORE LOGIC FUNCTIONS
@@ -724,7 +1374,7 @@ def get_student_details_from_plp(plp_item_id):
     query = f"""query {{ items (ids: [{plp_item_id}]) {{ column_values (ids: ["{PLP_TO_MASTER_STUDENT_CONNECT_COLUMN}"]) {{ value }} }} }}"""
     result = execute_monday_graphql(query)
     try:
-        connect_column_value = json.loads(result['data']['items'][0]['column_values'][0]['value'])
+        connect_column_value = json_codec.loads(result['data']['items'][0]['column_values'][0]['value'])
         linked_ids = [item['linkedPulseId'] for item in connect_column_value.get('linkedPulseIds', [])]
         if not linked_ids: return None
         master_student_id = linked_ids[0]
@@ -739,7 +1389,7 @@ def get_student_details_from_plp(plp_item_id):
         grade_text = column_map.get(MASTER_STUDENT_GRADE_COLUMN_ID, '')
         if not all([student_name, email]): return None
         return {'name': student_name, 'ssid': ssid, 'email': email, 'canvas_id': canvas_id, 'master_id': master_student_id, 'grade_text': grade_text}
-    except (TypeError, KeyError, IndexError, json.JSONDecodeError) as e:
+    except (TypeError, KeyError, IndexError, json_codec.JSONDecodeError) as e:
         print(f"ERROR: Could not parse student details from Monday.com response: {e}")
         return None
 
@@ -774,7 +1424,7 @@ def manage_class_enrollment(action, plp_item_id, class_item_id, student_details,
 # CELERY APP DEFINITION & TASKS
 # ==============================================================================
 broker_use_ssl_config = {'ssl_cert_reqs': 'required'} if CELERY_BROKER_URL.startswith('rediss://') else {}
-celery_app = Celery('tasks', broker=CELERY_BROKER_URL, backend=CELERY_RESULT_BACKEND, include=[__name__])
+celery_app = Celery('tasks', broker=CELERY_BROKER_URL, backend=CELERY_RESULT_BACKEND, include=[__name__, 'nightly_tasks'])
 if broker_use_ssl_config:
     celery_app.conf.broker_use_ssl = broker_use_ssl_config
     celery_app.conf.redis_backend_use_ssl = broker_use_ssl_config
@@ -788,6 +1438,36 @@ celery_app.conf.broker_transport_options = {
 }
 celery_app.conf.broker_connection_retry_on_startup = True
 
+_task_api_usage_tokens = {}
+_task_profiles = {}
+_profile_schedule = ProfileSchedule(PROFILE_TASKS)
+
+def profile_requested(task):
+    """True when the webhook that queued this task asked for a profile (see enqueue)."""
+    if not PROFILE_ALLOW_HEADER: return False
+    return bool(getattr(task.request, 'profile', None) or (task.request.headers or {}).get('profile'))
+
+@task_prerun.connect
+def on_task_prerun(task_id=None, task=None, **kwargs):
+    _task_api_usage_tokens[task_id] = start_api_usage(task.name)
+    if _profile_schedule.should_profile(task.name) or profile_requested(task):
+        stack = ExitStack()
+        stack.enter_context(profiled(task.name, task_id, PROFILE_DIR, PROFILE_MODE, PROFILE_INTERVAL_MS / 1000))
+        _task_profiles[task_id] = stack
+
+@task_postrun.connect
+def on_task_postrun(task_id=None, task=None, args=None, state=None, **kwargs):
+    profile = _task_profiles.pop(task_id, None)
+    if profile: profile.close()
+    token = _task_api_usage_tokens.pop(task_id, None)
+    usage = finish_api_usage(token) if token is not None else None
+    if usage: observe_metric('celery_task_duration_seconds', usage.duration, TASK_BUCKETS, {'task': task.name})
+    inc_metric('celery_tasks_total', {'task': task.name, 'state': state})
+    event = args[0] if args and isinstance(args[0], dict) else {}
+    triggered_at = parse_trigger_time(event.get('triggerTime')) if event.get('triggerTime') else None
+    if state == 'SUCCESS' and triggered_at:
+        observe_metric('webhook_propagation_seconds', (datetime.now(timezone.utc) - triggered_at).total_seconds(), PROPAGATION_BUCKETS, {'task': task.name})
+
 @celery_app.task(name='app.process_general_webhook')
 def process_general_webhook(event_data, config_rule):
     log_type, params = config_rule.get("log_type"), config_rule.get("params", {})
@@ -804,14 +1484,15 @@ def process_general_webhook(event_data, config_rule):
         if column_data and column_data.get('text'): update_item_name(item_id, board_id, column_data['text'])
     elif log_type == "ConnectBoardChange":
         current_ids, previous_ids = get_linked_ids_from_connect_column_value(event_data.get('value')), get_linked_ids_from_connect_column_value(event_data.get('previousValue'))
-        changer, date, prefix, linked_board_id = get_user_name(event_data.get('userId')) or "automation", datetime.now().strftime('%Y-%m-%d'), params.get('subitem_name_prefix', ''), params.get('linked_board_id')
+        changer, date, prefix = get_user_name(event_data.get('userId')) or "automation", datetime.now().strftime('%Y-%m-%d'), params.get('subitem_name_prefix', '')
         subitem_cols = {params['entry_type_column_id']: {"labels": [str(params['subitem_entry_type'])]}} if params.get('entry_type_column_id') and params.get('subitem_entry_type') else {}
-        for link_id in (current_ids - previous_ids):
-            name = get_item_name(link_id, linked_board_id)
-            if name: create_subitem(item_id, f"Added {prefix} '{name}' on {date} by {changer}", subitem_cols)
-        for link_id in (previous_ids - current_ids):
-            name = get_item_name(link_id, linked_board_id)
-            if name: create_subitem(item_id, f"Removed {prefix} '{name}' on {date} by {changer}", subitem_cols)
+        # One name lookup for every changed link, then all log subitems go out in batched mutations
+        names = get_item_names(current_ids ^ previous_ids)
+        with MondayMutationBuffer() as mutations:
+            for link_id in sorted(current_ids - previous_ids):
+                if names.get(link_id): mutations.create_subitem(item_id, f"Added {prefix} '{names[link_id]}' on {date} by {changer}", subitem_cols)
+            for link_id in sorted(previous_ids - current_ids):
+                if names.get(link_id): mutations.create_subitem(item_id, f"Removed {prefix} '{names[link_id]}' on {date} by {changer}", subitem_cols)
 
 @celery_app.task(name='app.process_canvas_full_sync_from_status')
 def process_canvas_full_sync_from_status(event_data):
@@ -914,13 +1595,14 @@ def process_canvas_full_sync_from_status(event_data):
     for class_id, category in class_id_to_category_map.items():
         category_to_class_ids_map_logs[category].append(class_id)
         
-    for category, class_ids in category_to_class_ids_map_logs.items():
-        subitem_name = f"{category} Curriculum"
-        subitem_id = find_or_create_subitem(plp_item_id, subitem_name)
-        if subitem_id:
-            current_names_str = ", ".join([f"'{id_to_name_map.get(cid)}'" for cid in sorted(class_ids) if id_to_name_map.get(cid)]) or "Blank"
-            update_text = f"Full Canvas Sync triggered by {changer_name}. Current {category} curriculum is now: {current_names_str}."
-            create_monday_update(subitem_id, update_text)
+    with MondayMutationBuffer() as mutations:
+        for category, class_ids in category_to_class_ids_map_logs.items():
+            subitem_name = f"{category} Curriculum"
+            subitem_id = find_or_create_subitem(plp_item_id, subitem_name)
+            if subitem_id:
+                current_names_str = ", ".join([f"'{id_to_name_map.get(cid)}'" for cid in sorted(class_ids) if id_to_name_map.get(cid)]) or "Blank"
+                update_text = f"Full Canvas Sync triggered by {changer_name}. Current {category} curriculum is now: {current_names_str}."
+                mutations.create_update(subitem_id, update_text)
 
 @celery_app.task(name='app.process_canvas_delta_sync_from_course_change')
 def process_canvas_delta_sync_from_course_change(event_data):
@@ -1037,17 +1719,20 @@ def process_master_student_person_sync_webhook(event_data):
     mappings = MASTER_STUDENT_PEOPLE_COLUMN_MAPPINGS.get(trigger_column_id)
     if not mappings: return
     
-    # Syncs people columns to other boards
-    for target in mappings["targets"]:
-        linked_ids = get_linked_items_from_board_relation(master_item_id, int(MASTER_STUDENT_BOARD_ID), target["connect_column_id"])
-        for linked_id in linked_ids:
-            update_people_column(linked_id, int(target["board_id"]), target["target_column_id"], current_value_raw, target["target_column_type"])
+    # One read of every connect column the targets use, then all target boards are updated in parallel
+    linked_by_column = get_linked_items_by_column(master_item_id, [target["connect_column_id"] for target in mappings["targets"]])
+    if linked_by_column is None:
+        print(f"ERROR: Could not read connect columns on Master Student item {master_item_id}.")
+        return
+    updates = [(linked_id, int(target["board_id"]), target["target_column_id"], current_value_raw, target["target_column_type"])
+               for target in mappings["targets"] for linked_id in linked_by_column.get(target["connect_column_id"], set())]
+    run_concurrently(update_people_column, updates, raise_errors=True)
 
     # Creates a single, detailed log update on the PLP board
     plp_target = next((t for t in mappings["targets"] if str(t.get("board_id")) == str(PLP_BOARD_ID)), None)
     if not plp_target: return
     
-    plp_linked_ids = get_linked_items_from_board_relation(master_item_id, int(MASTER_STUDENT_BOARD_ID), plp_target["connect_column_id"])
+    plp_linked_ids = linked_by_column.get(plp_target["connect_column_id"])
     if not plp_linked_ids: return
     
     plp_item_id = list(plp_linked_ids)[0]
@@ -1058,8 +1743,10 @@ def process_master_student_person_sync_webhook(event_data):
     subitem_id = find_or_create_subitem(plp_item_id, subitem_name)
     if not subitem_id: return
     
-    added_names = [name for name in [get_user_name(pid) for pid in (current_ids - previous_ids)] if name]
-    removed_names = [name for name in [get_user_name(pid) for pid in (previous_ids - current_ids)] if name]
+    # One directory lookup covers every added/removed person, so no per-person user calls.
+    people = resolve_users(current_ids | previous_ids)
+    added_names = [name for name in [people.get(_as_user_id(pid), {}).get('name') for pid in (current_ids - previous_ids)] if name]
+    removed_names = [name for name in [people.get(_as_user_id(pid), {}).get('name') for pid in (previous_ids - current_ids)] if name]
 
     update_messages = []
     for name in removed_names:
@@ -1111,13 +1798,8 @@ def process_plp_course_sync_webhook(event_data):
     
     # 1. Get secondary categories for all added courses to make a single API call
     secondary_category_col_id = "dropdown_mkq0r2av"
-    if added_courses:
-        course_ids_to_query = list(added_courses)
-        secondary_category_query = f"query {{ items (ids: {course_ids_to_query}) {{ id column_values(ids: [\"{secondary_category_col_id}\"]) {{ text }} }} }}"
-        secondary_category_results = execute_monday_graphql(secondary_category_query)
-        secondary_category_map = {int(item['id']): item['column_values'][0].get('text') for item in secondary_category_results.get('data', {}).get('items', []) if item.get('column_values')}
-    else:
-        secondary_category_map = {}
+    secondary_category_map = {course_id: item['columns'][secondary_category_col_id].get('text') for course_id, item in fetch_items_by_ids(added_courses, [secondary_category_col_id]).items()
+                              if secondary_category_col_id in item['columns']}
 
     # 2. Process primary tags and determine final columns for each added course
     for course_id in added_courses:
@@ -1150,16 +1832,15 @@ def process_plp_course_sync_webhook(event_data):
                     else:
                         print(f"WARNING: Tag '{category}' not mapped and 'Other/Elective' is not configured. Skipping.")
     
-    # 3. Add courses to the determined columns
+    # 3. Plan every addition and every removal (from all category columns), then apply them with one read and one write
+    connect_changes = defaultdict(lambda: {'add': set(), 'remove': set()})
     for course_id, col_ids in course_to_final_cols.items():
-        for col_id in set(col_ids):
-            update_connect_board_column(plp_item_id, int(PLP_BOARD_ID), col_id, course_id, "add")
-
-    # 4. Handle removed courses
-    for course_id in removed_courses:
-        possible_cols = PLP_CATEGORY_TO_CONNECT_COLUMN_MAP.values()
-        for col_id in possible_cols:
-            update_connect_board_column(plp_item_id, int(PLP_BOARD_ID), col_id, course_id, "remove")
+        for col_id in col_ids:
+            connect_changes[col_id]['add'].add(course_id)
+    if removed_courses:
+        for col_id in PLP_CATEGORY_TO_CONNECT_COLUMN_MAP.values():
+            connect_changes[col_id]['remove'].update(removed_courses)
+    apply_connect_column_changes(plp_item_id, int(PLP_BOARD_ID), connect_changes)
 
     downstream_event = {'pulseId': plp_item_id, 'userId': event_data.get('userId')}
     process_canvas_delta_sync_from_course_change.delay(downstream_event)
@@ -1176,13 +1857,11 @@ def process_teacher_enrollment_webhook(event_data):
         return
     added_staff_item_ids = get_linked_ids_from_connect_column_value(event_data.get('value')) - get_linked_ids_from_connect_column_value(event_data.get('previousValue'))
     if not added_staff_item_ids: return
+    staff_details = staff_directory.details(added_staff_item_ids)
     for staff_item_id in added_staff_item_ids:
-        teacher_name = get_item_name(staff_item_id, int(ALL_STAFF_BOARD_ID)) or f"Staff Item {staff_item_id}"
-        email_val = get_column_value(staff_item_id, int(ALL_STAFF_BOARD_ID), ALL_STAFF_EMAIL_COLUMN_ID)
-        sis_id_val = get_column_value(staff_item_id, int(ALL_STAFF_BOARD_ID), ALL_STAFF_SIS_ID_COLUMN_ID)
-        canvas_id_val = get_column_value(staff_item_id, int(ALL_STAFF_BOARD_ID), ALL_STAFF_CANVAS_ID_COLUMN)
-        internal_id_val = get_column_value(staff_item_id, int(ALL_STAFF_BOARD_ID), ALL_STAFF_INTERNAL_ID_COLUMN)
-        teacher_details = { 'name': teacher_name, 'email': email_val.get('text') if email_val else None, 'sis_id': sis_id_val.get('text') if sis_id_val else None, 'canvas_id': canvas_id_val.get('text') if canvas_id_val else None, 'internal_id': internal_id_val.get('text') if internal_id_val else None, }
+        teacher_details = staff_details.get(int(staff_item_id)) or {'email': None, 'sis_id': None, 'canvas_id': None, 'internal_id': None}
+        teacher_name = teacher_details.get('name') or f"Staff Item {staff_item_id}"
+        teacher_details = {**teacher_details, 'name': teacher_name}
         result = enroll_teacher_in_course(canvas_course_id, teacher_details)
         create_monday_update(course_item_id, f"Enrollment attempt for '{teacher_name}': {result}")
 
@@ -1192,52 +1871,121 @@ def process_sped_students_person_sync_webhook(event_data):
     config = SPED_STUDENTS_PEOPLE_COLUMN_MAPPING.get(col_id)
     if not config: return
     linked_ids = get_linked_items_from_board_relation(source_item_id, int(SPED_STUDENTS_BOARD_ID), SPED_TO_IEPAP_CONNECT_COLUMN_ID)
-    for linked_id in linked_ids:
-        update_people_column(linked_id, int(IEP_AP_BOARD_ID), config["target_column_id"], col_val, config["target_column_type"])
+    run_concurrently(update_people_column, [(linked_id, int(IEP_AP_BOARD_ID), config["target_column_id"], col_val, config["target_column_type"]) for linked_id in linked_ids], raise_errors=True)
+
+# ==============================================================================
+# WEBHOOK RECORDER
+# ==============================================================================
+# When WEBHOOK_RECORD_PATH is set, each webhook payload is appended to a JSONL file
+# with its arrival time, for replay with replay_webhooks.py. Rotation isn't safe
+# across processes, so every gunicorn worker writes its own file with its PID before
+# the extension (webhooks.jsonl -> webhooks.1234.jsonl).
+_webhook_recorder = None
+
+def get_webhook_recorder():
+    global _webhook_recorder
+    if _webhook_recorder is None and WEBHOOK_RECORD_PATH:
+        root, ext = os.path.splitext(WEBHOOK_RECORD_PATH)
+        try:
+            handler = RotatingFileHandler(f"{root}.{os.getpid()}{ext or '.jsonl'}", maxBytes=WEBHOOK_RECORD_MAX_BYTES, backupCount=WEBHOOK_RECORD_BACKUPS, encoding='utf-8')
+        except OSError as e:
+            print(f"WARNING: Could not open webhook capture file: {e}")
+            return None
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        recorder = logging.getLogger(f"webhook_recorder.{os.getpid()}")
+        recorder.setLevel(logging.INFO)
+        recorder.propagate = False
+        recorder.addHandler(handler)
+        _webhook_recorder = recorder
+    return _webhook_recorder
+
+def record_webhook(payload):
+    recorder = get_webhook_recorder()
+    if recorder is None: return
+    try: recorder.info(json.dumps({'received_at': time.time(), 'path': request.path, 'payload': payload}, separators=(',', ':')))
+    except (TypeError, ValueError) as e: print(f"WARNING: Could not record webhook: {e}")
 
 # ==============================================================================
 # FLASK WEB APP
 # ==============================================================================
 app = Flask(__name__)
 
+@app.before_request
+def start_request_timer():
+    g.request_started = time.monotonic()
+
+@app.after_request
+def record_request_metrics(response):
+    if request.path != '/metrics' and 'request_started' in g:
+        route = g.get('webhook_route') or (request.url_rule.rule if request.url_rule else 'unmatched')
+        observe_metric('webhook_request_duration_seconds', time.monotonic() - g.request_started, INGEST_BUCKETS, {'route': route})
+        inc_metric('webhook_requests_total', {'route': route, 'status': response.status_code})
+    return response
+
+def enqueue(task, *args):
+    """Queues a task for a webhook, counting successes and broker failures by task."""
+    g.webhook_route = task.name
+    profile = PROFILE_ALLOW_HEADER and request.headers.get('X-Profile-Task') == '1'
+    try: result = task.apply_async(args=args, headers={'profile': True}) if profile else task.delay(*args)
+    except Exception:
+        inc_metric('webhook_enqueue_failures_total', {'task': task.name})
+        raise
+    inc_metric('webhook_enqueued_total', {'task': task.name})
+    return result
+
 @app.route('/monday-webhooks', methods=['POST'])
 def monday_unified_webhooks():
     data = request.get_json()
-    if 'challenge' in data: return jsonify({'challenge': data['challenge']})
+    if 'challenge' in data:
+        g.webhook_route = 'challenge'
+        return jsonify({'challenge': data['challenge']})
+    record_webhook(data)
     event = data.get('event', {})
+    remember_webhook_event(event)
     board_id, col_id, webhook_type = str(event.get('boardId')), event.get('columnId'), event.get('type')
+    if board_id == ALL_STAFF_BOARD_ID and event.get('pulseId'):
+        staff_directory.invalidate(event['pulseId'])
     parent_board_id = str(event.get('parentItemBoardId')) if event.get('parentItemBoardId') else None
     if board_id == PLP_BOARD_ID and webhook_type == "update_column_value":
         if col_id == PLP_CANVAS_SYNC_COLUMN_ID:
-            process_canvas_full_sync_from_status.delay(event)
+            enqueue(process_canvas_full_sync_from_status, event)
             return jsonify({"message": "Canvas Full Sync queued."}), 202
         if col_id in [c.strip() for c in PLP_ALL_CLASSES_CONNECT_COLUMNS_STR.split(',')]:
-            process_canvas_delta_sync_from_course_change.delay(event)
+            enqueue(process_canvas_delta_sync_from_course_change, event)
             return jsonify({"message": "Canvas Delta Sync queued."}), 202
     if parent_board_id == HS_ROSTER_BOARD_ID and col_id == HS_ROSTER_CONNECT_ALL_COURSES_COLUMN_ID:
-        process_plp_course_sync_webhook.delay(event)
+        enqueue(process_plp_course_sync_webhook, event)
         return jsonify({"message": "PLP Course Sync queued."}), 202
     if board_id == MASTER_STUDENT_BOARD_ID and col_id in MASTER_STUDENT_PEOPLE_COLUMNS:
-        process_master_student_person_sync_webhook.delay(event)
+        enqueue(process_master_student_person_sync_webhook, event)
         return jsonify({"message": "Master Student Person Sync queued."}), 202
     if board_id == SPED_STUDENTS_BOARD_ID and col_id in SPED_STUDENTS_PEOPLE_COLUMN_MAPPING:
-        process_sped_students_person_sync_webhook.delay(event)
+        enqueue(process_sped_students_person_sync_webhook, event)
         return jsonify({"message": "SpEd Students Person Sync queued."}), 202
     if board_id == CANVAS_BOARD_ID and col_id == CANVAS_TO_STAFF_CONNECT_COLUMN_ID:
-        process_teacher_enrollment_webhook.delay(event)
+        enqueue(process_teacher_enrollment_webhook, event)
         return jsonify({"message": "Canvas Teacher Enrollment queued."}), 202
     for rule in LOG_CONFIGS:
         if str(rule.get("trigger_board_id")) == board_id:
             if (webhook_type == "update_column_value" and rule.get("trigger_column_id") == col_id) or \
                (webhook_type == "create_pulse" and not rule.get("trigger_column_id")):
-                    process_general_webhook.delay(event, rule)
+                    enqueue(process_general_webhook, event, rule)
                     return jsonify({"message": f"General task '{rule.get('log_type')}' queued."}), 202
+    g.webhook_route = 'ignored'
     return jsonify({"status": "ignored"}), 200
 
 @app.route('/')
 def home():
     return "Consolidated Webhook Handler is running!", 200
 
+@app.route('/metrics')
+def metrics():
+    try: body = render_metrics()
+    except redis.RedisError as e:
+        print(f"ERROR: Could not read metrics from Valkey: {e}")
+        return "Metrics store unavailable\n", 503
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
     port = int(os.environ.get("PORT", 5000))
     app.run(host='0.0.0.0', port=port)
@@ -0,0 +1,151 @@
+# board_snapshot.py
+#
+# Description:
+# Compact, indexed copies of whole Monday.com boards for one nightly run. Each item is a
+# SnapshotItem with __slots__ (integer ID, name, updated_at) instead of a dict, and a
+# BoardSnapshot indexes the items by ID. The connect columns read with the snapshot are
+# indexed both ways as integer IDs, so "the HS Roster of this PLP" and "the PLPs linked
+# from this HS Roster" are dict lookups instead of a scan of the board or an API call.
+# nightly_sync.get_board_snapshot() reads one board into a snapshot.
+#
+# Usage (memory and lookup time against lists of item dicts):
+# python board_snapshot.py --items 5000
+#
+# Required Python packages:
+# None (standard library only)
+
+import argparse
+import json
+import time
+import tracemalloc
+
+
+class SnapshotItem:
+    """One board item. Reads like the {'id', 'name', 'updated_at'} dicts it replaces, so item['id'] still works."""
+    __slots__ = ('id', 'name', 'updated_at')
+
+    def __init__(self, item_id, name, updated_at=None):
+        self.id = int(item_id)
+        self.name = name
+        self.updated_at = updated_at
+
+    def __getitem__(self, key):
+        if key not in SnapshotItem.__slots__: raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in SnapshotItem.__slots__ else default
+
+    def __repr__(self):
+        return f"SnapshotItem({self.id}, {self.name!r})"
+
+
+class BoardSnapshot:
+    """The items of one board, by ID, with connect columns indexed both ways."""
+
+    def __init__(self, board_id, link_column_ids=()):
+        self.board_id = board_id
+        self.items = []
+        self.by_id = {}
+        self.links = {column_id: {} for column_id in link_column_ids}  # {column_id: {item_id: (linked IDs)}}
+        self.linked_from = {column_id: {} for column_id in link_column_ids}  # {column_id: {linked ID: (item IDs)}}
+
+    def add(self, item_id, name, updated_at=None, links=None):
+        """links: {column_id: linked IDs} for the snapshot's connect columns."""
+        item = SnapshotItem(item_id, name, updated_at)
+        if item.id in self.by_id: return self.by_id[item.id]
+        self.items.append(item)
+        self.by_id[item.id] = item
+        for column_id, linked_ids in (links or {}).items():
+            if column_id not in self.links or not linked_ids: continue
+            linked_ids = tuple(sorted(int(linked_id) for linked_id in linked_ids))
+            self.links[column_id][item.id] = linked_ids
+            reverse = self.linked_from[column_id]
+            for linked_id in linked_ids:
+                reverse[linked_id] = reverse.get(linked_id, ()) + (item.id,)
+        return item
+
+    def get(self, item_id, default=None):
+        return self.by_id.get(int(item_id), default)
+
+    def linked_ids(self, item_id, column_id):
+        """The item's linked IDs in a connect column, or None if the snapshot didn't read that column."""
+        if column_id not in self.links: return None
+        return self.links[column_id].get(int(item_id), ())
+
+    def items_linking_to(self, column_id, linked_id):
+        """IDs of the items whose connect column links to linked_id."""
+        return self.linked_from.get(column_id, {}).get(int(linked_id), ())
+
+    def __contains__(self, item_id):
+        return int(item_id) in self.by_id
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+# ==============================================================================
+# BENCHMARK
+# ==============================================================================
+def make_pages(items, link_column_id):
+    """Synthetic PLP and HS Roster items as items_page returns them, each HS Roster linked to one PLP."""
+    def page_item(item_id, linked_id):
+        value = json.dumps({"linkedPulseIds": [{"linkedPulseId": linked_id}]})
+        return {'id': str(item_id), 'name': f"Student {item_id}", 'updated_at': "2026-10-01T04:00:00Z",
+                'column_values': [{'id': link_column_id, 'value': value}]}
+    plp_pages = [page_item(10_000_000_000 + i, 20_000_000_000 + i) for i in range(items)]
+    hs_pages = [page_item(20_000_000_000 + i, 10_000_000_000 + i) for i in range(items)]
+    return plp_pages, hs_pages
+
+
+def snapshot_from_pages(board_id, pages, link_column_id):
+    snapshot = BoardSnapshot(board_id, [link_column_id])
+    for item in pages:
+        links = {cv['id']: [link['linkedPulseId'] for link in json.loads(cv['value'])['linkedPulseIds']] for cv in item['column_values']}
+        snapshot.add(item['id'], item['name'], item['updated_at'], links)
+    return snapshot
+
+
+def traced(func):
+    """(result, peak bytes allocated while func ran)."""
+    tracemalloc.start()
+    try:
+        result = func()
+        return result, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_benchmark(items):
+    link_column_id = "connect_boards"
+    plp_pages, hs_pages = make_pages(items, link_column_id)
+    # What the run kept before: the page dicts (json round trip so nothing is shared with the generator)
+    before, before_peak = traced(lambda: (json.loads(json.dumps(plp_pages)), json.loads(json.dumps(hs_pages))))
+    after, after_peak = traced(lambda: (snapshot_from_pages(1, plp_pages, link_column_id), snapshot_from_pages(2, hs_pages, link_column_id)))
+    print(f"{items} PLP and {items} HS Roster items")
+    print(f"  lists of dicts   peak {before_peak / 2**20:7.1f} MiB")
+    print(f"  board snapshots  peak {after_peak / 2**20:7.1f} MiB ({before_peak / after_peak:.1f}x smaller)")
+
+    plp_list, hs_list = before
+    start = time.perf_counter()
+    for plp_item in plp_list:
+        hs_roster_item_id = int(json.loads(plp_item['column_values'][0]['value'])['linkedPulseIds'][0]['linkedPulseId'])
+        hs_item = next(item for item in hs_list if int(item['id']) == hs_roster_item_id)
+    scan_time = time.perf_counter() - start
+    plp_snapshot, hs_snapshot = after
+    start = time.perf_counter()
+    for plp_item in plp_snapshot:
+        hs_item = hs_snapshot.get(plp_snapshot.linked_ids(plp_item.id, link_column_id)[0])
+    index_time = time.perf_counter() - start
+    assert hs_item.id == int(hs_list[-1]['id'])
+    print(f"  PLP -> HS Roster for every student: scan {scan_time * 1000:.1f} ms, index {index_time * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare board snapshots with lists of item dicts.")
+    parser.add_argument('--items', type=int, default=5000)
+    args = parser.parse_args()
+    run_benchmark(args.items)
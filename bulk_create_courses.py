@@ -1,8 +1,10 @@
 import os
 import json
 import requests
+import asyncio
 from canvasapi import Canvas
 from canvasapi.exceptions import CanvasException
+from canvas_async import AsyncCanvasClient
 
 # ==============================================================================
 # SCRIPT CONFIGURATION
@@ -18,6 +20,13 @@ CANVAS_COURSE_ID_COLUMN_ID = os.environ.get("CANVAS_COURSE_ID_COLUMN_ID")
 CANVAS_TERM_ID = os.environ.get("CANVAS_TERM_ID")
 CANVAS_SUBACCOUNT_ID = os.environ.get("CANVAS_SUBACCOUNT_ID")
 CANVAS_TEMPLATE_COURSE_ID = os.environ.get("CANVAS_TEMPLATE_COURSE_ID")
+CANVAS_ROOT_ACCOUNT_ID = "1"
+
+# "concurrent" (default) prefetches SIS IDs, allocates them locally and creates courses in parallel.
+# "sequential" keeps the original one-course-at-a-time trial-and-error loop.
+RUNNER = os.environ.get("RUNNER", "concurrent").lower()
+CONCURRENCY = int(os.environ.get("CONCURRENCY", "5"))
+MONDAY_MUTATIONS_PER_REQUEST = 25
 
 MONDAY_HEADERS = { "Authorization": MONDAY_API_KEY, "Content-Type": "application/json", "API-Version": "2024-01" }
 
@@ -46,6 +55,29 @@ def change_column_value_generic(board_id, item_id, column_id, value):
     else:
         print(f"  MONDAY UPDATE Failed for item {item_id}. Response: {result}")
 
+def change_column_values_batch(board_id, column_id, item_values, batch_size=MONDAY_MUTATIONS_PER_REQUEST):
+    """
+    Writes {item_id: value} to one column using aliased change_column_value mutations,
+    batch_size per request. Returns the set of item IDs that were updated.
+    """
+    updated = set()
+    items = list(item_values.items())
+    for i in range(0, len(items), batch_size):
+        chunk = items[i:i + batch_size]
+        fields = " ".join(
+            f'm{n}: change_column_value(board_id: {int(board_id)}, item_id: {int(item_id)}, column_id: "{column_id}", value: {json.dumps(json.dumps(str(value)))}) {{ id }}'
+            for n, (item_id, value) in enumerate(chunk)
+        )
+        print(f"  EXECUTING MONDAY BATCH UPDATE for {len(chunk)} items...")
+        result = execute_monday_graphql(f"mutation {{ {fields} }}")
+        data = (result or {}).get('data') or {}
+        for n, (item_id, _) in enumerate(chunk):
+            if data.get(f"m{n}"):
+                updated.add(item_id)
+            else:
+                print(f"  MONDAY UPDATE Failed for item {item_id}. Response: {(result or {}).get('errors')}")
+    return updated
+
 def get_all_items_from_board(board_id, column_ids):
     all_items = []
     cursor = None
@@ -139,6 +171,90 @@ def create_canvas_course(course_name, term_id):
     print(f"  ERROR: Failed to create course '{course_name}' after {max_attempts} attempts. Giving up.")
     return None
 
+# ==============================================================================
+# CONCURRENT PROVISIONING
+# ==============================================================================
+def base_sis_course_id(course_name, term_id):
+    base_sis_name = ''.join(e for e in course_name if e.isalnum()).replace(' ', '_').lower()
+    return f"{base_sis_name}_{term_id}"
+
+def allocate_sis_course_id(course_name, term_id, taken_sis_ids):
+    """
+    Picks the first free SIS ID in the same sequence create_canvas_course tries
+    (base, base_1, base_2, ...) and reserves it in taken_sis_ids.
+    """
+    base_sis_id = base_sis_course_id(course_name, term_id)
+    candidate, suffix = base_sis_id, 0
+    while candidate in taken_sis_ids:
+        suffix += 1
+        candidate = f"{base_sis_id}_{suffix}"
+    taken_sis_ids.add(candidate)
+    return candidate
+
+def is_sis_id_conflict(body):
+    """Canvas reports a taken SIS ID as a 400 whose errors mention 'is already in use'."""
+    return 'is already in use' in json.dumps(body).lower()
+
+async def fetch_existing_sis_course_ids(client, term_id):
+    """One paginated listing of every course in the term, returning their SIS IDs."""
+    params = [("enrollment_term_id", f"sis_term_id:{term_id}"), ("state[]", "all"), ("per_page", 100)]
+    courses = await client.get_paginated(f"accounts/{CANVAS_ROOT_ACCOUNT_ID}/courses", params)
+    if courses is None:
+        return None
+    return {c['sis_course_id'] for c in courses if c.get('sis_course_id')}
+
+async def create_canvas_course_async(client, course_name, term_id, taken_sis_ids, max_attempts=3):
+    """
+    Creates one course with a locally allocated SIS ID. A conflict here means another
+    process took the ID after the prefetch, so the next free ID is allocated and retried.
+    """
+    for attempt in range(max_attempts):
+        sis_id = allocate_sis_course_id(course_name, term_id, taken_sis_ids)
+        course_data = {
+            'name': course_name, 'course_code': course_name,
+            'enrollment_term_id': f"sis_term_id:{term_id}", 'sis_course_id': sis_id,
+            'source_course_id': CANVAS_TEMPLATE_COURSE_ID
+        }
+        status, body, _ = await client.request("POST", f"accounts/{CANVAS_SUBACCOUNT_ID}/courses", json_body={'course': course_data})
+        if status and status < 400 and isinstance(body, dict) and body.get('id'):
+            print(f"  SUCCESS: '{course_name}' created with SIS ID '{sis_id}'. Canvas ID: {body['id']}")
+            return body
+        if status == 400 and is_sis_id_conflict(body):
+            print(f"  WARNING: SIS ID '{sis_id}' was taken after the prefetch. Allocating another...")
+            continue
+        print(f"  FATAL ERROR for course '{course_name}': {status} {body}. Aborting this course.")
+        return None
+    print(f"  ERROR: Failed to create course '{course_name}' after {max_attempts} attempts. Giving up.")
+    return None
+
+async def provision_courses_concurrently(courses_to_create):
+    """
+    Prefetches SIS IDs once, creates all courses concurrently under the Canvas rate
+    limit, then writes the new Canvas IDs back to Monday.com in batched mutations.
+    Returns (success_count, fail_count).
+    """
+    async with AsyncCanvasClient(CANVAS_API_URL, CANVAS_API_KEY, max_concurrency=CONCURRENCY) as client:
+        taken_sis_ids = await fetch_existing_sis_course_ids(client, CANVAS_TERM_ID)
+        if taken_sis_ids is None:
+            print("  ERROR: Could not list existing courses in the term. Aborting.")
+            return 0, len(courses_to_create)
+        print(f"Found {len(taken_sis_ids)} SIS course IDs already in use in term {CANVAS_TERM_ID}.")
+        new_courses = await asyncio.gather(*(
+            create_canvas_course_async(client, course_data['title'], CANVAS_TERM_ID, taken_sis_ids)
+            for course_data in courses_to_create
+        ))
+        print(f"Canvas requests: {client.request_count}, throttled responses: {client.throttle_count}")
+
+    canvas_ids_by_item = {
+        course_data['monday_item_id']: new_course['id']
+        for course_data, new_course in zip(courses_to_create, new_courses) if new_course
+    }
+    for course_data, new_course in zip(courses_to_create, new_courses):
+        if not new_course:
+            print(f"  SKIPPING UPDATE: Course creation failed for '{course_data['title']}'.")
+    updated = change_column_values_batch(CANVAS_BOARD_ID, CANVAS_COURSE_ID_COLUMN_ID, canvas_ids_by_item)
+    return len(updated), len(courses_to_create) - len(updated)
+
 def main():
     print("--- FORTIFIED SCRIPT (FINAL VERSION 2.0) INITIATED ---")
     print(f"Starting bulk Canvas course creation process by reading the 'Canvas Courses' board ({CANVAS_BOARD_ID}).")
@@ -158,7 +274,14 @@ def main():
         return
 
     print(f"\nFound {len(courses_to_create)} courses that need to be created in Canvas. Starting process...")
-    
+
+    if RUNNER != "sequential":
+        success_count, fail_count = asyncio.run(provision_courses_concurrently(courses_to_create))
+        print("\n--- Bulk Creation Complete ---")
+        print(f"Successfully created and updated: {success_count}")
+        print(f"Failed to create or update: {fail_count}")
+        return
+
     success_count = 0
     fail_count = 0
     for course_data in courses_to_create:
@@ -8,7 +8,9 @@ import time
 # ==============================================================================
 # This script is designed for a one-time, manual run to sync all teacher
 # assignments from the Master Student List board to all linked boards as
-# defined in your configuration. It includes a delay to prevent API rate-limiting.
+# defined in your configuration. It reads only the mapped columns, compares
+# them with what each target board already holds, and writes only the
+# differences in batched mutations.
 # ==============================================================================
 
 # ==============================================================================
@@ -28,9 +30,12 @@ except json.JSONDecodeError:
     print("ERROR: Could not parse MASTER_STUDENT_PEOPLE_COLUMN_MAPPINGS. Please check your environment variable.")
     MASTER_STUDENT_PEOPLE_COLUMN_MAPPINGS = {}
 
-# Delay between processing each student item to avoid hitting the API rate limit.
-# 0.25 seconds is a safe starting point.
-DELAY_BETWEEN_ITEMS = 0.25
+# Items per items(ids: [...]) read and mutations per batched write request.
+ITEMS_PER_READ = 100
+MUTATIONS_PER_WRITE = 20
+
+# Delay between batched write requests to avoid hitting the API rate limit.
+DELAY_BETWEEN_BATCHES = 0.25
 
 # ==============================================================================
 # MONDAY.COM API UTILITIES (Copied from app.py for standalone use)
@@ -47,10 +52,11 @@ def execute_monday_graphql(query):
         print(f"  -> API Error: {e}")
         return None
 
-def get_all_items_from_board(board_id):
-    """Fetches all items and their column values from a specified board."""
+def get_all_items_from_board(board_id, column_ids=None):
+    """Fetches all items from a specified board, projecting only column_ids when given."""
     all_items = []
     cursor = None
+    column_filter = f"(ids: {json.dumps(sorted(column_ids))})" if column_ids else ""
     while True:
         # Construct the query with pagination support (using a cursor)
         query = f"""
@@ -61,7 +67,7 @@ def get_all_items_from_board(board_id):
                     items {{
                         id
                         name
-                        column_values {{
+                        column_values{column_filter} {{
                             id
                             value
                             text
@@ -72,7 +78,7 @@ def get_all_items_from_board(board_id):
         }}
         """
         result = execute_monday_graphql(query)
-        if not result or 'data' not in result or not result['data']['boards']:
+        if not result or not result.get('data') or not result['data']['boards']:
             print(f"  -> Could not fetch items for board {board_id}. Stopping.")
             break
 
@@ -98,28 +104,28 @@ def get_linked_items_from_board_relation(item_data, connect_column_id):
         return {int(item["linkedPulseId"]) for item in parsed_value["linkedPulseIds"] if "linkedPulseId" in item}
     return set()
 
-def update_people_column(item_id, board_id, people_column_id, new_people_value, target_column_type):
-    """Updates a People column on a specific item."""
+def build_people_column_value(new_people_value, target_column_type):
+    """Builds the People column value change_multiple_column_values_batch writes, or None for an unsupported column type."""
     parsed_new_value = new_people_value if isinstance(new_people_value, dict) else json.loads(new_people_value) if isinstance(new_people_value, str) else {}
     persons_and_teams = parsed_new_value.get('personsAndTeams', [])
-    
+
     if target_column_type == "person":
         person_id = persons_and_teams[0].get('id') if persons_and_teams else None
-        graphql_value = json.dumps(json.dumps({"personId": person_id} if person_id else {}))
+        return {"personId": person_id} if person_id else {}
     elif target_column_type == "multiple-person":
-        people_list = [{"id": p.get('id'), "kind": "person"} for p in persons_and_teams if 'id' in p]
-        graphql_value = json.dumps(json.dumps({"personsAndTeams": people_list}))
-    else:
-        return False
-        
-    mutation = f"""
-    mutation {{
-        change_column_value(board_id: {board_id}, item_id: {item_id}, column_id: "{people_column_id}", value: {graphql_value}) {{
-            id
-        }}
-    }}
-    """
-    return execute_monday_graphql(mutation) is not None
+        return {"personsAndTeams": [{"id": p.get('id'), "kind": "person"} for p in persons_and_teams if 'id' in p]}
+    return None
+
+def get_people_ids_from_value(value_data):
+    """Returns the set of person IDs in a People column value (either write or read format)."""
+    if not value_data:
+        return set()
+    if isinstance(value_data, str):
+        try: value_data = json.loads(value_data)
+        except json.JSONDecodeError: return set()
+    if value_data.get('personId'):
+        return {int(value_data['personId'])}
+    return {int(p['id']) for p in value_data.get('personsAndTeams', []) if 'id' in p and p.get('kind', 'person') == 'person'}
 
 # Helper to get a column value from already fetched item data
 def get_column_value_from_item_data(item_data, column_id):
@@ -132,6 +138,47 @@ def get_column_value_from_item_data(item_data, column_id):
             return {'value': parsed_value, 'text': cv.get('text')}
     return None
 
+def get_items_column_values(item_ids, column_ids):
+    """
+    Bulk-reads column values for many items: {item_id: {column_id: parsed value}}.
+    Reads ITEMS_PER_READ items per request.
+    """
+    values = {}
+    item_ids = sorted(item_ids)
+    for i in range(0, len(item_ids), ITEMS_PER_READ):
+        chunk = item_ids[i:i + ITEMS_PER_READ]
+        query = f"query {{ items(ids: {chunk}, limit: {len(chunk)}) {{ id column_values(ids: {json.dumps(sorted(column_ids))}) {{ id value text }} }} }}"
+        result = execute_monday_graphql(query)
+        if not result or not result.get('data'):
+            print(f"  -> Could not read current values for {len(chunk)} items. They will be treated as unknown.")
+            continue
+        for item in result['data'].get('items') or []:
+            values[int(item['id'])] = {cv['id']: get_column_value_from_item_data(item, cv['id'])['value'] for cv in item.get('column_values', [])}
+    return values
+
+def change_multiple_column_values_batch(board_id, item_updates):
+    """
+    Sends {item_id: {column_id: value}} as aliased change_multiple_column_values
+    mutations, MUTATIONS_PER_WRITE per request. Returns the number of items updated.
+    """
+    updated = 0
+    items = sorted(item_updates.items())
+    for i in range(0, len(items), MUTATIONS_PER_WRITE):
+        chunk = items[i:i + MUTATIONS_PER_WRITE]
+        fields = " ".join(
+            f"m{n}: change_multiple_column_values(board_id: {board_id}, item_id: {item_id}, column_values: {json.dumps(json.dumps(column_values))}) {{ id }}"
+            for n, (item_id, column_values) in enumerate(chunk)
+        )
+        result = execute_monday_graphql(f"mutation {{ {fields} }}")
+        data = (result or {}).get('data') or {}
+        succeeded = sum(1 for n in range(len(chunk)) if data.get(f"m{n}"))
+        if succeeded < len(chunk):
+            print(f"  -> {len(chunk) - succeeded} of {len(chunk)} updates failed on board {board_id}: {(result or {}).get('errors')}")
+        updated += succeeded
+        # Pause to respect API rate limits
+        time.sleep(DELAY_BETWEEN_BATCHES)
+    return updated
+
 # ==============================================================================
 # MAIN SYNC LOGIC
 # ==============================================================================
@@ -143,8 +190,12 @@ def bulk_sync_teachers():
         print("ERROR: Missing one or more required environment variables. Aborting.")
         return
 
+    # Only the mapped People columns and the connect columns they sync through are needed.
+    source_column_ids = set(MASTER_STUDENT_PEOPLE_COLUMN_MAPPINGS.keys())
+    connect_column_ids = {t.get("connect_column_id") for m in MASTER_STUDENT_PEOPLE_COLUMN_MAPPINGS.values() for t in m.get("targets", []) if t.get("connect_column_id")}
+
     print(f"Fetching all students from Master Student Board (ID: {MASTER_STUDENT_BOARD_ID})...")
-    all_students = get_all_items_from_board(MASTER_STUDENT_BOARD_ID)
+    all_students = get_all_items_from_board(MASTER_STUDENT_BOARD_ID, source_column_ids | connect_column_ids)
     
     if not all_students:
         print("No students found on the board. Nothing to sync.")
@@ -153,11 +204,9 @@ def bulk_sync_teachers():
     total_students = len(all_students)
     print(f"Found {total_students} students to process.\n")
 
-    for index, student_item in enumerate(all_students):
-        student_id = student_item['id']
-        student_name = student_item['name']
-        print(f"Processing student {index + 1}/{total_students}: {student_name} (ID: {student_id})")
-
+    # 1. Work out the desired value of every mapped target column, grouped by board and item.
+    desired = {}  # {board_id: {item_id: {column_id: (value, column_type)}}}
+    for student_item in all_students:
         # Iterate through each configured 'People' column that needs syncing
         for source_col_id, mappings in MASTER_STUDENT_PEOPLE_COLUMN_MAPPINGS.items():
             people_col_data = get_column_value_from_item_data(student_item, source_col_id)
@@ -167,7 +216,7 @@ def bulk_sync_teachers():
                 continue
 
             people_value_raw = people_col_data['value']
-            
+
             # Iterate through the target boards/columns defined in the mapping
             for target in mappings.get("targets", []):
                 target_board_id = target.get("board_id")
@@ -178,29 +227,40 @@ def bulk_sync_teachers():
                 if not all([target_board_id, target_col_id, connect_col_id, target_col_type]):
                     continue
 
-                # Find all items linked to this student on the target board
-                linked_item_ids = get_linked_items_from_board_relation(student_item, connect_col_id)
-                
-                if not linked_item_ids:
+                for linked_item_id in get_linked_items_from_board_relation(student_item, connect_col_id):
+                    desired.setdefault(str(target_board_id), {}).setdefault(linked_item_id, {})[target_col_id] = (people_value_raw, target_col_type)
+
+    # 2. Bulk-read what each target board holds now, diff, and write only the changes.
+    total_checked = 0
+    total_changed = 0
+    for target_board_id, items in desired.items():
+        target_column_ids = {col_id for columns in items.values() for col_id in columns}
+        print(f"Board {target_board_id}: reading {len(target_column_ids)} column(s) on {len(items)} linked item(s)...")
+        current_values = get_items_column_values(items.keys(), target_column_ids)
+
+        item_updates = {}
+        for item_id, columns in items.items():
+            for col_id, (people_value_raw, col_type) in columns.items():
+                total_checked += 1
+                new_value = build_people_column_value(people_value_raw, col_type)
+                if new_value is None:
+                    continue
+                current = current_values.get(item_id, {}).get(col_id)
+                if item_id in current_values and get_people_ids_from_value(current) == get_people_ids_from_value(new_value):
                     continue
-                
-                print(f"  -> Found {len(linked_item_ids)} linked item(s) on board {target_board_id} to update.")
-                
-                for linked_item_id in linked_item_ids:
-                    print(f"    -> Syncing teacher to item {linked_item_id} in column {target_col_id}...")
-                    update_people_column(
-                        linked_item_id,
-                        target_board_id,
-                        target_col_id,
-                        people_value_raw,
-                        target_col_type
-                    )
-                    # Pause to respect API rate limits
-                    time.sleep(DELAY_BETWEEN_ITEMS)
+                item_updates.setdefault(item_id, {})[col_id] = new_value
 
+        changed_columns = sum(len(cols) for cols in item_updates.values())
+        total_changed += changed_columns
+        if not item_updates:
+            print("  -> Already in sync. Nothing to write.")
+            continue
+        print(f"  -> Writing {changed_columns} changed column(s) across {len(item_updates)} item(s)...")
+        updated = change_multiple_column_values_batch(target_board_id, item_updates)
+        print(f"  -> Updated {updated}/{len(item_updates)} item(s).")
         print("-" * 20)
 
-    print("\nBulk sync complete!")
+    print(f"\nBulk sync complete! Checked {total_checked} target column(s); {total_changed} needed an update.")
 
 # ==============================================================================
 # SCRIPT EXECUTION
@@ -0,0 +1,136 @@
+# canvas_async.py
+#
+# Description:
+# A small asyncio Canvas REST client used by the bulk scripts (aide_sub_enroll.py,
+# aide_sub_accept.py, bulk_create_courses.py). It runs many requests at once but
+# never more than a bounded number in flight. The bound adapts to Canvas throttling:
+# - A throttled request halves the bound. Canvas throttles with 403 "Rate Limit
+#   Exceeded" or 429.
+# - The bound also halves when X-Rate-Limit-Remaining drops below a low watermark.
+# - Each run of clean responses raises the bound by one, up to the configured maximum.
+# Throttled requests are retried after a jittered backoff.
+#
+# Required Python packages:
+# aiohttp
+#
+# To install dependencies:
+# pip install aiohttp
+
+import asyncio
+import json
+import random
+import aiohttp
+from canvas_throttle import RATE_LIMIT_LOW_WATERMARK, SUCCESSES_PER_INCREASE, is_throttled
+
+
+class AsyncCanvasClient:
+    """Bounded-concurrency Canvas client with AIMD backoff on throttling."""
+
+    def __init__(self, base_url, api_token, max_concurrency=10, min_concurrency=1, max_retries=6, timeout=60):
+        self.base_url = base_url.rstrip('/')
+        self.headers = {"Authorization": f"Bearer {api_token}"}
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.max_retries = max_retries
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.limit = self.max_concurrency
+        self.in_flight = 0
+        self.clean_streak = 0
+        self.throttle_count = 0
+        self.request_count = 0
+        self._cond = None
+        self._session = None
+
+    async def __aenter__(self):
+        self._cond = asyncio.Condition()
+        self._session = aiohttp.ClientSession(headers=self.headers, timeout=self.timeout)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._session.close()
+
+    def url(self, path_or_url):
+        return path_or_url if path_or_url.startswith("http") else f"{self.base_url}/api/v1/{path_or_url.lstrip('/')}"
+
+    async def _acquire(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+    async def _release(self):
+        async with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    async def _decrease(self, reason):
+        async with self._cond:
+            new_limit = max(self.min_concurrency, self.limit // 2)
+            if new_limit != self.limit:
+                print(f"  [throttle] {reason}. Concurrency {self.limit} -> {new_limit}.")
+            self.limit = new_limit
+            self.clean_streak = 0
+
+    async def _record_success(self, remaining):
+        if remaining is not None and remaining < RATE_LIMIT_LOW_WATERMARK:
+            await self._decrease(f"X-Rate-Limit-Remaining is {remaining:.0f}")
+            return
+        async with self._cond:
+            self.clean_streak += 1
+            if self.clean_streak >= SUCCESSES_PER_INCREASE and self.limit < self.max_concurrency:
+                self.limit += 1
+                self.clean_streak = 0
+                self._cond.notify_all()
+
+    async def request(self, method, path_or_url, params=None, json_body=None):
+        """
+        Sends one request, retrying throttled, 5xx and connection failures.
+        Returns (status, parsed_json_or_text, response_links).
+        """
+        url = self.url(path_or_url)
+        delay = 1.0
+        for attempt in range(self.max_retries):
+            await self._acquire()
+            try:
+                self.request_count += 1
+                async with self._session.request(method, url, params=params, json=json_body) as response:
+                    body_text = await response.text()
+                    status = response.status
+                    links = response.links
+                    remaining = response.headers.get("X-Rate-Limit-Remaining")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                status, body_text, links, remaining = None, str(e), {}, None
+            finally:
+                await self._release()
+
+            if status is not None and is_throttled(status, body_text):
+                self.throttle_count += 1
+                await self._decrease(f"Throttled on {method} {url}")
+            elif status is None or status >= 500:
+                print(f"  [retry] {method} {url} failed ({status or body_text}).")
+            else:
+                try: remaining = float(remaining) if remaining is not None else None
+                except ValueError: remaining = None
+                await self._record_success(remaining)
+                try: body = json.loads(body_text) if body_text else None
+                except ValueError: body = body_text
+                return status, body, links
+
+            if attempt < self.max_retries - 1:
+                await asyncio.sleep(delay + random.uniform(0, delay))
+                delay = min(delay * 2, 30)
+        return status, body_text, {}
+
+    async def get_paginated(self, path_or_url, params=None):
+        """Follows Canvas Link-header pagination and returns all results, or None on failure."""
+        results = []
+        url = self.url(path_or_url)
+        while url:
+            status, body, links = await self.request("GET", url, params=params)
+            if status is None or status >= 400 or not isinstance(body, list):
+                print(f"Error making API request to {url}: {status} {body}")
+                return None
+            results.extend(body)
+            next_link = links.get('next') if links else None
+            url = str(next_link['url']) if next_link else None
+            params = None  # The 'next' URL already carries the query string.
+        return results
@@ -0,0 +1,261 @@
+# canvas_reports.py
+#
+# Description:
+# Loads the Canvas provisioning report (users, sections and enrollments CSVs) for one
+# account and term into a CanvasLookupIndex, so the nightly run can answer "does this
+# user exist" and "is this student in this section" locally, instead of with a get_user,
+# get_sections or get_enrollments call per student and course.
+# - request_provisioning_report() starts the report and polls it until Canvas has built
+#   it. download_report() fetches the attachment, and parse_provisioning_report() reads
+#   the zip (or a single CSV) into the index.
+# - The index keys users by Canvas ID, SIS user ID and login ID (case-insensitive),
+#   sections by course and case-folded name, and enrollments by course and user.
+# - It is a snapshot from when Canvas built the report. The nightly run records its own
+#   writes in it (record_user/record_section/record_enrollment), and everything the
+#   report doesn't cover (other terms, users created since) falls back to the API.
+#   The report has no enrollment IDs, so concluding an enrollment still reads the course.
+#
+# Usage (benchmark: parse a synthetic report and time lookups):
+# python canvas_reports.py --students 5000 --courses 200
+#
+# Required Python packages:
+# canvasapi, requests
+
+import argparse
+import csv
+import io
+import random
+import threading
+import time
+import zipfile
+from collections import Counter
+
+import requests
+
+REPORT_TYPE = "provisioning_csv"
+ENROLLMENT_TYPES = {'student': 'StudentEnrollment', 'teacher': 'TeacherEnrollment', 'ta': 'TaEnrollment',
+                    'designer': 'DesignerEnrollment', 'observer': 'ObserverEnrollment'}
+LIVE_ENROLLMENT_STATES = ('active', 'invited')  # What get_enrollments returns by default
+
+
+class CanvasReportError(Exception):
+    pass
+
+
+class CanvasLookupIndex:
+    """Users, sections and enrollments from a provisioning report, indexed for local lookups. Thread-safe."""
+
+    def __init__(self, account_id=None, term_id=None):
+        self.account_id = account_id
+        self.term_id = term_id
+        self.lock = threading.Lock()
+        self.users = {}  # {canvas user ID: {'id', 'name', 'sis_user_id', 'login_id'}}
+        self.user_keys = {'sis_user_id': {}, 'login_id': {}}  # {kind: {lower-case key: canvas user ID}}
+        self.sections = {}  # {section ID: (course ID, name)}
+        self.section_ids = {}  # {(course ID, lower-case name): section ID}
+        self.courses = set()  # Courses the report covers; only for these is a missing enrollment an answer
+        self.enrollments = {}  # {(course ID, user ID): {(section ID, type): state}}
+        self.lookups = Counter()  # hits and misses, for the end-of-run summary
+
+    # --- Loading and write-through ---------------------------------------------------
+    def record_user(self, user_id, name=None, sis_user_id=None, login_id=None):
+        user_id = int(user_id)
+        with self.lock:
+            self.users[user_id] = {'id': user_id, 'name': name, 'sis_user_id': sis_user_id or None, 'login_id': login_id or None}
+            for kind, key in (('sis_user_id', sis_user_id), ('login_id', login_id)):
+                if key: self.user_keys[kind][str(key).lower()] = user_id
+
+    def record_section(self, section_id, course_id, name):
+        section_id, course_id = int(section_id), int(course_id)
+        with self.lock:
+            self.sections[section_id] = (course_id, name)
+            self.section_ids[(course_id, (name or '').lower())] = section_id
+            self.courses.add(course_id)
+
+    def record_enrollment(self, course_id, user_id, section_id, enrollment_type='StudentEnrollment', state='active'):
+        """Records an enrollment, or its new state (a concluded enrollment is recorded as 'completed')."""
+        with self.lock:
+            self.enrollments.setdefault((int(course_id), int(user_id)), {})[(int(section_id), enrollment_type)] = state
+
+    # --- Lookups ---------------------------------------------------------------------
+    def _count(self, what, found):
+        self.lookups[f"{what}_{'hit' if found else 'miss'}"] += 1
+        return found
+
+    def find_user(self, *keys):
+        """
+        The first user matching keys, given in priority order as (kind, value) with kind 'id',
+        'sis_user_id' or 'login_id'. Returns the user's attributes, or None.
+        """
+        with self.lock:
+            for kind, value in keys:
+                if not value: continue
+                if kind == 'id':
+                    try: user_id = int(value)
+                    except (TypeError, ValueError): continue
+                    user_id = user_id if user_id in self.users else None
+                else:
+                    user_id = self.user_keys[kind].get(str(value).lower())
+                if user_id is not None: return self._count("user", dict(self.users[user_id]))
+        return self._count("user", None)
+
+    def covers_course(self, course_id):
+        return int(course_id) in self.courses
+
+    def find_section(self, course_id, section_name):
+        """(section ID, name) of the course's section with that name (case-insensitive), or None."""
+        with self.lock:
+            section_id = self.section_ids.get((int(course_id), (section_name or '').lower()))
+            return self._count("section", (section_id, self.sections[section_id][1]) if section_id else None)
+
+    def user_sections(self, course_id, user_id, enrollment_type='StudentEnrollment', states=LIVE_ENROLLMENT_STATES):
+        """
+        The IDs of the sections the user is enrolled in (in one of states) in the course, or None
+        if the report doesn't cover the course and only the API can answer.
+        """
+        course_id = int(course_id)
+        with self.lock:
+            if course_id not in self.courses: return self._count("enrollment", None)
+            enrollments = self.enrollments.get((course_id, int(user_id)), {})
+            return self._count("enrollment", {section_id for (section_id, kind), state in enrollments.items() if kind == enrollment_type and state in states})
+
+    def summary(self):
+        enrollments = sum(len(by_section) for by_section in self.enrollments.values())
+        return f"{len(self.users)} users, {len(self.sections)} sections in {len(self.courses)} courses, {enrollments} enrollments"
+
+
+# ==============================================================================
+# REPORT REQUEST, DOWNLOAD AND PARSING
+# ==============================================================================
+def request_provisioning_report(canvas_api, account_id, term_id=None, poll_seconds=5, timeout_seconds=1800):
+    """Starts a users/sections/enrollments provisioning report and waits for it. Returns the finished AccountReport."""
+    parameters = {'users': True, 'sections': True, 'enrollments': True}
+    if term_id: parameters['enrollment_term_id'] = term_id
+    account = canvas_api.get_account(account_id)
+    report = account.create_report(REPORT_TYPE, parameters=parameters)
+    print(f"INFO: Requested Canvas provisioning report {report.id} for account {account_id}" + (f", term {term_id}." if term_id else "."))
+    deadline = time.monotonic() + timeout_seconds
+    while getattr(report, 'status', None) not in ('complete', 'error', 'deleted', 'aborted'):
+        if time.monotonic() > deadline: raise CanvasReportError(f"Provisioning report {report.id} was not ready after {timeout_seconds}s")
+        time.sleep(poll_seconds)
+        report = account.get_report(REPORT_TYPE, report.id)
+    if report.status != 'complete' or not (getattr(report, 'attachment', None) or {}).get('url'):
+        raise CanvasReportError(f"Provisioning report {report.id} finished with status '{report.status}' and no file")
+    return report
+
+
+def download_report(url, api_key, session=None, timeout=300):
+    """The report file's bytes. Canvas redirects to file storage, which drops the Authorization header."""
+    response = (session or requests).get(url, headers={'Authorization': f"Bearer {api_key}"}, timeout=timeout)
+    response.raise_for_status()
+    return response.content
+
+
+def report_csv_files(data):
+    """{file name: text} for a zipped report, or {'report.csv': text} for a single CSV."""
+    if zipfile.is_zipfile(io.BytesIO(data)):
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            return {name: archive.read(name).decode('utf-8-sig') for name in archive.namelist() if name.lower().endswith('.csv')}
+    return {'report.csv': data.decode('utf-8-sig')}
+
+
+def parse_provisioning_report(data, index=None):
+    """
+    Reads the users, sections and enrollments CSVs into index (a new CanvasLookupIndex by default).
+    Each file is recognised by its header, so the names Canvas gives them don't matter. Deleted rows are skipped.
+    """
+    index = index if index is not None else CanvasLookupIndex()
+    for name, text in report_csv_files(data).items():
+        rows = csv.DictReader(io.StringIO(text))
+        columns = set(rows.fieldnames or ())
+        if 'canvas_section_id' in columns and 'canvas_user_id' in columns:
+            for row in rows:
+                if row.get('status') == 'deleted' or not (row.get('canvas_user_id') and row.get('canvas_section_id')): continue
+                enrollment_type = row.get('base_role_type') or ENROLLMENT_TYPES.get((row.get('role') or '').lower(), row.get('role'))
+                index.record_enrollment(row['canvas_course_id'], row['canvas_user_id'], row['canvas_section_id'], enrollment_type, row.get('status') or 'active')
+        elif 'canvas_section_id' in columns:
+            for row in rows:
+                if row.get('status') == 'deleted' or not row.get('canvas_course_id'): continue
+                index.record_section(row['canvas_section_id'], row['canvas_course_id'], row.get('name'))
+        elif 'canvas_user_id' in columns:
+            for row in rows:
+                if row.get('status') == 'deleted': continue
+                name = row.get('full_name') or ' '.join(part for part in (row.get('first_name'), row.get('last_name')) if part)
+                index.record_user(row['canvas_user_id'], name, row.get('user_id'), row.get('login_id'))
+        else:
+            print(f"WARNING: Skipping unrecognised file '{name}' in the provisioning report.")
+    # Enrollments in a course the sections file left out (a cross-listed section) still mark it as covered
+    index.courses.update(course_id for course_id, _ in index.enrollments)
+    return index
+
+
+def load_provisioning_index(canvas_api, api_key, account_id, term_id=None, session=None, poll_seconds=5):
+    """Requests, downloads and parses the provisioning report. Raises CanvasReportError, CanvasException or RequestException."""
+    start = time.monotonic()
+    report = request_provisioning_report(canvas_api, account_id, term_id, poll_seconds=poll_seconds)
+    data = download_report(report.attachment['url'], api_key, session=session)
+    index = parse_provisioning_report(data, CanvasLookupIndex(account_id, term_id))
+    print(f"INFO: Loaded Canvas provisioning report {report.id} ({len(data) / 2**20:.1f} MiB) in {time.monotonic() - start:.1f}s: {index.summary()}.")
+    return index
+
+
+# ==============================================================================
+# BENCHMARK
+# ==============================================================================
+def make_report(students, courses, sections_per_course=4, courses_per_student=6, seed=42):
+    """A synthetic provisioning report zip in Canvas's column layout."""
+    rng = random.Random(seed)
+    users = io.StringIO()
+    writer = csv.writer(users)
+    writer.writerow(['canvas_user_id', 'user_id', 'integration_id', 'authentication_provider_id', 'login_id', 'first_name', 'last_name', 'full_name', 'sortable_name', 'short_name', 'email', 'status', 'created_by_sis'])
+    for i in range(students):
+        writer.writerow([100_000 + i, f"{3_000_000 + i}", '', '112', f"student{i}@example.org", 'Student', str(i), f"Student {i}", f"{i}, Student", f"Student {i}", f"student{i}@example.org", 'active', 'true'])
+    sections = io.StringIO()
+    writer = csv.writer(sections)
+    writer.writerow(['canvas_section_id', 'section_id', 'canvas_course_id', 'course_id', 'integration_id', 'name', 'status', 'start_date', 'end_date', 'canvas_account_id', 'account_id', 'created_by_sis'])
+    for course in range(courses):
+        for section in range(sections_per_course):
+            writer.writerow([course * sections_per_course + section + 1, '', 10_000 + course, '', '', f"Section {section}", 'active', '', '', 1, '', 'false'])
+    enrollments = io.StringIO()
+    writer = csv.writer(enrollments)
+    writer.writerow(['canvas_course_id', 'course_id', 'canvas_user_id', 'user_id', 'role', 'role_id', 'canvas_section_id', 'section_id', 'status', 'canvas_associated_user_id', 'associated_user_id', 'created_by_sis', 'base_role_type', 'limit_section_privileges'])
+    for i in range(students):
+        for course in rng.sample(range(courses), min(courses_per_student, courses)):
+            section = course * sections_per_course + rng.randrange(sections_per_course) + 1
+            writer.writerow([10_000 + course, '', 100_000 + i, f"{3_000_000 + i}", 'student', 3, section, '', 'active', '', '', 'false', 'StudentEnrollment', 'false'])
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zipped:
+        zipped.writestr('users.csv', users.getvalue())
+        zipped.writestr('sections.csv', sections.getvalue())
+        zipped.writestr('enrollments.csv', enrollments.getvalue())
+    return archive.getvalue()
+
+
+def run_benchmark(students, courses, call_ms):
+    data = make_report(students, courses)
+    start = time.perf_counter()
+    index = parse_provisioning_report(data)
+    parse_time = time.perf_counter() - start
+    print(f"Report: {len(data) / 2**20:.1f} MiB zipped; {index.summary()}")
+    print(f"  parse     {parse_time * 1000:8.1f} ms")
+    start = time.perf_counter()
+    checks = 0
+    for i in range(students):
+        user = index.find_user(('id', None), ('login_id', f"STUDENT{i}@example.org"), ('sis_user_id', f"{3_000_000 + i}"))
+        for course in range(0, courses, max(1, courses // 6)):
+            index.find_section(10_000 + course, "section 1")
+            index.user_sections(10_000 + course, user['id'])
+            checks += 1
+    lookup_time = time.perf_counter() - start
+    calls = students + checks * 2  # get_user, then get_sections and get_enrollments per course
+    print(f"  {students} user lookups and {checks} section/enrollment checks: {lookup_time * 1000:.1f} ms locally")
+    print(f"  The same answers from the API: {calls} calls, ~{calls * call_ms / 1000 / 60:.0f} min at {call_ms:.0f} ms each")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark parsing a provisioning report and looking up users and enrollments in it.")
+    parser.add_argument('--students', type=int, default=5000)
+    parser.add_argument('--courses', type=int, default=200)
+    parser.add_argument('--call-ms', type=float, default=250, help="Typical Canvas API round trip, for the comparison.")
+    args = parser.parse_args()
+    run_benchmark(args.students, args.courses, args.call_ms)
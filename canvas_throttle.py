@@ -0,0 +1,157 @@
+# canvas_throttle.py
+#
+# Description:
+# Adaptive throttling for the synchronous Canvas clients, which are canvasapi in app.py and
+# nightly_sync.py. CanvasThrottleAdapter is mounted on the canvasapi requests session:
+# - Each process bounds its Canvas calls in flight with the same AIMD rule as
+#   canvas_async.py. A throttled response or a low X-Rate-Limit-Remaining halves the
+#   bound, and every SUCCESSES_PER_INCREASE clean responses raise it by one.
+# - The Celery worker, the gunicorn workers and the nightly job all spend one token's
+#   bucket. The latest X-Rate-Limit-Remaining is therefore published to Valkey. Before
+#   each call, a process whose newest reading (its own or the shared one) is below the
+#   low watermark waits for the bucket to refill.
+# - Throttled requests (403 "Rate Limit Exceeded" or 429) are retried after a jittered
+#   backoff instead of surfacing as failed enrollments.
+#
+# Required Python packages:
+# requests (redis for the shared bucket reading)
+
+import json
+import random
+import threading
+import time
+from requests.adapters import HTTPAdapter
+
+try:
+    from redis import RedisError
+except ImportError:
+    RedisError = OSError
+
+# Canvas starts every token with a 700 unit bucket. Below this we back off early.
+RATE_LIMIT_LOW_WATERMARK = 150
+# Clean responses needed before the concurrency bound is raised by one.
+SUCCESSES_PER_INCREASE = 10
+SHARED_REMAINING_KEY = "canvas:rate_limit_remaining"
+
+
+def is_throttled(status, body_text):
+    """Canvas reports throttling as 403 'Rate Limit Exceeded' (or, rarely, 429)."""
+    return status == 429 or (status == 403 and "rate limit exceeded" in (body_text or "").lower())
+
+
+class CanvasThrottle:
+    """Process-wide AIMD bound on Canvas calls in flight, steered by X-Rate-Limit-Remaining."""
+
+    def __init__(self, max_concurrency=10, min_concurrency=1, refill_per_second=10.0, get_client=None, share_interval=0.5):
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.refill_per_second = refill_per_second
+        self.get_client = get_client
+        self.share_interval = share_interval
+        self.limit = self.max_concurrency
+        self.in_flight = 0
+        self.clean_streak = 0
+        self.reading = None  # (remaining, epoch seconds) from the newest response seen here or in Valkey
+        self._published_at = 0.0
+        self._fetched_at = 0.0
+        self._paused_until = 0.0
+        self._cond = threading.Condition()  # A gevent-aware Condition once the worker has monkey-patched threading.
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= self.limit:
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def record(self, remaining, throttled, reason=""):
+        """Feeds one response into the AIMD bound and the shared bucket reading."""
+        with self._cond:
+            if throttled or (remaining is not None and remaining < RATE_LIMIT_LOW_WATERMARK):
+                new_limit = max(self.min_concurrency, self.limit // 2)
+                if new_limit != self.limit:
+                    print(f"  [canvas throttle] {reason or f'X-Rate-Limit-Remaining is {remaining:.0f}'}. Concurrency {self.limit} -> {new_limit}.")
+                self.limit = new_limit
+                self.clean_streak = 0
+            else:
+                self.clean_streak += 1
+                if self.clean_streak >= SUCCESSES_PER_INCREASE and self.limit < self.max_concurrency:
+                    self.limit += 1
+                    self.clean_streak = 0
+                    self._cond.notify_all()
+        if throttled: remaining = 0.0
+        if remaining is not None:
+            self.reading = (remaining, time.time())
+            self._publish()
+
+    def wait_for_budget(self):
+        """Sleeps until the estimated bucket is back above the low watermark."""
+        self._fetch()
+        if self.reading is None: return
+        remaining, at = self.reading
+        estimate = remaining + (time.time() - at) * self.refill_per_second
+        if estimate < RATE_LIMIT_LOW_WATERMARK:
+            time.sleep(min(10.0, (RATE_LIMIT_LOW_WATERMARK - estimate) / self.refill_per_second) * random.uniform(0.5, 1.5))
+
+    def _valkey(self):
+        if self.get_client is None or time.monotonic() < self._paused_until: return None
+        return self.get_client()
+
+    def _unavailable(self, e):
+        print(f"WARNING: Could not share the Canvas rate limit through Valkey, pausing for a minute: {e}")
+        self._paused_until = time.monotonic() + 60
+
+    def _publish(self):
+        if time.monotonic() - self._published_at < self.share_interval: return
+        client = self._valkey()
+        if client is None: return
+        self._published_at = time.monotonic()
+        remaining, at = self.reading
+        try: client.set(SHARED_REMAINING_KEY, json.dumps({'remaining': remaining, 'at': at}), ex=60)
+        except RedisError as e: self._unavailable(e)
+
+    def _fetch(self):
+        if time.monotonic() - self._fetched_at < self.share_interval: return
+        client = self._valkey()
+        if client is None: return
+        self._fetched_at = time.monotonic()
+        try: raw = client.get(SHARED_REMAINING_KEY)
+        except RedisError as e:
+            self._unavailable(e)
+            return
+        if not raw: return
+        shared = json.loads(raw)
+        if self.reading is None or shared['at'] > self.reading[1]:
+            self.reading = (shared['remaining'], shared['at'])
+
+
+class CanvasThrottleAdapter(HTTPAdapter):
+    """requests adapter that sends every Canvas call through a CanvasThrottle and retries throttled ones."""
+
+    def __init__(self, throttle, max_throttle_retries=6, on_throttled=None, **kwargs):
+        super().__init__(**kwargs)
+        self.throttle = throttle
+        self.max_throttle_retries = max_throttle_retries
+        self.on_throttled = on_throttled
+
+    def send(self, request, **kwargs):
+        delay = 1.0
+        for attempt in range(self.max_throttle_retries + 1):
+            self.throttle.wait_for_budget()
+            self.throttle.acquire()
+            try: response = super().send(request, **kwargs)
+            finally: self.throttle.release()
+            throttled = response.status_code in (403, 429) and is_throttled(response.status_code, response.text)
+            try: remaining = float(response.headers['X-Rate-Limit-Remaining'])
+            except (KeyError, ValueError): remaining = None
+            self.throttle.record(remaining, throttled, f"Throttled on {request.method} {request.path_url.split('?')[0]}")
+            if not throttled or attempt == self.max_throttle_retries:
+                return response
+            if self.on_throttled: self.on_throttled(response)
+            response.close()
+            time.sleep(delay + random.uniform(0, delay))
+            delay = min(delay * 2, 30)
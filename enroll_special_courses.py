@@ -8,6 +8,7 @@ import requests
 import time
 import re
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from canvasapi import Canvas
 from canvasapi.exceptions import CanvasException, Conflict, ResourceDoesNotExist
 
@@ -39,6 +40,14 @@ ALL_COURSES_TO_CANVAS_CONNECT_COLUMN_ID = os.environ.get("ALL_COURSES_TO_CANVAS_
 CANVAS_COURSE_ID_COLUMN_ID = os.environ.get("CANVAS_COURSE_ID_COLUMN_ID")
 CANVAS_BOARD_STUDY_HALL_COLUMN_ID = "color_mktqgt0t"
 
+# --- RUN MODE ---
+# "plan" (default) gathers every student's data in bulk, builds a course -> section -> students
+# plan and applies it in grouped batches. "per-student" walks the PLP board one item at a time.
+RUNNER = os.environ.get("RUNNER", "plan").lower()
+ITEMS_PER_READ = 100
+READ_CONCURRENCY = 4
+MONDAY_MUTATIONS_PER_REQUEST = 25
+
 # --- MONDAY.COM ITEM IDs for Special Courses ---
 # This dictionary was missing
 SPECIAL_COURSE_MONDAY_IDS = {
@@ -357,6 +366,273 @@ def process_student_special_enrollments(plp_item, dry_run=True):
         if not dry_run:
             bulk_add_to_connect_column(plp_item_id, int(PLP_BOARD_ID), PLP_JUMPSTART_SH_CONNECT_COLUMN, plp_links_to_add)
 # ==============================================================================
+# COURSE-CENTRIC PLANNING MODE
+# ==============================================================================
+def get_all_board_items_with_columns(board_id, column_ids):
+    """Like get_all_board_items, but also returns the projected column values of each item."""
+    all_items = []
+    cursor = None
+    column_ids_str = json.dumps(sorted(column_ids))
+    while True:
+        cursor_str = f'cursor: "{cursor}"' if cursor else ""
+        query = f'query {{ boards(ids: {board_id}) {{ items_page (limit: 100, {cursor_str}) {{ cursor items {{ id name column_values(ids: {column_ids_str}) {{ id text value }} }} }} }} }}'
+        result = execute_monday_graphql(query)
+        if not result or 'data' not in result: break
+        try:
+            page_info = result['data']['boards'][0]['items_page']
+            all_items.extend(page_info['items'])
+            cursor = page_info.get('cursor')
+            if not cursor: break
+            print(f"  Fetched {len(all_items)} items from board {board_id}...")
+        except (KeyError, IndexError, TypeError):
+            print(f"ERROR: Could not parse items from board {board_id}.")
+            break
+    return all_items
+
+def get_items_by_ids(item_ids, column_ids=None):
+    """
+    Reads many items in chunks of ITEMS_PER_READ, READ_CONCURRENCY chunks at a time, fetching only the
+    given columns. Returns {item_id: {'name', 'columns': {column_id: column_value}}}.
+    """
+    item_ids = sorted({int(i) for i in item_ids})
+    if not item_ids: return {}
+    column_values_str = f" column_values(ids: {json.dumps(sorted(column_ids))}) {{ id text value }}" if column_ids else ""
+    chunks = [item_ids[i:i + ITEMS_PER_READ] for i in range(0, len(item_ids), ITEMS_PER_READ)]
+
+    def read_chunk(chunk):
+        query = f'query {{ items(ids: {chunk}, limit: {len(chunk)}) {{ id name{column_values_str} }} }}'
+        result = execute_monday_graphql(query)
+        if not result or not result.get('data'):
+            print(f"  WARNING: Could not read {len(chunk)} items: {(result or {}).get('errors')}")
+            return []
+        return result['data'].get('items') or []
+
+    items = {}
+    with ThreadPoolExecutor(max_workers=min(READ_CONCURRENCY, len(chunks))) as pool:
+        for found in pool.map(read_chunk, chunks):
+            for item in found:
+                items[int(item['id'])] = {'name': item.get('name', ''), 'columns': {cv['id']: cv for cv in item.get('column_values', [])}}
+    return items
+
+def get_user_names(user_ids):
+    """Looks up many Monday user names at once. Returns {user_id: name}."""
+    names = {}
+    user_ids = sorted({int(u) for u in user_ids})
+    for i in range(0, len(user_ids), ITEMS_PER_READ):
+        chunk = user_ids[i:i + ITEMS_PER_READ]
+        result = execute_monday_graphql(f"query {{ users(ids: {chunk}, limit: {len(chunk)}) {{ id name }} }}")
+        for user in ((result or {}).get('data') or {}).get('users') or []:
+            names[int(user['id'])] = user.get('name')
+    return names
+
+def add_to_connect_columns_batch(board_id, connect_column_id, item_links):
+    """
+    Writes {item_id: set of linked IDs} to one connect column using aliased
+    change_column_value mutations. Returns the number of items updated.
+    """
+    updated = 0
+    items = sorted(item_links.items())
+    for i in range(0, len(items), MONDAY_MUTATIONS_PER_REQUEST):
+        chunk = items[i:i + MONDAY_MUTATIONS_PER_REQUEST]
+        fields = " ".join(
+            f'm{n}: change_column_value(board_id: {board_id}, item_id: {item_id}, column_id: "{connect_column_id}", value: {json.dumps(json.dumps({"linkedPulseIds": [{"linkedPulseId": int(lid)} for lid in sorted(linked_ids)]}))}) {{ id }}'
+            for n, (item_id, linked_ids) in enumerate(chunk)
+        )
+        result = execute_monday_graphql(f"mutation {{ {fields} }}")
+        data = (result or {}).get('data') or {}
+        for n, (item_id, _) in enumerate(chunk):
+            if data.get(f"m{n}"): updated += 1
+            else: print(f"  ERROR: PLP link update failed for item {item_id}: {(result or {}).get('errors')}")
+    return updated
+
+def build_enrollment_plan():
+    """
+    Gathers all students' data with bulk reads and returns
+    (plan, students, plp_links) where plan is {canvas_course_id: {section_name: [plp_item_id]}},
+    students is {plp_item_id: student_details} and plp_links is {plp_item_id: set of item IDs to link}.
+    """
+    course_column_ids = [c.strip() for c in PLP_ALL_CLASSES_CONNECT_COLUMNS_STR.split(',') if c.strip()]
+
+    print("Reading PLP board...")
+    plp_items = get_all_board_items_with_columns(PLP_BOARD_ID, [PLP_TO_MASTER_STUDENT_CONNECT_COLUMN, PLP_JUMPSTART_SH_CONNECT_COLUMN] + course_column_ids)
+    print(f"Found {len(plp_items)} total students to plan.")
+
+    plp_to_master = {}
+    plp_to_courses = {}
+    plp_current_links = {}
+    for item in plp_items:
+        cols = {cv['id']: cv for cv in item.get('column_values', [])}
+        master_ids = get_linked_ids_from_connect_column_value(cols.get(PLP_TO_MASTER_STUDENT_CONNECT_COLUMN, {}).get('value'))
+        if not master_ids:
+            print(f"  SKIPPING {item['name']} (PLP ID: {item['id']}): No Master Student item linked.")
+            continue
+        plp_item_id = int(item['id'])
+        plp_to_master[plp_item_id] = list(master_ids)[0]
+        plp_to_courses[plp_item_id] = set()
+        for col_id in course_column_ids:
+            plp_to_courses[plp_item_id].update(get_linked_ids_from_connect_column_value(cols.get(col_id, {}).get('value')))
+        plp_current_links[plp_item_id] = get_linked_ids_from_connect_column_value(cols.get(PLP_JUMPSTART_SH_CONNECT_COLUMN, {}).get('value'))
+
+    print(f"Reading {len(set(plp_to_master.values()))} Master Student items...")
+    masters = get_items_by_ids(plp_to_master.values(), [MASTER_STUDENT_TOR_COLUMN_ID, MASTER_STUDENT_EMAIL_COLUMN, MASTER_STUDENT_SSID_COLUMN, MASTER_STUDENT_CANVAS_ID_COLUMN])
+    master_tor_ids = {}
+    for master_id, master in masters.items():
+        tor_ids = get_people_ids_from_value(master['columns'].get(MASTER_STUDENT_TOR_COLUMN_ID, {}).get('value'))
+        if tor_ids: master_tor_ids[master_id] = list(tor_ids)[0]
+    tor_names = get_user_names(master_tor_ids.values())
+
+    all_course_ids = set().union(*plp_to_courses.values()) if plp_to_courses else set()
+    print(f"Reading {len(all_course_ids)} course items...")
+    courses = get_items_by_ids(all_course_ids, [ALL_COURSES_TO_CANVAS_CONNECT_COLUMN_ID])
+    course_to_canvas_items = {
+        course_id: get_linked_ids_from_connect_column_value(course['columns'].get(ALL_COURSES_TO_CANVAS_CONNECT_COLUMN_ID, {}).get('value'))
+        for course_id, course in courses.items()
+    }
+    all_canvas_item_ids = set().union(*course_to_canvas_items.values()) if course_to_canvas_items else set()
+    print(f"Reading Study Hall status for {len(all_canvas_item_ids)} Canvas course items...")
+    canvas_items = get_items_by_ids(all_canvas_item_ids, [CANVAS_BOARD_STUDY_HALL_COLUMN_ID])
+    canvas_item_sh = {item_id: item['columns'].get(CANVAS_BOARD_STUDY_HALL_COLUMN_ID, {}).get('text') for item_id, item in canvas_items.items()}
+
+    plan = defaultdict(lambda: defaultdict(list))
+    students = {}
+    plp_links = {}
+    for plp_item_id, master_id in plp_to_master.items():
+        master = masters.get(master_id)
+        if not master:
+            print(f"  WARNING: Could not fetch details for master item {master_id}.")
+            continue
+        cols = master['columns']
+        students[plp_item_id] = {
+            'name': master['name'],
+            'email': cols.get(MASTER_STUDENT_EMAIL_COLUMN, {}).get('text', '') or '',
+            'ssid': cols.get(MASTER_STUDENT_SSID_COLUMN, {}).get('text', '') or '',
+            'canvas_id': cols.get(MASTER_STUDENT_CANVAS_ID_COLUMN, {}).get('text', '') or '',
+        }
+        tor_full_name = tor_names.get(master_tor_ids.get(master_id))
+        tor_last_name = tor_full_name.split()[-1] if tor_full_name else "Orientation"
+
+        links_to_add = set()
+        jumpstart_canvas_id = SPECIAL_COURSE_CANVAS_IDS.get("Jumpstart")
+        if jumpstart_canvas_id:
+            plan[jumpstart_canvas_id][tor_last_name].append(plp_item_id)
+            if SPECIAL_COURSE_MONDAY_IDS.get("Jumpstart"): links_to_add.add(SPECIAL_COURSE_MONDAY_IDS["Jumpstart"])
+
+        # Same rule as the per-student run: the first linked Canvas course with a known Study Hall wins,
+        # and the section is named after the course that links to it.
+        canvas_item_to_course_name = {}
+        for course_id in plp_to_courses[plp_item_id]:
+            for canvas_item_id in course_to_canvas_items.get(course_id, set()):
+                canvas_item_to_course_name[canvas_item_id] = courses[course_id]['name']
+        for canvas_item_id in sorted(canvas_item_to_course_name):
+            sh_name = canvas_item_sh.get(canvas_item_id)
+            if sh_name and sh_name in SPECIAL_COURSE_CANVAS_IDS:
+                plan[SPECIAL_COURSE_CANVAS_IDS[sh_name]][canvas_item_to_course_name[canvas_item_id]].append(plp_item_id)
+                if SPECIAL_COURSE_MONDAY_IDS.get(sh_name): links_to_add.add(SPECIAL_COURSE_MONDAY_IDS[sh_name])
+                break
+
+        if links_to_add - plp_current_links.get(plp_item_id, set()):
+            plp_links[plp_item_id] = plp_current_links.get(plp_item_id, set()) | links_to_add
+
+    return plan, students, plp_links
+
+def get_course_student_enrollments(course):
+    """Returns ({user_id: set of section IDs}, {login_id or sis_user_id: user_id}) for a course's students."""
+    sections_by_user = defaultdict(set)
+    user_ids_by_key = {}
+    for enrollment in course.get_enrollments(type=['StudentEnrollment'], per_page=100):
+        sections_by_user[enrollment.user_id].add(enrollment.course_section_id)
+        user = getattr(enrollment, 'user', {}) or {}
+        for key in (user.get('login_id'), user.get('sis_user_id')):
+            if key: user_ids_by_key[str(key).lower()] = enrollment.user_id
+    return sections_by_user, user_ids_by_key
+
+def resolve_canvas_user_id(student_details, user_ids_by_key, user_id_cache):
+    """Resolves a student's Canvas user ID, using known IDs and course rosters before any lookup."""
+    cache_key = (student_details.get('email') or student_details.get('ssid') or student_details.get('name', '')).lower()
+    if cache_key in user_id_cache:
+        return user_id_cache[cache_key]
+    user_id = None
+    canvas_id = str(student_details.get('canvas_id') or '').strip()
+    if canvas_id.isdigit():
+        user_id = int(canvas_id)
+    for key in (student_details.get('email'), student_details.get('ssid')):
+        if not user_id and key:
+            user_id = user_ids_by_key.get(str(key).lower())
+    if not user_id:
+        user = find_canvas_user(student_details)
+        if not user:
+            print(f"  INFO: Canvas user not found for {student_details.get('email', 'N/A')}. Creating new user.")
+            user = create_canvas_user(student_details)
+        user_id = user.id if user else None
+    user_id_cache[cache_key] = user_id
+    return user_id
+
+def apply_enrollment_plan(plan, students, plp_links):
+    """Creates each course's missing sections once, enrolls only the students not already in their section, then batches the PLP link updates."""
+    canvas_api = initialize_canvas_api()
+    if not canvas_api:
+        print("ERROR: Canvas API not initialized.")
+        return
+    user_id_cache = {}
+    totals = defaultdict(int)
+    for canvas_course_id, sections in plan.items():
+        try:
+            course = canvas_api.get_course(canvas_course_id)
+            existing_sections = {section.name.lower(): section for section in course.get_sections()}
+            sections_by_user, user_ids_by_key = get_course_student_enrollments(course)
+        except CanvasException as e:
+            print(f"ERROR: Could not load Canvas course {canvas_course_id}: {e}")
+            continue
+        print(f"\n--- {course.name}: {len(sections)} section(s), {sum(len(s) for s in sections.values())} student(s) ---")
+
+        for section_name, plp_item_ids in sections.items():
+            section = existing_sections.get(section_name.lower())
+            if not section:
+                try:
+                    section = course.create_course_section(course_section={'name': section_name})
+                    existing_sections[section_name.lower()] = section
+                    print(f"  Created section '{section_name}'.")
+                except CanvasException as e:
+                    print(f"  ERROR: Canvas section creation failed for {section_name}: {e}")
+                    continue
+
+            for plp_item_id in plp_item_ids:
+                student_details = students[plp_item_id]
+                user_id = resolve_canvas_user_id(student_details, user_ids_by_key, user_id_cache)
+                if not user_id:
+                    print(f"  ERROR: Could not find or create Canvas user for {student_details.get('name')}")
+                    totals['failed'] += 1
+                    continue
+                if section.id in sections_by_user.get(user_id, set()):
+                    totals['already enrolled'] += 1
+                    continue
+                try:
+                    course.enroll_user(user_id, 'StudentEnrollment', enrollment={'course_section_id': section.id, 'notify': False})
+                    sections_by_user[user_id].add(section.id)
+                    totals['enrolled'] += 1
+                except Conflict:
+                    totals['already enrolled'] += 1
+                except CanvasException as e:
+                    print(f"  ERROR: Failed to enroll user {user_id} in section {section.id}. Details: {e}")
+                    totals['failed'] += 1
+            print(f"  Section '{section_name}': {len(plp_item_ids)} planned.")
+
+    print(f"\nEnrollments: {dict(totals)}")
+    if plp_links:
+        print(f"Linking special courses on {len(plp_links)} PLP items...")
+        updated = add_to_connect_columns_batch(int(PLP_BOARD_ID), PLP_JUMPSTART_SH_CONNECT_COLUMN, plp_links)
+        print(f"Updated {updated}/{len(plp_links)} PLP items.")
+
+def run_planned_sync(dry_run=True):
+    plan, students, plp_links = build_enrollment_plan()
+    print("\n--- ENROLLMENT PLAN ---")
+    for canvas_course_id, sections in plan.items():
+        print(f"Canvas course {canvas_course_id}: " + ", ".join(f"{name} ({len(ids)})" for name, ids in sorted(sections.items())))
+    print(f"PLP items needing new links: {len(plp_links)}")
+    if not dry_run:
+        apply_enrollment_plan(plan, students, plp_links)
+
+# ==============================================================================
 # SCRIPT EXECUTION
 # ==============================================================================
 if __name__ == '__main__':
@@ -367,21 +643,24 @@ if __name__ == '__main__':
     if DRY_RUN:
         print("\n!!! DRY RUN MODE IS ON !!!")
 
-    all_plp_items = get_all_board_items(PLP_BOARD_ID)
-    total_items = len(all_plp_items)
-    print(f"\nFound {total_items} total students to process.")
-
-    for i, item in enumerate(all_plp_items):
-        try:
-            process_student_special_enrollments(item, dry_run=DRY_RUN)
-        except Exception as e:
-            print(f"FATAL ERROR processing item {item.get('id', 'N/A')}: {e}")
-            import traceback
-            traceback.print_exc()
-        
-        # --- THIS LINE IS THE FIX ---
-        if not DRY_RUN:
-            time.sleep(2)
+    if RUNNER == "plan":
+        run_planned_sync(dry_run=DRY_RUN)
+    else:
+        all_plp_items = get_all_board_items(PLP_BOARD_ID)
+        total_items = len(all_plp_items)
+        print(f"\nFound {total_items} total students to process.")
+
+        for i, item in enumerate(all_plp_items):
+            try:
+                process_student_special_enrollments(item, dry_run=DRY_RUN)
+            except Exception as e:
+                print(f"FATAL ERROR processing item {item.get('id', 'N/A')}: {e}")
+                import traceback
+                traceback.print_exc()
+
+            # --- THIS LINE IS THE FIX ---
+            if not DRY_RUN:
+                time.sleep(2)
 
     print("\n======================================================")
     print("=== SCRIPT FINISHED                                ===")
@@ -0,0 +1,164 @@
+# enrollment_matrix.py
+#
+# Description:
+# Columnar (student, course, section) memberships for the nightly plan in nightly_plan.py.
+# Desired and actual memberships for the whole school are passed as parallel columns.
+# Students, courses and (case-folded) section names are each mapped to dense integer IDs
+# with np.unique, and every row is packed into one int64:
+#   student index << 40 | course index << 20 | section index
+# The enrollments to create, the enrollments to conclude and the section moves then come
+# out of a few sorted-set operations on two arrays, instead of a Python loop per student
+# and course.
+#
+# Usage (benchmark against the per-student loop):
+# python enrollment_matrix.py --students 5000 --courses 50
+#
+# Required Python packages:
+# numpy
+
+import argparse
+import random
+import time
+from collections import defaultdict
+
+import numpy as np
+
+COURSE_SHIFT = 20
+STUDENT_SHIFT = 40  # So up to ~1M distinct students, courses and section names each
+
+
+def dense_ids(values):
+    """Maps each value to its index among the sorted distinct values."""
+    return np.unique(np.asarray(values, dtype=np.int64), return_inverse=True)[1].astype(np.int64).reshape(-1)
+
+
+def membership_codes(students, courses, section_names):
+    """Packs parallel student/course/section-name columns into int64 codes; section names match case-insensitively."""
+    # There are few distinct section names, so only those are case-folded
+    distinct_names, name_rows = np.unique(np.asarray(section_names, dtype=str), return_inverse=True)
+    section_ids = np.unique(np.char.lower(distinct_names), return_inverse=True)[1].reshape(-1)[name_rows.reshape(-1)].astype(np.int64)
+    return dense_ids(students) << STUDENT_SHIFT | dense_ids(courses) << COURSE_SHIFT | section_ids
+
+
+def as_columns(rows, width):
+    """Row tuples as `width` parallel columns (empty columns for no rows)."""
+    return tuple(zip(*rows)) if rows else ((),) * width
+
+
+def diff_enrollments(desired, actual):
+    """
+    desired is (students, courses, section_names, moves) and actual is (students, courses, section_names),
+    as parallel columns. A move also concludes the student's other sections in that course (study halls).
+    Returns (indices of the desired rows to create, boolean mask of the actual rows to conclude, number of
+    section moves). Duplicate desired rows are created once.
+    """
+    students, courses, section_names, moves = desired
+    count = len(students)
+    codes = membership_codes(list(students) + list(actual[0]), list(courses) + list(actual[1]), list(section_names) + list(actual[2]))
+    desired_codes, actual_codes = codes[:count], codes[count:]
+    unique_codes, first_rows = np.unique(desired_codes, return_index=True)
+    to_create = np.sort(first_rows[~np.isin(unique_codes, actual_codes)])
+    move_pairs = desired_codes[np.asarray(moves, dtype=bool)] >> COURSE_SHIFT
+    to_conclude = ~np.isin(actual_codes, desired_codes) & np.isin(actual_codes >> COURSE_SHIFT, move_pairs)
+    section_moves = np.intersect1d(desired_codes[to_create] >> COURSE_SHIFT, actual_codes[to_conclude] >> COURSE_SHIFT).size
+    return to_create, to_conclude, int(section_moves)
+
+
+# ==============================================================================
+# BENCHMARK
+# ==============================================================================
+def make_school(students, courses, courses_per_student, sections_per_course, move_courses, seed):
+    """Synthetic desired memberships and Canvas rosters: mostly in sync, some missing, some in the wrong section."""
+    rng = random.Random(seed)
+    wanted = defaultdict(dict)  # {course: {student: (section names, move)}}, as nightly_plan.py builds it
+    rosters = defaultdict(list)  # {course: [(student, section name, enrollment_id)]}
+    enrollment_ids = iter(range(1, 10**9))
+    for student in range(students):
+        for course in rng.sample(range(courses), courses_per_student):
+            section = f"Section {rng.randrange(sections_per_course)}"
+            move = course < move_courses
+            wanted[course][student] = ({section}, move)
+            roll = rng.random()
+            if roll < 0.85:
+                rosters[course].append((student, section, next(enrollment_ids)))
+            elif roll < 0.95:
+                rosters[course].append((student, f"Section {(int(section.split()[1]) + 1) % sections_per_course}", next(enrollment_ids)))
+    return wanted, rosters
+
+
+def diff_with_loops(wanted, rosters):
+    """The per-student loop this module replaces. Returns (creates, concludes) as sets."""
+    by_course = {course: defaultdict(list) for course in rosters}
+    for course, roster in rosters.items():
+        for student, section, enrollment_id in roster:
+            by_course[course][student].append((section.lower(), enrollment_id))
+    creates, concludes = set(), set()
+    for course, by_student in wanted.items():
+        current_by_student = by_course.get(course, {})
+        for student, (section_names, move) in by_student.items():
+            current = current_by_student.get(student, [])
+            targets = {name.lower() for name in section_names}
+            for name in section_names:
+                if not any(section == name.lower() for section, _ in current):
+                    creates.add((student, course, name))
+            if move:
+                concludes.update(enrollment_id for section, enrollment_id in current if section not in targets)
+    return creates, concludes
+
+
+def to_columns(wanted, rosters):
+    """The benchmark data as the parallel columns diff_enrollments takes, plus the enrollment ID of each actual row."""
+    rows = [(student, course, name, move) for course, by_student in wanted.items() for student, (section_names, move) in by_student.items() for name in section_names]
+    roster_rows = [(student, course, section, enrollment_id) for course, roster in rosters.items() for student, section, enrollment_id in roster]
+    desired, actual = as_columns(rows, 4), as_columns(roster_rows, 4)
+    return desired, actual[:3], np.asarray(actual[3], dtype=np.int64)
+
+
+def diff_with_matrix(wanted, rosters, columns=None):
+    desired, actual, actual_ids = columns or to_columns(wanted, rosters)
+    to_create, to_conclude, moves = diff_enrollments(desired, actual)
+    return {(desired[0][i], desired[1][i], desired[2][i]) for i in to_create.tolist()}, set(actual_ids[to_conclude].tolist()), moves
+
+
+def best_time(func, repeat):
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def run_benchmark(students, courses, courses_per_student, sections_per_course, move_courses, seed, repeat):
+    wanted, rosters = make_school(students, courses, courses_per_student, sections_per_course, move_courses, seed)
+    memberships = sum(len(by_student) for by_student in wanted.values())
+    print(f"{students} students x {courses} courses: {memberships} desired memberships, {sum(len(r) for r in rosters.values())} current enrollments")
+    columns = to_columns(wanted, rosters)
+    runs = [("per-student loop", lambda: diff_with_loops(wanted, rosters)),
+            ("matrix, from dicts", lambda: diff_with_matrix(wanted, rosters)),
+            ("matrix, from columns", lambda: diff_with_matrix(wanted, rosters, columns))]
+    timings = {}
+    for name, func in runs:
+        timings[name] = best_time(func, repeat)
+        elapsed, result = timings[name]
+        print(f"  {name:<21} {elapsed * 1000:8.1f} ms  creates={len(result[0])} concludes={len(result[1])}")
+    loop_time, (loop_creates, loop_concludes) = timings["per-student loop"]
+    for name, _ in runs[1:]:
+        matrix_creates, matrix_concludes, moves = timings[name][1]
+        assert loop_creates == matrix_creates and loop_concludes == matrix_concludes, f"The loop and {name} disagree"
+    print(f"  All diffs agree ({moves} section moves). Speed-up: {loop_time / timings['matrix, from dicts'][0]:.1f}x from dicts, "
+          f"{loop_time / timings['matrix, from columns'][0]:.1f}x from columns")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the enrollment matrix diff against the per-student loop.")
+    parser.add_argument('--students', type=int, default=5000)
+    parser.add_argument('--courses', type=int, default=50)
+    parser.add_argument('--courses-per-student', type=int, default=8)
+    parser.add_argument('--sections-per-course', type=int, default=4)
+    parser.add_argument('--move-courses', type=int, default=2, help="Courses (like the study halls) whose other sections are concluded.")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    run_benchmark(args.students, args.courses, args.courses_per_student, args.sections_per_course, args.move_courses, args.seed, args.repeat)
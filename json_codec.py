@@ -0,0 +1,158 @@
+# json_codec.py
+#
+# Description:
+# The JSON layer for Monday.com GraphQL requests, responses and column values. It uses
+# orjson when it is installed and the standard library json module otherwise. Set
+# JSON_CODEC=json to force the standard library. Both backends write compact JSON.
+# Column values come back from Monday as JSON strings, and the same string is often read
+# again and again: a connect column on every chunk of a board scan, or a people column
+# once per phase. linked_item_ids() and people_entries() parse each distinct string once.
+# They keep the result in an LRU cache as an immutable typed form (a frozenset of item IDs,
+# a tuple of (id, kind) pairs), so callers can reuse it for the rest of the task.
+#
+# Usage (micro-benchmark: decode and read a full board scan):
+# python json_codec.py --items 5000
+#
+# Required Python packages:
+# orjson (optional; see requirements.txt)
+
+import argparse
+import json
+import os
+import time
+from functools import lru_cache
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_CODEC = "orjson" if orjson and os.environ.get("JSON_CODEC", "orjson").lower() == "orjson" else "json"
+COLUMN_VALUE_CACHE_SIZE = int(os.environ.get("COLUMN_VALUE_CACHE_SIZE", 65536))
+
+# orjson.JSONDecodeError subclasses json.JSONDecodeError, so one except clause covers both
+JSONDecodeError = json.JSONDecodeError
+_stdlib_encoder = json.JSONEncoder(separators=(',', ':'))
+
+
+def dumps(obj):
+    """Compact JSON text."""
+    if JSON_CODEC == "orjson": return orjson.dumps(obj).decode()
+    return _stdlib_encoder.encode(obj)
+
+
+def dumps_bytes(obj):
+    """Compact JSON as UTF-8 bytes, for an HTTP request body."""
+    if JSON_CODEC == "orjson": return orjson.dumps(obj)
+    return _stdlib_encoder.encode(obj).encode()
+
+
+def loads(data):
+    """Parses JSON text or bytes."""
+    if JSON_CODEC == "orjson": return orjson.loads(data)
+    return json.loads(data)
+
+
+def graphql_string(value):
+    """value as JSON, quoted as a GraphQL string literal: what Monday's column_values and value arguments take."""
+    return dumps(dumps(value))
+
+
+def _parsed(value_data):
+    if isinstance(value_data, (str, bytes)):
+        try: return loads(value_data)
+        except JSONDecodeError: return None
+    return value_data
+
+
+@lru_cache(maxsize=COLUMN_VALUE_CACHE_SIZE)
+def _linked_item_ids(raw):
+    return linked_item_ids(_parsed(raw))
+
+
+@lru_cache(maxsize=COLUMN_VALUE_CACHE_SIZE)
+def _people_entries(raw):
+    return people_entries(_parsed(raw))
+
+
+def linked_item_ids(value_data):
+    """Item IDs in a connect-boards column value (JSON text or parsed), as a frozenset of ints."""
+    if not value_data: return frozenset()
+    if isinstance(value_data, (str, bytes)): return _linked_item_ids(value_data)
+    try: return frozenset(int(link['linkedPulseId']) for link in value_data.get('linkedPulseIds') or [] if 'linkedPulseId' in link)
+    except (AttributeError, TypeError, ValueError): return frozenset()
+
+
+def people_entries(value_data):
+    """(id, kind) pairs in a people column value (JSON text or parsed), as a tuple."""
+    if not value_data: return ()
+    if isinstance(value_data, (str, bytes)): return _people_entries(value_data)
+    try: return tuple((entry['id'], entry.get('kind')) for entry in value_data.get('personsAndTeams') or [] if 'id' in entry)
+    except (AttributeError, TypeError): return ()
+
+
+# ==============================================================================
+# BENCHMARK
+# ==============================================================================
+def make_board_page(items, seed_people=40):
+    """A synthetic items_page response body: each item has a connect column, a people column and a text column."""
+    page = []
+    for i in range(items):
+        links = {"linkedPulseIds": [{"linkedPulseId": 20_000_000_000 + (i * 7 + k) % items} for k in range(3)]}
+        people = {"personsAndTeams": [{"id": 50_000_000 + i % seed_people, "kind": "person"}], "changed_at": "2026-10-01T04:00:00.000Z"}
+        page.append({'id': str(10_000_000_000 + i), 'name': f"Student {i}", 'column_values': [
+            {'id': "connect_boards", 'text': None, 'value': json.dumps(links)},
+            {'id': "person", 'text': f"Staffer {i % seed_people}", 'value': json.dumps(people)},
+            {'id': "text", 'text': f"{i:06d}", 'value': json.dumps(f"{i:06d}")}]})
+    return json.dumps({'data': {'boards': [{'items_page': {'cursor': None, 'items': page}}]}}).encode()
+
+
+def scan_with_stdlib(body, reads):
+    """The old helpers: json.loads of the body, then json.loads of each column value on every read."""
+    items = json.loads(body)['data']['boards'][0]['items_page']['items']
+    total = 0
+    for _ in range(reads):
+        for item in items:
+            columns = {cv['id']: cv for cv in item['column_values']}
+            total += len({int(link['linkedPulseId']) for link in json.loads(columns['connect_boards']['value'])['linkedPulseIds']})
+            total += len({person['id'] for person in json.loads(columns['person']['value'])['personsAndTeams'] if 'id' in person})
+    return total
+
+
+def scan_with_codec(body, reads):
+    items = loads(body)['data']['boards'][0]['items_page']['items']
+    total = 0
+    for _ in range(reads):
+        for item in items:
+            columns = {cv['id']: cv for cv in item['column_values']}
+            total += len(linked_item_ids(columns['connect_boards']['value']))
+            total += len(people_entries(columns['person']['value']))
+    return total
+
+
+def run_benchmark(items, reads, repeat):
+    body = make_board_page(items)
+    print(f"{items} items ({len(body) / 2**20:.1f} MiB response), each column value read {reads} times. Backend: {JSON_CODEC}")
+    timings = {}
+    for name, func in (("stdlib, parse on every read", scan_with_stdlib), ("codec, parse once", scan_with_codec)):
+        best = None
+        for _ in range(repeat):
+            _linked_item_ids.cache_clear(); _people_entries.cache_clear()
+            start = time.perf_counter()
+            result = func(body, reads)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        timings[name] = (best, result)
+        print(f"  {name:<28} {best * 1000:8.1f} ms")
+    (old_time, old_result), (new_time, new_result) = timings.values()
+    assert old_result == new_result, "The scans disagree"
+    print(f"  Speed-up: {old_time / new_time:.1f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the JSON codec on a full board scan.")
+    parser.add_argument('--items', type=int, default=5000)
+    parser.add_argument('--reads', type=int, default=3, help="How often each column value is read during the run.")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    run_benchmark(args.items, args.reads, args.repeat)
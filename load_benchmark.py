@@ -0,0 +1,417 @@
+# load_benchmark.py
+#
+# Description:
+# End-to-end load benchmark for the Celery tasks in app.py and the nightly_sync.py phases.
+# It starts the mock Monday.com and Canvas servers from mock_apis.py and seeds them with
+# a deterministic dataset of realistic size. Each scenario then runs through the real
+# code, and the report gives wall time, API call counts, Monday complexity and
+# throughput. Nothing here talks to production.
+#
+# Scenarios:
+#   full_sync, delta_sync, person_sync, plp_course_sync, teacher_enrollment, connect_log  (app.py tasks)
+#   nightly_special, nightly_hs_roster, nightly_plp, nightly_teachers, nightly_reconcile   (nightly_sync.py phases)
+#   nightly_plan, nightly_apply                                                           (nightly_plan.py stages, all students as one unit)
+#
+# Usage:
+# python load_benchmark.py --students 300 --courses 60 --latency-ms 80 --scenarios full_sync,nightly_plp
+# python load_benchmark.py --skip-sleeps --json results.json
+#
+# Notes:
+# - Tasks run inline through task.run (and Celery eager mode for tasks they queue), so no broker is needed. Set REDIS_URL / DATABASE_URL
+#   to a running Valkey to include the user-directory cache; without one it degrades as in production.
+# - The nightly phases use an in-memory SQLite processed_students table unless --mysql is given,
+#   in which case the DB_* variables are used as in nightly_sync.py.
+# - --skip-sleeps removes the scripts' fixed pauses and backoff sleeps and reports the skipped
+#   seconds instead, so wall time reflects API cost. Mock latency is unaffected.
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import threading
+import time
+import types
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+from mock_apis import MockCanvas, MockMonday, start_servers
+
+# ==============================================================================
+# DATASET LAYOUT (board, column and account IDs the seeded data uses)
+# ==============================================================================
+PLP, MASTER, ALL_COURSES, CANVAS_BOARD, HS_ROSTER, ALL_STAFF, SPED, IEP_AP = 1001, 1002, 1003, 1004, 1005, 1006, 1007, 1008
+CATEGORY_COLUMNS = {"Math": "board_relation_math", "ELA": "board_relation_ela", "Science": "board_relation_sci",
+                    "ACE": "board_relation_ace", "Other/Elective": "board_relation_other"}
+PLP_SYNC_STATUS_COLUMN = "status_canvas_sync"
+TOR_COLUMN, ACE_COLUMN, CONNECT_COLUMN = "multiple_person_tor", "multiple_person_ace", "multiple_person_connect"
+SPED_CM_COLUMN = "multiple_person_cm"
+CANVAS_TERM_ID, CANVAS_SUBACCOUNT_ID, CANVAS_TEMPLATE_COURSE_ID = "2025-26", 2, 9000
+CREATOR_NAME = "Sarah Bruce"
+GRADES = ["TK", "K", "1st", "2nd", "3rd", "4th", "5th", "6th", "7th", "8th", "9th", "10th", "11th", "12th"]
+
+ENVIRONMENT = {
+    "MONDAY_API_KEY": "benchmark", "CANVAS_API_KEY": "benchmark",
+    "PLP_BOARD_ID": str(PLP), "MASTER_STUDENT_BOARD_ID": str(MASTER), "ALL_COURSES_BOARD_ID": str(ALL_COURSES),
+    "CANVAS_BOARD_ID": str(CANVAS_BOARD), "HS_ROSTER_BOARD_ID": str(HS_ROSTER), "ALL_STAFF_BOARD_ID": str(ALL_STAFF),
+    "SPED_STUDENTS_BOARD_ID": str(SPED), "IEP_AP_BOARD_ID": str(IEP_AP),
+    "PLP_CANVAS_SYNC_COLUMN_ID": PLP_SYNC_STATUS_COLUMN, "PLP_CANVAS_SYNC_STATUS_VALUE": "Done",
+    "PLP_ALL_CLASSES_CONNECT_COLUMNS_STR": ",".join(CATEGORY_COLUMNS.values()),
+    "PLP_CATEGORY_TO_CONNECT_COLUMN_MAP": json.dumps(CATEGORY_COLUMNS),
+    "PLP_TO_MASTER_STUDENT_CONNECT_COLUMN": "board_relation_master", "PLP_TO_HS_ROSTER_CONNECT_COLUMN": "board_relation_hs",
+    "MASTER_STUDENT_SSID_COLUMN": "text_ssid", "MASTER_STUDENT_EMAIL_COLUMN": "email_student",
+    "MASTER_STUDENT_TOR_COLUMN_ID": TOR_COLUMN, "MASTER_STUDENT_ACE_PEOPLE_COLUMN_ID": ACE_COLUMN,
+    "MASTER_STUDENT_CONNECT_PEOPLE_COLUMN_ID": CONNECT_COLUMN,
+    "ALL_COURSES_TO_CANVAS_CONNECT_COLUMN_ID": "board_relation_canvas",
+    "CANVAS_COURSE_ID_COLUMN_ID": "text_canvas_course_id", "CANVAS_TO_STAFF_CONNECT_COLUMN_ID": "board_relation_staff",
+    "HS_ROSTER_CONNECT_ALL_COURSES_COLUMN_ID": "board_relation_courses", "HS_ROSTER_SUBITEM_DROPDOWN_COLUMN_ID": "dropdown_subject",
+    "HS_ROSTER_MAIN_ITEM_to_PLP_CONNECT_COLUMN_ID": "board_relation_hs_plp",
+    "ALL_STAFF_EMAIL_COLUMN_ID": "email_staff", "ALL_STAFF_SIS_ID_COLUMN_ID": "text_staff_sis", "ALL_STAFF_PERSON_COLUMN_ID": "people_staff",
+    "SPED_TO_IEPAP_CONNECT_COLUMN_ID": "board_relation_iepap",
+    "CANVAS_TERM_ID": CANVAS_TERM_ID, "CANVAS_SUBACCOUNT_ID": str(CANVAS_SUBACCOUNT_ID), "CANVAS_TEMPLATE_COURSE_ID": str(CANVAS_TEMPLATE_COURSE_ID),
+    "MASTER_STUDENT_PEOPLE_COLUMNS": json.dumps({TOR_COLUMN: "TOR", ACE_COLUMN: "ACE", CONNECT_COLUMN: "Connect"}),
+    "MASTER_STUDENT_PEOPLE_COLUMN_MAPPINGS": json.dumps({
+        column: {"name": name, "targets": [{"board_id": str(PLP), "connect_column_id": "board_relation_plp", "target_column_id": target, "target_column_type": "multiple-person"}]}
+        for column, name, target in [(TOR_COLUMN, "TOR", "person"), (ACE_COLUMN, "ACE", "multiple_person_mks1w5fc"), (CONNECT_COLUMN, "Connect", "multiple_person_mks1hzcz")]
+    }),
+    "SPED_STUDENTS_PEOPLE_COLUMN_MAPPING": json.dumps({SPED_CM_COLUMN: {"target_column_id": "multiple_person_cm_target", "target_column_type": "multiple-person"}}),
+}
+CONNECT_LOG_RULE = {"log_type": "ConnectBoardChange", "params": {"linked_board_id": str(ALL_COURSES), "subitem_name_prefix": "course"}}
+
+
+def links(*item_ids):
+    return {"linkedPulseIds": [{"linkedPulseId": int(i)} for i in item_ids]}
+
+
+def people(*user_ids):
+    return {"personsAndTeams": [{"id": int(u), "kind": "person"} for u in user_ids]}
+
+# ==============================================================================
+# SEEDING
+# ==============================================================================
+def seed_dataset(monday, canvas, students, courses, staff, seed=42):
+    """Fills both mocks and returns the IDs the scenarios need."""
+    rng = random.Random(seed)
+    e = ENVIRONMENT
+    data = {'students': [], 'staff': [], 'courses': [], 'canvas_items': []}
+
+    creator_id = monday.add_user(900, CREATOR_NAME, "sarah.bruce@example.org", me=True)
+    data['creator_id'] = creator_id
+    canvas.add_account(1, "Root")
+    canvas.add_account(CANVAS_SUBACCOUNT_ID, "Courses")
+    canvas.add_course("Template", course_id=CANVAS_TEMPLATE_COURSE_ID)
+    for email in ("sub@triviumcharter.org", "aide@triviumcharter.org"):
+        canvas.add_user(email.split('@')[0].title(), email)
+
+    # --- Staff ---
+    for n in range(staff):
+        user_id = monday.add_user(1000 + n, f"Teacher{n} Staffer{n}", f"teacher{n}@example.org")
+        canvas_id = canvas.add_user(f"Teacher{n} Staffer{n}", f"teacher{n}@example.org", f"T{n:05d}")
+        item_id = monday.add_item(ALL_STAFF, f"Teacher{n} Staffer{n}", {
+            e["ALL_STAFF_EMAIL_COLUMN_ID"]: f"teacher{n}@example.org", e["ALL_STAFF_SIS_ID_COLUMN_ID"]: f"T{n:05d}",
+            e["ALL_STAFF_PERSON_COLUMN_ID"]: people(user_id), "text_mktg7h6": str(canvas_id) if n % 3 else "",
+        })
+        data['staff'].append({'user_id': user_id, 'item_id': item_id, 'canvas_id': canvas_id})
+
+    # --- Courses: special courses referenced by ID in the scripts, then regular ones ---
+    special = {"Jumpstart": 10069, "ACE Study Hall": 10128, "Connect English Study Hall": 10109, "Connect Math Study Hall": 9966,
+               "Prep Math and ELA Study Hall": 9960, "EL Support Study Hall": 10046, "MS Math": 10326, "MS ELA": 10327}
+    for name, course_id in special.items():
+        canvas.add_course(name, course_id=course_id, term_id=CANVAS_TERM_ID, account_id=CANVAS_SUBACCOUNT_ID)
+    subjects = list(CATEGORY_COLUMNS)
+    for n in range(courses):
+        category = subjects[n % len(subjects)]
+        prefix = rng.choice(["Connect ", "Prep ", "", ""]) if category in ("Math", "ELA") else ""
+        name = f"{prefix}{category} {n}"
+        canvas_course_id = canvas.add_course(name, sis_course_id=f"course_{n}_{CANVAS_TERM_ID}", term_id=CANVAS_TERM_ID, account_id=CANVAS_SUBACCOUNT_ID)
+        teachers = rng.sample(data['staff'], k=min(len(data['staff']), rng.choice([1, 1, 2])))
+        canvas_item = monday.add_item(CANVAS_BOARD, name, {
+            e["CANVAS_COURSE_ID_COLUMN_ID"]: str(canvas_course_id),
+            e["CANVAS_TO_STAFF_CONNECT_COLUMN_ID"]: links(*(t['item_id'] for t in teachers)),
+            "color_mktqgt0t": {"label": rng.choice(list(special)[1:6])} if n % 4 == 0 else None,
+        })
+        course_item = monday.add_item(ALL_COURSES, name, {
+            e["ALL_COURSES_TO_CANVAS_CONNECT_COLUMN_ID"]: links(canvas_item),
+            "dropdown_mkq0r2av": {"labels": ["ACE"]} if category == "ACE" else None,
+        })
+        data['courses'].append({'item_id': course_item, 'category': category, 'canvas_course_id': canvas_course_id, 'canvas_item': canvas_item})
+        data['canvas_items'].append({'item_id': canvas_item, 'staff': [t['item_id'] for t in teachers]})
+
+    # --- Students ---
+    courses_by_category = {c: [course for course in data['courses'] if course['category'] == c] for c in subjects}
+    for n in range(students):
+        grade = rng.choice(GRADES)
+        email = f"student{n}@students.example.org"
+        canvas_user = canvas.add_user(f"Student{n} Learner", email, f"S{n:06d}") if rng.random() < 0.7 else None
+        tor = rng.choice(data['staff'])
+        master_item = monday.add_item(MASTER, f"Student{n} Learner", {
+            e["MASTER_STUDENT_SSID_COLUMN"]: f"S{n:06d}", e["MASTER_STUDENT_EMAIL_COLUMN"]: email,
+            "text_mktgs1ax": str(canvas_user) if canvas_user and rng.random() < 0.5 else "",
+            "color_mksy8hcw": {"label": grade}, TOR_COLUMN: people(tor['user_id']),
+        })
+        plp_columns = {e["PLP_TO_MASTER_STUDENT_CONNECT_COLUMN"]: links(master_item)}
+        enrolled = []
+        for category, column in CATEGORY_COLUMNS.items():
+            picks = rng.sample(courses_by_category[category], k=min(len(courses_by_category[category]), rng.choice([0, 1, 1, 2])))
+            enrolled.extend(picks)
+            plp_columns[column] = links(*(c['item_id'] for c in picks)) if picks else None
+        plp_item = monday.add_item(PLP, f"Student{n} Learner", plp_columns)
+        monday._set_column(master_item, "board_relation_plp", links(plp_item))
+
+        hs_item = None
+        if GRADES.index(grade) >= GRADES.index("9th"):
+            hs_item = monday.add_item(HS_ROSTER, f"Student{n} Learner", {e["HS_ROSTER_MAIN_ITEM_to_PLP_CONNECT_COLUMN_ID"]: links(plp_item)})
+            monday._set_column(plp_item, e["PLP_TO_HS_ROSTER_CONNECT_COLUMN"], links(hs_item))
+            for course in enrolled[:4]:
+                monday.add_item(HS_ROSTER, course['category'], {
+                    e["HS_ROSTER_SUBITEM_DROPDOWN_COLUMN_ID"]: {"labels": [course['category']]},
+                    e["HS_ROSTER_CONNECT_ALL_COURSES_COLUMN_ID"]: links(course['item_id']),
+                    "status7": {"label": rng.choice(["College Prep", "Honors", ""])}, "color6": {"label": rng.choice(["Fall", "Fall", "Spring"])},
+                }, parent_id=hs_item)
+        data['students'].append({'plp_item': plp_item, 'master_item': master_item, 'hs_item': hs_item, 'grade': grade,
+                                 'tor': tor['user_id'], 'courses': [c['item_id'] for c in enrolled]})
+    return data
+
+# ==============================================================================
+# SCENARIOS
+# ==============================================================================
+def build_scenarios(app, nightly, monday, data, db_cursor, limit):
+    """Returns {name: (prepare, [work units])}. prepare() mutates the mocks before timing starts."""
+    e = ENVIRONMENT
+    rng = random.Random(7)
+    students = data['students'][:limit] if limit else data['students']
+    staff_users = [s['user_id'] for s in data['staff']]
+    course_items = [c['item_id'] for c in data['courses']]
+    plp_items = {s['plp_item']: {'id': str(s['plp_item']), 'name': monday.items[s['plp_item']]['name']} for s in students}
+    scenarios = {}
+
+    def pending_event(student, column):
+        current = {int(l['linkedPulseId']) for l in json.loads(monday.items[student['plp_item']]['columns'].get(column) or '{"linkedPulseIds": []}')['linkedPulseIds']}
+        added = rng.choice([c for c in course_items if c not in current])
+        monday._set_column(student['plp_item'], column, links(*(current | {added})))
+        return {'pulseId': student['plp_item'], 'boardId': PLP, 'columnId': column, 'userId': rng.choice(staff_users),
+                'value': links(*(current | {added})), 'previousValue': links(*current)}
+
+    scenarios['full_sync'] = (None, [
+        (lambda s=s: app.process_canvas_full_sync_from_status.run({'pulseId': s['plp_item'], 'boardId': PLP, 'userId': s['tor'],
+                                                              'columnId': PLP_SYNC_STATUS_COLUMN, 'value': {'label': {'text': 'Done'}}}))
+        for s in students])
+
+    delta_events = []
+    scenarios['delta_sync'] = (lambda: delta_events.extend(pending_event(s, CATEGORY_COLUMNS['Math']) for s in students),
+                               [lambda i=i: app.process_canvas_delta_sync_from_course_change.run(delta_events[i]) for i in range(len(students))])
+
+    person_events = []
+    def prepare_person_sync():
+        for s in students:
+            new_tor = rng.choice([u for u in staff_users if u != s['tor']])
+            monday._set_column(s['master_item'], TOR_COLUMN, people(new_tor))
+            person_events.append({'pulseId': s['master_item'], 'boardId': MASTER, 'columnId': TOR_COLUMN, 'userId': rng.choice(staff_users),
+                                  'value': people(new_tor), 'previousValue': people(s['tor'])})
+            s['tor'] = new_tor
+    scenarios['person_sync'] = (prepare_person_sync, [lambda i=i: app.process_master_student_person_sync_webhook.run(person_events[i]) for i in range(len(students))])
+
+    hs_students = [s for s in students if s['hs_item'] and monday.items[s['hs_item']]['subitems']]
+    course_events = []
+    def prepare_course_sync():
+        for s in hs_students:
+            subitem = monday.items[monday.items[s['hs_item']]['subitems'][0]]
+            current = {int(l['linkedPulseId']) for l in json.loads(subitem['columns'][e["HS_ROSTER_CONNECT_ALL_COURSES_COLUMN_ID"]])['linkedPulseIds']}
+            new = current | {rng.choice(course_items)}
+            monday._set_column(subitem['id'], e["HS_ROSTER_CONNECT_ALL_COURSES_COLUMN_ID"], links(*new))
+            course_events.append({'pulseId': subitem['id'], 'parentItemId': s['hs_item'], 'boardId': subitem['board_id'], 'userId': rng.choice(staff_users),
+                                  'columnId': e["HS_ROSTER_CONNECT_ALL_COURSES_COLUMN_ID"], 'value': links(*new), 'previousValue': links(*current)})
+    scenarios['plp_course_sync'] = (prepare_course_sync, [lambda i=i: app.process_plp_course_sync_webhook.run(course_events[i]) for i in range(len(hs_students))])
+
+    staff_events = []
+    def prepare_teacher_enrollment():
+        for item in data['canvas_items']:
+            added = rng.choice([s['item_id'] for s in data['staff'] if s['item_id'] not in item['staff']])
+            monday._set_column(item['item_id'], e["CANVAS_TO_STAFF_CONNECT_COLUMN_ID"], links(*item['staff'], added))
+            staff_events.append({'pulseId': item['item_id'], 'boardId': CANVAS_BOARD, 'columnId': e["CANVAS_TO_STAFF_CONNECT_COLUMN_ID"],
+                                 'value': links(*item['staff'], added), 'previousValue': links(*item['staff'])})
+            item['staff'].append(added)
+    scenarios['teacher_enrollment'] = (prepare_teacher_enrollment, [lambda i=i: app.process_teacher_enrollment_webhook.run(staff_events[i]) for i in range(len(data['canvas_items']))])
+
+    log_events = []
+    scenarios['connect_log'] = (lambda: log_events.extend(pending_event(s, CATEGORY_COLUMNS['ELA']) for s in students),
+                                [lambda i=i: app.process_general_webhook.run(log_events[i], CONNECT_LOG_RULE) for i in range(len(students))])
+
+    creator_id = data['creator_id']
+    hs_items = {s['hs_item']: {'id': str(s['hs_item']), 'name': monday.items[s['hs_item']]['name']} for s in students if s['hs_item']}
+    scenarios['nightly_special'] = (None, [lambda p=p: nightly.process_student_special_enrollments(p, db_cursor, dry_run=False) for p in plp_items.values()])
+    scenarios['nightly_hs_roster'] = (None, [lambda h=h: nightly.run_hs_roster_sync_for_student(h, dry_run=False) for h in hs_items.values()])
+    scenarios['nightly_plp'] = (None, [lambda p=p: nightly.run_plp_sync_for_student(p, creator_id, db_cursor, dry_run=False) for p in plp_items])
+    scenarios['nightly_teachers'] = (None, [lambda: nightly.sync_canvas_teachers_and_tas(db_cursor, dry_run=False)])
+    scenarios['nightly_reconcile'] = (None, [lambda p=p: nightly.reconcile_subitems(p, creator_id, db_cursor, dry_run=False) for p in plp_items])
+
+    import nightly_plan
+    plans = {}
+    build_plan = lambda: plans.update(plan=nightly_plan.build_nightly_plan(list(plp_items.values()), db_cursor))
+    scenarios['nightly_plan'] = (None, [build_plan])
+    scenarios['nightly_apply'] = (lambda: plans or build_plan(), [lambda: nightly_plan.apply_nightly_plan(plans.pop('plan'), types.SimpleNamespace(commit=lambda: None), db_cursor)])
+    return scenarios
+
+# ==============================================================================
+# HARNESS
+# ==============================================================================
+class SqliteCursor:
+    """processed_students in in-memory SQLite, accepting the MySQL-style placeholders and upsert nightly_sync.py uses."""
+
+    def __init__(self, plp_item_ids):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(':memory:', check_same_thread=False)
+        self.cursor = self.conn.cursor()
+        self.cursor.execute("CREATE TABLE processed_students (student_id INTEGER PRIMARY KEY, last_synced_at TIMESTAMP, canvas_id VARCHAR(255))")
+        self.cursor.executemany("INSERT INTO processed_students (student_id) VALUES (?)", [(i,) for i in plp_item_ids])
+
+    def execute(self, sql, params=()):
+        sql = sql.replace('%s', '?').replace('NOW()', 'CURRENT_TIMESTAMP').replace('ON DUPLICATE KEY UPDATE', 'ON CONFLICT(student_id) DO UPDATE SET')
+        with self.lock:
+            self.cursor.execute(sql, params)
+
+    def fetchone(self):
+        with self.lock:
+            return self.cursor.fetchone()
+
+    def fetchall(self):
+        with self.lock:
+            return self.cursor.fetchall()
+
+
+class SleepMeter:
+    """Stands in for a module's `time` so its sleeps are counted instead of slept."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.slept = 0.0
+
+    def install(self, module):
+        meter = self
+        proxy = types.SimpleNamespace(**{name: getattr(time, name) for name in dir(time) if not name.startswith('_')})
+        def sleep(seconds):
+            with meter.lock:
+                meter.slept += seconds
+        proxy.sleep = sleep
+        module.time = proxy
+
+
+def run_scenario(name, prepare, units, monday, canvas, concurrency, sleep_meter, quiet):
+    if prepare:
+        prepare()
+    monday.reset_stats()
+    canvas.reset_stats()
+    slept_before = sleep_meter.slept if sleep_meter else 0.0
+    failures = 0
+    devnull = open(os.devnull, 'w') if quiet else None
+    stdout = sys.stdout
+    start = time.perf_counter()
+    try:
+        if devnull:
+            sys.stdout = devnull
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for future in [pool.submit(unit) for unit in units]:
+                try: future.result()
+                except Exception as e:
+                    failures += 1
+                    print(f"ERROR in {name}: {e!r}", file=sys.stderr)
+    finally:
+        sys.stdout = stdout
+        if devnull:
+            devnull.close()
+    wall = time.perf_counter() - start
+    m, c = monday.snapshot(), canvas.snapshot()
+    return {
+        'scenario': name, 'units': len(units), 'failures': failures, 'wall_s': round(wall, 3),
+        'units_per_s': round(len(units) / wall, 2) if wall else None,
+        'skipped_sleep_s': round((sleep_meter.slept - slept_before) if sleep_meter else 0.0, 1),
+        'monday_requests': m.get('requests', 0), 'monday_complexity': m.get('complexity', 0),
+        'monday_mutations': m.get('mutations', 0), 'monday_429s': m.get('rate_limited', 0),
+        'canvas_requests': c.get('requests', 0), 'canvas_throttled': c.get('throttled', 0),
+        'monday_operations': m.get('operations', {}), 'canvas_operations': c.get('operations', {}),
+    }
+
+
+def print_report(results):
+    header = f"{'scenario':<20}{'units':>7}{'fail':>6}{'wall s':>9}{'units/s':>9}{'sleep s':>9}{'monday':>8}{'/unit':>7}{'cplx/unit':>11}{'429s':>6}{'canvas':>8}{'/unit':>7}{'403s':>6}"
+    print("\n" + header)
+    print("-" * len(header))
+    for r in results:
+        n = r['units'] or 1
+        print(f"{r['scenario']:<20}{r['units']:>7}{r['failures']:>6}{r['wall_s']:>9.2f}{r['units_per_s'] or 0:>9.2f}{r['skipped_sleep_s']:>9.1f}"
+              f"{r['monday_requests']:>8}{r['monday_requests'] / n:>7.1f}{r['monday_complexity'] / n:>11.0f}{r['monday_429s']:>6}"
+              f"{r['canvas_requests']:>8}{r['canvas_requests'] / n:>7.1f}{r['canvas_throttled']:>6}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the webhook tasks and nightly phases against local mock APIs.")
+    parser.add_argument('--students', type=int, default=300)
+    parser.add_argument('--courses', type=int, default=60)
+    parser.add_argument('--staff', type=int, default=40)
+    parser.add_argument('--limit', type=int, default=0, help="Run per-student scenarios on only the first N students.")
+    parser.add_argument('--scenarios', default="all", help="Comma-separated scenario names, or 'all'.")
+    parser.add_argument('--latency-ms', type=float, default=50)
+    parser.add_argument('--jitter-ms', type=float, default=10)
+    parser.add_argument('--concurrency', type=int, default=1, help="Work units run at once (the worker runs up to 100).")
+    parser.add_argument('--complexity-budget', type=int, default=5_000_000)
+    parser.add_argument('--monday-rpm', type=int, default=5000)
+    parser.add_argument('--skip-sleeps', action='store_true')
+    parser.add_argument('--mysql', action='store_true')
+    parser.add_argument('--verbose', action='store_true', help="Show the scripts' own output.")
+    parser.add_argument('--json', help="Write the full results (including per-operation counts) to this file.")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    monday = MockMonday(args.latency_ms, args.jitter_ms, args.complexity_budget, args.monday_rpm)
+    canvas = MockCanvas(args.latency_ms, args.jitter_ms)
+    monday_server, canvas_server = start_servers(monday, canvas)
+
+    print(f"Seeding {args.students} students, {args.courses} courses, {args.staff} staff...")
+    data = seed_dataset(monday, canvas, args.students, args.courses, args.staff, args.seed)
+
+    os.environ.update(ENVIRONMENT)
+    os.environ["MONDAY_API_URL"] = f"{monday_server.url}/v2"
+    os.environ["CANVAS_API_URL"] = canvas_server.url
+    warnings.filterwarnings("ignore", message="Canvas may respond unexpectedly")  # The mocks are plain HTTP.
+    import app
+    import nightly_sync
+    app.celery_app.conf.task_always_eager = True
+
+    sleep_meter = None
+    if args.skip_sleeps:
+        sleep_meter = SleepMeter()
+        sleep_meter.install(app)
+        sleep_meter.install(nightly_sync)
+
+    if args.mysql:
+        import mysql.connector
+        db = mysql.connector.connect(host=nightly_sync.DB_HOST, user=nightly_sync.DB_USER, password=nightly_sync.DB_PASSWORD,
+                                     database=nightly_sync.DB_NAME, port=int(nightly_sync.DB_PORT), autocommit=True)
+        db_cursor = db.cursor(buffered=True)
+    else:
+        db_cursor = SqliteCursor([s['plp_item'] for s in data['students']])
+
+    scenarios = build_scenarios(app, nightly_sync, monday, data, db_cursor, args.limit)
+    selected = list(scenarios) if args.scenarios == "all" else [s.strip() for s in args.scenarios.split(',') if s.strip()]
+    unknown = [s for s in selected if s not in scenarios]
+    if unknown:
+        parser.error(f"Unknown scenario(s): {', '.join(unknown)}. Choose from: {', '.join(scenarios)}")
+
+    results = []
+    for name in selected:
+        prepare, units = scenarios[name]
+        print(f"Running {name} ({len(units)} units, concurrency {args.concurrency})...")
+        results.append(run_scenario(name, prepare, units, monday, canvas, args.concurrency, sleep_meter, not args.verbose))
+
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'config': vars(args), 'results': results}, f, indent=2)
+        print(f"\nWrote {args.json}")
+    monday_server.stop()
+    canvas_server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,970 @@
+# mock_apis.py
+#
+# Description:
+# Stateful local stand-ins for the Monday.com GraphQL API and the Canvas REST API.
+# load_benchmark.py drives the webhook tasks and nightly phases against them, so load
+# tests never touch production boards or courses.
+#
+# The Monday server understands the subset of GraphQL this repo sends:
+# - items, boards, items_page, next_items_page, items_page_by_column_values, users,
+#   complexity, subitems and updates
+# - change_column_value, change_simple_column_value, change_multiple_column_values,
+#   create_item, create_subitem, create_update and delete_item
+# - aliases and $variables
+# It charges every query a complexity cost against a per-minute budget and a request
+# rate limit, answering 429 when either runs out.
+#
+# The Canvas server keeps users, courses, sections and enrollments. It supports:
+# - Link-header pagination
+# - the "ID already in use" / "is already in use" 400 conflicts
+# - a leaky-bucket X-Rate-Limit-Remaining with 403 "Rate Limit Exceeded"
+# - provisioning_csv account reports: the report is "running" on the first poll and
+#   "complete" on the next, with a zip of users/sections/enrollments CSVs to download
+#
+# Both servers take a latency (plus jitter) per request and keep call counters.
+#
+# To run standalone (empty stores; seed them through the Python API):
+# python mock_apis.py --monday-port 8901 --canvas-port 8902 --latency-ms 80
+#
+# Required Python packages:
+# Flask
+
+import argparse
+import csv
+import io
+import itertools
+import json
+import logging
+import random
+import re
+import threading
+import time
+import zipfile
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from urllib.parse import urlencode
+
+from flask import Flask, Response, jsonify, request
+from werkzeug.serving import make_server
+
+# ==============================================================================
+# MINIMAL GRAPHQL PARSER
+# ==============================================================================
+TOKEN_RE = re.compile(r'''
+    (?P<skip>[\s,]+|\#[^\n]*)
+  | (?P<punct>[{}()\[\]:!$=])
+  | (?P<string>"(?:\\.|[^"\\])*")
+  | (?P<number>-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)
+  | (?P<name>[_A-Za-z][_0-9A-Za-z]*)
+''', re.VERBOSE)
+
+
+class GraphQLError(Exception):
+    pass
+
+
+class Field:
+    __slots__ = ('alias', 'name', 'args', 'selections')
+
+    def __init__(self, alias, name, args, selections):
+        self.alias, self.name, self.args, self.selections = alias, name, args, selections
+
+
+def tokenize(text):
+    pos = 0
+    while pos < len(text):
+        match = TOKEN_RE.match(text, pos)
+        if not match:
+            raise GraphQLError(f"Syntax error near: {text[pos:pos + 20]!r}")
+        pos = match.end()
+        if match.lastgroup != 'skip':
+            yield match.lastgroup, match.group()
+
+
+class QueryParser:
+    """Parses one operation into (operation_type, [Field]), substituting $variables."""
+
+    def __init__(self, text, variables=None):
+        self.tokens = list(tokenize(text))
+        self.pos = 0
+        self.variables = variables or {}
+
+    def peek(self, value=None):
+        if self.pos >= len(self.tokens):
+            return None if value is None else False
+        return self.tokens[self.pos] if value is None else self.tokens[self.pos][1] == value
+
+    def take(self, value=None):
+        if self.pos >= len(self.tokens):
+            raise GraphQLError("Unexpected end of query")
+        token = self.tokens[self.pos]
+        if value is not None and token[1] != value:
+            raise GraphQLError(f"Expected '{value}' but found '{token[1]}'")
+        self.pos += 1
+        return token
+
+    def parse(self):
+        operation = 'query'
+        if self.peek() and self.peek()[0] == 'name' and self.peek()[1] in ('query', 'mutation'):
+            operation = self.take()[1]
+            if self.peek() and self.peek()[0] == 'name':
+                self.take()
+            if self.peek('('):
+                depth = 0
+                while True:
+                    value = self.take()[1]
+                    depth += value == '('
+                    depth -= value == ')'
+                    if depth == 0:
+                        break
+        return operation, self.selection_set()
+
+    def selection_set(self):
+        self.take('{')
+        fields = []
+        while not self.peek('}'):
+            fields.append(self.field())
+        self.take('}')
+        return fields
+
+    def field(self):
+        name = self.take()[1]
+        alias = name
+        if self.peek(':'):
+            self.take(':')
+            name = self.take()[1]
+        args = {}
+        if self.peek('('):
+            self.take('(')
+            while not self.peek(')'):
+                arg_name = self.take()[1]
+                self.take(':')
+                args[arg_name] = self.value()
+            self.take(')')
+        selections = self.selection_set() if self.peek('{') else None
+        return Field(alias, name, args, selections)
+
+    def value(self):
+        kind, text = self.take()
+        if kind == 'string':
+            return json.loads(text)
+        if kind == 'number':
+            return float(text) if any(c in text for c in '.eE') else int(text)
+        if kind == 'name':
+            return {'true': True, 'false': False, 'null': None}.get(text, text)
+        if text == '$':
+            return self.variables.get(self.take()[1])
+        if text == '[':
+            values = []
+            while not self.peek(']'):
+                values.append(self.value())
+            self.take(']')
+            return values
+        if text == '{':
+            obj = {}
+            while not self.peek('}'):
+                key = self.take()[1]
+                self.take(':')
+                obj[key] = self.value()
+            self.take('}')
+            return obj
+        raise GraphQLError(f"Unexpected token '{text}'")
+
+
+def as_id_list(value):
+    if value is None:
+        return None
+    return [int(v) for v in (value if isinstance(value, list) else [value])]
+
+# ==============================================================================
+# MOCK MONDAY.COM
+# ==============================================================================
+class MockMonday:
+    """In-memory Monday.com account: boards, items, subitems, users and updates."""
+
+    def __init__(self, latency_ms=0, jitter_ms=0, complexity_budget=5_000_000, requests_per_minute=5000, max_page_size=500):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.complexity_budget = complexity_budget
+        self.requests_per_minute = requests_per_minute
+        self.max_page_size = max_page_size
+        self.lock = threading.RLock()
+        self.boards = {}
+        self.items = {}
+        self.users = {}
+        self.me_id = None
+        self.cursors = {}
+        self._ids = itertools.count(10_000_000_000)
+        self._window_start = time.monotonic()
+        self._window_cost = 0
+        self._window_requests = 0
+        self.reset_stats()
+
+    # --- Seeding -----------------------------------------------------------------
+    def add_board(self, board_id, name=None):
+        self.boards[int(board_id)] = {'id': int(board_id), 'name': name or f"Board {board_id}", 'subitem_board_id': None}
+        return int(board_id)
+
+    def add_user(self, user_id, name, email=None, me=False):
+        self.users[int(user_id)] = {'id': int(user_id), 'name': name, 'email': email or f"user{user_id}@example.org"}
+        if me or self.me_id is None:
+            self.me_id = int(user_id)
+        return int(user_id)
+
+    def add_item(self, board_id, name, column_values=None, item_id=None, parent_id=None, group_id='topics'):
+        """column_values: {column_id: value}; strings are plain text, dicts/lists are stored as JSON."""
+        item_id = int(item_id) if item_id else next(self._ids)
+        if int(board_id) not in self.boards:
+            self.add_board(board_id)
+        now = datetime.now(timezone.utc).isoformat()
+        self.items[item_id] = {
+            'id': item_id, 'name': name, 'board_id': int(board_id), 'group_id': group_id,
+            'parent_id': parent_id, 'subitems': [], 'updates': [], 'columns': {},
+            'creator_id': self.me_id, 'created_at': now, 'updated_at': now, 'state': 'active',
+        }
+        for column_id, value in (column_values or {}).items():
+            self._set_column(item_id, column_id, value)
+        if parent_id:
+            self.items[int(parent_id)]['subitems'].append(item_id)
+        return item_id
+
+    def _subitem_board(self, parent):
+        board = self.boards[parent['board_id']]
+        if not board['subitem_board_id']:
+            board['subitem_board_id'] = self.add_board(next(self._ids), f"Subitems of {board['name']}")
+        return board['subitem_board_id']
+
+    def _set_column(self, item_id, column_id, value):
+        item = self.items[item_id]
+        if column_id == 'name':
+            item['name'] = value
+        elif value is None or value == '' or value == {}:
+            item['columns'][column_id] = None
+        elif isinstance(value, (dict, list)):
+            item['columns'][column_id] = json.dumps(value)
+        else:
+            item['columns'][column_id] = json.dumps(str(value))
+        item['updated_at'] = datetime.now(timezone.utc).isoformat()
+
+    def _column_text(self, raw):
+        if raw is None:
+            return ""
+        value = json.loads(raw)
+        if isinstance(value, str):
+            return value
+        if not isinstance(value, dict):
+            return str(value)
+        if 'linkedPulseIds' in value:
+            return ", ".join(self.items[int(p['linkedPulseId'])]['name'] for p in value['linkedPulseIds'] if int(p.get('linkedPulseId', 0)) in self.items)
+        people = [p.get('id') for p in value.get('personsAndTeams', [])] + value.get('persons', []) + ([value['personId']] if value.get('personId') else [])
+        if people or 'personsAndTeams' in value:
+            return ", ".join(self.users[int(p)]['name'] for p in people if int(p) in self.users)
+        if 'labels' in value:
+            return ", ".join(str(label) for label in value['labels'])
+        for key in ('label', 'text', 'date', 'email'):
+            if key in value:
+                return str(value[key].get('text', '') if isinstance(value[key], dict) else value[key])
+        return ""
+
+    # --- Stats -------------------------------------------------------------------
+    def reset_stats(self):
+        with self.lock:
+            self.stats = Counter()
+            self.operations = Counter()
+
+    def snapshot(self):
+        with self.lock:
+            return {**self.stats, 'operations': dict(self.operations)}
+
+    # --- Request handling ----------------------------------------------------------
+    def handle(self, query, variables=None):
+        """Returns (http_status, payload, headers) for one GraphQL request."""
+        if self.latency_ms:
+            time.sleep(max(0, self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000)
+        with self.lock:
+            self.stats['requests'] += 1
+            now = time.monotonic()
+            if now - self._window_start >= 60:
+                self._window_start, self._window_cost, self._window_requests = now, 0, 0
+            reset_in = int(60 - (now - self._window_start)) + 1
+            self._window_requests += 1
+            if self._window_requests > self.requests_per_minute or self._window_cost >= self.complexity_budget:
+                self.stats['rate_limited'] += 1
+                code = 'RATE_LIMIT_EXCEEDED' if self._window_requests > self.requests_per_minute else 'COMPLEXITY_BUDGET_EXHAUSTED'
+                return 429, {'errors': [{'message': 'Rate limit exceeded', 'extensions': {'code': code, 'retry_in_seconds': reset_in}}]}, {'Retry-After': str(reset_in)}
+
+            self.cost = 0
+            self.errors = []
+            complexity = {}
+            try:
+                operation, fields = QueryParser(query, variables).parse()
+                resolver = self._mutation_field if operation == 'mutation' else self._query_field
+                data = {}
+                for field in fields:
+                    self.operations[f"{operation}.{field.name}"] += 1
+                    if field.name == 'complexity':
+                        data[field.alias] = complexity
+                        continue
+                    data[field.alias] = resolver(field)
+            except GraphQLError as e:
+                self.stats['errors'] += 1
+                return 200, {'errors': [{'message': str(e)}]}, {}
+
+            cost = max(self.cost, 1)
+            before = self.complexity_budget - self._window_cost
+            self._window_cost += cost
+            self.stats['complexity'] += cost
+            complexity.update({'before': before, 'query': cost, 'after': before - cost, 'reset_in_x_seconds': reset_in})
+            payload = {'data': data, 'account_id': 1}
+            if self.errors:
+                self.stats['errors'] += 1
+                payload['errors'] = [{'message': message} for message in self.errors]
+            return 200, payload, {}
+
+    def _select(self, fields, selections):
+        out = {}
+        for field in selections or []:
+            if field.name not in fields:
+                raise GraphQLError(f"Cannot query field \"{field.name}\"")
+            resolver = fields[field.name]
+            out[field.alias] = resolver(field) if callable(resolver) else resolver
+            self.cost += 1
+        return out
+
+    def _user(self, user_id, selections):
+        user = self.users.get(int(user_id)) if user_id else None
+        if not user:
+            return None
+        return self._select({'id': str(user['id']), 'name': user['name'], 'email': user['email']}, selections)
+
+    def _column_value(self, item, column_id, selections):
+        raw = item['columns'].get(column_id)
+        return self._select({
+            'id': column_id,
+            'value': raw,
+            'text': lambda f: self._column_text(raw),
+            'type': column_id.rsplit('_', 1)[0] if '_' in column_id else column_id,
+            'column': lambda f: self._select({'id': column_id, 'title': column_id}, f.selections),
+        }, selections)
+
+    def _column_ids(self, item, ids):
+        if ids is None:
+            return sorted(item['columns'])
+        return [ids] if isinstance(ids, str) else ids
+
+    def _item(self, item, selections):
+        return self._select({
+            'id': str(item['id']),
+            'name': item['name'],
+            'state': item['state'],
+            'created_at': item['created_at'],
+            'updated_at': item['updated_at'],
+            'board': lambda f: self._select({'id': str(item['board_id']), 'name': self.boards[item['board_id']]['name']}, f.selections),
+            'group': lambda f: self._select({'id': item['group_id'], 'title': item['group_id']}, f.selections),
+            'parent_item': lambda f: self._item(self.items[item['parent_id']], f.selections) if item['parent_id'] in self.items else None,
+            'creator_id': str(item['creator_id']) if item['creator_id'] else None,
+            'creator': lambda f: self._user(item['creator_id'], f.selections),
+            'column_values': lambda f: [self._column_value(item, column_id, f.selections) for column_id in self._column_ids(item, f.args.get('ids'))],
+            'subitems': lambda f: [self._item(self.items[s], f.selections) for s in item['subitems'] if s in self.items],
+            'updates': lambda f: [self._update(u, f.selections) for u in item['updates'][:f.args.get('limit', 25)]],
+        }, selections)
+
+    def _update(self, update, selections):
+        return self._select({
+            'id': str(update['id']), 'body': update['body'], 'text_body': update['body'],
+            'created_at': update['created_at'], 'creator_id': str(update['creator_id']),
+            'creator': lambda f: self._user(update['creator_id'], f.selections),
+        }, selections)
+
+    def _page(self, item_ids, limit, selections):
+        limit = min(int(limit or 25), self.max_page_size)
+        cursor = None
+        if len(item_ids) > limit:
+            cursor = f"mock-{next(self._ids)}"
+            self.cursors[cursor] = item_ids[limit:]
+        return self._select({
+            'cursor': cursor,
+            'items': lambda f: [self._item(self.items[i], f.selections) for i in item_ids[:limit]],
+        }, selections)
+
+    def _board_items(self, board_id, group_id=None):
+        return [i for i, item in self.items.items() if item['board_id'] == board_id and item['parent_id'] is None and (group_id is None or item['group_id'] == group_id)]
+
+    def _items_page(self, board_id, field, group_id=None):
+        if field.args.get('cursor'):
+            return self._page(self.cursors.pop(field.args['cursor'], []), field.args.get('limit'), field.selections)
+        item_ids = self._board_items(board_id, group_id)
+        params = field.args.get('query_params') or {}
+        if params.get('ids'):
+            wanted = set(as_id_list(params['ids']))
+            item_ids = [i for i in item_ids if i in wanted]
+        for rule in params.get('rules') or []:
+            compare = {str(v) for v in (rule.get('compare_value') if isinstance(rule.get('compare_value'), list) else [rule.get('compare_value')])}
+            item_ids = [i for i in item_ids if self._column_text(self.items[i]['columns'].get(rule['column_id'])) in compare]
+        return self._page(item_ids, field.args.get('limit'), field.selections)
+
+    def _board(self, board, selections):
+        return self._select({
+            'id': str(board['id']),
+            'name': board['name'],
+            'items_count': len(self._board_items(board['id'])),
+            'items_page': lambda f: self._items_page(board['id'], f),
+            'groups': lambda f: [
+                self._select({'id': gid, 'title': gid, 'items_page': lambda g, gid=gid: self._items_page(board['id'], g, gid)}, f.selections)
+                for gid in (f.args.get('ids') or sorted({self.items[i]['group_id'] for i in self._board_items(board['id'])}))
+            ],
+        }, selections)
+
+    def _matches_column_values(self, item, columns):
+        for spec in columns:
+            raw = item['columns'].get(spec['column_id'])
+            text = self._column_text(raw)
+            people = {int(p) for p in re.findall(r'"id":\s*(\d+)', raw or '')}
+            matched = False
+            for wanted in spec.get('column_values') or []:
+                try: wanted_ids = {int(i) for i in json.loads(wanted).get('ids', [])}
+                except (ValueError, AttributeError, TypeError): wanted_ids = set()
+                if wanted == text or (wanted_ids and wanted_ids & people):
+                    matched = True
+            if not matched:
+                return False
+        return True
+
+    def _query_field(self, field):
+        args = field.args
+        if field.name == 'items':
+            # Like Monday, items(ids:) returns 25 items unless a limit (at most 100) is given.
+            ids = as_id_list(args.get('ids')) or []
+            found = [self.items[i] for i in ids if i in self.items][:min(int(args.get('limit') or 25), 100)]
+            return [self._item(item, field.selections) for item in found]
+        if field.name == 'boards':
+            ids = as_id_list(args.get('ids')) or sorted(self.boards)
+            return [self._board(self.boards[b], field.selections) for b in ids if b in self.boards]
+        if field.name == 'next_items_page':
+            return self._page(self.cursors.pop(args.get('cursor'), []), args.get('limit'), field.selections)
+        if field.name == 'items_page_by_column_values':
+            if args.get('cursor'):
+                return self._page(self.cursors.pop(args['cursor'], []), args.get('limit'), field.selections)
+            item_ids = [i for i in self._board_items(int(args['board_id'])) if self._matches_column_values(self.items[i], args.get('columns') or [])]
+            return self._page(item_ids, args.get('limit'), field.selections)
+        if field.name == 'users':
+            users = sorted(self.users.values(), key=lambda u: u['id'])
+            if args.get('ids'):
+                wanted = set(as_id_list(args['ids']))
+                users = [u for u in users if u['id'] in wanted]
+            if args.get('emails'):
+                users = [u for u in users if u['email'] in args['emails']]
+            limit = args.get('limit') or len(users) or 1
+            start = (int(args.get('page', 1)) - 1) * limit
+            return [self._user(u['id'], field.selections) for u in users[start:start + limit]]
+        if field.name == 'me':
+            return self._user(self.me_id, field.selections)
+        raise GraphQLError(f"Cannot query field \"{field.name}\" on type \"Query\"")
+
+    def _target_item(self, field, key='item_id'):
+        item_id = int(field.args.get(key) or 0)
+        if item_id not in self.items:
+            self.errors.append(f"Item {item_id} not found")
+            return None
+        return self.items[item_id]
+
+    def _mutation_field(self, field):
+        args = field.args
+        self.stats['mutations'] += 1
+        self.cost += 10
+        if field.name in ('change_column_value', 'change_simple_column_value'):
+            item = self._target_item(field)
+            if not item: return None
+            value = args.get('value')
+            if field.name == 'change_column_value' and isinstance(value, str):
+                try: value = json.loads(value)
+                except ValueError: pass
+            self._set_column(item['id'], args['column_id'], value)
+            return self._item(item, field.selections)
+        if field.name == 'change_multiple_column_values':
+            item = self._target_item(field)
+            if not item: return None
+            values = args.get('column_values') or {}
+            for column_id, value in (json.loads(values) if isinstance(values, str) else values).items():
+                self._set_column(item['id'], column_id, value)
+            return self._item(item, field.selections)
+        if field.name in ('create_item', 'create_subitem'):
+            values = args.get('column_values') or {}
+            values = json.loads(values) if isinstance(values, str) else values
+            if field.name == 'create_subitem':
+                parent = self._target_item(field, 'parent_item_id')
+                if not parent: return None
+                new_id = self.add_item(self._subitem_board(parent), args.get('item_name', ''), values, parent_id=parent['id'])
+            else:
+                new_id = self.add_item(int(args['board_id']), args.get('item_name', ''), values, group_id=args.get('group_id') or 'topics')
+            return self._item(self.items[new_id], field.selections)
+        if field.name == 'create_update':
+            item = self._target_item(field)
+            if not item: return None
+            update = {'id': next(self._ids), 'body': args.get('body', ''), 'creator_id': self.me_id, 'created_at': datetime.now(timezone.utc).isoformat()}
+            item['updates'].insert(0, update)
+            return self._update(update, field.selections)
+        if field.name in ('delete_item', 'archive_item'):
+            item = self._target_item(field)
+            if not item: return None
+            result = self._item(item, field.selections)
+            if item['parent_id'] in self.items:
+                self.items[item['parent_id']]['subitems'].remove(item['id'])
+            for sub_id in item['subitems']:
+                self.items.pop(sub_id, None)
+            del self.items[item['id']]
+            return result
+        raise GraphQLError(f"Cannot query field \"{field.name}\" on type \"Mutation\"")
+
+    # --- HTTP --------------------------------------------------------------------
+    def make_app(self):
+        app = Flask('mock_monday')
+
+        @app.route('/v2', methods=['POST'])
+        def graphql():
+            body = request.get_json(silent=True) or {}
+            status, payload, headers = self.handle(body.get('query', ''), body.get('variables'))
+            return jsonify(payload), status, headers
+
+        @app.route('/__stats')
+        def stats():
+            return jsonify(self.snapshot())
+
+        return app
+
+# ==============================================================================
+# MOCK CANVAS
+# ==============================================================================
+def nest_form(form):
+    """Turns canvasapi's 'user[name]' / 'state[]' form keys into nested dicts and lists."""
+    nested = {}
+    for key in form.keys():
+        values = form.getlist(key)
+        parts = re.findall(r'[^\[\]]+|\[\]', key)
+        target = nested
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        last = parts[-1] if parts else key
+        if key.endswith('[]'):
+            container = nested
+            for part in parts[:-2]:
+                container = container.setdefault(part, {})
+            container[parts[-2]] = values
+        else:
+            target[last] = values[-1]
+    return nested
+
+
+class MockCanvas:
+    """In-memory Canvas account with a per-token leaky-bucket throttle."""
+
+    def __init__(self, latency_ms=0, jitter_ms=0, bucket_size=700.0, leak_per_second=10.0, request_cost=1.0, preflight_cost=50.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.bucket_size = bucket_size
+        self.leak_per_second = leak_per_second
+        self.request_cost = request_cost
+        self.preflight_cost = preflight_cost
+        self.lock = threading.RLock()
+        self.users = {}
+        self.logins = {}
+        self.courses = {}
+        self.sections = {}
+        self.enrollments = {}
+        self.reports = {}
+        self.accounts = {1: {'id': 1, 'name': 'Root Account', 'parent_account_id': None}}
+        self._ids = itertools.count(100_000)
+        self._buckets = defaultdict(lambda: [0.0, time.monotonic()])  # token -> [used, last_leak]
+        self.reset_stats()
+
+    # --- Seeding -----------------------------------------------------------------
+    def add_account(self, account_id, name=None):
+        self.accounts[int(account_id)] = {'id': int(account_id), 'name': name or f"Account {account_id}", 'parent_account_id': 1}
+        return int(account_id)
+
+    def add_user(self, name, login_id, sis_user_id=None, user_id=None, email=None):
+        user_id = int(user_id) if user_id else next(self._ids)
+        self.users[user_id] = {'id': user_id, 'name': name, 'sortable_name': name, 'short_name': name,
+                               'login_id': login_id, 'sis_user_id': sis_user_id, 'email': email or login_id}
+        login_id_num = next(self._ids)
+        self.logins[login_id_num] = {'id': login_id_num, 'user_id': user_id, 'account_id': 1, 'unique_id': login_id, 'sis_user_id': sis_user_id}
+        return user_id
+
+    def add_course(self, name, course_id=None, sis_course_id=None, term_id=None, account_id=1):
+        course_id = int(course_id) if course_id else next(self._ids)
+        self.courses[course_id] = {'id': course_id, 'name': name, 'course_code': name, 'sis_course_id': sis_course_id,
+                                   'enrollment_term_id': term_id, 'account_id': int(account_id), 'workflow_state': 'available'}
+        self.add_section(course_id, name, default=True)
+        return course_id
+
+    def add_section(self, course_id, name, default=False):
+        section_id = next(self._ids)
+        self.sections[section_id] = {'id': section_id, 'name': name, 'course_id': int(course_id), 'default_section': default}
+        return section_id
+
+    def add_enrollment(self, course_id, user_id, enrollment_type='StudentEnrollment', section_id=None, state='active'):
+        section_id = section_id or next(s for s, sec in self.sections.items() if sec['course_id'] == int(course_id) and sec['default_section'])
+        enrollment_id = next(self._ids)
+        user = self.users[int(user_id)]
+        self.enrollments[enrollment_id] = {
+            'id': enrollment_id, 'course_id': int(course_id), 'course_section_id': int(section_id), 'user_id': int(user_id),
+            'type': enrollment_type, 'role': enrollment_type, 'enrollment_state': state,
+            'user': {'id': user['id'], 'name': user['name'], 'login_id': user['login_id'], 'sis_user_id': user['sis_user_id']},
+        }
+        return enrollment_id
+
+    # --- Stats -------------------------------------------------------------------
+    def reset_stats(self):
+        """Clears the counters and refills every throttle bucket."""
+        with self.lock:
+            self.stats = Counter()
+            self.operations = Counter()
+            self._buckets.clear()
+
+    def snapshot(self):
+        with self.lock:
+            return {**self.stats, 'operations': dict(self.operations)}
+
+    # --- Throttle ----------------------------------------------------------------
+    def _bucket(self, token):
+        bucket = self._buckets[token]
+        now = time.monotonic()
+        bucket[0] = max(0.0, bucket[0] - (now - bucket[1]) * self.leak_per_second)
+        bucket[1] = now
+        return bucket
+
+    def _charge_preflight(self, token):
+        with self.lock:
+            bucket = self._bucket(token)
+            if bucket[0] + self.preflight_cost > self.bucket_size:
+                self.stats['throttled'] += 1
+                return None
+            bucket[0] += self.preflight_cost
+            return self.bucket_size - bucket[0]
+
+    def _settle(self, token):
+        with self.lock:
+            bucket = self._bucket(token)
+            bucket[0] = max(0.0, bucket[0] - self.preflight_cost + self.request_cost)
+            return self.bucket_size - bucket[0]
+
+    # --- Lookups -----------------------------------------------------------------
+    def find_user(self, ref):
+        ref = str(ref)
+        if ref.isdigit():
+            return self.users.get(int(ref))
+        id_type, _, value = ref.partition(':')
+        key = {'login_id': 'login_id', 'sis_user_id': 'sis_user_id'}.get(id_type)
+        return next((u for u in self.users.values() if key and str(u.get(key) or '').lower() == value.lower()), None)
+
+    def find_course(self, ref):
+        ref = str(ref)
+        if ref.isdigit():
+            return self.courses.get(int(ref))
+        if ref.startswith('sis_course_id:'):
+            return next((c for c in self.courses.values() if c['sis_course_id'] == ref.split(':', 1)[1]), None)
+        return None
+
+    # --- Reports -----------------------------------------------------------------
+    def provisioning_report(self, account_id, term_id=None):
+        """A provisioning_csv zip of the account's courses in the term (every course for the root account)."""
+        with self.lock:
+            root = int(account_id) == 1
+            courses = {c['id'] for c in self.courses.values()
+                       if (root or c['account_id'] == int(account_id)) and (not term_id or str(c['enrollment_term_id']) == str(term_id))}
+            enrollments = [e for e in self.enrollments.values() if e['course_id'] in courses]
+            user_ids = set(self.users) if root else {e['user_id'] for e in enrollments}
+            files = {
+                'users.csv': (['canvas_user_id', 'user_id', 'login_id', 'full_name', 'email', 'status'],
+                              [[u['id'], u['sis_user_id'] or '', u['login_id'], u['name'], u['email'] or '', 'active'] for i, u in self.users.items() if i in user_ids]),
+                'sections.csv': (['canvas_section_id', 'section_id', 'canvas_course_id', 'course_id', 'name', 'status'],
+                                 [[s['id'], '', s['course_id'], '', s['name'], 'active'] for s in self.sections.values() if s['course_id'] in courses]),
+                'enrollments.csv': (['canvas_course_id', 'course_id', 'canvas_user_id', 'user_id', 'role', 'canvas_section_id', 'section_id', 'status', 'base_role_type'],
+                                    [[e['course_id'], '', e['user_id'], e['user']['sis_user_id'] or '', e['type'].replace('Enrollment', '').lower(),
+                                      e['course_section_id'], '', e['enrollment_state'], e['type']] for e in enrollments]),
+            }
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zipped:
+            for name, (header, rows) in files.items():
+                text = io.StringIO()
+                writer = csv.writer(text)
+                writer.writerow(header)
+                writer.writerows(rows)
+                zipped.writestr(name, text.getvalue())
+        return archive.getvalue()
+
+    # --- HTTP --------------------------------------------------------------------
+    def make_app(self):
+        app = Flask('mock_canvas')
+        mock = self
+
+        def params():
+            merged = nest_form(request.args)
+            merged.update(nest_form(request.form))
+            merged.update(request.get_json(silent=True) or {})
+            return merged
+
+        def paginate(results):
+            per_page = min(int(request.args.get('per_page', 10)), 100)
+            page = int(request.args.get('page', 1))
+            chunk = results[(page - 1) * per_page:page * per_page]
+            query = [(k, v) for k in request.args.keys() for v in request.args.getlist(k) if k != 'page']
+            links = [f'<{request.base_url}?{urlencode(query + [("page", page)])}>; rel="current"',
+                     f'<{request.base_url}?{urlencode(query + [("page", 1)])}>; rel="first"']
+            if page * per_page < len(results):
+                links.append(f'<{request.base_url}?{urlencode(query + [("page", page + 1)])}>; rel="next"')
+            return jsonify(chunk), 200, {'Link': ', '.join(links)}
+
+        def not_found(what):
+            return jsonify({'errors': [{'message': f'The specified resource does not exist: {what}'}]}), 404
+
+        @app.before_request
+        def throttle():
+            if request.path.startswith('/__'):
+                return None
+            token = request.headers.get('Authorization', '')
+            request.canvas_token = token
+            remaining = mock._charge_preflight(token)
+            with mock.lock:
+                mock.stats['requests'] += 1
+                mock.operations[f"{request.method} {request.url_rule.rule if request.url_rule else request.path}"] += 1
+            if remaining is None:
+                return '403 Forbidden (Rate Limit Exceeded)', 403, {'X-Rate-Limit-Remaining': '0'}
+            if mock.latency_ms:
+                time.sleep(max(0, mock.latency_ms + random.uniform(-mock.jitter_ms, mock.jitter_ms)) / 1000)
+            return None
+
+        @app.after_request
+        def settle(response):
+            if getattr(request, 'canvas_token', None) is not None and response.status_code != 403:
+                response.headers['X-Rate-Limit-Remaining'] = f"{mock._settle(request.canvas_token):.1f}"
+                response.headers['X-Request-Cost'] = f"{mock.request_cost:.1f}"
+            return response
+
+        @app.route('/__stats')
+        def stats():
+            return jsonify(mock.snapshot())
+
+        @app.route('/api/v1/accounts/<int:account_id>')
+        def get_account(account_id):
+            return jsonify(mock.accounts.get(account_id) or {'id': account_id, 'name': f"Account {account_id}"})
+
+        @app.route('/api/v1/accounts/<int:account_id>/users', methods=['GET', 'POST'])
+        def account_users(account_id):
+            if request.method == 'GET':
+                term = (request.args.get('search_term') or '').lower()
+                with mock.lock:
+                    found = [u for u in mock.users.values() if term in u['name'].lower() or term in (u['login_id'] or '').lower() or term in (u['email'] or '').lower()]
+                return paginate(found)
+            body = params()
+            pseudonym, user = body.get('pseudonym', {}), body.get('user', {})
+            with mock.lock:
+                unique_id = pseudonym.get('unique_id')
+                if unique_id and mock.find_user(f"login_id:{unique_id}"):
+                    return jsonify({'errors': {'pseudonym': {'unique_id': [{'attribute': 'unique_id', 'type': 'taken', 'message': 'ID already in use for this account and authentication provider'}]}}}), 400
+                sis_id = pseudonym.get('sis_user_id')
+                if sis_id and mock.find_user(f"sis_user_id:{sis_id}"):
+                    return jsonify({'errors': {'pseudonym': {'sis_user_id': [{'attribute': 'sis_user_id', 'type': 'taken', 'message': f'SIS ID "{sis_id}" is already in use'}]}}}), 400
+                user_id = mock.add_user(user.get('name', unique_id), unique_id, sis_id)
+                return jsonify(mock.users[user_id])
+
+        @app.route('/api/v1/accounts/<int:account_id>/courses', methods=['GET', 'POST'])
+        def account_courses(account_id):
+            if request.method == 'GET':
+                term = request.args.get('enrollment_term_id')
+                with mock.lock:
+                    found = [c for c in mock.courses.values() if not term or str(c['enrollment_term_id']) == term]
+                return paginate(found)
+            course = params().get('course', {})
+            with mock.lock:
+                sis_id = course.get('sis_course_id')
+                if sis_id and mock.find_course(f"sis_course_id:{sis_id}"):
+                    return jsonify({'errors': {'sis_source_id': [{'attribute': 'sis_source_id', 'type': 'taken', 'message': f'SIS ID "{sis_id}" is already in use'}]}}), 400
+                course_id = mock.add_course(course.get('name', ''), sis_course_id=sis_id, term_id=course.get('enrollment_term_id'), account_id=account_id)
+                return jsonify(mock.courses[course_id])
+
+        @app.route('/api/v1/accounts/<int:account_id>/reports/<report_type>', methods=['POST'])
+        def create_report(account_id, report_type):
+            parameters = params().get('parameters', {})
+            with mock.lock:
+                report_id = next(mock._ids)
+                mock.reports[report_id] = {'id': report_id, 'report': report_type, 'status': 'running', 'progress': 0,
+                                           'parameters': parameters, 'account_id': account_id, 'file': None}
+                return jsonify({k: v for k, v in mock.reports[report_id].items() if k != 'file'})
+
+        @app.route('/api/v1/accounts/<int:account_id>/reports/<report_type>/<int:report_id>')
+        def get_report(account_id, report_type, report_id):
+            report = mock.reports.get(report_id)
+            if not report:
+                return not_found(f"report {report_id}")
+            if report['status'] == 'running' and report['report'] == 'provisioning_csv':
+                # Built on the second poll, so the file reflects the mock's state at that moment
+                report['file'] = mock.provisioning_report(account_id, report['parameters'].get('enrollment_term_id'))
+                report.update(status='complete', progress=100,
+                              attachment={'id': report_id, 'filename': 'provisioning.zip', 'url': f"{request.host_url}files/{report_id}/download"})
+            elif report['status'] == 'running':
+                report.update(status='error')
+            return jsonify({k: v for k, v in report.items() if k != 'file'})
+
+        @app.route('/files/<int:report_id>/download')
+        def download_report(report_id):
+            report = mock.reports.get(report_id)
+            if not report or report['file'] is None:
+                return not_found(f"file {report_id}")
+            return Response(report['file'], mimetype='application/zip')
+
+        @app.route('/api/v1/accounts/<int:account_id>/logins/<int:login_id>', methods=['PUT'])
+        def edit_login(account_id, login_id):
+            login = params().get('login', {})
+            with mock.lock:
+                record = mock.logins.get(login_id)
+                if not record:
+                    return not_found(f"login {login_id}")
+                if 'sis_user_id' in login:
+                    record['sis_user_id'] = login['sis_user_id']
+                    mock.users[record['user_id']]['sis_user_id'] = login['sis_user_id']
+                return jsonify(record)
+
+        @app.route('/api/v1/users/<user_ref>')
+        def get_user(user_ref):
+            with mock.lock:
+                user = mock.find_user(user_ref)
+            return jsonify(user) if user else not_found(f"user {user_ref}")
+
+        @app.route('/api/v1/users/<user_ref>/logins')
+        def user_logins(user_ref):
+            with mock.lock:
+                user = mock.find_user(user_ref)
+                found = [l for l in mock.logins.values() if user and l['user_id'] == user['id']]
+            return paginate(found) if user else not_found(f"user {user_ref}")
+
+        def filter_enrollments(enrollments):
+            types = set(request.args.getlist('type[]') or request.args.getlist('type'))
+            states = set(request.args.getlist('state[]') or request.args.getlist('state')) or {'active', 'invited'}
+            user_id = request.args.get('user_id')
+            return [e for e in enrollments
+                    if (not types or e['type'] in types) and e['enrollment_state'] in states
+                    and (not user_id or str(e['user_id']) == str(user_id))]
+
+        @app.route('/api/v1/users/<user_ref>/enrollments')
+        def user_enrollments(user_ref):
+            with mock.lock:
+                user = mock.find_user(user_ref)
+                if not user:
+                    return not_found(f"user {user_ref}")
+                found = filter_enrollments([e for e in mock.enrollments.values() if e['user_id'] == user['id']])
+            return paginate(found)
+
+        @app.route('/api/v1/courses/<course_ref>')
+        def get_course(course_ref):
+            with mock.lock:
+                course = mock.find_course(course_ref)
+            return jsonify(course) if course else not_found(f"course {course_ref}")
+
+        @app.route('/api/v1/courses/<course_ref>/sections', methods=['GET', 'POST'])
+        def course_sections(course_ref):
+            with mock.lock:
+                course = mock.find_course(course_ref)
+                if not course:
+                    return not_found(f"course {course_ref}")
+                if request.method == 'POST':
+                    section_id = mock.add_section(course['id'], params().get('course_section', {}).get('name', 'Section'))
+                    return jsonify(mock.sections[section_id])
+                found = [s for s in mock.sections.values() if s['course_id'] == course['id']]
+            return paginate(found)
+
+        @app.route('/api/v1/sections/<int:section_id>')
+        def get_section(section_id):
+            section = mock.sections.get(section_id)
+            return jsonify(section) if section else not_found(f"section {section_id}")
+
+        @app.route('/api/v1/courses/<course_ref>/enrollments', methods=['GET', 'POST'])
+        def course_enrollments(course_ref):
+            with mock.lock:
+                course = mock.find_course(course_ref)
+                if not course:
+                    return not_found(f"course {course_ref}")
+                if request.method == 'GET':
+                    found = filter_enrollments([e for e in mock.enrollments.values() if e['course_id'] == course['id']])
+                    return paginate(found)
+                enrollment = params().get('enrollment', {})
+                user = mock.find_user(enrollment.get('user_id'))
+                if not user:
+                    return not_found(f"user {enrollment.get('user_id')}")
+                section_id = int(enrollment.get('course_section_id') or next(s for s, sec in mock.sections.items() if sec['course_id'] == course['id'] and sec['default_section']))
+                enrollment_type = enrollment.get('type', 'StudentEnrollment')
+                # Canvas answers a repeat enrollment with the existing record rather than an error.
+                existing = next((e for e in mock.enrollments.values() if e['course_id'] == course['id'] and e['user_id'] == user['id']
+                                 and e['course_section_id'] == section_id and e['type'] == enrollment_type and e['enrollment_state'] in ('active', 'invited')), None)
+                if existing:
+                    return jsonify(existing)
+                state = enrollment.get('enrollment_state') or 'invited'
+                enrollment_id = mock.add_enrollment(course['id'], user['id'], enrollment_type, section_id, state)
+                return jsonify(mock.enrollments[enrollment_id])
+
+        @app.route('/api/v1/courses/<course_ref>/enrollments/<int:enrollment_id>', methods=['DELETE'])
+        def conclude_enrollment(course_ref, enrollment_id):
+            with mock.lock:
+                enrollment = mock.enrollments.get(enrollment_id)
+                if not enrollment:
+                    return not_found(f"enrollment {enrollment_id}")
+                enrollment['enrollment_state'] = 'deleted' if request.values.get('task') == 'delete' else 'completed'
+                return jsonify(enrollment)
+
+        @app.route('/api/v1/courses/<course_ref>/enrollments/<int:enrollment_id>/accept', methods=['POST'])
+        def accept_enrollment(course_ref, enrollment_id):
+            with mock.lock:
+                enrollment = mock.enrollments.get(enrollment_id)
+                if not enrollment:
+                    return not_found(f"enrollment {enrollment_id}")
+                enrollment['enrollment_state'] = 'active'
+            return jsonify({'success': True})
+
+        return app
+
+# ==============================================================================
+# SERVER HELPERS
+# ==============================================================================
+class ServerThread(threading.Thread):
+    """Runs a Flask app on a threaded werkzeug server in the background."""
+
+    def __init__(self, app, host='127.0.0.1', port=0):
+        super().__init__(daemon=True)
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        self.server = make_server(host, port, app, threaded=True)
+        self.port = self.server.server_port
+        self.url = f"http://{host}:{self.port}"
+
+    def run(self):
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.shutdown()
+
+
+def start_servers(monday, canvas, monday_port=0, canvas_port=0):
+    """Starts both mocks and returns (monday_thread, canvas_thread)."""
+    monday_thread, canvas_thread = ServerThread(monday.make_app(), port=monday_port), ServerThread(canvas.make_app(), port=canvas_port)
+    monday_thread.start()
+    canvas_thread.start()
+    return monday_thread, canvas_thread
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run the mock Monday.com and Canvas servers.")
+    parser.add_argument('--monday-port', type=int, default=8901)
+    parser.add_argument('--canvas-port', type=int, default=8902)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--jitter-ms', type=float, default=0)
+    args = parser.parse_args()
+
+    monday_mock = MockMonday(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms)
+    canvas_mock = MockCanvas(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms)
+    monday_server, canvas_server = start_servers(monday_mock, canvas_mock, args.monday_port, args.canvas_port)
+    print(f"Mock Monday.com GraphQL: {monday_server.url}/v2")
+    print(f"Mock Canvas REST:        {canvas_server.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
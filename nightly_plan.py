@@ -0,0 +1,449 @@
+# nightly_plan.py
+#
+# Description:
+# Plan/apply mode for nightly_sync.py. The per-student run reads and writes as it goes,
+# and DRY_RUN still makes every one of those reads serially. This mode splits the run
+# into two stages:
+# - `python nightly_sync.py --plan plan.json` reads the boards and Canvas in bulk and
+#   works out what phases 0-2 would change for the selected students: PLP connect-column
+#   links from the HS Roster, Canvas enrollments and study hall section moves (diffed for
+#   every student at once in enrollment_matrix.py), the PLP people columns, and the
+#   curriculum/staff log updates. It writes that diff to the plan file and makes no writes
+#   of its own, so it is the dry run.
+# - `python nightly_sync.py --apply plan.json` executes only the plan's operations:
+#   one connect-column write per PLP item, people columns and log updates through
+#   MondayMutationBuffer, and Canvas changes grouped by course with each missing section
+#   created once. Students whose operations all succeeded are marked as synced.
+# The Canvas teacher/TA sync and the reconciliation pass still run after --apply as
+# they do after a normal run.
+#
+# Required Python packages:
+# canvasapi, mysql-connector-python, numpy (see requirements.txt)
+
+import json
+import unicodedata
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+
+import numpy as np
+from canvasapi.enrollment import Enrollment
+from canvasapi.exceptions import CanvasException, Conflict
+
+from enrollment_matrix import as_columns, diff_enrollments
+from nightly_sync import (
+    ALL_COURSES_SECONDARY_CATEGORY_COLUMN_ID, ALL_COURSES_TO_CANVAS_CONNECT_COLUMN_ID, ALL_SPECIAL_COURSES,
+    CANVAS_COURSE_ID_COLUMN_ID, HS_ROSTER_CONNECT_ALL_COURSES_COLUMN_ID, HS_ROSTER_SUBITEM_DROPDOWN_COLUMN_ID,
+    HS_ROSTER_SUBITEM_TERM_COLUMN_ID, HS_ROSTER_TRACK_COLUMN_ID, MASTER_STUDENT_CANVAS_ID_COLUMN, MASTER_STUDENT_EMAIL_COLUMN,
+    MASTER_STUDENT_GRADE_COLUMN_ID, MASTER_STUDENT_M_SERIES_COLUMN_ID, MASTER_STUDENT_PEOPLE_COLUMN_MAPPINGS, MASTER_STUDENT_SSID_COLUMN,
+    MASTER_STUDENT_TOR_COLUMN_ID, MondayMutationBuffer, PLP_BOARD_ID, PLP_CATEGORY_TO_CONNECT_COLUMN_MAP, PLP_PEOPLE_COLUMNS_MAP,
+    PLP_TO_HS_ROSTER_CONNECT_COLUMN, PLP_TO_MASTER_STUDENT_CONNECT_COLUMN, ROSTER_AND_CREDIT_COURSES, SPECIAL_COURSE_CANVAS_IDS,
+    SYNCED_UPDATE_QUERY, apply_connect_column_changes, fetch_items_by_ids, fetch_subitems_by_parent, find_canvas_user,
+    find_or_create_canvas_user, get_hs_roster_course_categories, get_hs_roster_course_tracks, get_linked_ids_from_connect_column_value,
+    get_logged_items_from_update_list, get_people_column_write_value, get_people_ids_from_value, get_plp_columns_for_hs_courses,
+    initialize_canvas_api, is_high_school_student, is_middle_or_high_school, resolve_users, section_name_for_class,
+)
+
+PLAN_VERSION = 1
+# Subitems are read with their updates for the log diff, so fewer parents fit in one request
+LOG_READ_PARENTS_PER_REQUEST = 25
+
+
+# ==============================================================================
+# PLAN
+# ==============================================================================
+def get_plp_people_targets():
+    """{source column on Master Student: (PLP column, PLP column type)} from MASTER_STUDENT_PEOPLE_COLUMN_MAPPINGS."""
+    targets = {}
+    for source_col_id, mapping in MASTER_STUDENT_PEOPLE_COLUMN_MAPPINGS.items():
+        target = next((t for t in mapping.get("targets", []) if str(t.get("board_id")) == str(PLP_BOARD_ID)), None)
+        if target and target.get("target_column_id"):
+            targets[source_col_id] = (target["target_column_id"], target.get("target_column_type"))
+    return targets
+
+def get_ordered_people_ids(value):
+    """Person IDs in column order, since a single-person column takes the first one."""
+    try: parsed = json.loads(value) if isinstance(value, str) else value or {}
+    except json.JSONDecodeError: return []
+    return [p['id'] for p in parsed.get('personsAndTeams', []) if 'id' in p and p.get('kind') == 'person']
+
+def get_student_details(plp_item_id, master_id, master):
+    """The get_student_details_from_plp dict, built from an already-read Master Student item."""
+    cols = master['columns']
+    raw_email = cols.get(MASTER_STUDENT_EMAIL_COLUMN, {}).get('text')
+    if not master.get('name') or not raw_email:
+        print(f"  SKIPPING: Master Student item {master_id} is missing a name or email address.")
+        return None
+    return {'name': master['name'], 'ssid': cols.get(MASTER_STUDENT_SSID_COLUMN, {}).get('text') or '',
+            'email': unicodedata.normalize('NFKC', raw_email).strip(), 'canvas_id': cols.get(MASTER_STUDENT_CANVAS_ID_COLUMN, {}).get('text') or '',
+            'master_id': str(master_id), 'plp_id': plp_item_id, 'grade_text': cols.get(MASTER_STUDENT_GRADE_COLUMN_ID, {}).get('text') or ''}
+
+def read_canvas_courses(canvas_course_ids):
+    """Returns {course_id: {'sections': {name.lower(): (name, id)}, 'students': {user_id: [(section_id, enrollment_id, state)]}}} and roster keys."""
+    canvas_api = initialize_canvas_api()
+    courses = {}
+    user_ids_by_key = {}
+    if not canvas_api: return courses, user_ids_by_key
+    for canvas_course_id in sorted(canvas_course_ids):
+        try:
+            course = canvas_api.get_course(canvas_course_id)
+            sections = {section.name.lower(): (section.name, section.id) for section in course.get_sections()}
+            students = defaultdict(list)
+            for enrollment in course.get_enrollments(type=['StudentEnrollment'], per_page=100):
+                students[enrollment.user_id].append((enrollment.course_section_id, enrollment.id, enrollment.enrollment_state))
+                user = getattr(enrollment, 'user', {}) or {}
+                for key in (user.get('login_id'), user.get('sis_user_id')):
+                    if key: user_ids_by_key[str(key).lower()] = enrollment.user_id
+        except CanvasException as e:
+            print(f"WARNING: Could not read Canvas course {canvas_course_id}: {e}. Its enrollments will be checked at apply time.")
+            continue
+        courses[canvas_course_id] = {'sections': sections, 'students': students}
+    return courses, user_ids_by_key
+
+def get_cached_canvas_ids(cursor, plp_item_ids):
+    if cursor is None or not plp_item_ids: return {}
+    cursor.execute("SELECT student_id, canvas_id FROM processed_students WHERE canvas_id IS NOT NULL")
+    wanted = set(plp_item_ids)
+    return {int(row[0]): row[1] for row in cursor.fetchall() if int(row[0]) in wanted and row[1]}
+
+def build_nightly_plan(items_to_process, cursor=None):
+    """Reads everything phases 0-2 need in bulk and returns the plan (a JSON-ready dict). Makes no writes."""
+    plp_item_ids = sorted(int(item['id']) for item in items_to_process)
+    category_columns = {column_id: category for category, column_id in PLP_CATEGORY_TO_CONNECT_COLUMN_MAP.items() if column_id}
+    people_targets = get_plp_people_targets()
+
+    print(f"PLAN: Reading {len(plp_item_ids)} PLP items...")
+    plp_columns = [PLP_TO_MASTER_STUDENT_CONNECT_COLUMN, PLP_TO_HS_ROSTER_CONNECT_COLUMN, *category_columns, *(t[0] for t in people_targets.values()), *PLP_PEOPLE_COLUMNS_MAP.values()]
+    plp_items = fetch_items_by_ids(plp_item_ids, [c for c in plp_columns if c])
+    plp_to_master, plp_to_hs, current_links = {}, {}, {}
+    for plp_item_id, item in plp_items.items():
+        cols = item['columns']
+        master_ids = get_linked_ids_from_connect_column_value(cols.get(PLP_TO_MASTER_STUDENT_CONNECT_COLUMN, {}).get('value'))
+        hs_ids = get_linked_ids_from_connect_column_value(cols.get(PLP_TO_HS_ROSTER_CONNECT_COLUMN, {}).get('value'))
+        if master_ids: plp_to_master[plp_item_id] = list(master_ids)[0]
+        if hs_ids: plp_to_hs[plp_item_id] = list(hs_ids)[0]
+        current_links[plp_item_id] = {col_id: get_linked_ids_from_connect_column_value(cols.get(col_id, {}).get('value')) for col_id in category_columns}
+
+    print(f"PLAN: Reading {len(set(plp_to_master.values()))} Master Student items and {len(set(plp_to_hs.values()))} HS Rosters...")
+    master_columns = [MASTER_STUDENT_SSID_COLUMN, MASTER_STUDENT_EMAIL_COLUMN, MASTER_STUDENT_CANVAS_ID_COLUMN, MASTER_STUDENT_GRADE_COLUMN_ID,
+                      MASTER_STUDENT_TOR_COLUMN_ID, MASTER_STUDENT_M_SERIES_COLUMN_ID, *people_targets]
+    masters = fetch_items_by_ids(plp_to_master.values(), [c for c in master_columns if c])
+    hs_subitems = fetch_subitems_by_parent(plp_to_hs.values(), [HS_ROSTER_SUBITEM_DROPDOWN_COLUMN_ID, HS_ROSTER_CONNECT_ALL_COURSES_COLUMN_ID,
+                                                                HS_ROSTER_SUBITEM_TERM_COLUMN_ID, HS_ROSTER_TRACK_COLUMN_ID])
+
+    students = {}
+    for plp_item_id, master_id in plp_to_master.items():
+        if master_id not in masters:
+            print(f"  SKIPPING: Could not read Master Student item {master_id} for PLP item {plp_item_id}.")
+            continue
+        details = get_student_details(plp_item_id, master_id, masters[master_id])
+        if details: students[plp_item_id] = details
+
+    # --- Phase 1: HS Roster courses the PLP connect columns are missing ---
+    hs_course_data = {}
+    for plp_item_id, hs_roster_id in plp_to_hs.items():
+        hs_course_data[plp_item_id] = get_hs_roster_course_categories(hs_subitems.get(hs_roster_id, []))
+    hs_course_ids = set().union(*(data.keys() for data in hs_course_data.values())) if hs_course_data else set()
+    linked_course_ids = set().union(*(ids for links in current_links.values() for ids in links.values())) if current_links else set()
+
+    print(f"PLAN: Reading {len(hs_course_ids | linked_course_ids)} course items...")
+    course_items = fetch_items_by_ids(hs_course_ids | linked_course_ids, [ALL_COURSES_SECONDARY_CATEGORY_COLUMN_ID, ALL_COURSES_TO_CANVAS_CONNECT_COLUMN_ID])
+    secondary_category_map = {course_id: item['columns'][ALL_COURSES_SECONDARY_CATEGORY_COLUMN_ID].get('text')
+                              for course_id, item in course_items.items() if ALL_COURSES_SECONDARY_CATEGORY_COLUMN_ID in item['columns']}
+
+    connect_changes = {}
+    desired_links = {plp_item_id: {col_id: set(ids) for col_id, ids in links.items()} for plp_item_id, links in current_links.items()}
+    for plp_item_id, course_data in hs_course_data.items():
+        changes = {}
+        for col_id, course_ids in get_plp_columns_for_hs_courses(course_data, secondary_category_map).items():
+            missing = set(course_ids) - current_links[plp_item_id].get(col_id, set())
+            if missing: changes[col_id] = sorted(missing)
+            desired_links[plp_item_id].setdefault(col_id, set()).update(course_ids)
+        if changes: connect_changes[str(plp_item_id)] = changes
+
+    # Courses phase 1 adds were not in the first read
+    new_course_ids = set().union(*(ids for links in desired_links.values() for ids in links.values())) - set(course_items) if desired_links else set()
+    course_items.update(fetch_items_by_ids(new_course_ids, [ALL_COURSES_TO_CANVAS_CONNECT_COLUMN_ID]))
+    course_to_canvas_item = {}
+    for course_id, item in course_items.items():
+        canvas_item_ids = get_linked_ids_from_connect_column_value(item['columns'].get(ALL_COURSES_TO_CANVAS_CONNECT_COLUMN_ID, {}).get('value'))
+        if canvas_item_ids: course_to_canvas_item[course_id] = list(canvas_item_ids)[0]
+    canvas_items = fetch_items_by_ids(course_to_canvas_item.values(), [CANVAS_COURSE_ID_COLUMN_ID])
+    canvas_course_by_item = {}
+    for canvas_item_id, item in canvas_items.items():
+        text = (item['columns'].get(CANVAS_COURSE_ID_COLUMN_ID, {}).get('text') or '').strip()
+        if text.isdigit(): canvas_course_by_item[canvas_item_id] = int(text)
+
+    tor_ids = {}
+    for plp_item_id, details in students.items():
+        ids = get_people_ids_from_value(masters[plp_to_master[plp_item_id]]['columns'].get(MASTER_STUDENT_TOR_COLUMN_ID, {}).get('value'))
+        if ids: tor_ids[plp_item_id] = list(ids)[0]
+    people_ids = {plp_item_id: {source_col_id: get_ordered_people_ids(masters[plp_to_master[plp_item_id]]['columns'].get(source_col_id, {}).get('value'))
+                                for source_col_id in people_targets} for plp_item_id in students}
+    directory = resolve_users(set(tor_ids.values()) | {uid for cols in people_ids.values() for ids in cols.values() for uid in ids})
+
+    # --- Phases 0 and 2: the sections each student should be in ---
+    # One row per (student, course, section). A move also concludes the student's other sections in that course (study halls).
+    desired_rows = []  # (plp_item_id, canvas_course_id, section name, move, create_user)
+    for plp_item_id, details in students.items():
+        tor_full_name = (directory.get(tor_ids.get(plp_item_id)) or {}).get('name')
+        tor_last_name = tor_full_name.split()[-1] if tor_full_name else "Orientation"
+        jumpstart_canvas_id = SPECIAL_COURSE_CANVAS_IDS.get("Jumpstart")
+        if jumpstart_canvas_id: desired_rows.append((plp_item_id, jumpstart_canvas_id, tor_last_name, True, True))
+        ace_sh_canvas_id = SPECIAL_COURSE_CANVAS_IDS.get("ACE Study Hall")
+        if ace_sh_canvas_id and is_middle_or_high_school(details.get('grade_text')):
+            desired_rows.append((plp_item_id, ace_sh_canvas_id, tor_last_name, True, True))
+
+        class_id_to_category_map = {class_id: category_columns[col_id] for col_id, ids in desired_links.get(plp_item_id, {}).items() for class_id in ids}
+        id_to_name_map = {class_id: course_items[class_id]['name'] for class_id in class_id_to_category_map if class_id in course_items}
+        course_to_track_map = {}
+        if is_high_school_student(details.get('grade_text')) and plp_item_id in plp_to_hs:
+            course_to_track_map = get_hs_roster_course_tracks(hs_subitems.get(plp_to_hs[plp_item_id], []))
+        m_series_text = masters[plp_to_master[plp_item_id]]['columns'].get(MASTER_STUDENT_M_SERIES_COLUMN_ID, {}).get('text')
+        for class_item_id in class_id_to_category_map:
+            canvas_course_id = canvas_course_by_item.get(course_to_canvas_item.get(class_item_id))
+            if not canvas_course_id: continue
+            class_name = id_to_name_map.get(class_item_id, "")
+            if class_item_id in ALL_SPECIAL_COURSES:
+                desired_rows.append((plp_item_id, canvas_course_id, tor_last_name, False, False))  # The per-student run only enrolls existing users in these
+                if class_item_id in ROSTER_AND_CREDIT_COURSES:
+                    desired_rows.append((plp_item_id, canvas_course_id, "2.5 Credits" if "2.5" in class_name else "5 Credits", False, False))
+            else:
+                section_name = section_name_for_class(class_item_id, class_name, details, m_series_text, course_to_track_map, class_id_to_category_map, id_to_name_map)
+                desired_rows.append((plp_item_id, canvas_course_id, section_name, False, True))
+
+    canvas_course_ids = {row[1] for row in desired_rows}
+    print(f"PLAN: Reading sections and student enrollments for {len(canvas_course_ids)} Canvas courses...")
+    canvas_courses, user_ids_by_key = read_canvas_courses(canvas_course_ids)
+    cached_canvas_ids = get_cached_canvas_ids(cursor, list(students))
+    canvas_user_ids = {}
+    for plp_item_id, details in students.items():
+        user_id = None
+        for candidate in (cached_canvas_ids.get(plp_item_id), details.get('canvas_id')):
+            if candidate and str(candidate).strip().isdigit():
+                user_id = int(str(candidate).strip())
+                break
+        for key in (details.get('email'), details.get('ssid')):
+            if not user_id and key: user_id = user_ids_by_key.get(str(key).lower())
+        canvas_user_ids[plp_item_id] = user_id
+
+    first_rows = {}
+    for row in desired_rows: first_rows.setdefault((row[0], row[1]), row)
+    move_pairs = {(row[0], row[1]) for row in desired_rows if row[3]}
+    plp_by_user_id = {user_id: plp_item_id for plp_item_id, user_id in canvas_user_ids.items() if user_id}
+    actual_rows = []  # (plp_item_id, canvas_course_id, section name, enrollment_id)
+    for canvas_course_id, course in canvas_courses.items():
+        section_names_by_id = {section_id: name for name, section_id in course['sections'].values()}
+        for user_id, rows in course['students'].items():
+            pair = (plp_by_user_id.get(user_id), canvas_course_id)
+            if pair not in first_rows: continue
+            for section_id, enrollment_id, state in rows:
+                # Study hall moves accept any existing enrollment in the section; other classes need it active
+                if pair in move_pairs or state == 'active':
+                    actual_rows.append((*pair, section_names_by_id.get(section_id, f"Section {section_id}"), enrollment_id))
+    to_create, to_conclude, section_moves = diff_enrollments(as_columns(desired_rows, 5)[:4], as_columns(actual_rows, 4)[:3])
+    print(f"PLAN: {len(desired_rows)} desired and {len(actual_rows)} current memberships: {len(to_create)} to create, {int(to_conclude.sum())} to conclude, {section_moves} section moves.")
+
+    concludes = defaultdict(list)
+    for i in np.flatnonzero(to_conclude).tolist():
+        plp_item_id, canvas_course_id, _, enrollment_id = actual_rows[i]
+        concludes[(plp_item_id, canvas_course_id)].append(enrollment_id)
+    course_ops = defaultdict(lambda: defaultdict(list))
+    for i in to_create.tolist():
+        plp_item_id, canvas_course_id, section_name, _, create_user = desired_rows[i]
+        course_ops[canvas_course_id][section_name].append({'plp_id': plp_item_id, 'user_id': canvas_user_ids.get(plp_item_id), 'create_user': create_user,
+                                                           'enroll': True, 'conclude': sorted(concludes.pop((plp_item_id, canvas_course_id), []))})
+    for (plp_item_id, canvas_course_id), enrollment_ids in concludes.items():  # Already in the right section, but also in others
+        _, _, section_name, _, create_user = first_rows[(plp_item_id, canvas_course_id)]
+        course_ops[canvas_course_id][section_name].append({'plp_id': plp_item_id, 'user_id': canvas_user_ids.get(plp_item_id), 'create_user': create_user,
+                                                           'enroll': False, 'conclude': sorted(enrollment_ids)})
+    enrollments, sections = {}, {}
+    for canvas_course_id, by_section in course_ops.items():
+        known_sections = canvas_courses.get(canvas_course_id, {}).get('sections', {})
+        enrollments[str(canvas_course_id)] = dict(by_section)
+        sections[str(canvas_course_id)] = {name: known_sections.get(name.lower(), (None, None))[1] for name in by_section}
+
+    # --- People columns and the log updates for the state this plan leaves behind ---
+    people_changes = {}
+    desired_staff_names = {}
+    for plp_item_id in students:
+        cols = plp_items[plp_item_id]['columns']
+        changes = {}
+        staff_names = {}
+        for source_col_id, (target_col_id, target_col_type) in people_targets.items():
+            desired_ids = people_ids[plp_item_id][source_col_id]
+            if target_col_type == "person": desired_ids = desired_ids[:1]
+            current_ids = get_people_ids_from_value(cols.get(target_col_id, {}).get('value'))
+            if set(desired_ids) != current_ids:
+                write_value = get_people_column_write_value({'personsAndTeams': [{'id': uid, 'kind': 'person'} for uid in desired_ids]}, target_col_type)
+                if write_value is not None: changes[target_col_id] = write_value
+            staff_names[target_col_id] = {f"'{(directory.get(uid) or {}).get('name', uid)}'" for uid in desired_ids}
+        if changes: people_changes[str(plp_item_id)] = changes
+        for subitem_name, column_id in PLP_PEOPLE_COLUMNS_MAP.items():
+            if column_id not in staff_names:
+                text = cols.get(column_id, {}).get('text') or ''
+                staff_names[column_id] = {f"'{name.strip()}'" for name in text.split(',')} if text else set()
+        desired_staff_names[plp_item_id] = staff_names
+
+    print(f"PLAN: Reading log subitems for {len(students)} PLP items...")
+    log_subitems = fetch_subitems_by_parent(students, with_updates=True, chunk_size=LOG_READ_PARENTS_PER_REQUEST)
+    log_updates = []
+    for plp_item_id in students:
+        subitems_by_name = {sub['name']: sub for sub in log_subitems.get(plp_item_id, [])}
+        expected = []
+        for category, column_id in PLP_CATEGORY_TO_CONNECT_COLUMN_MAP.items():
+            ids = desired_links.get(plp_item_id, {}).get(column_id)
+            if ids:
+                names = {f"'{course_items[i]['name']}'" for i in ids if i in course_items}
+                expected.append((f"{category} Curriculum", names, f"Nightly sync: Current {category} curriculum is now: {{}}."))
+        for subitem_name, column_id in PLP_PEOPLE_COLUMNS_MAP.items():
+            names = desired_staff_names[plp_item_id].get(column_id)
+            if names:
+                expected.append((subitem_name, names, f"Nightly sync: Current {subitem_name.replace(' Assignments', '')} assignment is now: {{}}."))
+        for subitem_name, names, template in expected:
+            subitem = subitems_by_name.get(subitem_name)
+            if subitem and get_logged_items_from_update_list(subitem['updates']) == names: continue
+            log_updates.append({'plp_id': plp_item_id, 'subitem_id': subitem['id'] if subitem else None, 'subitem_name': subitem_name,
+                                'text': template.format(", ".join(sorted(names)) or "Blank")})
+
+    return {
+        'version': PLAN_VERSION, 'created_at': datetime.now(timezone.utc).isoformat(), 'plp_ids': plp_item_ids,
+        'students': {str(plp_item_id): details for plp_item_id, details in students.items()},
+        'canvas_user_ids': {str(plp_item_id): user_id for plp_item_id, user_id in canvas_user_ids.items() if user_id},
+        'connect_changes': connect_changes, 'people_changes': people_changes,
+        'sections': sections, 'enrollments': enrollments, 'log_updates': log_updates,
+    }
+
+def write_plan(plan, path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(plan, f, indent=2, sort_keys=True)
+    print(f"INFO: Wrote plan for {len(plan['plp_ids'])} students to {path}")
+
+def load_plan(path):
+    with open(path, encoding="utf-8") as f:
+        plan = json.load(f)
+    if plan.get('version') != PLAN_VERSION:
+        raise ValueError(f"Plan {path} is version {plan.get('version')}, expected {PLAN_VERSION}. Re-run --plan.")
+    return plan
+
+def print_plan_summary(plan):
+    enrollment_entries = [entry for by_section in plan['enrollments'].values() for entries in by_section.values() for entry in entries]
+    print("\n--- NIGHTLY PLAN ---")
+    print(f"Students: {len(plan['plp_ids'])} ({len(plan['students'])} with complete Master Student details)")
+    print(f"PLP items with new course links: {len(plan['connect_changes'])} ({sum(len(ids) for changes in plan['connect_changes'].values() for ids in changes.values())} links)")
+    print(f"People column writes: {sum(len(changes) for changes in plan['people_changes'].values())}")
+    print(f"Canvas courses to change: {len(plan['enrollments'])}, new sections: {sum(1 for by_name in plan['sections'].values() for section_id in by_name.values() if section_id is None)}")
+    print(f"Enrollments: {sum(1 for entry in enrollment_entries if entry['enroll'])}, concluded enrollments: {sum(len(entry['conclude']) for entry in enrollment_entries)}")
+    print(f"Log updates: {len(plan['log_updates'])}")
+
+
+# ==============================================================================
+# APPLY
+# ==============================================================================
+def resolve_plan_user_id(plp_item_id, entry, plan, db_cursor, user_id_cache):
+    if plp_item_id in user_id_cache: return user_id_cache[plp_item_id]
+    user_id = entry.get('user_id')
+    if not user_id:
+        details = plan['students'][str(plp_item_id)]
+        user = find_or_create_canvas_user(details, db_cursor) if entry.get('create_user') else find_canvas_user(details, db_cursor)
+        user_id = user.id if user else None
+        if user_id and db_cursor:
+            db_cursor.execute("UPDATE processed_students SET canvas_id = %s WHERE student_id = %s", (str(user_id), plp_item_id))
+    user_id_cache[plp_item_id] = user_id
+    return user_id
+
+def apply_canvas_operations(plan, db_cursor, failed, totals):
+    canvas_api = initialize_canvas_api()
+    if not canvas_api:
+        print("ERROR: Canvas API not initialized. Skipping the plan's Canvas operations.")
+        failed.update(int(entry['plp_id']) for by_section in plan['enrollments'].values() for entries in by_section.values() for entry in entries)
+        return
+    requester = canvas_api._Canvas__requester
+    user_id_cache = {}
+    for canvas_course_id, by_section in plan['enrollments'].items():
+        try: course = canvas_api.get_course(int(canvas_course_id))
+        except CanvasException as e:
+            print(f"ERROR: Could not load Canvas course {canvas_course_id}: {e}")
+            failed.update(int(entry['plp_id']) for entries in by_section.values() for entry in entries)
+            continue
+        known_sections = plan['sections'].get(canvas_course_id, {})
+        if any(section_id is None for section_id in known_sections.values()):
+            # Re-read once, in case a section was created since the plan
+            try: known_sections = {**known_sections, **{s.name: s.id for s in course.get_sections() if s.name in known_sections}}
+            except CanvasException: pass
+        print(f"\n--- Canvas course {canvas_course_id}: {sum(len(entries) for entries in by_section.values())} operation(s) ---")
+        for section_name, entries in by_section.items():
+            section_id = known_sections.get(section_name)
+            if section_id is None:
+                try:
+                    section_id = course.create_course_section(course_section={'name': section_name}).id
+                    totals['sections created'] += 1
+                except CanvasException as e:
+                    print(f"  ERROR: Canvas section creation failed for {section_name}: {e}")
+                    failed.update(int(entry['plp_id']) for entry in entries)
+                    continue
+            for entry in entries:
+                plp_item_id = int(entry['plp_id'])
+                try:
+                    for enrollment_id in entry['conclude']:
+                        Enrollment(requester, {'id': enrollment_id, 'course_id': int(canvas_course_id)}).deactivate(task='conclude')
+                        totals['concluded'] += 1
+                    if not entry['enroll']: continue
+                    user_id = resolve_plan_user_id(plp_item_id, entry, plan, db_cursor, user_id_cache)
+                    if not user_id:
+                        print(f"  ERROR: Could not find or create a Canvas user for PLP item {plp_item_id}.")
+                        failed.add(plp_item_id)
+                        continue
+                    course.enroll_user(user_id, 'StudentEnrollment', enrollment={'course_section_id': section_id, 'enrollment_state': 'active', 'notify': False})
+                    totals['enrolled'] += 1
+                except Conflict:
+                    totals['already enrolled'] += 1
+                except CanvasException as e:
+                    print(f"  ERROR: Canvas operation failed for PLP item {plp_item_id} in section '{section_name}': {e}")
+                    failed.add(plp_item_id)
+
+def apply_monday_operations(plan, failed, totals):
+    board_id = int(PLP_BOARD_ID)
+    for plp_item_id, changes in plan['connect_changes'].items():
+        if apply_connect_column_changes(int(plp_item_id), board_id, {col_id: {'add': ids} for col_id, ids in changes.items()}):
+            totals['connect columns'] += len(changes)
+        else:
+            failed.add(int(plp_item_id))
+
+    with MondayMutationBuffer() as mutations:
+        for plp_item_id, changes in plan['people_changes'].items():
+            for col_id, value in changes.items():
+                mutations.change_column_value(board_id, int(plp_item_id), col_id, value, key=('people', plp_item_id, col_id))
+        # Log subitems that don't exist yet are created first, so their updates have somewhere to go
+        for i, log in enumerate(plan['log_updates']):
+            if not log['subitem_id']:
+                mutations.create_subitem(int(log['plp_id']), log['subitem_name'], key=('subitem', i))
+    created = mutations.results
+    for key, result in created.items():
+        if key[0] == 'people':
+            if result: totals['people columns'] += 1
+            else: failed.add(int(key[1]))
+
+    with MondayMutationBuffer() as mutations:
+        for i, log in enumerate(plan['log_updates']):
+            subitem_id = log['subitem_id'] or created.get(('subitem', i))
+            if not subitem_id:
+                failed.add(int(log['plp_id']))
+                continue
+            mutations.create_update(int(subitem_id), log['text'], key=('log', i))
+    for key, result in mutations.results.items():
+        if result: totals['log updates'] += 1
+        else: failed.add(int(plan['log_updates'][key[1]]['plp_id']))
+
+def apply_nightly_plan(plan, db, db_cursor):
+    """Executes the plan's operations and marks each student with no failed operation as synced. Returns the failed PLP IDs."""
+    failed = set()
+    totals = Counter()
+    apply_monday_operations(plan, failed, totals)
+    apply_canvas_operations(plan, db_cursor, failed, totals)
+    synced = [plp_item_id for plp_item_id in plan['plp_ids'] if plp_item_id not in failed]
+    for plp_item_id in synced:
+        db_cursor.execute(SYNCED_UPDATE_QUERY, (plp_item_id,))
+    db.commit()
+    print(f"\nAPPLY: {dict(totals)}")
+    print(f"APPLY: {len(synced)} students synced, {len(failed)} with failed operations (left for the next run).")
+    return failed
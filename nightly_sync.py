@@ -3,16 +3,35 @@
 # NIGHTLY PLP & HS ROSTER SYNC SCRIPT (FINAL, COMPLETE, AND CORRECTED)
 # ==============================================================================
 import os
+import sys
 import json
+import cProfile
 import requests
 import time
+import threading
+import tracemalloc
 from datetime import datetime, timezone
-from collections import defaultdict
+from collections import defaultdict, Counter
+from contextlib import contextmanager
+from urllib.parse import urlparse
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 import mysql.connector
+import redis
 from canvasapi import Canvas
+from canvasapi.course import Course
 from canvasapi.exceptions import CanvasException, Conflict, ResourceDoesNotExist
+from canvasapi.section import Section
+from canvasapi.user import User
 import unicodedata
 import re
+from task_profiler import accumulate_samples, profile_path, top_leaves, write_folded
+from canvas_throttle import CanvasThrottle, CanvasThrottleAdapter
+from board_snapshot import BoardSnapshot
+import json_codec
+from phase_graph import Phase, print_phase_timings, run_phase_graph
+from canvas_reports import CanvasReportError, load_provisioning_index
+from staff_directory import StaffDirectory
 
 # ==============================================================================
 # 1. CENTRALIZED CONFIGURATION
@@ -20,7 +39,27 @@ import re
 MONDAY_API_KEY = os.environ.get("MONDAY_API_KEY")
 CANVAS_API_KEY = os.environ.get("CANVAS_API_KEY")
 CANVAS_API_URL = os.environ.get("CANVAS_API_URL")
-MONDAY_API_URL = "https://api.monday.com/v2"
+MONDAY_API_URL = os.environ.get("MONDAY_API_URL", "https://api.monday.com/v2")
+API_CALL_WARN_THRESHOLD = int(os.environ.get("API_CALL_WARN_THRESHOLD", 0))  # 0 disables the warning
+MONDAY_TRACK_COMPLEXITY = os.environ.get("MONDAY_TRACK_COMPLEXITY", "true").lower() == "true"
+VALKEY_URL = os.environ.get("DATABASE_URL") or os.environ.get("REDIS_URL")  # Shares the Canvas rate limit reading with the webhook workers
+CANVAS_MAX_CONCURRENCY = int(os.environ.get("CANVAS_MAX_CONCURRENCY", 10))
+CANVAS_RATE_LIMIT_REFILL_PER_SECOND = float(os.environ.get("CANVAS_RATE_LIMIT_REFILL_PER_SECOND", 10))
+NIGHTLY_DISTRIBUTED = os.environ.get("NIGHTLY_DISTRIBUTED", "false").lower() == "true"  # Same as --distributed
+NIGHTLY_SHARD_SIZE = int(os.environ.get("NIGHTLY_SHARD_SIZE", 25))  # Students per Celery task in a distributed run
+NIGHTLY_LEASE_SECONDS = int(os.environ.get("NIGHTLY_LEASE_SECONDS", 1800))  # How long a shard may hold one student before another can take it
+MONDAY_READ_CONCURRENCY = int(os.environ.get("MONDAY_READ_CONCURRENCY", 4))  # Parallel items(ids:) chunks per bulk read
+MONDAY_ITEMS_PER_READ = 100  # The most items(ids:) returns in one request
+MONDAY_MUTATION_BATCH_SIZE = int(os.environ.get("MONDAY_MUTATION_BATCH_SIZE", 25))  # Mutations per aliased request
+MONDAY_MAX_IN_FLIGHT = int(os.environ.get("MONDAY_MAX_IN_FLIGHT", 8))  # Monday requests in flight across all phases of the run
+NIGHTLY_PHASE_CONCURRENCY = int(os.environ.get("NIGHTLY_PHASE_CONCURRENCY", 3))  # Independent phases that may run at once
+PROFILE_PHASES = "--profile" in sys.argv or os.environ.get("NIGHTLY_PROFILE", "false").lower() == "true"
+PROFILE_MODE = os.environ.get("PROFILE_MODE", "sample")  # "sample" (collapsed stacks) or "cprofile"
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", 5))
+TRACE_MEMORY = "--trace-memory" in sys.argv or os.environ.get("NIGHTLY_TRACE_MEMORY", "false").lower() == "true"  # tracemalloc current/peak at each stage
+PROVISIONING_REPORT = "--provisioning-report" in sys.argv or os.environ.get("NIGHTLY_PROVISIONING_REPORT", "false").lower() == "true"  # Look up Canvas users/sections/enrollments in the sub-account's provisioning report
+CANVAS_REPORT_POLL_SECONDS = float(os.environ.get("CANVAS_REPORT_POLL_SECONDS", 5))
 DB_HOST = os.environ.get("DB_HOST")
 DB_USER = os.environ.get("DB_USER")
 DB_PASSWORD = os.environ.get("DB_PASSWORD")
@@ -43,6 +82,9 @@ MASTER_STUDENT_CANVAS_ID_COLUMN = "text_mktgs1ax"
 HS_ROSTER_SUBITEM_DROPDOWN_COLUMN_ID = os.environ.get("HS_ROSTER_SUBITEM_DROPDOWN_COLUMN_ID")
 HS_ROSTER_CONNECT_ALL_COURSES_COLUMN_ID = os.environ.get("HS_ROSTER_CONNECT_ALL_COURSES_COLUMN_ID")
 HS_ROSTER_TRACK_COLUMN_ID = "status7"
+HS_ROSTER_SUBITEM_TERM_COLUMN_ID = "color6"
+MASTER_STUDENT_M_SERIES_COLUMN_ID = "status_12__1"
+ALL_COURSES_SECONDARY_CATEGORY_COLUMN_ID = "dropdown_mkq0r2av"
 CANVAS_COURSE_ID_COLUMN_ID = os.environ.get("CANVAS_COURSE_ID_COLUMN_ID")
 ALL_COURSES_TO_CANVAS_CONNECT_COLUMN_ID = os.environ.get("ALL_COURSES_TO_CANVAS_CONNECT_COLUMN_ID")
 ALL_CLASSES_CANVAS_ID_COLUMN = os.environ.get("ALL_CLASSES_CANVAS_ID_COLUMN")
@@ -64,6 +106,8 @@ TA_AIDE_EMAIL = "aide@triviumcharter.org"
 # <<< ADDED FROM app.py: Configuration variables for teacher sync
 ALL_STAFF_EMAIL_COLUMN_ID = os.environ.get("ALL_STAFF_EMAIL_COLUMN_ID")
 ALL_STAFF_SIS_ID_COLUMN_ID = os.environ.get("ALL_STAFF_SIS_ID_COLUMN_ID")
+ALL_STAFF_PERSON_COLUMN_ID = os.environ.get("ALL_STAFF_PERSON_COLUMN_ID")
+STAFF_DIRECTORY_REFRESH_SECONDS = int(os.environ.get("STAFF_DIRECTORY_REFRESH_SECONDS", 3600))
 ALL_STAFF_CANVAS_ID_COLUMN = "text_mktg7h6"
 ALL_STAFF_INTERNAL_ID_COLUMN = "text_mkthjxht"
 
@@ -87,6 +131,138 @@ PLP_PEOPLE_COLUMNS_MAP = {
     "ACE Assignments": "multiple_person_mks1w5fc"
 }
 
+# ==============================================================================
+# API CALL ACCOUNTING (Copied from app.py for standalone use)
+# ==============================================================================
+# Each phase of a student's sync is charged separately. The per-phase totals are
+# printed as "API_USAGE {json}" lines at the end of the run.
+_current_api_usage = contextvars.ContextVar('api_usage', default=None)
+GRAPHQL_SHAPE_RE = re.compile(r'^\s*(query|mutation)?[^{]*\{\s*(?:\w+\s*:\s*)?(\w+)')
+CANVAS_PATH_ID_RE = re.compile(r'/(?:\d+|[a-z_]+:[^/]+)(?=/|$)')
+
+class ApiUsage:
+    """Call counts, latency, complexity, retries and 429s for one task or phase."""
+    def __init__(self, label, parent=None):
+        self.label = label
+        self.parent = parent
+        self.started = time.monotonic()
+        self.duration = 0.0
+        self.invocations = 1
+        self.services = defaultdict(lambda: {'calls': 0, 'total_latency_s': 0.0, 'max_latency_s': 0.0, 'retries': 0, 'rate_limited': 0, 'failed': 0})
+        self.shapes = Counter()
+
+    def record(self, service, shape, latency, retry=False, rate_limited=False, failed=False, complexity=0):
+        stats = self.services[service]
+        stats['calls'] += 1
+        stats['total_latency_s'] += latency
+        stats['max_latency_s'] = max(stats['max_latency_s'], latency)
+        stats['retries'] += int(retry)
+        stats['rate_limited'] += int(rate_limited)
+        stats['failed'] += int(failed)
+        if complexity: stats['complexity'] = stats.get('complexity', 0) + complexity
+        self.shapes[f"{service} {shape}"] += 1
+
+    def merge(self, other):
+        self.invocations += other.invocations
+        self.duration += other.duration
+        for service, other_stats in other.services.items():
+            stats = self.services[service]
+            for key, value in other_stats.items():
+                stats[key] = max(stats.get(key, 0), value) if key == 'max_latency_s' else stats.get(key, 0) + value
+        self.shapes.update(other.shapes)
+
+    @property
+    def total_calls(self):
+        return sum(stats['calls'] for stats in self.services.values())
+
+    def summary(self, top=5):
+        return {
+            'label': self.label, 'invocations': self.invocations, 'duration_s': round(self.duration, 3), 'calls': self.total_calls,
+            **{service: {k: round(v, 3) if isinstance(v, float) else v for k, v in stats.items()} for service, stats in self.services.items()},
+            'top_calls': self.shapes.most_common(top),
+        }
+
+def start_api_usage(label):
+    """Begins charging API calls to a new ApiUsage. Returns the token for finish_api_usage."""
+    return _current_api_usage.set(ApiUsage(label, parent=_current_api_usage.get()))
+
+def finish_api_usage(token, emit=True):
+    """Ends the current ApiUsage, folds it into any enclosing one, and returns it."""
+    usage = _current_api_usage.get()
+    _current_api_usage.reset(token)
+    if usage is None: return None
+    usage.duration = time.monotonic() - usage.started
+    if usage.parent: usage.parent.merge(usage)
+    if emit: print(f"API_USAGE {json.dumps(usage.summary())}")
+    if API_CALL_WARN_THRESHOLD and usage.total_calls > API_CALL_WARN_THRESHOLD:
+        print(f"WARNING: '{usage.label}' made {usage.total_calls} API calls (threshold {API_CALL_WARN_THRESHOLD}). Top calls: {usage.shapes.most_common(3)}")
+    return usage
+
+@contextmanager
+def api_usage(label, emit=True):
+    """Charges the API calls made inside the block to `label`."""
+    token = start_api_usage(label)
+    try: yield _current_api_usage.get()
+    finally: finish_api_usage(token, emit=emit)
+
+PHASE_PROFILES = {}
+
+@contextmanager
+def phase_api_usage(totals, phase):
+    """Charges the block to `phase` and folds it into the run's per-phase totals. With --profile it is also profiled."""
+    usage = None
+    try:
+        with api_usage(phase, emit=False) as usage, phase_profile(phase): yield usage
+    finally:
+        if usage is not None:
+            if phase in totals: totals[phase].merge(usage)
+            else: totals[phase] = usage
+
+@contextmanager
+def phase_profile(phase):
+    """Adds the block to the run's profile for `phase`: stack samples, or cProfile stats with PROFILE_MODE=cprofile."""
+    if not PROFILE_PHASES:
+        yield
+    elif PROFILE_MODE == "cprofile":
+        profiler = PHASE_PROFILES.setdefault(phase, cProfile.Profile())
+        profiler.enable()
+        try: yield
+        finally: profiler.disable()
+    else:
+        with accumulate_samples(PHASE_PROFILES.setdefault(phase, Counter()), PROFILE_INTERVAL_MS / 1000): yield
+
+def write_phase_profiles(run_tag):
+    for phase, profile in PHASE_PROFILES.items():
+        if isinstance(profile, Counter):
+            path = profile_path(PROFILE_DIR, f"nightly.{phase}", run_tag, "folded")
+            write_folded(profile, path)
+            print(f"INFO: Wrote {sum(profile.values())} stack samples for {phase} to {path}. Top frames: {top_leaves(profile)}")
+        else:
+            path = profile_path(PROFILE_DIR, f"nightly.{phase}", run_tag, "pstats")
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            profile.dump_stats(path)
+            print(f"INFO: Wrote cProfile stats for {phase} to {path}")
+
+def record_api_call(service, shape, latency, **kwargs):
+    usage = _current_api_usage.get()
+    if usage is not None: usage.record(service, shape, latency, **kwargs)
+
+def graphql_shape(query):
+    """'mutation change_multiple_column_values' for a query string; aliases are ignored."""
+    match = GRAPHQL_SHAPE_RE.match(query)
+    return f"{match.group(1) or 'query'} {match.group(2)}" if match else "unknown"
+
+def with_complexity_field(query):
+    """Asks Monday to report the query's complexity cost alongside its data."""
+    return query.replace("{", "{ complexity { query } ", 1)
+
+def record_canvas_response(response, *args, **kwargs):
+    """requests response hook for the canvasapi session."""
+    path = CANVAS_PATH_ID_RE.sub('/:id', urlparse(response.request.url).path.replace('/api/v1', '', 1))
+    rate_limited = response.status_code == 429 or (response.status_code == 403 and 'rate limit' in response.text.lower())
+    record_api_call('canvas', f"{response.request.method} {path}", response.elapsed.total_seconds(),
+                    rate_limited=rate_limited, failed=response.status_code >= 500)
+
 # ==============================================================================
 # 2. MONDAY.COM & CANVAS UTILITIES (ALL DEFINED FIRST)
 # ==============================================================================
@@ -125,16 +301,146 @@ def create_monday_update(item_id, update_text):
     mutation = f'mutation {{ create_update (item_id: {item_id}, body: {json.dumps(update_text)}) {{ id }} }}'
     return execute_monday_graphql(mutation)
 
-def get_item_names(item_ids):
-    """Efficiently gets names for a list of item IDs."""
-    if not item_ids:
+class MondayMutationBuffer:
+    """
+    (Copied from app.py for standalone use)
+    Collects create_update, create_subitem and change_column_value mutations and sends them as
+    aliased multi-mutation documents of up to MONDAY_MUTATION_BATCH_SIZE operations. Each mutation
+    is charged its own complexity, so documents this size stay far inside the per-query budget.
+    Use it as a context manager to flush on exit; flush() returns {key: new or changed ID, or None}.
+    """
+    def __init__(self, batch_size=MONDAY_MUTATION_BATCH_SIZE):
+        self.batch_size = max(1, batch_size)
+        self.pending = []
+        self.results = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+    def _add(self, key, mutation, idempotent=False):
+        key = len(self.results) + len(self.pending) if key is None else key
+        self.pending.append((key, mutation, idempotent))
+        return key
+
+    def create_update(self, item_id, update_text, key=None):
+        return self._add(key, f"create_update (item_id: {item_id}, body: {json.dumps(update_text)}) {{ id }}")
+
+    def create_subitem(self, parent_item_id, subitem_name, column_values=None, key=None):
+        return self._add(key, f"create_subitem (parent_item_id: {parent_item_id}, item_name: {json.dumps(subitem_name)}, column_values: {json_codec.graphql_string(column_values or {})}) {{ id }}")
+
+    def change_column_value(self, board_id, item_id, column_id, value, key=None):
+        return self._add(key, f"change_column_value (board_id: {board_id}, item_id: {item_id}, column_id: \"{column_id}\", value: {json_codec.graphql_string(value)}) {{ id }}", idempotent=True)
+
+    def flush(self):
+        pending, self.pending = self.pending, []
+        for start in range(0, len(pending), self.batch_size):
+            batch = pending[start:start + self.batch_size]
+            if len(batch) == 1:
+                self.results[batch[0][0]] = self._send_one(batch[0][1])
+                continue
+            document = "mutation { " + " ".join(f"op{i}: {mutation}" for i, (_, mutation, _) in enumerate(batch)) + " }"
+            # An error in one operation leaves the others' results in the data, so only the failed ones are handled below
+            data = (execute_monday_graphql(document, partial=True) or {}).get('data') or {}
+            failed = []
+            for i, (key, mutation, idempotent) in enumerate(batch):
+                written = data.get(f"op{i}")
+                if isinstance(written, dict) and written.get('id'): self.results[key] = written['id']
+                else: failed.append((key, mutation, idempotent))
+            if not failed: continue
+            # A failed create may still have gone through (when the whole request failed), so only idempotent writes are retried one by one
+            print(f"ERROR: {len(failed)} of {len(batch)} batched mutations failed. Retrying the column writes individually.")
+            for key, mutation, idempotent in failed:
+                self.results[key] = self._send_one(mutation) if idempotent else None
+        return self.results
+
+    @staticmethod
+    def _send_one(mutation):
+        result = execute_monday_graphql(f"mutation {{ {mutation} }}")
+        try: return next(iter(result['data'].values()))['id']
+        except (TypeError, KeyError, AttributeError, StopIteration): return None
+
+def run_concurrently(func, jobs, limit=MONDAY_READ_CONCURRENCY, raise_errors=False):
+    """
+    (Copied from app.py for standalone use)
+    Calls func(*job) for every job with at most `limit` in flight and returns the results in order.
+    Each job runs in a copy of the caller's context so its API calls are charged to the current phase.
+    A job that raises is logged and returns None instead of failing the others; with raise_errors, a
+    RuntimeError naming the failures is raised once every job has finished.
+    """
+    jobs = list(jobs)
+    errors = []
+    if len(jobs) <= 1 or limit <= 1: results = [_run_job(func, job, errors) for job in jobs]
+    else:
+        with ThreadPoolExecutor(max_workers=min(limit, len(jobs))) as pool:
+            contexts = [contextvars.copy_context() for _ in jobs]
+            results = list(pool.map(lambda context, job: context.run(_run_job, func, job, errors), contexts, jobs))
+    if errors and raise_errors:
+        raise RuntimeError(f"{len(errors)} of {len(jobs)} {func.__name__} calls failed") from errors[0]
+    return results
+
+def _run_job(func, job, errors):
+    try: return func(*job)
+    except Exception as e:
+        print(f"ERROR: {func.__name__}{tuple(job)} failed: {e}")
+        errors.append(e)
+        return None
+
+def fetch_items_by_ids(item_ids, column_ids=None):
+    """
+    (Copied from app.py for standalone use)
+    Reads many items with items(ids:) in chunks of MONDAY_ITEMS_PER_READ, up to MONDAY_READ_CONCURRENCY
+    chunks at a time, fetching only the given columns. Returns {item_id: {'name', 'columns': {column_id:
+    {'id', 'text', 'value'}}}}. A chunk that fails is logged and left out.
+    """
+    item_ids = sorted({int(i) for i in item_ids})
+    if not item_ids: return {}
+    columns = f" column_values(ids: {json.dumps(sorted(column_ids))}) {{ id text value }}" if column_ids else ""
+    chunks = [item_ids[i:i + MONDAY_ITEMS_PER_READ] for i in range(0, len(item_ids), MONDAY_ITEMS_PER_READ)]
+    merged = {}
+    for found in run_concurrently(_fetch_item_chunk, [(chunk, columns) for chunk in chunks], limit=MONDAY_READ_CONCURRENCY):
+        merged.update(found or {})
+    return merged
+
+def _fetch_item_chunk(chunk, columns):
+    result = execute_monday_graphql(f"query {{ items(ids: {chunk}, limit: {len(chunk)}) {{ id name{columns} }} }}")
+    try: found = result['data']['items'] or []
+    except (TypeError, KeyError):
+        print(f"WARNING: Could not read {len(chunk)} items ({chunk[0]}..{chunk[-1]}).")
         return {}
-    query = f"query {{ items(ids: {list(item_ids)}) {{ id name }} }}"
-    result = execute_monday_graphql(query)
-    try:
-        return {int(item['id']): item['name'] for item in result['data']['items']}
-    except (TypeError, KeyError, IndexError):
+    return {int(item['id']): {'name': item.get('name'), 'columns': {cv['id']: cv for cv in item.get('column_values') or []}} for item in found}
+
+def fetch_subitems_by_parent(parent_ids, column_ids=None, with_updates=False, chunk_size=MONDAY_ITEMS_PER_READ):
+    """
+    Reads the subitems of many parent items, chunked and concurrent like fetch_items_by_ids.
+    Returns {parent_id: [{'id', 'name', 'column_values', 'updates'}]}, each subitem in the shape a subitems
+    query returns it, so the HS Roster helpers take them as they are; 'updates' (newest first) only with with_updates.
+    """
+    parent_ids = sorted({int(i) for i in parent_ids})
+    if not parent_ids: return {}
+    fields = "id name"
+    if column_ids: fields += f" column_values(ids: {json.dumps(sorted(column_ids))}) {{ id text value }}"
+    if with_updates: fields += " updates(limit: 50) { body }"
+    chunks = [parent_ids[i:i + chunk_size] for i in range(0, len(parent_ids), chunk_size)]
+    merged = {}
+    for found in run_concurrently(_fetch_subitem_chunk, [(chunk, fields) for chunk in chunks], limit=MONDAY_READ_CONCURRENCY):
+        merged.update(found or {})
+    return merged
+
+def _fetch_subitem_chunk(chunk, fields):
+    result = execute_monday_graphql(f"query {{ items(ids: {chunk}, limit: {len(chunk)}) {{ id subitems {{ {fields} }} }} }}")
+    try: found = result['data']['items'] or []
+    except (TypeError, KeyError):
+        print(f"WARNING: Could not read subitems of {len(chunk)} items ({chunk[0]}..{chunk[-1]}).")
         return {}
+    return {int(item['id']): [{'id': int(sub['id']), 'name': sub.get('name'), 'column_values': sub.get('column_values') or [],
+                               'updates': sub.get('updates') or []} for sub in item.get('subitems') or []] for item in found}
+
+def get_item_names(item_ids):
+    """Efficiently gets names for a list of item IDs."""
+    return {item_id: item['name'] for item_id, item in fetch_items_by_ids(item_ids).items()}
 
 def get_logged_items_from_updates(subitem_id):
     """
@@ -146,8 +452,12 @@ def get_logged_items_from_updates(subitem_id):
     query = f"query {{ items(ids: [{subitem_id}]) {{ updates(limit: 50) {{ body }} }} }}"
     result = execute_monday_graphql(query)
     
+    try: return get_logged_items_from_update_list(result['data']['items'][0]['updates'])
+    except (TypeError, KeyError, IndexError): return set()
+
+def get_logged_items_from_update_list(updates):
+    """The logged state declared by the newest 'is now:' update in an already-read list of updates."""
     try:
-        updates = result['data']['items'][0]['updates']
         # Updates are newest first, so we don't need to reverse
         for update in updates:
             body = update.get('body', '')
@@ -199,20 +509,33 @@ def find_or_create_subitem(parent_item_id, subitem_name, column_values=None, dry
         # Return a placeholder and True to simulate creation
         return "dry_run_placeholder_id", True
         
-def execute_monday_graphql(query):
+# Overlapping phases each fan out their own reads, so the cap on requests in flight is shared by the whole process
+monday_in_flight = threading.BoundedSemaphore(MONDAY_MAX_IN_FLIGHT)
+
+def execute_monday_graphql(query, partial=False):
+    """Returns the response, or None on failure. With partial, a response with errors is still returned for whatever data it has."""
     max_retries = 4; delay = 2
+    shape = graphql_shape(query)
+    if MONDAY_TRACK_COMPLEXITY: query = with_complexity_field(query)
     for attempt in range(max_retries):
+        started = time.monotonic()
         try:
-            response = requests.post(MONDAY_API_URL, json={"query": query}, headers=MONDAY_HEADERS, timeout=30)
+            with monday_in_flight:
+                response = requests.post(MONDAY_API_URL, data=json_codec.dumps_bytes({"query": query}), headers=MONDAY_HEADERS, timeout=30)
             if response.status_code == 429:
+                record_api_call('monday', shape, time.monotonic() - started, retry=attempt > 0, rate_limited=True)
                 print(f"WARNING: Rate limit hit. Waiting {delay} seconds..."); time.sleep(delay); delay *= 2; continue
             response.raise_for_status()
-            json_response = response.json()
+            json_response = json_codec.loads(response.content)
+            data = json_response.get('data')
+            complexity = data.pop('complexity', None) if isinstance(data, dict) else None
+            record_api_call('monday', shape, time.monotonic() - started, retry=attempt > 0, complexity=(complexity or {}).get('query', 0))
             if "errors" in json_response:
                 print(f"ERROR: Monday GraphQL Error: {json_response['errors']}")
-                return None
+                return json_response if partial else None
             return json_response
-        except requests.exceptions.RequestException as e:
+        except (requests.exceptions.RequestException, json_codec.JSONDecodeError) as e:
+            record_api_call('monday', shape, time.monotonic() - started, retry=attempt > 0, failed=True)
             print(f"WARNING: Monday HTTP Request Error: {e}. Retrying...")
             if attempt < max_retries - 1: time.sleep(delay); delay *= 2
             else: print("ERROR: Final retry failed."); return None
@@ -248,21 +571,88 @@ def get_all_board_items(board_id, item_ids=None, group_id=None):
             break
     return all_items
 
+# Whole-board snapshots for the run, by board ID. Connect columns read with them answer
+# get_linked_items_from_board_relation without an API call.
+BOARD_SNAPSHOTS = {}
+
+def get_board_snapshot(board_id, link_column_ids=(), page_size=100):
+    """Reads every item of a board into a BoardSnapshot, with the given connect columns indexed both ways."""
+    link_column_ids = [column_id for column_id in link_column_ids if column_id]
+    snapshot = BoardSnapshot(int(board_id), link_column_ids)
+    columns_field = f" column_values(ids: {json.dumps(link_column_ids)}) {{ id value }}" if link_column_ids else ""
+    cursor = None
+    while True:
+        cursor_arg = f', cursor: "{cursor}"' if cursor else ""
+        query = f"query {{ boards(ids: {board_id}) {{ items_page(limit: {page_size}{cursor_arg}) {{ cursor items {{ id name updated_at{columns_field} }} }} }} }}"
+        result = execute_monday_graphql(query)
+        try:
+            page_info = result['data']['boards'][0]['items_page']
+        except (TypeError, KeyError, IndexError):
+            print(f"ERROR: Could not parse items from board {board_id}.")
+            break
+        for item in page_info['items']:
+            links = {cv['id']: get_linked_ids_from_connect_column_value(cv.get('value')) for cv in item.get('column_values') or []}
+            snapshot.add(item['id'], item['name'], item.get('updated_at'), links)
+        cursor = page_info.get('cursor')
+        if not cursor: break
+        print(f"  Fetched {len(snapshot)} items from board {board_id}...")
+    BOARD_SNAPSHOTS[snapshot.board_id] = snapshot
+    return snapshot
+
+def report_memory(label):
+    if not tracemalloc.is_tracing(): return
+    current, peak = tracemalloc.get_traced_memory()
+    print(f"MEMORY: {label}: current {current / 2**20:.1f} MiB, peak {peak / 2**20:.1f} MiB")
+
+# In-memory user directory for the run: one paginated sweep, then batched fallback for misses.
+USER_DIRECTORY = {'by_id': {}, 'by_name': {}, 'loaded': False}
+
+def load_user_directory(page_size=200):
+    """Loads every Monday.com user (id, name, email) in one paginated sweep."""
+    page = 1
+    while True:
+        query = f"query {{ users(kind: all, limit: {page_size}, page: {page}) {{ id name email }} }}"
+        result = execute_monday_graphql(query)
+        try: page_users = result['data']['users'] or []
+        except (TypeError, KeyError):
+            print(f"WARNING: Could not read users page {page}. User directory may be incomplete.")
+            break
+        for user in page_users:
+            add_user_to_directory(user)
+        if len(page_users) < page_size: break
+        page += 1
+    USER_DIRECTORY['loaded'] = True
+    print(f"INFO: Loaded {len(USER_DIRECTORY['by_id'])} Monday.com users into the user directory.")
+
+def add_user_to_directory(user):
+    user_id = int(user['id'])
+    USER_DIRECTORY['by_id'][user_id] = {'name': user.get('name'), 'email': user.get('email')}
+    if user.get('name'):
+        USER_DIRECTORY['by_name'][user['name'].lower()] = user_id
+
+def resolve_users(user_ids, chunk_size=100):
+    """Returns {user_id: {'name', 'email'}}, fetching unknown IDs in batched users(ids: [...]) queries."""
+    if not USER_DIRECTORY['loaded']: load_user_directory()
+    wanted = {int(uid) for uid in user_ids if uid is not None}
+    missing = sorted(wanted - USER_DIRECTORY['by_id'].keys())
+    for i in range(0, len(missing), chunk_size):
+        chunk = missing[i:i + chunk_size]
+        result = execute_monday_graphql(f"query {{ users(ids: {chunk}, limit: {len(chunk)}) {{ id name email }} }}")
+        try:
+            for user in result['data']['users'] or []: add_user_to_directory(user)
+        except (TypeError, KeyError): pass
+    return {uid: USER_DIRECTORY['by_id'][uid] for uid in wanted if uid in USER_DIRECTORY['by_id']}
+
 def get_user_id(user_name):
-    query = f'query {{ users(kind: all) {{ id name }} }}'
-    result = execute_monday_graphql(query)
-    try:
-        for user in result['data']['users']:
-            if user['name'].lower() == user_name.lower(): return user['id']
-    except (KeyError, IndexError, TypeError): pass
-    return None
+    if not USER_DIRECTORY['loaded']: load_user_directory()
+    user_id = USER_DIRECTORY['by_name'].get(user_name.lower())
+    return str(user_id) if user_id is not None else None
 
 def get_user_name(user_id):
     if user_id is None: return None
-    query = f"query {{ users(ids: [{user_id}]) {{ name }} }}"
-    result = execute_monday_graphql(query)
-    try: return result['data']['users'][0].get('name')
-    except (TypeError, KeyError, IndexError): return None
+    try: user = resolve_users([user_id]).get(int(user_id))
+    except (TypeError, ValueError): return None
+    return user.get('name') if user else None
 
 def get_roster_teacher_name(master_student_id):
     tor_val = get_column_value(master_student_id, int(MASTER_STUDENT_BOARD_ID), MASTER_STUDENT_TOR_COLUMN_ID)
@@ -279,92 +669,147 @@ def get_column_value(item_id, board_id, column_id):
     result = execute_monday_graphql(query)
     try:
         col_val = result['data']['items'][0]['column_values'][0]
-        parsed_value = json.loads(col_val.get('value')) if col_val.get('value') else None
+        parsed_value = json_codec.loads(col_val.get('value')) if col_val.get('value') else None
         return {'value': parsed_value, 'text': col_val.get('text')}
-    except (TypeError, KeyError, IndexError, json.JSONDecodeError): return None
+    except (TypeError, KeyError, IndexError, json_codec.JSONDecodeError): return None
 
 def get_linked_ids_from_connect_column_value(value_data):
-    if not value_data: return set()
-    try:
-        parsed_value = value_data if isinstance(value_data, dict) else json.loads(value_data)
-        if "linkedPulseIds" in parsed_value: return {int(item["linkedPulseId"]) for item in parsed_value["linkedPulseIds"]}
-    except (json.JSONDecodeError, TypeError): pass
-    return set()
+    return set(json_codec.linked_item_ids(value_data))
 
 def get_linked_items_from_board_relation(item_id, board_id, connect_column_id):
+    snapshot = BOARD_SNAPSHOTS.get(int(board_id)) if board_id else None
+    if snapshot and int(item_id) in snapshot:
+        linked_ids = snapshot.linked_ids(item_id, connect_column_id)
+        if linked_ids is not None: return set(linked_ids)
     column_data = get_column_value(item_id, board_id, connect_column_id)
     return get_linked_ids_from_connect_column_value(column_data.get('value')) if column_data else set()
 
 def get_people_ids_from_value(value_data):
-    if not value_data: return set()
-    if isinstance(value_data, str):
-        try: value_data = json.loads(value_data)
-        except json.JSONDecodeError: return set()
-    persons_and_teams = value_data.get('personsAndTeams', [])
-    return {person['id'] for person in persons_and_teams if 'id' in person and person.get('kind') == 'person'}
+    return {person_id for person_id, kind in json_codec.people_entries(value_data) if kind == 'person'}
 
 def create_subitem(parent_item_id, subitem_name, column_values=None):
-    column_values_json = json.dumps(column_values or {})
-    mutation = f'mutation {{ create_subitem (parent_item_id: {parent_item_id}, item_name: {json.dumps(subitem_name)}, column_values: {json.dumps(column_values_json)}) {{ id }} }}'
+    mutation = f'mutation {{ create_subitem (parent_item_id: {parent_item_id}, item_name: {json.dumps(subitem_name)}, column_values: {json_codec.graphql_string(column_values or {})}) {{ id }} }}'
     result = execute_monday_graphql(mutation)
     if result and 'data' in result and result['data'].get('create_subitem'):
         return result['data']['create_subitem'].get('id')
     print(f"WARNING: Failed to create subitem '{subitem_name}'.")
     return None
 
-def bulk_add_to_connect_column(item_id, board_id, connect_column_id, course_ids_to_add):
-    """Efficiently adds multiple items to a connect boards column."""
-    query_current = f'query {{ items(ids:[{item_id}]) {{ column_values(ids:["{connect_column_id}"]) {{ value }} }} }}'
-    result = execute_monday_graphql(query_current)
-    current_linked_items = set()
-    try:
-        col_val = result['data']['items'][0]['column_values']
-        if col_val:
-            current_linked_items = get_linked_ids_from_connect_column_value(col_val[0]['value'])
+def apply_connect_column_changes(item_id, board_id, changes):
+    """
+    (Copied from app.py for standalone use)
+    Applies every add/remove for one item's connect columns with one read and at most one
+    change_multiple_column_values. `changes` is {column_id: {'add': ids, 'remove': ids}};
+    removals win over adds. Returns False only if the read or write failed.
+    """
+    changes = {col_id: change for col_id, change in changes.items() if col_id and (change.get('add') or change.get('remove'))}
+    if not changes: return True
+    query = f"query {{ items (ids: [{item_id}]) {{ column_values (ids: {json.dumps(sorted(changes))}) {{ id value }} }} }}"
+    result = execute_monday_graphql(query)
+    try: current = {cv['id']: get_linked_ids_from_connect_column_value(cv.get('value')) for cv in result['data']['items'][0]['column_values']}
     except (TypeError, KeyError, IndexError):
-        pass
-        
-    updated_linked_items = current_linked_items.union(course_ids_to_add)
-    
-    if updated_linked_items == current_linked_items:
-        return True
-
-    connect_value = {"linkedPulseIds": [{"linkedPulseId": int(lid)} for lid in sorted(list(updated_linked_items))]}
-    graphql_value = json.dumps(json.dumps(connect_value))
-    
-    mutation = f'mutation {{ change_column_value (board_id: {board_id}, item_id: {item_id}, column_id: "{connect_column_id}", value: {graphql_value}) {{ id }} }}'
-    
-    print(f"    SYNCING: Adding {len(course_ids_to_add - current_linked_items)} courses to column {connect_column_id} on PLP item {item_id}.")
+        print(f"ERROR: Could not read connect columns on item {item_id}.")
+        return False
+    column_values = {}
+    for col_id, change in changes.items():
+        before = current.get(col_id, set())
+        after = (before | {int(i) for i in change.get('add', ())}) - {int(i) for i in change.get('remove', ())}
+        if after != before:
+            column_values[col_id] = {"linkedPulseIds": [{"linkedPulseId": lid} for lid in sorted(after)]}
+    if not column_values: return True
+    print(f"INFO: Updating connect column(s) {sorted(column_values)} on item {item_id} in one write.")
+    mutation = f"mutation {{ change_multiple_column_values (board_id: {board_id}, item_id: {item_id}, column_values: {json_codec.graphql_string(column_values)}) {{ id }} }}"
     return execute_monday_graphql(mutation) is not None
 
-def update_people_column(item_id, board_id, people_column_id, new_people_value, target_column_type):
-    parsed_new_value = new_people_value if isinstance(new_people_value, dict) else json.loads(new_people_value) if isinstance(new_people_value, str) else {}
-    persons_and_teams = parsed_new_value.get('personsAndTeams', [])
+def get_people_column_write_value(new_people_value, target_column_type):
+    """The change_column_value payload that sets a person or multiple-person column, or None for other types."""
+    people = json_codec.people_entries(new_people_value)
     if target_column_type == "person":
-        person_id = persons_and_teams[0].get('id') if persons_and_teams else None
-        graphql_value = json.dumps(json.dumps({"personId": person_id} if person_id else {}))
-    elif target_column_type == "multiple-person":
-        people_list = [{"id": p.get('id'), "kind": "person"} for p in persons_and_teams if 'id' in p]
-        graphql_value = json.dumps(json.dumps({"personsAndTeams": people_list}))
-    else: return False
-    mutation = f"""mutation {{ change_column_value(board_id: {board_id}, item_id: {item_id}, column_id: "{people_column_id}", value: {graphql_value}) {{ id }} }}"""
+        person_id = people[0][0] if people else None
+        return {"personId": person_id} if person_id else {}
+    if target_column_type == "multiple-person":
+        return {"personsAndTeams": [{"id": person_id, "kind": "person"} for person_id, _ in people]}
+    return None
+
+def update_people_column(item_id, board_id, people_column_id, new_people_value, target_column_type):
+    write_value = get_people_column_write_value(new_people_value, target_column_type)
+    if write_value is None: return False
+    mutation = f"""mutation {{ change_column_value(board_id: {board_id}, item_id: {item_id}, column_id: "{people_column_id}", value: {json_codec.graphql_string(write_value)}) {{ id }} }}"""
     return execute_monday_graphql(mutation) is not None
 
+_valkey_client = None
+
+def get_valkey_client():
+    """(Copied from app.py for standalone use) Returns a shared Valkey client, or None if no URL is configured."""
+    global _valkey_client
+    if _valkey_client is None and VALKEY_URL:
+        try:
+            ssl_kwargs = {'ssl_cert_reqs': 'required'} if VALKEY_URL.startswith('rediss://') else {}
+            _valkey_client = redis.Redis.from_url(VALKEY_URL, socket_timeout=5, socket_connect_timeout=5, **ssl_kwargs)
+        except (redis.RedisError, ValueError) as e:
+            print(f"WARNING: Could not create Valkey client: {e}")
+    return _valkey_client
+
+# The same All Staff directory as app.py's, so a run reuses the webhook workers' scan (see staff_directory.py)
+staff_directory = StaffDirectory(ALL_STAFF_BOARD_ID, {'email': ALL_STAFF_EMAIL_COLUMN_ID, 'sis_id': ALL_STAFF_SIS_ID_COLUMN_ID, 'canvas_id': ALL_STAFF_CANVAS_ID_COLUMN,
+                                                      'internal_id': ALL_STAFF_INTERNAL_ID_COLUMN, 'person': ALL_STAFF_PERSON_COLUMN_ID},
+                                 execute_monday_graphql, fetch_items_by_ids, get_valkey_client, refresh_seconds=STAFF_DIRECTORY_REFRESH_SECONDS)
+
+# The nightly job spends the same Canvas token as the webhook workers, so it reads and publishes the shared bucket reading too
+canvas_throttle = CanvasThrottle(max_concurrency=CANVAS_MAX_CONCURRENCY, refill_per_second=CANVAS_RATE_LIMIT_REFILL_PER_SECOND, get_client=get_valkey_client)
+
 def initialize_canvas_api():
-    return Canvas(CANVAS_API_URL, CANVAS_API_KEY) if CANVAS_API_URL and CANVAS_API_KEY else None
+    if not (CANVAS_API_URL and CANVAS_API_KEY): return None
+    canvas = Canvas(CANVAS_API_URL, CANVAS_API_KEY)
+    session = canvas._Canvas__requester._session
+    session.mount(CANVAS_API_URL, CanvasThrottleAdapter(canvas_throttle, on_throttled=record_canvas_response))
+    session.hooks['response'].append(record_canvas_response)
+    return canvas
+
+CANVAS_INDEX = None  # CanvasLookupIndex of the provisioning report, when the run loaded one (see canvas_reports.py)
+
+def load_canvas_index():
+    """Loads the sub-account's provisioning report for the term into CANVAS_INDEX. Without it the run uses the API as before."""
+    global CANVAS_INDEX
+    canvas_api = initialize_canvas_api()
+    if not (canvas_api and CANVAS_SUBACCOUNT_ID):
+        print("WARNING: Canvas or CANVAS_SUBACCOUNT_ID is not configured. Skipping the provisioning report.")
+        return None
+    try:
+        CANVAS_INDEX = load_provisioning_index(canvas_api, CANVAS_API_KEY, CANVAS_SUBACCOUNT_ID, CANVAS_TERM_ID,
+                                               session=canvas_api._Canvas__requester._session, poll_seconds=CANVAS_REPORT_POLL_SECONDS)
+    except (CanvasReportError, CanvasException, requests.RequestException, ValueError, KeyError) as e:
+        print(f"WARNING: Could not load the Canvas provisioning report: {e}. Looking up Canvas users and enrollments through the API.")
+    return CANVAS_INDEX
+
+def print_canvas_index_usage():
+    if CANVAS_INDEX is not None:
+        print(f"INFO: Provisioning report lookups: {json.dumps(dict(sorted(CANVAS_INDEX.lookups.items())))}")
+
+def find_indexed_canvas_user(canvas_api, *keys):
+    """A User stub (no GET) for the first (kind, value) key found in CANVAS_INDEX, or None."""
+    if CANVAS_INDEX is None: return None
+    attributes = CANVAS_INDEX.find_user(*keys)
+    return User(canvas_api._Canvas__requester, attributes) if attributes else None
 
 def find_canvas_user(student_details, cursor):
     canvas_api = initialize_canvas_api()
     if not canvas_api: return None
     plp_item_id = student_details.get('plp_id')
+    cached_canvas_id = None
     if plp_item_id and cursor:
         cursor.execute("SELECT canvas_id FROM processed_students WHERE student_id = %s", (plp_item_id,))
         result = cursor.fetchone()
-        if result and result[0]:
-            print(f"  INFO: Found cached Canvas ID {result[0]} for student.")
-            try: return canvas_api.get_user(result[0])
-            except ResourceDoesNotExist: print(f"  WARNING: Cached Canvas ID {result[0]} was not found. Searching again.")
+        cached_canvas_id = result[0] if result and result[0] else None
     id_from_monday = student_details.get('canvas_id')
+    # The same keys, in the same order, as the API lookups below
+    indexed_user = find_indexed_canvas_user(canvas_api, ('id', cached_canvas_id), ('id', id_from_monday), ('sis_user_id', None if str(id_from_monday).isdigit() else id_from_monday),
+                                            ('login_id', student_details.get('email')), ('sis_user_id', student_details.get('ssid')))
+    if indexed_user: return indexed_user
+    if cached_canvas_id:
+        print(f"  INFO: Found cached Canvas ID {cached_canvas_id} for student.")
+        try: return canvas_api.get_user(cached_canvas_id)
+        except ResourceDoesNotExist: print(f"  WARNING: Cached Canvas ID {cached_canvas_id} was not found. Searching again.")
     if id_from_monday:
         try: return canvas_api.get_user(int(id_from_monday))
         except (ValueError, TypeError):
@@ -466,6 +911,8 @@ def create_canvas_user(user_details, role='student', db_cursor=None):
             }
         }
         new_user = account.create_user(**user_payload)
+        if CANVAS_INDEX is not None:
+            CANVAS_INDEX.record_user(new_user.id, user_details['name'], user_payload['pseudonym']['sis_user_id'], user_details['email'])
         return new_user
     except CanvasException as e:
         print(f"ERROR: Canvas user creation failed for {user_details['email']}: {e}")
@@ -498,12 +945,17 @@ def update_user_ssid(user, new_ssid):
 def create_section_if_not_exists(course_id, section_name):
     canvas_api = initialize_canvas_api()
     if not canvas_api: return None
+    indexed = CANVAS_INDEX.find_section(course_id, section_name) if CANVAS_INDEX is not None else None
+    if indexed:
+        return Section(canvas_api._Canvas__requester, {'id': indexed[0], 'name': indexed[1], 'course_id': int(course_id)})
     try:
         course = canvas_api.get_course(course_id)
         for section in course.get_sections():
             if section.name.lower() == section_name.lower():
                 return section
-        return course.create_course_section(course_section={'name': section_name})
+        section = course.create_course_section(course_section={'name': section_name})
+        if CANVAS_INDEX is not None: CANVAS_INDEX.record_section(section.id, course_id, section.name)
+        return section
     except CanvasException as e:
         print(f"ERROR: Canvas section creation/check failed: {e}")
         return None
@@ -513,10 +965,11 @@ def enroll_student_in_section(course_id, user_id, section_id):
     canvas_api = initialize_canvas_api()
     if not canvas_api: return "Failed"
     try:
-        course = canvas_api.get_course(course_id)
-        user = canvas_api.get_user(user_id)
-        # This line adds the critical 'enrollment_state' parameter
-        course.enroll_user(user, 'StudentEnrollment', enrollment_state='active', enrollment={'course_section_id': section_id, 'notify': False})
+        # Course stub and user ID: the POST fails the same way for a missing course or user, without two GETs first.
+        # enroll_user only sends enrollment_state and notify inside the enrollment params.
+        course = Course(canvas_api._Canvas__requester, {'id': course_id})
+        course.enroll_user(int(user_id), 'StudentEnrollment', enrollment={'course_section_id': section_id, 'enrollment_state': 'active', 'notify': False})
+        if CANVAS_INDEX is not None: CANVAS_INDEX.record_enrollment(course_id, user_id, section_id, 'StudentEnrollment', 'active')
         return "Success"
     except Conflict: return "Already Enrolled"
     except CanvasException as e:
@@ -545,12 +998,14 @@ def unenroll_student_from_course(course_id, student_details):
         def fetchone(self): return None
     user = find_canvas_user(student_details, cursor=DummyCursor())
     if not user: return True
+    if CANVAS_INDEX is not None and CANVAS_INDEX.user_sections(course_id, user.id) == set(): return True
     try:
         course = canvas_api.get_course(course_id)
         for enrollment in course.get_enrollments(user_id=user.id):
             if enrollment.role == 'StudentEnrollment':
                 print(f"  -> Deactivating enrollment {enrollment.id} for user {user.id} in course {course_id}")
                 enrollment.deactivate(task='conclude')
+                if CANVAS_INDEX is not None: CANVAS_INDEX.record_enrollment(course_id, user.id, enrollment.course_section_id, 'StudentEnrollment', 'completed')
         return True
     except CanvasException as e:
         print(f"ERROR: Canvas unenrollment failed: {e}")
@@ -560,9 +1015,13 @@ def enroll_teacher_in_course(course_id, teacher_details, role='TeacherEnrollment
     canvas_api = initialize_canvas_api()
     if not canvas_api:
         return "Failed: Canvas API not initialized"
+    user_to_enroll, error = find_or_create_canvas_teacher(teacher_details)
+    if not user_to_enroll: return error
+    return enroll_canvas_teacher(canvas_api, course_id, user_to_enroll, role)
 
+def find_or_create_canvas_teacher(teacher_details):
+    """Returns (Canvas user, None), or (None, failure message)."""
     teacher_name = teacher_details.get('name', teacher_details.get('email', 'Unknown'))
-    
     user_to_enroll = find_canvas_teacher(teacher_details)
 
     if not user_to_enroll:
@@ -575,14 +1034,17 @@ def enroll_teacher_in_course(course_id, teacher_details, role='TeacherEnrollment
                 print(f"  INFO: Create failed, user exists. Searching again.")
                 user_to_enroll = find_canvas_teacher(teacher_details)
             else:
-                return f"Failed: Could not create teacher '{teacher_name}'. Error: {e}"
+                return None, f"Failed: Could not create teacher '{teacher_name}'. Error: {e}"
 
     if not user_to_enroll:
-        return f"Failed: Could not find or create teacher '{teacher_name}' with the provided details."
-    
+        return None, f"Failed: Could not find or create teacher '{teacher_name}' with the provided details."
+    return user_to_enroll, None
+
+def enroll_canvas_teacher(canvas_api, course_id, user, role='TeacherEnrollment'):
     try:
-        course = canvas_api.get_course(course_id)
-        course.enroll_user(user_to_enroll, role, enrollment_state='active', notify=False)
+        # enroll_user only sends enrollment_state and notify inside the enrollment params
+        course = Course(canvas_api._Canvas__requester, {'id': course_id})
+        course.enroll_user(user, role, enrollment={'enrollment_state': 'active', 'notify': False})
         return "Success"
     except ResourceDoesNotExist:
         return f"Failed: Course with ID '{course_id}' not found in Canvas."
@@ -630,37 +1092,34 @@ def get_canvas_section_name(plp_item_id, class_item_id, class_name, student_deta
     """
     Determines the correct Canvas section name for a student. (FULLY CORRECTED)
     """
+    m_series_val = None
+    master_student_id = student_details.get('master_id')
+    
+    # This will only run if a Master Student item is actually linked.
+    if master_student_id and "Connect Math Study Hall" not in class_name:
+        # Query the SOURCE column ("status_12__1") on the Master Student board directly.
+        m_series_val = get_column_value(master_student_id, int(MASTER_STUDENT_BOARD_ID), MASTER_STUDENT_M_SERIES_COLUMN_ID)
+
+    m_series_text = m_series_val.get('text') if m_series_val else None
+    return section_name_for_class(class_item_id, class_name, student_details, m_series_text, course_to_track_map, class_id_to_category_map, id_to_name_map)
+
+def section_name_for_class(class_item_id, class_name, student_details, m_series_text, course_to_track_map, class_id_to_category_map, id_to_name_map):
+    """The section rules of get_canvas_section_name, given the student's M-Series/Op text. Makes no API calls."""
     # === PRIORITY 1: Handle Special Study Hall Sectioning ===
-    # ... (The study hall logic at the beginning of the function remains the same and is correct) ...
     if "Connect Math Study Hall" in class_name:
         for c_id, category in class_id_to_category_map.items():
             course_name = id_to_name_map.get(c_id, "")
             if category == "Math" and "Connect" in course_name:
                 return course_name
         return "General Math Connect"
-    # ... (etc. for other study halls) ...
-
-    # --- START OF MODIFICATION ---
 
     # === PRIORITY 2: Check M-Series/Op2 from the SOURCE on the Master Student Board ===
-    m_series_val = None
-    master_student_id = student_details.get('master_id')
-    
-    # This will only run if a Master Student item is actually linked.
-    if master_student_id:
-        # Query the SOURCE column ("status_12__1") on the Master Student board directly.
-        m_series_val = get_column_value(master_student_id, int(MASTER_STUDENT_BOARD_ID), "status_12__1")
-
-    m_series_text = m_series_val.get('text') if m_series_val else None
-    
     if m_series_text:
         match = re.search(r'M\d|Op\d', m_series_text)
         if match:
             # If found, use it immediately for any student and we are done.
             return match.group(0)
 
-    # --- END OF MODIFICATION ---
-
     # === PRIORITY 3: High School Specific Fallback ===
     if is_high_school_student(student_details.get('grade_text')):
         # This only runs if the M-Series check above fails for any reason
@@ -675,15 +1134,21 @@ def enroll_or_create_and_enroll(course_id, section_id, student_details, db_curso
     user = find_or_create_canvas_user(student_details, db_cursor)
     if user:
         try:
-            # Re-fetch the full user object to ensure all attributes are present
-            full_user = canvas_api.get_user(user.id)
+            # Re-fetch the full user object to ensure all attributes are present (users from the provisioning report already have them)
+            full_user = user if CANVAS_INDEX is not None and CANVAS_INDEX.find_user(('id', user.id)) else canvas_api.get_user(user.id)
             # *** NEW: Explicitly check for active enrollment before proceeding ***
-            course_obj = canvas_api.get_course(course_id)
-            enrollments = course_obj.get_enrollments(user_id=full_user.id)
-            for enrollment in enrollments:
-                if enrollment.course_section_id == section_id and enrollment.enrollment_state == 'active':
+            indexed_sections = CANVAS_INDEX.user_sections(course_id, full_user.id, states=('active',)) if CANVAS_INDEX is not None else None
+            if indexed_sections is not None:
+                if section_id in indexed_sections:
                     print(f"  -> INFO: Student is already active in section {section_id}. No action needed.")
                     return "Already Enrolled"
+            else:
+                course_obj = canvas_api.get_course(course_id)
+                enrollments = course_obj.get_enrollments(user_id=full_user.id)
+                for enrollment in enrollments:
+                    if enrollment.course_section_id == section_id and enrollment.enrollment_state == 'active':
+                        print(f"  -> INFO: Student is already active in section {section_id}. No action needed.")
+                        return "Already Enrolled"
 
             db_cursor.execute("UPDATE processed_students SET canvas_id = %s WHERE student_id = %s", (str(full_user.id), student_details['plp_id']))
             if student_details.get('ssid') and hasattr(full_user, 'sis_user_id') and full_user.sis_user_id != student_details['ssid']:
@@ -712,10 +1177,20 @@ def sync_study_hall_enrollment(course_id, student_details, target_section_name,
         return
     
     try:
-        course = canvas_api.get_course(course_id)
         target_section = create_section_if_not_exists(course_id, target_section_name)
         if not target_section: return
 
+        # The report has no enrollment IDs, so it only answers when there is nothing to conclude
+        indexed_sections = CANVAS_INDEX.user_sections(course_id, user.id) if CANVAS_INDEX is not None else None
+        if indexed_sections is not None and indexed_sections <= {target_section.id}:
+            if indexed_sections:
+                print(f"  INFO: Student already in correct section '{target_section_name}'.")
+            else:
+                print(f"  ACTION: Enrolling student in correct section '{target_section_name}'.")
+                enroll_student_in_section(course_id, user.id, target_section.id)
+            return
+
+        course = canvas_api.get_course(course_id)
         enrollments = course.get_enrollments(user_id=user.id)
         is_correctly_enrolled = False
         
@@ -732,6 +1207,7 @@ def sync_study_hall_enrollment(course_id, student_details, target_section_name,
                     except ResourceDoesNotExist:
                         print(f"  ACTION: Removing student from old/deleted section ID {enrollment.course_section_id}.")
                     enrollment.deactivate(task='conclude')
+                    if CANVAS_INDEX is not None: CANVAS_INDEX.record_enrollment(course_id, user.id, enrollment.course_section_id, 'StudentEnrollment', 'completed')
 
         if not is_correctly_enrolled:
             print(f"  ACTION: Enrolling student in correct section '{target_section_name}'.")
@@ -743,20 +1219,24 @@ def sync_study_hall_enrollment(course_id, student_details, target_section_name,
 def get_student_details_from_plp(plp_item_id):
     print(f"  [DIAGNOSTIC] Starting detail fetch for PLP item: {plp_item_id}")
     try:
-        query = f'query {{ items (ids: [{plp_item_id}]) {{ column_values (ids: ["{PLP_TO_MASTER_STUDENT_CONNECT_COLUMN}"]) {{ value }} }} }}'
-        result = execute_monday_graphql(query)
-        column_value = result['data']['items'][0]['column_values'][0]['value']
-        if not column_value:
-            print("  [DIAGNOSTIC] FAILED: 'Connect to Master' column is empty.")
-            return None
-        connect_column_value = json.loads(column_value)
-        linked_ids = [item['linkedPulseId'] for item in connect_column_value.get('linkedPulseIds', [])]
+        plp_snapshot = BOARD_SNAPSHOTS.get(int(PLP_BOARD_ID)) if PLP_BOARD_ID else None
+        if plp_snapshot and int(plp_item_id) in plp_snapshot and plp_snapshot.linked_ids(plp_item_id, PLP_TO_MASTER_STUDENT_CONNECT_COLUMN) is not None:
+            linked_ids = list(plp_snapshot.linked_ids(plp_item_id, PLP_TO_MASTER_STUDENT_CONNECT_COLUMN))
+        else:
+            query = f'query {{ items (ids: [{plp_item_id}]) {{ column_values (ids: ["{PLP_TO_MASTER_STUDENT_CONNECT_COLUMN}"]) {{ value }} }} }}'
+            result = execute_monday_graphql(query)
+            column_value = result['data']['items'][0]['column_values'][0]['value']
+            if not column_value:
+                print("  [DIAGNOSTIC] FAILED: 'Connect to Master' column is empty.")
+                return None
+            connect_column_value = json_codec.loads(column_value)
+            linked_ids = [item['linkedPulseId'] for item in connect_column_value.get('linkedPulseIds', [])]
         if not linked_ids:
             print("  [DIAGNOSTIC] FAILED: 'Connect to Master' column is linked, but the linked item list is empty.")
             return None
         master_student_id = linked_ids[0]
         print(f"  [DIAGNOSTIC] Found Master Student ID: {master_student_id}")
-    except (TypeError, KeyError, IndexError, json.JSONDecodeError) as e:
+    except (TypeError, KeyError, IndexError, json_codec.JSONDecodeError) as e:
         print(f"  [DIAGNOSTIC] FAILED: Could not get the Master Student ID. Error: {e}")
         return None
     try:
@@ -802,11 +1282,11 @@ def process_student_special_enrollments(plp_item, db_cursor, dry_run=True):
         tor_val_str = cols.get(MASTER_STUDENT_TOR_COLUMN_ID, {}).get('value')
         if tor_val_str:
             try:
-                tor_ids = get_people_ids_from_value(json.loads(tor_val_str))
+                tor_ids = get_people_ids_from_value(json_codec.loads(tor_val_str))
                 if tor_ids:
                     tor_full_name = get_user_name(list(tor_ids)[0])
                     if tor_full_name: tor_last_name = tor_full_name.split()[-1]
-            except (json.JSONDecodeError, TypeError):
+            except (json_codec.JSONDecodeError, TypeError):
                 print(f"  WARNING: Could not parse TOR value for master item {master_id}.")
     
     # --- JUMPSTART ENROLLMENT ---
@@ -824,69 +1304,30 @@ def process_student_special_enrollments(plp_item, db_cursor, dry_run=True):
         else:
             print(f"  SKIPPING: Student grade '{grade_text}' is not 6-12. No action needed for ACE Study Hall.")
 
-def run_hs_roster_sync_for_student(hs_roster_item, dry_run=True):
-    parent_item_id = int(hs_roster_item['id'])
-    print(f"\n--- Processing HS Roster for: {hs_roster_item['name']} (ID: {parent_item_id}) ---")
-
-    plp_query = f'query {{ items(ids:[{parent_item_id}]) {{ column_values(ids:["{HS_ROSTER_MAIN_ITEM_to_PLP_CONNECT_COLUMN_ID}"]) {{ value }} }} }}'
-    plp_result = execute_monday_graphql(plp_query)
-    try:
-        plp_linked_ids = get_linked_ids_from_connect_column_value(plp_result['data']['items'][0]['column_values'][0]['value'])
-        if not plp_linked_ids:
-            print("  SKIPPING: Could not find a linked PLP item.")
-            return
-        plp_item_id = list(plp_linked_ids)[0]
-    except (TypeError, KeyError, IndexError):
-        print("  SKIPPING: Could not find linked PLP item.")
-        return
-
-    HS_ROSTER_SUBITEM_TERM_COLUMN_ID = "color6"
-    subitems_query = f"""
-        query {{
-            items (ids: [{parent_item_id}]) {{
-                subitems {{
-                    id name
-                    column_values(ids: ["{HS_ROSTER_SUBITEM_DROPDOWN_COLUMN_ID}", "{HS_ROSTER_CONNECT_ALL_COURSES_COLUMN_ID}", "{HS_ROSTER_SUBITEM_TERM_COLUMN_ID}"]) {{ id text value }}
-                }}
-            }}
-        }}
-    """
-    subitems_result = execute_monday_graphql(subitems_query)
-
+def get_hs_roster_course_categories(subitems):
+    """Returns {course_id: {'primary_categories', 'secondary_category'}} for an HS Roster's non-Spring subitems."""
     course_data = defaultdict(lambda: {'primary_categories': set(), 'secondary_category': ''})
-    try:
-        subitems = subitems_result['data']['items'][0]['subitems']
-        for subitem in subitems:
-            subitem_cols = {cv['id']: cv for cv in subitem['column_values']}
-            
-            term_val = subitem_cols.get(HS_ROSTER_SUBITEM_TERM_COLUMN_ID, {}).get('text')
-            if term_val == "Spring":
-                print(f"  SKIPPING: Subitem '{subitem['name']}' is marked as Spring.")
-                continue
-            
-            category_text = subitem_cols.get(HS_ROSTER_SUBITEM_DROPDOWN_COLUMN_ID, {}).get('text', '')
-            courses_val = subitem_cols.get(HS_ROSTER_CONNECT_ALL_COURSES_COLUMN_ID, {}).get('value')
-            if category_text and courses_val:
-                labels = [label.strip() for label in category_text.split(',')]
-                course_ids = get_linked_ids_from_connect_column_value(courses_val)
-                for course_id in course_ids:
-                    for label in labels:
-                        if label:
-                            course_data[course_id]['primary_categories'].add(label)
-    except (TypeError, KeyError, IndexError):
-        print("  ERROR: Could not process subitems.")
-        return
-
-    all_course_ids = list(course_data.keys())
-    if not all_course_ids: 
-        print("  INFO: No non-Spring courses found to process.")
-        return
-
-    secondary_category_col_id = "dropdown_mkq0r2av"
-    secondary_category_query = f"query {{ items (ids: {all_course_ids}) {{ id column_values(ids: [\"{secondary_category_col_id}\"]) {{ text }} }} }}"
-    secondary_category_results = execute_monday_graphql(secondary_category_query)
-    secondary_category_map = {int(item['id']): item['column_values'][0].get('text') for item in secondary_category_results.get('data', {}).get('items', []) if item.get('column_values')}
-    
+    for subitem in subitems:
+        subitem_cols = {cv['id']: cv for cv in subitem['column_values']}
+        
+        term_val = subitem_cols.get(HS_ROSTER_SUBITEM_TERM_COLUMN_ID, {}).get('text')
+        if term_val == "Spring":
+            print(f"  SKIPPING: Subitem '{subitem['name']}' is marked as Spring.")
+            continue
+        
+        category_text = subitem_cols.get(HS_ROSTER_SUBITEM_DROPDOWN_COLUMN_ID, {}).get('text', '')
+        courses_val = subitem_cols.get(HS_ROSTER_CONNECT_ALL_COURSES_COLUMN_ID, {}).get('value')
+        if category_text and courses_val:
+            labels = [label.strip() for label in category_text.split(',')]
+            course_ids = get_linked_ids_from_connect_column_value(courses_val)
+            for course_id in course_ids:
+                for label in labels:
+                    if label:
+                        course_data[course_id]['primary_categories'].add(label)
+    return course_data
+
+def get_plp_columns_for_hs_courses(course_data, secondary_category_map):
+    """Routes each HS Roster course to its PLP connect column(s). Returns {column_id: set of course IDs}."""
     plp_updates = defaultdict(set)
     for course_id, data in course_data.items():
         primary_categories = data.get('primary_categories', set())
@@ -917,6 +1358,61 @@ def run_hs_roster_sync_for_student(hs_roster_item, dry_run=True):
                         plp_updates[other_col_id].add(course_id)
                     else:
                         print(f"  WARNING: Subject '{category}' not mapped and 'Other/Elective' is not configured. Skipping.")
+    return plp_updates
+
+def get_hs_roster_course_tracks(subitems):
+    """Returns {course_id: track name} from an HS Roster's subitems."""
+    course_to_track_map = {}
+    for subitem in subitems:
+        track_name = ''
+        linked_course_ids = set()
+        for cv in subitem['column_values']:
+            if cv['id'] == HS_ROSTER_TRACK_COLUMN_ID:
+                track_name = cv['text']
+            elif cv['id'] == HS_ROSTER_CONNECT_ALL_COURSES_COLUMN_ID:
+                linked_course_ids = get_linked_ids_from_connect_column_value(cv['value'])
+        if track_name:
+            for course_id in linked_course_ids:
+                course_to_track_map[course_id] = track_name
+    return course_to_track_map
+
+def run_hs_roster_sync_for_student(hs_roster_item, dry_run=True):
+    parent_item_id = int(hs_roster_item['id'])
+    print(f"\n--- Processing HS Roster for: {hs_roster_item['name']} (ID: {parent_item_id}) ---")
+
+    plp_linked_ids = get_linked_items_from_board_relation(parent_item_id, int(HS_ROSTER_BOARD_ID), HS_ROSTER_MAIN_ITEM_to_PLP_CONNECT_COLUMN_ID)
+    if not plp_linked_ids:
+        print("  SKIPPING: Could not find a linked PLP item.")
+        return
+    plp_item_id = sorted(plp_linked_ids)[0]
+
+    subitems_query = f"""
+        query {{
+            items (ids: [{parent_item_id}]) {{
+                subitems {{
+                    id name
+                    column_values(ids: ["{HS_ROSTER_SUBITEM_DROPDOWN_COLUMN_ID}", "{HS_ROSTER_CONNECT_ALL_COURSES_COLUMN_ID}", "{HS_ROSTER_SUBITEM_TERM_COLUMN_ID}"]) {{ id text value }}
+                }}
+            }}
+        }}
+    """
+    subitems_result = execute_monday_graphql(subitems_query)
+
+    try:
+        course_data = get_hs_roster_course_categories(subitems_result['data']['items'][0]['subitems'])
+    except (TypeError, KeyError, IndexError):
+        print("  ERROR: Could not process subitems.")
+        return
+
+    all_course_ids = list(course_data.keys())
+    if not all_course_ids: 
+        print("  INFO: No non-Spring courses found to process.")
+        return
+
+    secondary_category_col_id = ALL_COURSES_SECONDARY_CATEGORY_COLUMN_ID
+    secondary_category_map = {course_id: item['columns'][secondary_category_col_id].get('text') for course_id, item in fetch_items_by_ids(all_course_ids, [secondary_category_col_id]).items()
+                              if secondary_category_col_id in item['columns']}
+    plp_updates = get_plp_columns_for_hs_courses(course_data, secondary_category_map)
 
     if not plp_updates:
         print("  INFO: No valid courses found to sync after categorization.")
@@ -928,10 +1424,7 @@ def run_hs_roster_sync_for_student(hs_roster_item, dry_run=True):
             print(f"    DRY RUN: Would add {len(courses)} courses to PLP column {col_id}.")
         return
 
-    for col_id, courses in plp_updates.items():
-        if col_id and courses:
-            bulk_add_to_connect_column(plp_item_id, int(PLP_BOARD_ID), col_id, courses)
-            time.sleep(1)
+    apply_connect_column_changes(plp_item_id, int(PLP_BOARD_ID), {col_id: {'add': courses} for col_id, courses in plp_updates.items()})
 
 def manage_class_enrollment(action, plp_item_id, class_item_id, student_details, section_name, category_name, creator_id, db_cursor, dry_run=True):
     class_name = get_item_name(class_item_id, int(ALL_COURSES_BOARD_ID)) or f"Item {class_item_id}"
@@ -1015,21 +1508,8 @@ def run_plp_sync_for_student(plp_item_id, creator_id, db_cursor, dry_run=True):
             }} }} }}"""
             subitems_result = execute_monday_graphql(subitems_query)
             if subitems_result:
-                try:
-                    subitems = subitems_result['data']['items'][0]['subitems']
-                    for subitem in subitems:
-                        track_name = ''
-                        linked_course_ids = set()
-                        for cv in subitem['column_values']:
-                            if cv['id'] == HS_ROSTER_TRACK_COLUMN_ID:
-                                track_name = cv['text']
-                            elif cv['id'] == HS_ROSTER_CONNECT_ALL_COURSES_COLUMN_ID:
-                                linked_course_ids = get_linked_ids_from_connect_column_value(cv['value'])
-                        if track_name:
-                            for course_id in linked_course_ids:
-                                course_to_track_map[course_id] = track_name
-                except (KeyError, IndexError):
-                    pass
+                try: course_to_track_map = get_hs_roster_course_tracks(subitems_result['data']['items'][0]['subitems'])
+                except (KeyError, IndexError): pass
 
     # --- Sync Class Enrollments ---
     print("INFO: Syncing class enrollments...")
@@ -1116,6 +1596,9 @@ def reconcile_subitems(plp_item_id, creator_id, db_cursor, dry_run=True):
         print("  SKIPPING: Could not get complete student details for reconciliation.")
         return
 
+    # Discrepancy updates are collected and posted together at the end in batched mutations
+    mutations = MondayMutationBuffer()
+
     # --- Reconcile Courses ---
     print("  -> Verifying course enrollments and logs...")
     for category, column_id in PLP_CATEGORY_TO_CONNECT_COLUMN_MAP.items():
@@ -1136,7 +1619,7 @@ def reconcile_subitems(plp_item_id, creator_id, db_cursor, dry_run=True):
                 update_text = f"Reconciliation sync: Current {category} curriculum is now: {current_names_str}."
                 
                 if not dry_run:
-                    create_monday_update(subitem_id, update_text)
+                    mutations.create_update(subitem_id, update_text)
                     print(f"  -> Discrepancy found for '{subitem_name}'. Posting update.")
                 else:
                     print(f"     DRY RUN: Discrepancy found for '{subitem_name}'. Would post update: {update_text}")
@@ -1162,15 +1645,42 @@ def reconcile_subitems(plp_item_id, creator_id, db_cursor, dry_run=True):
                 update_text = f"Reconciliation sync: Current {col_name} assignment is now: {current_staff_str}."
 
                 if not dry_run:
-                    create_monday_update(subitem_id, update_text)
+                    mutations.create_update(subitem_id, update_text)
                     print(f"  -> Discrepancy found for '{subitem_name}'. Posting update.")
                 else:
                     print(f"     DRY RUN: Discrepancy found for '{subitem_name}'. Would post update: {update_text}")
 
+    mutations.flush()
+
+def get_course_teacher_keys(canvas_api, course_id):
+    """
+    (Canvas user IDs, SIS IDs, lowercased login IDs) of the course's current teachers, from one
+    paginated enrollments list, or None if it couldn't be read.
+    """
+    keys = (set(), set(), set())
+    try:
+        course = Course(canvas_api._Canvas__requester, {'id': course_id})
+        for enrollment in course.get_enrollments(type=['TeacherEnrollment'], state=['active', 'invited', 'creation_pending'], per_page=100):
+            user = getattr(enrollment, 'user', None) or {}
+            keys[0].add(int(enrollment.user_id))
+            if user.get('sis_user_id'): keys[1].add(str(user['sis_user_id']))
+            if user.get('login_id'): keys[2].add(user['login_id'].lower())
+    except CanvasException as e:
+        print(f"  WARNING: Could not list the teachers of Canvas course {course_id}: {e}")
+        return None
+    return keys
+
+def is_enrolled_teacher(teacher_details, canvas_user, course_teacher_keys):
+    user_ids, sis_ids, login_ids = course_teacher_keys
+    canvas_id = str(teacher_details.get('canvas_id') or '').strip()
+    return ((canvas_user is not None and canvas_user.id in user_ids) or (canvas_id.isdigit() and int(canvas_id) in user_ids)
+            or str(teacher_details.get('sis_id') or '') in sis_ids or (teacher_details.get('email') or '').strip().lower() in login_ids)
+
 def sync_canvas_teachers_and_tas(db_cursor, dry_run=True):
     """
-    Syncs teachers from Monday.com Canvas Courses board to Canvas,
-    and adds fixed TA accounts to all Canvas classes.
+    Syncs teachers from Monday.com Canvas Courses board to Canvas. Each course's current teachers
+    are read once, and only the linked staff who aren't among them are looked up and enrolled.
+    (The fixed TA accounts are enrolled by aide_sub_enroll.py.)
     """
     print("\n======================================================")
     print("=== STARTING CANVAS TEACHER AND TA SYNC          ===")
@@ -1211,62 +1721,71 @@ def sync_canvas_teachers_and_tas(db_cursor, dry_run=True):
 
     print(f"Found {len(all_canvas_course_items)} Canvas courses on Monday.com to process.")
 
-    for i, canvas_item in enumerate(all_canvas_course_items, 1):
-        canvas_item_id = int(canvas_item['id'])
-        canvas_item_name = canvas_item['name']
-        print(f"\n===== Processing Canvas Course {i}/{len(all_canvas_course_items)}: '{canvas_item_name}' (Monday ID: {canvas_item_id}) =====")
-
+    courses = []  # (Monday item, Canvas course ID, linked staff IDs)
+    for canvas_item in all_canvas_course_items:
         column_values = {cv['id']: cv for cv in canvas_item.get('column_values', [])}
-        canvas_course_id_val = column_values.get(CANVAS_COURSE_ID_COLUMN_ID, {}).get('text')
-        
-        if not canvas_course_id_val:
-            print(f"  WARNING: Canvas Course ID not found for Monday item {canvas_item_id}. Skipping teacher/TA sync for this course.")
+        canvas_course_id_val = (column_values.get(CANVAS_COURSE_ID_COLUMN_ID, {}).get('text') or '').strip()
+        if not canvas_course_id_val.isdigit():
+            print(f"  WARNING: Canvas Course ID not found for Monday item {canvas_item['id']}. Skipping teacher/TA sync for this course.")
             continue
-
-        canvas_course_id = int(canvas_course_id_val)
-
-        print("  -> Syncing assigned teachers...")
         linked_staff_ids = get_linked_ids_from_connect_column_value(column_values.get(CANVAS_TO_STAFF_CONNECT_COLUMN_ID, {}).get('value'))
-        
-        if linked_staff_ids:
-            for staff_monday_id in linked_staff_ids:
-                staff_details_query = f"""
-                    query {{
-                        items (ids: [{staff_monday_id}]) {{
-                            name
-                            column_values(ids: ["{ALL_STAFF_EMAIL_COLUMN_ID}", "{ALL_STAFF_SIS_ID_COLUMN_ID}", "{ALL_STAFF_CANVAS_ID_COLUMN}", "{ALL_STAFF_INTERNAL_ID_COLUMN}"]) {{
-                                id text
-                            }}
-                        }}
-                    }}
-                """
-                staff_result = execute_monday_graphql(staff_details_query)
-                if staff_result and staff_result.get('data', {}).get('items'):
-                    staff_item = staff_result['data']['items'][0]
-                    staff_name = staff_item.get('name')
-                    staff_col_map = {cv['id']: cv.get('text') for cv in staff_item.get('column_values', [])}
-                    
-                    teacher_details = {
-                        'name': staff_name,
-                        'email': staff_col_map.get(ALL_STAFF_EMAIL_COLUMN_ID),
-                        'sis_id': staff_col_map.get(ALL_STAFF_SIS_ID_COLUMN_ID),
-                        'canvas_id': staff_col_map.get(ALL_STAFF_CANVAS_ID_COLUMN),
-                        'internal_id': staff_col_map.get(ALL_STAFF_INTERNAL_ID_COLUMN)
-                    }
-                    if teacher_details['email']:
-                        print(f"    Attempting to enroll teacher: {teacher_details['name']} ({teacher_details['email']})")
-                        if not dry_run:
-                            enroll_status = enroll_teacher_in_course(canvas_course_id, teacher_details, role='TeacherEnrollment')
-                            print(f"    -> Enrollment status for {teacher_details['name']}: {enroll_status}")
-                    else:
-                        print(f"    WARNING: Teacher {staff_name} (Monday ID: {staff_monday_id}) missing email. Skipping enrollment.")
-                else:
-                    print(f"    WARNING: Could not retrieve details for staff ID {staff_monday_id}. Skipping enrollment.")
-        else:
-            print("  INFO: No specific teachers linked on Monday.com for this Canvas course.")
+        courses.append((canvas_item, int(canvas_course_id_val), sorted(linked_staff_ids)))
 
-        if not dry_run:
-            time.sleep(2)
+    canvas_api = initialize_canvas_api()
+    if not canvas_api:
+        print("ERROR: Canvas API not initialized. Skipping teacher/TA sync.")
+        return
+    staff_ids = sorted({staff_id for _, _, linked in courses for staff_id in linked})
+    print(f"  Reading {len(staff_ids)} linked staff members and the current teachers of {len(courses)} Canvas courses...")
+    staff_details = staff_directory.details(staff_ids)
+    course_ids = sorted({canvas_course_id for _, canvas_course_id, linked in courses if linked})
+    # Each course runs in a copy of this context so its calls are charged to the current phase
+    contexts = [contextvars.copy_context() for _ in course_ids]
+    with ThreadPoolExecutor(max_workers=max(1, min(CANVAS_MAX_CONCURRENCY, len(course_ids)))) as pool:
+        current_teachers = dict(zip(course_ids, pool.map(lambda context, course_id: context.run(get_course_teacher_keys, canvas_api, course_id), contexts, course_ids)))
+
+    counts = Counter()
+    canvas_teachers = {}  # Monday staff ID -> Canvas user, resolved once for the run
+    for i, (canvas_item, canvas_course_id, linked_staff_ids) in enumerate(courses, 1):
+        canvas_item_id = int(canvas_item['id'])
+        print(f"\n===== Processing Canvas Course {i}/{len(courses)}: '{canvas_item['name']}' (Monday ID: {canvas_item_id}) =====")
+        if not linked_staff_ids:
+            print("  INFO: No specific teachers linked on Monday.com for this Canvas course.")
+            continue
+        current = current_teachers.get(canvas_course_id)
+        if current is None:
+            print(f"  WARNING: Could not read the teachers of Canvas course {canvas_course_id}. Skipping it.")
+            counts['failed'] += len(linked_staff_ids)
+            continue
+        for staff_monday_id in linked_staff_ids:
+            teacher_details = staff_details.get(staff_monday_id)
+            if not teacher_details:
+                print(f"    WARNING: Could not retrieve details for staff ID {staff_monday_id}. Skipping enrollment.")
+                continue
+            if not teacher_details['email']:
+                print(f"    WARNING: Teacher {teacher_details['name']} (Monday ID: {staff_monday_id}) missing email. Skipping enrollment.")
+                continue
+            if is_enrolled_teacher(teacher_details, canvas_teachers.get(staff_monday_id), current):
+                counts['already_enrolled'] += 1
+                continue
+            print(f"    Enrolling missing teacher: {teacher_details['name']} ({teacher_details['email']})")
+            if dry_run:
+                counts['would_enroll'] += 1
+                continue
+            if staff_monday_id not in canvas_teachers:
+                canvas_teachers[staff_monday_id], error = find_or_create_canvas_teacher(teacher_details)
+                if error: print(f"    -> {error}")
+            user = canvas_teachers[staff_monday_id]
+            if not user:
+                counts['failed'] += 1
+            elif is_enrolled_teacher(teacher_details, user, current):  # Found under an ID the staff item doesn't have
+                counts['already_enrolled'] += 1
+            else:
+                enroll_status = enroll_canvas_teacher(canvas_api, canvas_course_id, user, role='TeacherEnrollment')
+                print(f"    -> Enrollment status for {teacher_details['name']}: {enroll_status}")
+                counts['enrolled' if enroll_status in ("Success", "Already Enrolled") else 'failed'] += 1
+                if enroll_status == "Success": current[0].add(user.id)
+    print(f"\nINFO: Teacher sync: {dict(counts)}")
 
     print("\n======================================================")
     print("=== CANVAS TEACHER AND TA SYNC FINISHED          ===")
@@ -1274,6 +1793,222 @@ def sync_canvas_teachers_and_tas(db_cursor, dry_run=True):
 
 # In nightly_sync.py
 
+# ==============================================================================
+# RUN ORCHESTRATION
+# ==============================================================================
+# The steps of a nightly run, shared by the single-process run below and the
+# distributed run in nightly_tasks.py (python nightly_sync.py --distributed).
+SYNCED_UPDATE_QUERY = ''' INSERT INTO processed_students (student_id, last_synced_at) VALUES (%s, NOW()) ON DUPLICATE KEY UPDATE last_synced_at = NOW() '''
+
+def connect_database(use_pure=False):
+    """use_pure avoids the C extension, whose blocking calls would stall a gevent worker."""
+    return mysql.connector.connect(host=DB_HOST, user=DB_USER, password=DB_PASSWORD, database=DB_NAME, port=int(DB_PORT), use_pure=use_pure)
+
+def ensure_tables(cursor):
+    cursor.execute("CREATE TABLE IF NOT EXISTS processed_students (student_id BIGINT PRIMARY KEY, last_synced_at TIMESTAMP, canvas_id VARCHAR(255))")
+    cursor.execute("CREATE TABLE IF NOT EXISTS nightly_student_leases (student_id BIGINT PRIMARY KEY, run_id VARCHAR(64), owner VARCHAR(255), leased_until DATETIME NULL, finished_at DATETIME NULL)")
+
+def read_plp_snapshot():
+    print("INFO: Fetching all PLP board items from Monday.com...")
+    return get_board_snapshot(PLP_BOARD_ID, [PLP_TO_HS_ROSTER_CONNECT_COLUMN, PLP_TO_MASTER_STUDENT_CONNECT_COLUMN])
+
+def read_hs_roster_snapshot():
+    print("INFO: Fetching all HS Roster items...")
+    return get_board_snapshot(HS_ROSTER_BOARD_ID, [HS_ROSTER_MAIN_ITEM_to_PLP_CONNECT_COLUMN_ID])
+
+def select_students_to_process(cursor, force_full_sync=False, plp_snapshot=None, hs_roster_snapshot=None):
+    """
+    Picks the PLP items whose item or linked HS Roster changed since their last sync. Reads the
+    boards unless the snapshots are passed in. Returns (items_to_process, plp_snapshot,
+    hs_roster_snapshot); both snapshots are also kept in BOARD_SNAPSHOTS.
+    """
+    print("INFO: Fetching last sync times for processed students...")
+    cursor.execute("SELECT student_id, last_synced_at, canvas_id FROM processed_students")
+    processed_map = {row[0]: {'last_synced': row[1], 'canvas_id': row[2]} for row in cursor.fetchall()}
+    print(f"INFO: Found {len(processed_map)} students in the database.")
+
+    if plp_snapshot is None: plp_snapshot = read_plp_snapshot()
+    if hs_roster_snapshot is None: hs_roster_snapshot = read_hs_roster_snapshot()
+
+    if force_full_sync:
+        print("\n*** FORCE FULL SYNC IS ENABLED. PROCESSING ALL STUDENTS. ***\n")
+        return list(plp_snapshot), plp_snapshot, hs_roster_snapshot
+
+    plp_ids_to_process = set()
+    print("INFO: Filtering for students with updated PLP items...")
+    for item in plp_snapshot:
+        item_id = item.id
+        updated_at = parse_flexible_timestamp(item.updated_at)
+        sync_data = processed_map.get(item_id)
+        last_synced = sync_data['last_synced'].replace(tzinfo=timezone.utc) if sync_data and sync_data['last_synced'] else None
+
+        if not last_synced or updated_at > last_synced:
+            plp_ids_to_process.add(item_id)
+
+    print("INFO: Filtering for PLP items linked to updated HS Rosters...")
+    for hs_item in hs_roster_snapshot:
+        linked_plp_ids = hs_roster_snapshot.linked_ids(hs_item.id, HS_ROSTER_MAIN_ITEM_to_PLP_CONNECT_COLUMN_ID)
+        if linked_plp_ids:
+            plp_id = linked_plp_ids[0]
+            sync_data = processed_map.get(plp_id)
+            last_synced = sync_data['last_synced'].replace(tzinfo=timezone.utc) if sync_data and sync_data['last_synced'] else None
+            hs_updated_at = parse_flexible_timestamp(hs_item.updated_at)
+
+            if not last_synced or hs_updated_at > last_synced:
+                plp_ids_to_process.update(linked_plp_ids)
+
+    items_to_process = [plp_snapshot.get(pid) for pid in plp_ids_to_process if pid in plp_snapshot]
+    return items_to_process, plp_snapshot, hs_roster_snapshot
+
+def process_student(plp_item, hs_roster_items_by_id, creator_id, db, cursor, totals, dry_run=True):
+    """Phases 0-2 for one student, then records the sync time. Raises on failure. hs_roster_items_by_id may be a BoardSnapshot."""
+    plp_item_id = int(plp_item['id'])
+    print("--- Phase 0: Syncing Special Enrollments (Jumpstart/Study Hall) ---")
+    with phase_api_usage(totals, "phase0_special_enrollments"):
+        process_student_special_enrollments(plp_item, cursor, dry_run=dry_run)
+    print("--- Phase 1: Checking for and syncing HS Roster ---")
+    with phase_api_usage(totals, "phase1_hs_roster"):
+        hs_roster_ids = get_linked_items_from_board_relation(plp_item_id, int(PLP_BOARD_ID), PLP_TO_HS_ROSTER_CONNECT_COLUMN)
+        if hs_roster_ids:
+            hs_roster_item_id = sorted(hs_roster_ids)[0]
+            hs_roster_item_object = hs_roster_items_by_id.get(hs_roster_item_id)
+            if not hs_roster_item_object:
+                fetched = fetch_items_by_ids([hs_roster_item_id]).get(hs_roster_item_id)
+                hs_roster_item_object = {'id': str(hs_roster_item_id), 'name': fetched['name']} if fetched else None
+            if hs_roster_item_object:
+                run_hs_roster_sync_for_student(hs_roster_item_object, dry_run=dry_run)
+            else:
+                print(f"WARNING: Could not fetch HS Roster item object for ID {hs_roster_item_id}")
+        else:
+            print("INFO: No HS Roster item linked. Skipping Phase 1.")
+    print("--- Phase 2: Syncing PLP to Canvas ---")
+    with phase_api_usage(totals, "phase2_plp_sync"):
+        run_plp_sync_for_student(plp_item_id, creator_id, cursor, dry_run=dry_run)
+    if not dry_run:
+        print(f"INFO: Sync successful. Updating timestamp for PLP item {plp_item_id}.")
+        cursor.execute(SYNCED_UPDATE_QUERY, (plp_item_id,))
+        db.commit()
+
+def run_reconciliation(all_plp_items, creator_id, db, cursor, totals, dry_run=True):
+    print("\n======================================================")
+    print("=== STARTING FINAL RECONCILIATION RUN          ===")
+    print("======================================================")
+    total_all_students = len(all_plp_items)
+    print(f"INFO: Reconciling subitems for all {total_all_students} students...")
+    for i, plp_item in enumerate(all_plp_items, 1):
+        plp_item_id = int(plp_item['id'])
+        print(f"\n===== Reconciling Student {i}/{total_all_students} (PLP ID: {plp_item_id}) =====")
+        try:
+            with phase_api_usage(totals, "reconciliation"):
+                reconcile_subitems(plp_item_id, creator_id, cursor, dry_run=dry_run)
+            if not dry_run:
+                print(f"INFO: Reconciliation successful. Updating timestamp for PLP item {plp_item_id}.")
+                cursor.execute(SYNCED_UPDATE_QUERY, (plp_item_id,))
+                db.commit()
+        except Exception as e:
+            print(f"FATAL ERROR during reconciliation for PLP item {plp_item_id}: {e}")
+
+def run_nightly_phases(creator_id, db, cursor, totals, force_full_sync=False, dry_run=True):
+    """
+    The nightly run as a phase graph. The two board scans and the teacher/TA sync start together;
+    the students wait for both scans, and reconciliation waits for the students. The database
+    cursor is only used along select -> students -> reconciliation, which run one after another.
+    With PROVISIONING_REPORT the Canvas report is requested alongside the scans, and the students
+    wait for it too.
+    """
+    def plp_scan():
+        with phase_api_usage(totals, "plp_scan"): return read_plp_snapshot()
+
+    def hs_roster_scan():
+        with phase_api_usage(totals, "hs_roster_scan"): return read_hs_roster_snapshot()
+
+    def select(plp_scan, hs_roster_scan):
+        items_to_process = select_students_to_process(cursor, force_full_sync, plp_scan, hs_roster_scan)[0]
+        print(f"INFO: Found {len(items_to_process)} unique students to process.")
+        report_memory(f"board snapshots ({len(plp_scan)} PLP, {len(hs_roster_scan)} HS Roster items)")
+        return items_to_process
+
+    def canvas_report():
+        with phase_api_usage(totals, "canvas_report"): return load_canvas_index()
+
+    def students(select, hs_roster_scan, canvas_report=None):
+        for i, plp_item in enumerate(select, 1):
+            print(f"\n===== Processing Student {i}/{len(select)} (PLP ID: {plp_item.id}) =====")
+            try:
+                process_student(plp_item, hs_roster_scan, creator_id, db, cursor, totals, dry_run=dry_run)
+            except Exception as e:
+                print(f"FATAL ERROR processing PLP item {plp_item.id}: {e}")
+
+    def teacher_ta_sync():
+        # Only reads the Canvas and All Staff boards, so it doesn't wait for the students
+        with phase_api_usage(totals, "teacher_ta_sync"): sync_canvas_teachers_and_tas(None, dry_run=dry_run)
+
+    def reconciliation(plp_scan, students):
+        run_reconciliation(plp_scan, creator_id, db, cursor, totals, dry_run=dry_run)
+
+    phases = [Phase("plp_scan", plp_scan), Phase("hs_roster_scan", hs_roster_scan), Phase("teacher_ta_sync", teacher_ta_sync),
+              Phase("select", select, needs=["plp_scan", "hs_roster_scan"]),
+              Phase("students", students, needs=["select", "hs_roster_scan"] + (["canvas_report"] if PROVISIONING_REPORT else [])),
+              Phase("reconciliation", reconciliation, needs=["plp_scan", "students"])]
+    if PROVISIONING_REPORT: phases.append(Phase("canvas_report", canvas_report))
+    _, timings = run_phase_graph(phases, max_workers=NIGHTLY_PHASE_CONCURRENCY)
+    print_phase_timings(timings)
+    print_canvas_index_usage()
+    return timings
+
+def run_apply_phases(plan, creator_id, db, cursor, totals):
+    """
+    --apply as a phase graph: the teacher/TA sync and the PLP scan overlap the plan; reconciliation waits for both.
+    With PROVISIONING_REPORT the plan's Canvas user lookups wait for the report.
+    """
+    from nightly_plan import apply_nightly_plan
+
+    def canvas_report():
+        with phase_api_usage(totals, "canvas_report"): return load_canvas_index()
+
+    def apply_plan(canvas_report=None):
+        with phase_api_usage(totals, "apply_plan"): apply_nightly_plan(plan, db, cursor)
+
+    def plp_scan():
+        with phase_api_usage(totals, "plp_scan"): return read_plp_snapshot()
+
+    def teacher_ta_sync():
+        with phase_api_usage(totals, "teacher_ta_sync"): sync_canvas_teachers_and_tas(None, dry_run=False)
+
+    def reconciliation(apply_plan, plp_scan):
+        run_reconciliation(plp_scan, creator_id, db, cursor, totals, dry_run=False)
+
+    phases = [Phase("apply_plan", apply_plan, needs=["canvas_report"] if PROVISIONING_REPORT else []), Phase("plp_scan", plp_scan),
+              Phase("teacher_ta_sync", teacher_ta_sync), Phase("reconciliation", reconciliation, needs=["apply_plan", "plp_scan"])]
+    if PROVISIONING_REPORT: phases.append(Phase("canvas_report", canvas_report))
+    _, timings = run_phase_graph(phases, max_workers=NIGHTLY_PHASE_CONCURRENCY)
+    print_phase_timings(timings)
+    print_canvas_index_usage()
+    return timings
+
+def acquire_student_lease(db, cursor, run_id, plp_item_id, owner):
+    """
+    Takes the student's row in nightly_student_leases for NIGHTLY_LEASE_SECONDS. Fails while
+    another owner holds an unexpired lease, or once the student has finished in this run.
+    """
+    cursor.execute("INSERT IGNORE INTO nightly_student_leases (student_id) VALUES (%s)", (plp_item_id,))
+    cursor.execute("UPDATE nightly_student_leases SET run_id = %s, owner = %s, leased_until = NOW() + INTERVAL %s SECOND, finished_at = NULL "
+                   "WHERE student_id = %s AND (leased_until IS NULL OR leased_until < NOW()) AND NOT (run_id <=> %s AND finished_at IS NOT NULL)",
+                   (run_id, owner, NIGHTLY_LEASE_SECONDS, plp_item_id, run_id))
+    acquired = cursor.rowcount == 1
+    db.commit()
+    return acquired
+
+def release_student_lease(db, cursor, plp_item_id, owner, finished):
+    cursor.execute("UPDATE nightly_student_leases SET leased_until = NULL, finished_at = IF(%s, NOW(), NULL) WHERE student_id = %s AND owner = %s",
+                   (bool(finished), plp_item_id, owner))
+    db.commit()
+
+def print_phase_usage(totals):
+    for usage in totals.values():
+        print(f"API_USAGE {json.dumps(usage.summary())}")
+
+
 if __name__ == '__main__':
     # Set this to True to run the script on ALL students, not just recently updated ones.
     # Should only be used for a one-time full sync after a cleanup.
@@ -1281,6 +2016,13 @@ if __name__ == '__main__':
     
     DRY_RUN = False
     TARGET_USER_NAME = "Sarah Bruce"
+    DISTRIBUTED = "--distributed" in sys.argv or NIGHTLY_DISTRIBUTED
+    # --plan FILE writes what phases 0-2 would change and stops; --apply FILE executes a plan (see nightly_plan.py)
+    PLAN_PATH = sys.argv[sys.argv.index("--plan") + 1] if "--plan" in sys.argv else None
+    APPLY_PATH = sys.argv[sys.argv.index("--apply") + 1] if "--apply" in sys.argv else None
+    if PLAN_PATH or APPLY_PATH:
+        # nightly_plan.py imports this module by name, so it must find this run's copy rather than load a second one
+        sys.modules.setdefault("nightly_sync", sys.modules[__name__])
 
     print("======================================================")
     print("=== STARTING NIGHTLY DELTA SYNC SCRIPT           ===")
@@ -1292,110 +2034,39 @@ if __name__ == '__main__':
         print("!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!")
     db = None
     cursor = None
+    api_usage_by_phase = {}
+    if TRACE_MEMORY: tracemalloc.start()
     try:
         print("INFO: Connecting to the database...")
-        db = mysql.connector.connect( host=DB_HOST, user=DB_USER, password=DB_PASSWORD, database=DB_NAME, port=int(DB_PORT) )
+        db = connect_database()
         cursor = db.cursor()
-        print("INFO: Fetching last sync times for processed students...")
-        cursor.execute("CREATE TABLE IF NOT EXISTS processed_students (student_id BIGINT PRIMARY KEY, last_synced_at TIMESTAMP, canvas_id VARCHAR(255))")
-        cursor.execute("SELECT student_id, last_synced_at, canvas_id FROM processed_students")
-        processed_map = {row[0]: {'last_synced': row[1], 'canvas_id': row[2]} for row in cursor.fetchall()}
-        print(f"INFO: Found {len(processed_map)} students in the database.")
+        ensure_tables(cursor)
 
         creator_id = get_user_id(TARGET_USER_NAME)
         if not creator_id: raise Exception(f"Halting script: Target user '{TARGET_USER_NAME}' could not be found.")
 
-        print("INFO: Fetching all PLP board items from Monday.com...")
-        all_plp_items = get_all_board_items(PLP_BOARD_ID)
-        
-        items_to_process = []
-        if FORCE_FULL_SYNC:
-            print("\n*** FORCE FULL SYNC IS ENABLED. PROCESSING ALL STUDENTS. ***\n")
-            items_to_process = all_plp_items
+        if APPLY_PATH:
+            from nightly_plan import load_plan
+            plan = load_plan(APPLY_PATH)
+            print(f"INFO: Applying plan {APPLY_PATH} from {plan['created_at']} for {len(plan['plp_ids'])} students.")
+            run_apply_phases(plan, creator_id, db, cursor, api_usage_by_phase)
+        elif PLAN_PATH or DISTRIBUTED:
+            items_to_process, plp_snapshot, hs_roster_snapshot = select_students_to_process(cursor, FORCE_FULL_SYNC)
+            total_to_process = len(items_to_process)
+            print(f"INFO: Found {total_to_process} unique students to process.")
+            report_memory(f"board snapshots ({len(plp_snapshot)} PLP, {len(hs_roster_snapshot)} HS Roster items)")
+
+            if PLAN_PATH:
+                from nightly_plan import build_nightly_plan, print_plan_summary, write_plan
+                with phase_api_usage(api_usage_by_phase, "plan"):
+                    plan = build_nightly_plan(items_to_process, cursor)
+                print_plan_summary(plan)
+                write_plan(plan, PLAN_PATH)
+            else:
+                from nightly_tasks import dispatch_distributed_run
+                dispatch_distributed_run(items_to_process, creator_id, dry_run=DRY_RUN)
         else:
-            plp_ids_to_process = set()
-
-            print("INFO: Filtering for students with updated PLP items...")
-            for item in all_plp_items:
-                item_id = int(item['id'])
-                updated_at = parse_flexible_timestamp(item['updated_at'])
-                sync_data = processed_map.get(item_id)
-                last_synced = sync_data['last_synced'].replace(tzinfo=timezone.utc) if sync_data and sync_data['last_synced'] else None
-                
-                if not last_synced or updated_at > last_synced:
-                    plp_ids_to_process.add(item_id)
-
-            print("INFO: Fetching all HS Roster items to check for recent updates...")
-            all_hs_roster_items = get_all_board_items(HS_ROSTER_BOARD_ID)
-            
-            print("INFO: Filtering for PLP items linked to updated HS Rosters...")
-            for hs_item in all_hs_roster_items:
-                hs_item_id = int(hs_item['id'])
-                linked_plp_ids = get_linked_items_from_board_relation(hs_item_id, int(HS_ROSTER_BOARD_ID), HS_ROSTER_MAIN_ITEM_to_PLP_CONNECT_COLUMN_ID)
-                if linked_plp_ids:
-                    plp_id = list(linked_plp_ids)[0]
-                    sync_data = processed_map.get(plp_id)
-                    last_synced = sync_data['last_synced'].replace(tzinfo=timezone.utc) if sync_data and sync_data['last_synced'] else None
-                    hs_updated_at = parse_flexible_timestamp(hs_item['updated_at'])
-
-                    if not last_synced or hs_updated_at > last_synced:
-                        plp_ids_to_process.update(linked_plp_ids)
-            
-            if plp_ids_to_process:
-                all_items_on_board = {int(i['id']): i for i in all_plp_items}
-                items_to_process = [all_items_on_board[pid] for pid in plp_ids_to_process if pid in all_items_on_board]
-        
-        total_to_process = len(items_to_process)
-        print(f"INFO: Found {total_to_process} unique students to process.")
-
-        for i, plp_item in enumerate(items_to_process, 1):
-            plp_item_id = int(plp_item['id'])
-            print(f"\n===== Processing Student {i}/{total_to_process} (PLP ID: {plp_item_id}) =====")
-            try:
-                print("--- Phase 0: Syncing Special Enrollments (Jumpstart/Study Hall) ---")
-                process_student_special_enrollments(plp_item, cursor, dry_run=DRY_RUN)
-                print("--- Phase 1: Checking for and syncing HS Roster ---")
-                hs_roster_connect_val = get_column_value(plp_item_id, int(PLP_BOARD_ID), PLP_TO_HS_ROSTER_CONNECT_COLUMN)
-                hs_roster_ids = get_linked_ids_from_connect_column_value(hs_roster_connect_val.get('value')) if hs_roster_connect_val else set()
-                if hs_roster_ids:
-                    hs_roster_item_id = list(hs_roster_ids)[0]
-                    hs_roster_item_object = next((item for item in all_hs_roster_items if int(item['id']) == hs_roster_item_id), None)
-                    if hs_roster_item_object:
-                        run_hs_roster_sync_for_student(hs_roster_item_object, dry_run=DRY_RUN)
-                    else:
-                        print(f"WARNING: Could not fetch HS Roster item object for ID {hs_roster_item_id}")
-                else:
-                    print("INFO: No HS Roster item linked. Skipping Phase 1.")
-                print("--- Phase 2: Syncing PLP to Canvas ---")
-                run_plp_sync_for_student(plp_item_id, creator_id, cursor, dry_run=DRY_RUN)
-                if not DRY_RUN:
-                    print(f"INFO: Sync successful. Updating timestamp for PLP item {plp_item_id}.")
-                    update_query = ''' INSERT INTO processed_students (student_id, last_synced_at) VALUES (%s, NOW()) ON DUPLICATE KEY UPDATE last_synced_at = NOW() '''
-                    cursor.execute(update_query, (plp_item_id,))
-                    db.commit()
-            except Exception as e:
-                print(f"FATAL ERROR processing PLP item {plp_item_id}: {e}")
-
-        # Always run Teacher/TA Sync after student processing
-        sync_canvas_teachers_and_tas(cursor, dry_run=DRY_RUN)
-
-        print("\n======================================================")
-        print("=== STARTING FINAL RECONCILIATION RUN          ===")
-        print("======================================================")
-        total_all_students = len(all_plp_items)
-        print(f"INFO: Reconciling subitems for all {total_all_students} students...")
-        for i, plp_item in enumerate(all_plp_items, 1):
-            plp_item_id = int(plp_item['id'])
-            print(f"\n===== Reconciling Student {i}/{total_all_students} (PLP ID: {plp_item_id}) =====")
-            try:
-                reconcile_subitems(plp_item_id, creator_id, cursor, dry_run=DRY_RUN)
-                if not DRY_RUN:
-                    print(f"INFO: Reconciliation successful. Updating timestamp for PLP item {plp_item_id}.")
-                    update_query = ''' INSERT INTO processed_students (student_id, last_synced_at) VALUES (%s, NOW()) ON DUPLICATE KEY UPDATE last_synced_at = NOW() '''
-                    cursor.execute(update_query, (plp_item_id,))
-                    db.commit()
-            except Exception as e:
-                print(f"FATAL ERROR during reconciliation for PLP item {plp_item_id}: {e}")
+            run_nightly_phases(creator_id, db, cursor, api_usage_by_phase, force_full_sync=FORCE_FULL_SYNC, dry_run=DRY_RUN)
     except Exception as e:
         print(f"A critical error occurred: {e}")
     finally:
@@ -1403,6 +2074,9 @@ if __name__ == '__main__':
         if db and db.is_connected():
             db.close()
             print("\nINFO: Database connection closed.")
+        print_phase_usage(api_usage_by_phase)
+        report_memory("end of run")
+        if PROFILE_PHASES: write_phase_profiles(datetime.now().strftime('%Y%m%d-%H%M%S'))
     print("\n======================================================")
     print("=== SCRIPT FINISHED                                ===")
     print("======================================================")
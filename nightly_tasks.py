@@ -0,0 +1,98 @@
+# nightly_tasks.py
+#
+# Description:
+# Distributed mode for nightly_sync.py. `python nightly_sync.py --distributed` (or
+# NIGHTLY_DISTRIBUTED=true) picks the students to sync as usual. It then splits them
+# into shards of NIGHTLY_SHARD_SIZE and queues them on the webhook worker fleet as a
+# Celery chord:
+# - Each shard task syncs its students (phases 0-2) on its own database connection.
+#   Before touching a student it takes that student's row in nightly_student_leases,
+#   so a redelivered or duplicated shard never syncs a student that another shard holds
+#   or that has already finished in this run.
+# - The chord callback runs the Canvas teacher/TA sync and the reconciliation pass once
+#   every shard has reported back.
+# Throughput grows with the number of worker processes, because each one runs up to
+# -c shard tasks at once. The worker loads this module through the `include` list in
+# app.py, and it needs the same environment as the nightly job (DB_* and the board and
+# column IDs).
+#
+# Required Python packages:
+# celery, mysql-connector-python (see requirements.txt)
+
+import os
+import socket
+import uuid
+from celery import chord
+
+import nightly_sync
+from app import celery_app
+
+
+def dispatch_distributed_run(items_to_process, creator_id, dry_run=True):
+    """Queues the run as a chord of shard tasks and returns its run ID."""
+    run_id = f"nightly-{uuid.uuid4().hex[:12]}"
+    # Only what the shard needs goes over the broker
+    students = [{'id': item['id'], 'name': item.get('name'), 'updated_at': item.get('updated_at')} for item in items_to_process]
+    shards = [students[i:i + nightly_sync.NIGHTLY_SHARD_SIZE] for i in range(0, len(students), nightly_sync.NIGHTLY_SHARD_SIZE)]
+    header = [sync_students_shard.s(run_id, shard, creator_id, dry_run) for shard in shards]
+    chord(header)(finish_distributed_run.s(run_id, creator_id, dry_run))
+    print(f"INFO: Queued distributed run {run_id}: {len(students)} students in {len(shards)} shards of up to {nightly_sync.NIGHTLY_SHARD_SIZE}.")
+    return run_id
+
+
+@celery_app.task(name='nightly.sync_students_shard', bind=True)
+def sync_students_shard(self, run_id, students, creator_id, dry_run=True):
+    """Runs phases 0-2 for each leased student. Never raises, so one bad shard can't stall the chord."""
+    owner = f"{socket.gethostname()}:{os.getpid()}:{self.request.id}"
+    counts = {'processed': 0, 'skipped': 0, 'failed': 0}
+    totals = {}
+    db = cursor = None
+    try:
+        db = nightly_sync.connect_database(use_pure=True)
+        cursor = db.cursor()
+        for plp_item in students:
+            plp_item_id = int(plp_item['id'])
+            if not nightly_sync.acquire_student_lease(db, cursor, run_id, plp_item_id, owner):
+                print(f"INFO: [{run_id}] PLP item {plp_item_id} is leased by another shard or already done. Skipping.")
+                counts['skipped'] += 1
+                continue
+            finished = False
+            try:
+                print(f"\n===== [{run_id}] Processing Student (PLP ID: {plp_item_id}) =====")
+                nightly_sync.process_student(plp_item, {}, creator_id, db, cursor, totals, dry_run=dry_run)
+                finished = True
+                counts['processed'] += 1
+            except Exception as e:
+                print(f"FATAL ERROR processing PLP item {plp_item_id}: {e}")
+                counts['failed'] += 1
+            finally:
+                nightly_sync.release_student_lease(db, cursor, plp_item_id, owner, finished)
+    except Exception as e:
+        print(f"ERROR: [{run_id}] Shard stopped early: {e}")
+        counts['failed'] += len(students) - counts['processed'] - counts['skipped'] - counts['failed']
+    finally:
+        if cursor: cursor.close()
+        if db and db.is_connected(): db.close()
+        nightly_sync.print_phase_usage(totals)
+    return counts
+
+
+@celery_app.task(name='nightly.finish_distributed_run')
+def finish_distributed_run(shard_counts, run_id, creator_id, dry_run=True):
+    """Chord callback: the teacher/TA sync and reconciliation, once every shard is done."""
+    summary = {key: sum(counts.get(key, 0) for counts in shard_counts) for key in ('processed', 'skipped', 'failed')}
+    print(f"INFO: [{run_id}] All {len(shard_counts)} shards finished: {summary}")
+    totals = {}
+    db = nightly_sync.connect_database(use_pure=True)
+    cursor = db.cursor()
+    try:
+        with nightly_sync.phase_api_usage(totals, "teacher_ta_sync"):
+            nightly_sync.sync_canvas_teachers_and_tas(cursor, dry_run=dry_run)
+        all_plp_items = nightly_sync.get_all_board_items(nightly_sync.PLP_BOARD_ID)
+        nightly_sync.run_reconciliation(all_plp_items, creator_id, db, cursor, totals, dry_run=dry_run)
+    finally:
+        cursor.close()
+        if db.is_connected(): db.close()
+        nightly_sync.print_phase_usage(totals)
+    print(f"INFO: [{run_id}] Distributed nightly run finished.")
+    return summary
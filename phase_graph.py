@@ -0,0 +1,145 @@
+# phase_graph.py
+#
+# Description:
+# Runs a nightly job as a dependency graph of phases instead of a fixed sequence. Each
+# Phase names the phases it needs and is called with their results as keyword arguments.
+# It starts as soon as all of them have finished, so independent phases (the PLP and HS
+# Roster board scans, the Canvas teacher/TA sync) overlap. Up to max_workers phases run at
+# once on threads, each in a copy of the caller's context so API usage is still charged
+# to the right phase. All phases go through the process-wide API budgets (CanvasThrottle
+# for Canvas, MONDAY_MAX_IN_FLIGHT in nightly_sync.py for Monday), so overlapping phases
+# share one rate budget instead of multiplying it.
+# A phase that raises is logged. The phases that need it are skipped and the rest still run.
+# Each phase records when it was ready, started and finished. It also records how much later
+# it could have finished without delaying the run (its slack). The phases with no slack form
+# the critical path that bounds the total runtime.
+#
+# Required Python packages:
+# None (standard library only)
+
+import contextvars
+import json
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class Phase:
+    __slots__ = ('name', 'func', 'needs')
+
+    def __init__(self, name, func, needs=()):
+        self.name = name
+        self.func = func
+        self.needs = tuple(needs)
+
+
+def check_phase_graph(phases):
+    """Raises ValueError for duplicate names, unknown needs or a cycle."""
+    by_name = {}
+    for phase in phases:
+        if phase.name in by_name: raise ValueError(f"Duplicate phase '{phase.name}'")
+        by_name[phase.name] = phase
+    for phase in phases:
+        unknown = [need for need in phase.needs if need not in by_name]
+        if unknown: raise ValueError(f"Phase '{phase.name}' needs unknown phases {unknown}")
+    state = {}  # name -> "visiting" | "done"
+    def visit(name, path):
+        if state.get(name) == "done": return
+        if state.get(name) == "visiting": raise ValueError(f"Phase cycle: {' -> '.join(path + [name])}")
+        state[name] = "visiting"
+        for need in by_name[name].needs: visit(need, path + [name])
+        state[name] = "done"
+    for phase in phases: visit(phase.name, [])
+    return by_name
+
+
+def _run_phase(phase, inputs, run_started):
+    started = time.monotonic() - run_started
+    try:
+        value, error = phase.func(**inputs), None
+    except Exception as e:
+        value, error = None, e
+        print(f"ERROR: Phase '{phase.name}' failed: {e}\n{traceback.format_exc()}")
+    return started, time.monotonic() - run_started, value, error
+
+
+def run_phase_graph(phases, max_workers=3):
+    """
+    Runs the phases in dependency order, up to max_workers at once. Returns (results, timings):
+    {name: return value} for the phases that finished, and {name: timing} for all of them.
+    """
+    by_name = check_phase_graph(phases)
+    timings = {phase.name: {'phase': phase.name, 'needs': list(phase.needs), 'status': "pending"} for phase in phases}
+    results = {}
+    pending = [phase.name for phase in phases]
+    running = {}
+    run_started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        while pending or running:
+            changed = True
+            while changed:
+                changed = False
+                for name in list(pending):
+                    needs = by_name[name].needs
+                    statuses = [timings[need]['status'] for need in needs]
+                    if any(status in ("failed", "skipped") for status in statuses):
+                        print(f"WARNING: Skipping phase '{name}' because a phase it needs did not finish.")
+                        timings[name]['status'] = "skipped"
+                    elif all(status == "done" for status in statuses):
+                        timings[name].update(status="running", ready_s=max((timings[need]['finished_s'] for need in needs), default=0.0))
+                        context = contextvars.copy_context()
+                        future = pool.submit(context.run, _run_phase, by_name[name], {need: results[need] for need in needs}, run_started)
+                        running[future] = name
+                    else:
+                        continue
+                    pending.remove(name)
+                    changed = True
+            if not running: break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                started, finished, value, error = future.result()
+                timings[name].update(status="failed" if error else "done", started_s=started, finished_s=finished, duration_s=finished - started)
+                if error: timings[name]['error'] = str(error)
+                else: results[name] = value
+    add_critical_path(timings)
+    return results, timings
+
+
+def add_critical_path(timings):
+    """Adds slack_s and on_critical_path to every phase that ran (critical path method, with measured durations)."""
+    ran = {name: timing for name, timing in timings.items() if 'finished_s' in timing}
+    if not ran: return
+    total = max(timing['finished_s'] for timing in ran.values())
+    dependents = {name: [other for other, timing in ran.items() if name in timing['needs']] for name in ran}
+    latest_finish = {}
+    def latest(name):
+        # The latest this phase could finish without pushing any dependent (or the run) later
+        if name not in latest_finish:
+            latest_finish[name] = min([latest(other) - ran[other]['duration_s'] for other in dependents[name]] or [total])
+        return latest_finish[name]
+    for name, timing in ran.items():
+        timing['slack_s'] = max(0.0, latest(name) - timing['finished_s'])
+        timing['on_critical_path'] = timing['slack_s'] < 0.01  # Scheduling jitter
+
+
+def critical_path(timings):
+    """The chain of phases that finished last: from the last phase back through the need that finished last."""
+    ran = {name: timing for name, timing in timings.items() if 'finished_s' in timing}
+    if not ran: return []
+    path = [max(ran, key=lambda name: ran[name]['finished_s'])]
+    while True:
+        needs = [need for need in ran[path[-1]]['needs'] if need in ran]
+        if not needs: break
+        path.append(max(needs, key=lambda need: ran[need]['finished_s']))
+    return path[::-1]
+
+
+def print_phase_timings(timings):
+    for timing in sorted(timings.values(), key=lambda t: t.get('started_s', float('inf'))):
+        print(f"PHASE_TIMING {json.dumps({key: round(value, 3) if isinstance(value, float) else value for key, value in timing.items()})}")
+    path = critical_path(timings)
+    if path:
+        total = timings[path[-1]]['finished_s']
+        busy = sum(timings[name]['duration_s'] for name in path)
+        print(f"INFO: Critical path: {' -> '.join(path)} ({busy:.1f}s running of {total:.1f}s total; the rest is waiting for a worker)")
@@ -0,0 +1,281 @@
+# replay_webhooks.py
+#
+# Description:
+# Replays webhook captures recorded by app.py (set WEBHOOK_RECORD_PATH) against a local
+# instance of the webhook service. The original inter-arrival gaps are kept, scaled
+# by --speed (1x, 10x, 100x, ...), and synthetic bursts can be mixed in to reproduce
+# the storms seen during start-of-term roster imports. Reports:
+# - Ingest latency percentiles for the webhook endpoint.
+# - Task completion throughput and propagation latency, read from the instance's
+#   /metrics before and after the replay once the Celery queue has drained.
+#
+# The instance under test must point at stand-in APIs, never production:
+#   python mock_apis.py --monday-port 8901 --canvas-port 8902
+#   export MONDAY_API_URL=http://127.0.0.1:8901/v2 CANVAS_API_URL=http://127.0.0.1:8902
+#   gunicorn --worker-class gevent -w 4 app:app   and   celery -A app.celery_app worker -P gevent -c 100
+#
+# Usage:
+# python replay_webhooks.py 'captures/webhooks.*.jsonl*' --speed 10
+# python replay_webhooks.py capture.jsonl --speed 100 --burst 500@30 --burst-spread 5
+#
+# Required Python packages:
+# aiohttp
+#
+# To install dependencies:
+# pip install aiohttp
+
+import argparse
+import asyncio
+import copy
+import glob
+import json
+import random
+import re
+import sys
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+import aiohttp
+
+METRIC_LINE_RE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{[^}]*\})?\s+(\S+)$')
+LABEL_RE = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+# ==============================================================================
+# CAPTURES AND SCHEDULE
+# ==============================================================================
+def load_captures(patterns):
+    """Reads every capture line from the given files or globs (including rotated .1, .2 files), oldest first."""
+    paths = sorted({path for pattern in patterns for path in (glob.glob(pattern) or [pattern])})
+    records = []
+    for path in paths:
+        try:
+            with open(path, encoding='utf-8') as f:
+                for line_number, line in enumerate(f, 1):
+                    try: record = json.loads(line)
+                    except ValueError:
+                        print(f"WARNING: Skipping unreadable line {line_number} in {path}")
+                        continue
+                    if isinstance(record, dict) and 'payload' in record and 'received_at' in record:
+                        records.append(record)
+        except OSError as e:
+            print(f"WARNING: Could not read {path}: {e}")
+    records.sort(key=lambda r: r['received_at'])
+    return records
+
+
+def parse_burst(spec):
+    """'500@30' -> (500, 30.0): 500 extra events starting 30 replay-seconds in."""
+    count, _, offset = spec.partition('@')
+    try: return int(count), float(offset or 0)
+    except ValueError: raise argparse.ArgumentTypeError(f"Burst must look like COUNT@SECONDS, not '{spec}'")
+
+
+def build_schedule(records, speed, bursts, burst_spread, seed):
+    """Returns [(send_offset_seconds, path, payload)] in replay time, sorted by offset."""
+    if not records: return []
+    start = records[0]['received_at']
+    schedule = [((r['received_at'] - start) / speed if speed > 0 else 0.0, r.get('path') or '/monday-webhooks', r['payload']) for r in records]
+    events = [r for r in records if isinstance(r['payload'], dict) and r['payload'].get('event')]
+    rng = random.Random(seed)
+    for count, offset in bursts:
+        if not events:
+            print("WARNING: No event payloads in the capture to build a burst from.")
+            break
+        for _ in range(count):
+            record = rng.choice(events)
+            schedule.append((offset + rng.uniform(0, burst_spread), record.get('path') or '/monday-webhooks', copy.deepcopy(record['payload'])))
+    schedule.sort(key=lambda item: item[0])
+    return schedule
+
+# ==============================================================================
+# METRICS SCRAPING
+# ==============================================================================
+def parse_metrics(text):
+    """Prometheus text format -> {(name, frozenset(labels)): value}."""
+    samples = {}
+    for line in text.splitlines():
+        match = METRIC_LINE_RE.match(line.strip())
+        if not match: continue
+        labels = frozenset(LABEL_RE.findall(match.group(2) or ''))
+        try: samples[(match.group(1), labels)] = float(match.group(3))
+        except ValueError: pass
+    return samples
+
+
+def metric_delta(before, after, name, **label_filter):
+    """Sum over all series of `name` (matching label_filter) of after - before."""
+    total = 0.0
+    for (metric, labels), value in after.items():
+        if metric != name: continue
+        label_map = dict(labels)
+        if any(label_map.get(k) != v for k, v in label_filter.items()): continue
+        total += value - before.get((metric, labels), 0.0)
+    return total
+
+
+def gauge(samples, name):
+    values = [value for (metric, _), value in samples.items() if metric == name]
+    return sum(values) if values else None
+
+
+def histogram_quantile(before, after, name, q):
+    """Quantile of the observations made between two scrapes, interpolated as Prometheus does."""
+    buckets = defaultdict(float)
+    for (metric, labels), value in after.items():
+        if metric != f"{name}_bucket": continue
+        le = dict(labels).get('le')
+        buckets[float('inf') if le == '+Inf' else float(le)] += value - before.get((metric, labels), 0.0)
+    if not buckets or buckets.get(float('inf'), 0) <= 0: return None
+    bounds = sorted(buckets)
+    rank = q * buckets[float('inf')]
+    previous_bound, previous_count = 0.0, 0.0
+    for bound in bounds:
+        if buckets[bound] >= rank:
+            if bound == float('inf'): return previous_bound
+            return previous_bound + (bound - previous_bound) * ((rank - previous_count) / max(buckets[bound] - previous_count, 1e-9))
+        previous_bound, previous_count = bound, buckets[bound]
+    return previous_bound
+
+
+async def scrape(session, metrics_url):
+    try:
+        async with session.get(metrics_url) as response:
+            if response.status != 200:
+                print(f"WARNING: {metrics_url} returned {response.status}")
+                return None
+            return parse_metrics(await response.text())
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"WARNING: Could not scrape {metrics_url}: {e}")
+        return None
+
+
+async def wait_for_drain(session, metrics_url, timeout, poll_seconds=2.0):
+    """Polls /metrics until the queue is empty and the finished-task count stops moving."""
+    deadline = time.monotonic() + timeout
+    last_finished = None
+    while time.monotonic() < deadline:
+        samples = await scrape(session, metrics_url)
+        if samples is None: return None
+        finished = gauge(samples, 'celery_tasks_total') or 0
+        depth, unacked = gauge(samples, 'celery_queue_depth') or 0, gauge(samples, 'celery_unacked_tasks') or 0
+        print(f"  queue depth {depth:.0f}, unacked {unacked:.0f}, finished tasks {finished:.0f}")
+        if depth == 0 and unacked == 0 and finished == last_finished:
+            return samples
+        last_finished = finished
+        await asyncio.sleep(poll_seconds)
+    print(f"WARNING: Queue did not drain within {timeout:.0f}s; reporting what has finished so far.")
+    return await scrape(session, metrics_url)
+
+# ==============================================================================
+# REPLAY
+# ==============================================================================
+def percentile(sorted_values, q):
+    if not sorted_values: return None
+    return sorted_values[min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))]
+
+
+async def replay(schedule, base_url, concurrency, refresh_trigger_time):
+    """Sends each payload at its scheduled offset. Returns (latencies, status_counts, elapsed)."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, statuses = [], Counter()
+    started = time.monotonic()
+
+    async def send(session, offset, path, payload):
+        delay = offset - (time.monotonic() - started)
+        if delay > 0: await asyncio.sleep(delay)
+        if refresh_trigger_time and isinstance(payload.get('event'), dict):
+            payload['event']['triggerTime'] = datetime.now(timezone.utc).isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+        async with semaphore:
+            sent = time.monotonic()
+            try:
+                async with session.post(f"{base_url}{path}", json=payload) as response:
+                    await response.read()
+                    statuses[response.status] += 1
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                statuses[type(e).__name__] += 1
+            latencies.append(time.monotonic() - sent)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=60)) as session:
+        await asyncio.gather(*(send(session, offset, path, payload) for offset, path, payload in schedule))
+    return sorted(latencies), statuses, time.monotonic() - started
+
+
+async def main_async(args):
+    records = load_captures(args.captures)
+    if not records:
+        print("ERROR: No webhook payloads found in the capture files.")
+        return 1
+    schedule = build_schedule(records, args.speed, args.burst, args.burst_spread, args.seed)
+    parts = urlsplit(args.target)
+    base_url = f"{parts.scheme}://{parts.netloc}"
+    metrics_url = args.metrics_url or f"{base_url}/metrics"
+    span = schedule[-1][0] if schedule else 0
+    print(f"INFO: Replaying {len(schedule)} webhooks ({len(records)} captured) over ~{span:.1f}s at {args.speed}x against {base_url}")
+
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30)) as session:
+        before = None if args.no_metrics else await scrape(session, metrics_url)
+        latencies, statuses, elapsed = await replay(schedule, base_url, args.concurrency, not args.keep_trigger_time)
+        print(f"INFO: Sent {len(latencies)} webhooks in {elapsed:.2f}s ({len(latencies) / elapsed if elapsed else 0:.1f}/s).")
+        after = None
+        if before is not None:
+            print("INFO: Waiting for the Celery queue to drain...")
+            drain_started = time.monotonic()
+            after = await wait_for_drain(session, metrics_url, args.drain_timeout)
+            drain_elapsed = elapsed + (time.monotonic() - drain_started)
+
+    print("\n=== Ingest ===")
+    print(f"Status codes: {dict(statuses)}")
+    for label, q in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99)):
+        value = percentile(latencies, q)
+        print(f"{label}: {value * 1000:.1f} ms" if value is not None else f"{label}: n/a")
+    if latencies: print(f"max: {latencies[-1] * 1000:.1f} ms")
+
+    report = {'sent': len(latencies), 'send_seconds': round(elapsed, 3), 'statuses': {str(k): v for k, v in statuses.items()},
+              'ingest_ms': {k: round(percentile(latencies, q) * 1000, 1) for k, q in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99))} if latencies else {}}
+    if before is not None and after is not None:
+        finished = metric_delta(before, after, 'celery_tasks_total')
+        failed = metric_delta(before, after, 'celery_tasks_total', state='FAILURE')
+        enqueued = metric_delta(before, after, 'webhook_enqueued_total')
+        p50 = histogram_quantile(before, after, 'webhook_propagation_seconds', 0.5)
+        p99 = histogram_quantile(before, after, 'webhook_propagation_seconds', 0.99)
+        print("\n=== Tasks ===")
+        print(f"Enqueued: {enqueued:.0f}  Finished: {finished:.0f}  Failed: {failed:.0f}")
+        print(f"Throughput: {finished / drain_elapsed:.2f} tasks/s over {drain_elapsed:.1f}s")
+        if p50 is not None: print(f"Propagation p50: {p50:.1f}s  p99: {p99:.1f}s")
+        report['tasks'] = {'enqueued': enqueued, 'finished': finished, 'failed': failed, 'seconds': round(drain_elapsed, 3),
+                           'per_second': round(finished / drain_elapsed, 3) if drain_elapsed else None,
+                           'propagation_p50_s': p50, 'propagation_p99_s': p99}
+    elif not args.no_metrics:
+        print("\nWARNING: /metrics was not available; task throughput was not measured.")
+
+    if args.json:
+        with open(args.json, 'w') as f: json.dump(report, f, indent=2)
+        print(f"\nINFO: Wrote {args.json}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured Monday webhooks against a local instance.")
+    parser.add_argument('captures', nargs='+', help="Capture files or globs written by WEBHOOK_RECORD_PATH.")
+    parser.add_argument('--target', default="http://127.0.0.1:5000", help="Base URL of the instance under test.")
+    parser.add_argument('--metrics-url', help="Defaults to <target>/metrics.")
+    parser.add_argument('--speed', type=float, default=1.0, help="Time scale (10 = ten times faster). 0 sends everything at once.")
+    parser.add_argument('--concurrency', type=int, default=100, help="Maximum webhooks in flight.")
+    parser.add_argument('--burst', type=parse_burst, action='append', default=[], metavar="COUNT@SECONDS",
+                        help="Add COUNT copies of random captured events starting SECONDS into the replay. Repeatable.")
+    parser.add_argument('--burst-spread', type=float, default=0.0, help="Spread each burst over this many seconds.")
+    parser.add_argument('--keep-trigger-time', action='store_true', help="Send the captured triggerTime instead of the send time.")
+    parser.add_argument('--drain-timeout', type=float, default=600)
+    parser.add_argument('--no-metrics', action='store_true', help="Only measure ingest.")
+    parser.add_argument('--json', help="Write the report to this file.")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    if args.speed < 0: parser.error("--speed cannot be negative")
+    sys.exit(asyncio.run(main_async(args)))
+
+
+if __name__ == '__main__':
+    main()
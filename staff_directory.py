@@ -0,0 +1,203 @@
+# staff_directory.py
+#
+# Description:
+# The All Staff board as a directory of teacher details, shared by the webhook workers
+# (app.py) and the nightly teacher sync (nightly_sync.py). One projected scan of the
+# board reads each staff item's name, email, SIS ID, Canvas ID, internal ID and person
+# column. Entries are keyed by item ID, with email and Monday person ID indexes, and are
+# published to Valkey so every process reuses the same scan.
+# - Webhooks on the All Staff board call invalidate(item_id). That drops the item from
+#   Valkey and bumps a version number, so other processes reload their local copy. The
+#   next lookup of that item reads it again in a batched items(ids:) query.
+# - Items the directory doesn't have (new staff, or invalidated ones) are fetched the
+#   same way, and then cached.
+# - The whole board is scanned again after STAFF_DIRECTORY_REFRESH_SECONDS, in case a
+#   webhook was missed. Whichever process wins the refresh lock does the scan.
+# Without Valkey each process keeps its own copy and rescans after local_seconds.
+#
+# Required Python packages:
+# redis (optional, for the shared copy), orjson (optional, via json_codec.py)
+
+import json
+import threading
+import time
+
+import json_codec
+
+try:
+    from redis import RedisError
+except ImportError:
+    RedisError = OSError
+
+STAFF_DIRECTORY_KEY = "monday:staff_directory"
+STAFF_DIRECTORY_LOADED_AT_KEY = "monday:staff_directory:loaded_at"
+STAFF_DIRECTORY_VERSION_KEY = "monday:staff_directory:version"
+STAFF_DIRECTORY_LOCK_KEY = "monday:staff_directory:lock"
+
+
+class StaffDirectory:
+    """
+    columns maps the detail names ('email', 'sis_id', 'canvas_id', 'internal_id', 'person') to All Staff
+    column IDs. execute_graphql and fetch_items are the caller's Monday helpers (fetch_items returns
+    {item_id: {'name', 'columns': {column_id: {'id', 'text', 'value'}}}}), and get_client returns a Valkey
+    client or None.
+    """
+
+    def __init__(self, board_id, columns, execute_graphql, fetch_items, get_client=None, refresh_seconds=3600, local_seconds=300, page_size=500):
+        self.board_id = board_id
+        self.columns = {name: column_id for name, column_id in columns.items() if column_id}
+        self.execute_graphql = execute_graphql
+        self.fetch_items = fetch_items
+        self.get_client = get_client or (lambda: None)
+        self.refresh_seconds = refresh_seconds
+        self.local_seconds = local_seconds
+        self.page_size = page_size
+        self.lock = threading.RLock()
+        self.by_id = {}
+        self.by_email = {}
+        self.by_person = {}
+        self.version = None
+        self.checked_at = 0
+
+    # --- Building entries ----------------------------------------------------------
+    def entry(self, item_id, name, column_values):
+        """Teacher details as enroll_teacher_in_course takes them, plus the item ID and the person column."""
+        texts = {column_id: (cv.get('text') or None) for column_id, cv in column_values.items()}
+        raw_person = (column_values.get(self.columns.get('person')) or {}).get('value')
+        try: person_value = json_codec.loads(raw_person) if raw_person else None  # Parsed, as update_people_column takes it
+        except json_codec.JSONDecodeError: person_value = None
+        person_ids = [int(person_id) for person_id, kind in json_codec.people_entries(person_value) if kind in (None, 'person')]
+        return {'id': int(item_id), 'name': name, 'email': texts.get(self.columns.get('email')), 'sis_id': texts.get(self.columns.get('sis_id')),
+                'canvas_id': texts.get(self.columns.get('canvas_id')), 'internal_id': texts.get(self.columns.get('internal_id')),
+                'person_ids': person_ids, 'person_value': person_value}
+
+    def scan_board(self):
+        """Every staff item in one projected items_page scan. Returns {item_id: entry}, or None if a page failed."""
+        fields = f"id name column_values(ids: {json.dumps(sorted(self.columns.values()))}) {{ id text value }}"
+        entries = {}
+        cursor = None
+        while True:
+            if cursor: query = f'query {{ next_items_page(limit: {self.page_size}, cursor: "{cursor}") {{ cursor items {{ {fields} }} }} }}'
+            else: query = f"query {{ boards(ids: {self.board_id}) {{ items_page(limit: {self.page_size}) {{ cursor items {{ {fields} }} }} }} }}"
+            result = self.execute_graphql(query)
+            try: page = result['data']['next_items_page'] if cursor else result['data']['boards'][0]['items_page']
+            except (TypeError, KeyError, IndexError):
+                print(f"WARNING: Could not read the All Staff board {self.board_id}. Keeping the previous staff directory.")
+                return None
+            for item in page['items']:
+                entries[int(item['id'])] = self.entry(item['id'], item.get('name'), {cv['id']: cv for cv in item.get('column_values') or []})
+            cursor = page.get('cursor')
+            if not cursor: return entries
+
+    # --- Local copy ----------------------------------------------------------------
+    def _set_local(self, by_id, version=None):
+        with self.lock:
+            self.by_id = by_id
+            self.by_email = {entry['email'].lower(): item_id for item_id, entry in by_id.items() if entry.get('email')}
+            self.by_person = {person_id: item_id for item_id, entry in by_id.items() for person_id in entry.get('person_ids') or []}
+            self.version = version
+            self.checked_at = time.time()
+
+    def _add_local(self, entries):
+        with self.lock:
+            self._set_local({**self.by_id, **entries}, self.version)
+
+    # --- Valkey --------------------------------------------------------------------
+    def _store(self, client, entries, replace=False):
+        pipe = client.pipeline()
+        if replace:
+            pipe.delete(STAFF_DIRECTORY_KEY)
+            pipe.set(STAFF_DIRECTORY_LOADED_AT_KEY, int(time.time()))
+            pipe.incr(STAFF_DIRECTORY_VERSION_KEY)
+        if entries: pipe.hset(STAFF_DIRECTORY_KEY, mapping={str(item_id): json.dumps(entry) for item_id, entry in entries.items()})
+        pipe.execute()
+
+    def refresh(self):
+        """Scans the board and publishes the result. Returns {item_id: entry}."""
+        entries = self.scan_board()
+        if entries is None: return self.by_id
+        client = self.get_client()
+        version = None
+        if client is not None:
+            try:
+                self._store(client, entries, replace=True)
+                version = client.get(STAFF_DIRECTORY_VERSION_KEY)
+            except RedisError as e:
+                print(f"WARNING: Could not store the staff directory in Valkey: {e}")
+        self._set_local(entries, version)
+        print(f"INFO: Loaded {len(entries)} All Staff items into the staff directory.")
+        return entries
+
+    def load(self):
+        """
+        Makes the local copy current: kept while Valkey's version hasn't changed (or, without Valkey, for
+        local_seconds), otherwise read from Valkey, otherwise rebuilt by a scan.
+        """
+        client = self.get_client()
+        if client is None:
+            if not self.by_id or time.time() - self.checked_at >= self.local_seconds: self.refresh()
+            return self.by_id
+        try:
+            version, loaded_at = client.mget(STAFF_DIRECTORY_VERSION_KEY, STAFF_DIRECTORY_LOADED_AT_KEY)
+            if time.time() - int(loaded_at or 0) >= self.refresh_seconds:
+                if client.set(STAFF_DIRECTORY_LOCK_KEY, 1, nx=True, ex=120):
+                    try: return self.refresh()
+                    finally: client.delete(STAFF_DIRECTORY_LOCK_KEY)
+            if self.by_id and version == self.version: return self.by_id
+            raw_entries = client.hgetall(STAFF_DIRECTORY_KEY)
+        except RedisError as e:
+            print(f"WARNING: Could not read the staff directory from Valkey: {e}")
+            if not self.by_id: self._set_local(self.scan_board() or {})
+            return self.by_id
+        if raw_entries or loaded_at:
+            self._set_local({int(item_id): json.loads(entry) for item_id, entry in raw_entries.items()}, version)
+        else:
+            self.refresh()
+        return self.by_id
+
+    def invalidate(self, item_id):
+        """Drops one staff item (from a webhook on the board). Its next lookup reads it from Monday."""
+        item_id = int(item_id)
+        with self.lock:
+            if item_id in self.by_id:
+                self._set_local({other: entry for other, entry in self.by_id.items() if other != item_id}, self.version)
+        client = self.get_client()
+        if client is None: return
+        try:
+            pipe = client.pipeline()
+            pipe.hdel(STAFF_DIRECTORY_KEY, str(item_id))
+            pipe.incr(STAFF_DIRECTORY_VERSION_KEY)
+            pipe.execute()
+        except RedisError as e:
+            print(f"WARNING: Could not invalidate staff item {item_id} in Valkey: {e}")
+
+    # --- Lookups -------------------------------------------------------------------
+    def details(self, item_ids):
+        """{item_id: entry} for the given staff items. Items the directory lacks are read in one batched query and cached."""
+        wanted = {int(item_id) for item_id in item_ids}
+        if not wanted: return {}
+        by_id = self.load()
+        missing = wanted - by_id.keys()
+        if missing:
+            fetched = {item_id: self.entry(item_id, item.get('name'), item.get('columns') or {}) for item_id, item in self.fetch_items(missing, sorted(self.columns.values())).items()}
+            if fetched:
+                client = self.get_client()
+                if client is not None:
+                    try: self._store(client, fetched)
+                    except RedisError as e: print(f"WARNING: Could not store staff items in Valkey: {e}")
+                self._add_local(fetched)
+                by_id = self.by_id
+        return {item_id: by_id[item_id] for item_id in wanted if item_id in by_id}
+
+    def find_by_email(self, email):
+        if not email: return None
+        self.load()
+        item_id = self.by_email.get(email.strip().lower())
+        return self.by_id.get(item_id) if item_id is not None else None
+
+    def find_by_person(self, person_id):
+        try: person_id = int(person_id)
+        except (TypeError, ValueError): return None
+        self.load()
+        item_id = self.by_person.get(person_id)
+        return self.by_id.get(item_id) if item_id is not None else None
@@ -0,0 +1,157 @@
+# task_profiler.py
+#
+# Description:
+# On-demand profiling for the Celery tasks in app.py and the phases of nightly_sync.py.
+# The default "sample" mode is a wall-clock stack sampler. It works under the gevent
+# worker because it follows the greenlet that started the profile, not the OS thread:
+# - While that greenlet is running, its live frames are sampled.
+# - While it is parked on a socket, its suspended frames are sampled. Network wait
+#   therefore shows up as gevent hub/socket frames under the calling code.
+# Samples are written as collapsed stacks (one "frame;frame;frame count" line per
+# stack). flamegraph.pl, speedscope and inferno render them directly.
+#
+# The "cprofile" mode wraps the block in cProfile and writes a .pstats file instead.
+# It is only meaningful outside the gevent worker (e.g. nightly_sync.py).
+#
+# Required Python packages:
+# None (gevent is used when present).
+
+import cProfile
+import itertools
+import os
+import re
+import sys
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+try:
+    import greenlet
+    from gevent import monkey
+    _start_thread = monkey.get_original('_thread', 'start_new_thread')
+    _allocate_lock = monkey.get_original('_thread', 'allocate_lock')
+    _sleep = monkey.get_original('time', 'sleep')
+except ImportError:
+    greenlet = None
+    import _thread
+    import time
+    _start_thread = _thread.start_new_thread
+    _allocate_lock = _thread.allocate_lock
+    _sleep = time.sleep
+
+SAFE_NAME_RE = re.compile(r'[^A-Za-z0-9_.-]+')
+
+
+class StackSampler:
+    """Samples the stack of the calling greenlet (or thread) from a real OS thread."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self._lock = _allocate_lock()  # A real OS lock, even when gevent has patched threading.
+        self._running = False
+
+    def start(self):
+        self._thread_id = threading.get_ident()
+        self._greenlet = greenlet.getcurrent() if greenlet else None
+        self._running = True
+        _start_thread(self._run, ())
+        return self
+
+    def stop(self):
+        """Stops sampling and returns the collected {folded_stack: samples}."""
+        with self._lock:
+            self._running = False
+            return Counter(self.stacks)
+
+    def _run(self):
+        while self._running:
+            frame = self._greenlet.gr_frame if self._greenlet is not None else None
+            if frame is None:  # The greenlet is the one running right now (or there is no gevent).
+                frame = sys._current_frames().get(self._thread_id)
+            if frame is not None:
+                stack = fold_stack(frame)
+                with self._lock:
+                    if self._running: self.stacks[stack] += 1
+            _sleep(self.interval)
+
+
+def fold_stack(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names)).replace(" ", "_")
+
+
+def write_folded(stacks, path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        for stack, count in stacks.most_common():
+            f.write(f"{stack} {count}\n")
+
+
+def top_leaves(stacks, n=5):
+    """The functions most often on top of the stack, as [(frame, share)]."""
+    leaves = Counter()
+    for stack, count in stacks.items():
+        leaves[stack.rsplit(";", 1)[-1]] += count
+    total = sum(leaves.values()) or 1
+    return [(leaf, round(count / total, 3)) for leaf, count in leaves.most_common(n)]
+
+
+def profile_path(output_dir, label, tag, extension):
+    return os.path.join(output_dir, f"{SAFE_NAME_RE.sub('_', label)}.{SAFE_NAME_RE.sub('_', str(tag))}.{extension}")
+
+
+@contextmanager
+def profiled(label, tag, output_dir="profiles", mode="sample", interval=0.005):
+    """Profiles the block and writes <output_dir>/<label>.<tag>.folded (or .pstats)."""
+    if mode == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try: yield
+        finally:
+            profiler.disable()
+            path = profile_path(output_dir, label, tag, "pstats")
+            os.makedirs(output_dir, exist_ok=True)
+            profiler.dump_stats(path)
+            print(f"INFO: Wrote cProfile stats for {label} to {path}")
+        return
+    sampler = StackSampler(interval).start()
+    try: yield
+    finally:
+        stacks = sampler.stop()
+        path = profile_path(output_dir, label, tag, "folded")
+        write_folded(stacks, path)
+        print(f"INFO: Wrote {sum(stacks.values())} stack samples for {label} to {path}. Top frames: {top_leaves(stacks)}")
+
+
+@contextmanager
+def accumulate_samples(stacks, interval=0.005):
+    """Adds the block's stack samples to an existing Counter, e.g. one per nightly phase."""
+    sampler = StackSampler(interval).start()
+    try: yield
+    finally: stacks.update(sampler.stop())
+
+
+class ProfileSchedule:
+    """
+    Decides which task invocations to profile, from rules like
+    "app.process_canvas_full_sync_from_status:10,*:500" (1 in N, per process).
+    """
+
+    def __init__(self, rules):
+        self.every = {}
+        for rule in (rules or "").split(","):
+            name, _, every = rule.strip().rpartition(":")
+            if not name: continue
+            try: self.every[name] = max(0, int(every))
+            except ValueError: print(f"WARNING: Ignoring profile rule '{rule}'")
+        self.counters = {}
+
+    def should_profile(self, name):
+        every = self.every.get(name, self.every.get("*", 0))
+        if not every: return False
+        return next(self.counters.setdefault(name, itertools.count())) % every == 0